@@ -5,7 +5,8 @@ import math
 import ntpath
 import os
 import shutil
-from copy import deepcopy
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from inspect import signature
 from shutil import copyfile
 from threading import Thread
@@ -20,7 +21,11 @@ from subject.Subject import Subject
 from data.SIDList import SIDList
 from myutility.exceptions import SubjectListException, DataFileException, SubjectExistException
 from myutility.images.Image import Image
+from myutility.FileIndex import FileIndex
+from myutility.Inventory import Inventory, OutputsCollector, STEPS
 from myutility.fileutilities import sed_inplace, remove_ext
+from myutility.myfsl.utils.run import bind_context, get_context, rrun_many, tracing
+from myutility.myfsl.utils.trace import traced, trace_context, current_context
 
 
 class Project:
@@ -85,6 +90,8 @@ class Project:
         self.hasT2  = False
 
         self.subjects_lists_file    = os.path.join(self.script_dir, "subjects_lists.json")
+        self.inventory_file         = os.path.join(self.dir, "inventory.db")
+        self._inventory             = None
 
         self.globaldata             = globaldata
 
@@ -105,14 +112,21 @@ class Project:
     def existing_subjects(self) -> List[Subject]:
 
         subjects = []
-        subj_labels = [f for f in os.listdir(self.subjects_dir) if os.path.isdir(os.path.join(self.subjects_dir, f))]
-        for slab in subj_labels:
-            search_folder = os.path.join(self.subjects_dir, slab)
-            sessions = [int(f[1:]) for f in os.listdir(search_folder) if os.path.isdir(os.path.join(search_folder, f))]
+        for slab in FileIndex.subdirs(self.subjects_dir):
+            sessions = [int(f[1:]) for f in FileIndex.subdirs(os.path.join(self.subjects_dir, slab))]
             for sess in sessions:
                 subjects.append(Subject(slab, self, sess))
         return subjects
 
+    @property
+    def inventory(self) -> Inventory:
+        """
+        The inventory of the processing steps completed by the project's subjects (see myutility.Inventory), opened on first access.
+        """
+        if self._inventory is None:
+            self._inventory = Inventory(self.inventory_file)
+        return self._inventory
+
     @property
     def subjects_labels(self) -> List[str]:
         if len(self.subjects) > 0:
@@ -162,7 +176,7 @@ class Project:
 
     def get_subject_session(self, subj_label:str, sess:int=1, must_exist:bool=True) -> Subject:
         """
-        Get an indipendent (deepcopy or brand new instance) Subject instance with the given subject label/session.
+        Get an indipendent (session view or brand new instance) Subject instance with the given subject label/session.
         if must_exist is True check whether it exists and raise SubjectListException whether it not
 
         Parameters
@@ -187,10 +201,7 @@ class Project:
         if must_exist:
             for subj in self.subjects:
                 if subj.label == subj_label:
-                    if subj.sessid == sess:
-                        return deepcopy(subj)
-                    else:
-                        return subj.set_properties(sess, rollback=True)  # it returns a deepcopy of requested session
+                    return subj.session_view(sess)  # it returns a new instance, sharing project data, of requested session
             raise SubjectExistException("Error in Project.get_subject: given subject (" + subj_label + " does not exist")
         else:
             return Subject(subj_label, self, sess)
@@ -210,7 +221,7 @@ class Project:
             SubjectExistException: If error_if_empty is True and no session is available for given subj_label.
         """
         search_folder = os.path.join(self.subjects_dir, subj_lab)
-        sessions = [int(f[1:]) for f in os.listdir(search_folder) if os.path.isdir(os.path.join(search_folder, f))]
+        sessions = [int(f[1:]) for f in FileIndex.subdirs(search_folder)]
 
         if len(sessions) > 0:
             return sessions
@@ -251,18 +262,19 @@ class Project:
 
         # get list of subjects with given labels and session (add subj/sess only if exist, raise error if not exist but must_exist=True)
         subjects = []
-        for subj_lab in subj_labels:
-            if sess_ids is None:
-                sessions = self.get_subject_available_sessions(subj_lab)
-            else:
-                sessions = sess_ids
-
-            for sess_id in sessions:
-                subj = Subject(subj_lab, self, sess_id)
-                if not subj.exist and must_exist is True:
-                    raise SubjectExistException("Error in Project.get_subjects: requested subject (" + subj_lab + " | " + str(sess_id) + " ) does not exist")
-                elif subj.exist or (subj.exist is False and must_exist is False):
-                    subjects.append(subj)
+        with FileIndex():
+            for subj_lab in subj_labels:
+                if sess_ids is None:
+                    sessions = self.get_subject_available_sessions(subj_lab)
+                else:
+                    sessions = sess_ids
+
+                for sess_id in sessions:
+                    subj = Subject(subj_lab, self, sess_id)
+                    if not subj.exist and must_exist is True:
+                        raise SubjectExistException("Error in Project.get_subjects: requested subject (" + subj_lab + " | " + str(sess_id) + " ) does not exist")
+                    elif subj.exist or (subj.exist is False and must_exist is False):
+                        subjects.append(subj)
         return subjects
 
     def get_subject(self, subjlabel:str, sess_id:int=1, must_exist:bool=False) -> Subject:
@@ -402,9 +414,10 @@ class Project:
         """
         subjects        = self.validate_subjects(subjects)
         invalid_subjs   = ""
-        for subj in subjects:
-            if not subj.hasSeq(seq_type, images_labels):
-                invalid_subjs = invalid_subjs + subj.label + "\n"
+        with FileIndex():       # each subject directory is listed once instead of stat-ing every candidate image
+            for subj in subjects:
+                if not subj.hasSeq(seq_type, images_labels):
+                    invalid_subjs = invalid_subjs + subj.label + "\n"
 
         if len(invalid_subjs) > 0:
             print("ERROR.... the following subjects does not have the given sequence " + seq_type + " :\n" + invalid_subjs)
@@ -431,9 +444,10 @@ class Project:
         """
         subjects        = self.validate_subjects(subjects)
         invalid_subjs   = ""
-        for subj in subjects:
-            if not subj.can_run_analysis(analysis_type, analysis_params):
-                invalid_subjs = invalid_subjs + subj.label + "\n"
+        with FileIndex():       # each subject directory is listed once instead of stat-ing every candidate image
+            for subj in subjects:
+                if not subj.can_run_analysis(analysis_type, analysis_params):
+                    invalid_subjs = invalid_subjs + subj.label + "\n"
 
         if len(invalid_subjs) > 0:
             print("ERROR.... the following subjects prevent the completion of the " + analysis_type + " analysis:\n" + invalid_subjs)
@@ -468,47 +482,24 @@ class Project:
 
         self.run_subjects_methods("transform", "test_all_coregistration", [{"test_dir":outdir, "_from":_from, "_to":_to, "fmri_labels":fmri_labels, "overwrite":overwrite}], ncore=num_cpu, subjects=subjects)
 
-        if "hr" in _to:
-            l_t1 = os.path.join(outdir, "lin", "hr");            nl_t1 = os.path.join(outdir, "nlin", "hr")
-            sd_l_t1 = os.path.join(outdir, "slicesdir", "lin_hr");      os.makedirs(sd_l_t1, exist_ok=True)
-            sd_nl_t1 = os.path.join(outdir, "slicesdir", "nlin_hr");    os.makedirs(sd_nl_t1, exist_ok=True)
-            os.chdir(l_t1);     os.system("slicesdir ./*.nii.gz");  shutil.move(os.path.join(l_t1, "slicesdir"), sd_l_t1)
-            os.chdir(nl_t1);    os.system("slicesdir ./*.nii.gz");  shutil.move(os.path.join(nl_t1, "slicesdir"), sd_nl_t1)
-
-        if "dti" in _to:
-            l_dti = os.path.join(outdir, "lin", "dti");     nl_dti = os.path.join(outdir, "nlin", "dti")
-            sd_l_dti = os.path.join(outdir, "slicesdir", "lin_dti");    os.makedirs(sd_l_dti, exist_ok=True)
-            sd_nl_dti = os.path.join(outdir, "slicesdir", "nlin_dti");  os.makedirs(sd_nl_dti, exist_ok=True)
-            os.chdir(l_dti);    os.system("slicesdir ./*.nii.gz");  shutil.move(os.path.join(l_dti, "slicesdir"), sd_l_dti)
-            os.chdir(nl_dti);   os.system("slicesdir ./*.nii.gz");  shutil.move(os.path.join(nl_dti, "slicesdir"), sd_nl_dti)
-
-        if "rs" in _to:
-            l_rs = os.path.join(outdir, "lin", "rs");   nl_rs = os.path.join(outdir, "nlin", "rs")
-            sd_l_rs = os.path.join(outdir, "slicesdir", "lin_rs");      os.makedirs(sd_l_rs, exist_ok=True)
-            sd_nl_rs = os.path.join(outdir, "slicesdir", "nlin_rs");    os.makedirs(sd_nl_rs, exist_ok=True)
-            os.chdir(l_rs);     os.system("slicesdir ./*.nii.gz");  shutil.move(os.path.join(l_rs, "slicesdir"), sd_l_rs)
-            os.chdir(nl_rs);    os.system("slicesdir ./*.nii.gz");  shutil.move(os.path.join(nl_rs, "slicesdir"), sd_nl_rs)
-
-        if "std" in _to:
-            l_std = os.path.join(outdir, "lin", "std");     nl_std = os.path.join(outdir, "nlin", "std")
-            sd_l_std = os.path.join(outdir, "slicesdir", "lin_std");    os.makedirs(sd_l_std, exist_ok=True)
-            sd_nl_std = os.path.join(outdir, "slicesdir", "nlin_std");  os.makedirs(sd_nl_std, exist_ok=True)
-            os.chdir(l_std);    os.system("slicesdir -p " + self.globaldata.fsl_std_mni_2mm_brain + " ./*.nii.gz");  shutil.move(os.path.join(l_std, "slicesdir"), sd_l_std)
-            os.chdir(nl_std);   os.system("slicesdir -p " + self.globaldata.fsl_std_mni_2mm_brain + " ./*.nii.gz");  shutil.move(os.path.join(nl_std, "slicesdir"), sd_nl_std)
-
-        if "std4" in _to:
-            l_std4 = os.path.join(outdir, "lin", "std4");       nl_std4 = os.path.join(outdir, "nlin", "std4")
-            sd_l_std4 = os.path.join(outdir, "slicesdir", "lin_std4");  os.makedirs(sd_l_std4, exist_ok=True)
-            sd_nl_std4 = os.path.join(outdir, "slicesdir", "nlin_std4");os.makedirs(sd_nl_std4, exist_ok=True)
-            os.chdir(l_std4);   os.system("slicesdir -p " + self.globaldata.fsl_std_mni_4mm_brain + " ./*.nii.gz");  shutil.move(os.path.join(l_std4, "slicesdir"), sd_l_std4)
-            os.chdir(nl_std4);  os.system("slicesdir -p " + self.globaldata.fsl_std_mni_4mm_brain + " ./*.nii.gz");  shutil.move(os.path.join(nl_std4, "slicesdir"), sd_nl_std4)
-
-        if "t2" in _to:
-            l_t2 = os.path.join(outdir, "lin", "t2");       nl_t2 = os.path.join(outdir, "nlin", "t2")
-            sd_l_t2 = os.path.join(outdir, "slicesdir", "lin_t2");      os.makedirs(sd_l_t2, exist_ok=True)
-            sd_nl_t2 = os.path.join(outdir, "slicesdir", "nlin_t2");    os.makedirs(sd_nl_t2, exist_ok=True)
-            os.chdir(l_t2);     os.system("slicesdir ./*.nii.gz");  shutil.move(os.path.join(l_t2, "slicesdir"), sd_l_t2)
-            os.chdir(nl_t2);    os.system("slicesdir ./*.nii.gz");  shutil.move(os.path.join(nl_t2, "slicesdir"), sd_nl_t2)
+        # one slicesdir for each linear/non-linear registration of each target space: they are independent and run concurrently
+        templates   = {"std": self.globaldata.fsl_std_mni_2mm_brain, "std4": self.globaldata.fsl_std_mni_4mm_brain}
+        jobs        = []
+        for space in ["hr", "dti", "rs", "std", "std4", "t2"]:
+            if space not in _to:
+                continue
+            for regtype, prefix in [("lin", "lin_"), ("nlin", "nlin_")]:
+                imgs_dir    = os.path.join(outdir, regtype, space)
+                sd_dir      = os.path.join(outdir, "slicesdir", prefix + space);   os.makedirs(sd_dir, exist_ok=True)
+                images      = sorted(f for f in os.listdir(imgs_dir) if f.endswith(".nii.gz")) if os.path.isdir(imgs_dir) else []
+                if len(images) == 0:
+                    continue
+                cmd = ["slicesdir"] + (["-p", templates[space]] if space in templates else []) + ["./" + f for f in images]
+                jobs.append((imgs_dir, sd_dir, (cmd, {"cwd": imgs_dir, "exitcode": True})))
+
+        rrun_many([job[2] for job in jobs])
+        for imgs_dir, sd_dir, _ in jobs:
+            shutil.move(os.path.join(imgs_dir, "slicesdir"), sd_dir)
 
     # create a folder where it copies the brain extracted from BET, FreeSurfer and SPM
     def compare_brain_extraction(self, outdir:str, subjects:List[Subject]=None, num_cpu=1):
@@ -886,9 +877,16 @@ class Project:
     # region MULTICORE PROCESSING
     # *kwparams is a list of kwparams. if len(kwparams)=1 & len(subjects) > 1 ...pass that same kwparams[0] to all subjects
     # if subjects is not given...use the loaded subjects
-    def run_subjects_methods(self, method_type, method_name, kwparams, ncore=1, subjects:List[Subject]=None, must_exist:bool=True):
+    def run_subjects_methods(self, method_type, method_name, kwparams, ncore=1, subjects:List[Subject]=None, must_exist:bool=True,
+                             rolling:bool=False, use_processes:bool=False, inventory:bool=False,
+                             inventory_steps:List[str]=None) -> List[dict] | None:
         """
         Runs a method on a list of subjects.
+        By default subjects are divided in blocks of ncore threads, each block is joined before starting the next one.
+        With rolling=True, subjects are instead consumed from a queue by a pool of ncore workers: a new subject starts as soon as
+        any worker is free, so a single slow subject does not leave the other cores idle.
+        With inventory=True, each subject completing the method is recorded in the project's inventory: the method as a step (e.g. "mpr.cat_segment")
+        with the files produced by the commands it ran (if any), and each of the given inventory_steps whose known outputs all exist.
 
         Args:
             method_type (str): The type of method to run. Can be an empty string, "mpr", "epi", "dti", or "transform".
@@ -898,9 +896,15 @@ class Project:
             subjects (List[Subject], optional): list of Subject instances to run the method on. If None, all subjects are used. Defaults to None.
             sess_id (int, optional): The session ID. Defaults to 1.
             must_exist (bool, optional): If True, raise an exception if a subject does not exist. Defaults to True.
+            rolling (bool, optional): If True, use a pool of ncore workers fed by a queue of subjects instead of fixed blocks. Defaults to False.
+            use_processes (bool, optional): Only with rolling=True. If True, workers are processes instead of threads. Defaults to False.
+            inventory (bool, optional): If True, record the subjects completing the method in the project's inventory. Defaults to False.
+            inventory_steps (List[str], optional): Only with inventory=True. known steps (see myutility.Inventory.STEPS) completed by the method. Defaults to None.
 
         Returns:
-            None.
+            None in blocks mode.
+            In rolling mode, a list (ordered as subjects) of dict {"label", "session", "result", "error"} where result is the value returned
+            by the method and error is the raised exception (None if the method completed).
 
         Raises:
             Exception: If the method type is not one of the allowed values, or if the number of keyword arguments does not match the number of subjects.
@@ -947,6 +951,11 @@ class Project:
                 return
         # here nparams is surely == nsubj
 
+        project_inventory = self.inventory if inventory else None
+
+        if rolling:
+            return self.__run_subjects_methods_rolling(method_type, method_name, kwparams, ncore, subjects, use_processes, project_inventory, inventory_steps)
+
         numblocks = math.ceil(nprocesses / ncore)  # num of processing blocks (threads)
 
         subjs:List[List[Subject]]  = []
@@ -983,7 +992,10 @@ class Project:
                         method = eval("subj." + method_type + "." + method_name)
 
                     try:
-                        process = Thread(target=method, kwargs=processes[bl][s])
+                        pipeline = _pipeline_name(method_type, method_name)
+                        if project_inventory is not None:
+                            method = _inventoried(method, subj, pipeline, project_inventory, inventory_steps)
+                        process = Thread(target=traced(method, subject=subj.label, pipeline=pipeline), kwargs=processes[bl][s])
                         process.start()
                         threads.append(process)
                     except Exception as e:
@@ -994,6 +1006,97 @@ class Project:
 
             print("completed block " + str(bl) + " with processes: " + str(subj_labels))
 
+    def __run_subjects_methods_rolling(self, method_type:str, method_name:str, kwparams:list, ncore:int, subjects:List[Subject], use_processes:bool=False,
+                                       inventory:Inventory=None, inventory_steps:List[str]=None) -> List[dict]:
+        """
+        Runs a method on a list of subjects using a pool of ncore workers (threads or processes).
+        Each worker picks the next subject as soon as it completes the previous one.
+
+        Returns:
+            List[dict]: one dict {"label", "session", "result", "error"} for each subject, ordered as subjects.
+        """
+        results = [{"label": subj.label, "session": subj.sessid, "result": None, "error": None} for subj in subjects]
+
+        if use_processes:
+            executor = ProcessPoolExecutor(max_workers=ncore)
+        else:
+            executor = ThreadPoolExecutor(max_workers=ncore)
+
+        with executor:
+            futures = {}
+            for id_subj, subj in enumerate(subjects):
+                # threads do not inherit the caller's context (run context and trace tags), processes receive the trace tags only
+                target = _run_subject_method if use_processes else bind_context(_run_subject_method)
+                futures[executor.submit(target, subj, method_type, method_name, kwparams[id_subj], current_context(), inventory, inventory_steps)] = id_subj
+
+            for ncompleted, future in enumerate(as_completed(futures), 1):
+                res = results[futures[future]]
+                try:
+                    res["result"] = future.result()
+                    print("completed " + res["label"] + " (" + str(ncompleted) + "/" + str(len(subjects)) + ")")
+                except Exception as e:
+                    res["error"] = e
+                    print("ERROR in run_subjects_methods: " + method_name + " of subject " + res["label"] + " failed: " + str(e))
+
+        return results
+
     #endregion
 
     # ==================================================================================================================
+
+
+# module level (and not a Project method) to be picklable when run_subjects_methods uses a pool of processes
+def _run_subject_method(subj:Subject, method_type:str, method_name:str, kwparams:dict=None, trace_tags:dict=None,
+                        inventory:Inventory=None, inventory_steps:List[str]=None) -> Any:
+    """
+    Run the given method of a subject (or of one of its mpr/epi/dti/transform members) with the given keyword arguments.
+    Used as the worker target of Project.run_subjects_methods in rolling mode.
+    The commands it runs are tagged (see myutility.myfsl.utils.trace) with the subject label, the method and the caller's trace_tags.
+    If an inventory is given, the completed method (and the given inventory_steps) are recorded in it.
+    """
+    if kwparams is None:
+        kwparams = {}
+
+    if method_type == "":
+        method = getattr(subj, method_name)
+    else:
+        method = getattr(getattr(subj, method_type), method_name)
+
+    pipeline = _pipeline_name(method_type, method_name)
+    if inventory is not None:
+        method = _inventoried(method, subj, pipeline, inventory, inventory_steps)
+
+    try:
+        with trace_context(**dict(trace_tags or {}, subject=subj.label, pipeline=pipeline)):
+            return method(**kwparams)
+    except Exception:
+        traceback.print_exc()
+        raise
+
+
+def _inventoried(method, subj:Subject, step:str, inventory:Inventory, inventory_steps:List[str]=None):
+    """
+    Returns a wrapper of method that, once method completed, records in inventory the given step, with the files produced by the commands
+    run by the method through rrun as outputs, and the known inventory_steps.
+    Nothing is recorded in dry-run mode, the step is not recorded if its commands produced no file (e.g. the method caught
+    and printed its own error) and a known step is recorded only if all its outputs exist.
+    """
+    def wrapper(**kwargs):
+        if get_context().dry_run:
+            return method(**kwargs)
+
+        collector = OutputsCollector(get_context().tracer)
+        with tracing(collector):
+            res = method(**kwargs)
+
+        if len(collector.outputs) > 0:
+            inventory.record_subject(subj, step, collector.outputs)
+        for known_step in (inventory_steps or []):
+            if all(Inventory.resolve(out) is not None for out in STEPS[known_step](subj)):
+                inventory.record_subject(subj, known_step)
+        return res
+    return wrapper
+
+
+def _pipeline_name(method_type:str, method_name:str) -> str:
+    return method_name if method_type == "" else method_type + "." + method_name
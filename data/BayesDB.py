@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import os
 from typing import List, Optional
 
 import pandas
 
+from data.DBComparer import DBComparer
 from data.GDriveSheet import GDriveSheet
 from data.MSHDB import MSHDB
 from data.Sheets import Sheets
@@ -93,12 +95,14 @@ class BayesDB(MSHDB):
                         password: str = "",
                         calc_flags: bool = True,
                         sortonload: bool = True,
-                        check_consistency:bool=True):
+                        check_consistency:bool=True,
+                        use_cache:bool=False,
+                        cache_dir:str=None):
         """
         Initialize the class.
         """
 
-        super().__init__(file_schema, data, True, password=password, sortonload=sortonload)
+        super().__init__(file_schema, data, True, password=password, sortonload=sortonload, use_cache=use_cache, cache_dir=cache_dir)
 
         if data is not None:
             if check_consistency:
@@ -506,46 +510,46 @@ class BayesDB(MSHDB):
 
         return self
 
-    def compare_db(self, db2compare:BayesDB, diff_out_db:str, must_be_consistent:bool=False, sheets2compare:List[str]=None):
+    def compare_db(self, db2compare:BayesDB, diff_out_db:str, must_be_consistent:bool=False, sheets2compare:List[str]=None, chunk_size:int=10000) -> int:
+        """
+        Compare the given sheets of this database with those of db2compare, see DBComparer.
+        Rows are aligned by subject and session, thus the two databases may contain different subjects.
+
+        Parameters
+        ----------
+        db2compare : BayesDB
+            The database to compare with.
+        diff_out_db : str
+            The output file. A long-format (sheet, subj, session, column, old, new) differences file if .csv/.parquet,
+            otherwise an Excel workbook with, for each sheet with differences, the db2compare's values of the changed cells.
+        must_be_consistent : bool, optional
+            If True, raise an exception if db2compare is not consistent, by default False.
+        sheets2compare : List[str], optional
+            The sheets to compare, by default the schema sheets.
+        chunk_size : int, optional
+            The number of rows compared at once, by default 10000.
 
+        Returns
+        -------
+        int
+            The number of differences.
+        """
         if sheets2compare is None:
-            sheets2compare = self.schema_sheets_names
+            sheets2compare = [sh for sh in self.schema_sheets_names if sh in self.sheets and sh in db2compare.sheets]
 
         if must_be_consistent:
             if not db2compare.is_consistent:
                 raise DataFileException("Error in MSHDB.compare_db: given db is not consistent...skipping comparison")
 
         try:
-            if self.len != db2compare.len:
-                raise DataFileException("LENGTH", db2compare.len)
-
-            if not self.subjects.are_equal(db2compare.subjects):
-                raise DataFileException("SUBJECTS")
-
-            # can create a new MSHDB
-            diff_db:BayesDB = BayesDB(self.schema_file)
-            default_df      = self.get_default_columns(self.subjects, [])   # don't add groups info
-            sheets2save     = []
-            for sh in sheets2compare:
-                are_equal = True
-                # create a copy of self with only the first two columns filled and the other nan
-                cols                = self.get_sheet_sd(sh).header[2:]
-                df                  = pandas.DataFrame(columns=cols)
-                diff_db.sheets[sh]  = SubjectsData(pandas.concat([default_df, df]))
-
-                for col in cols:
-                    for sid in self.subjects:
-                        curr_value  = self.get_sheet_sd(sh).get_subject_col_value(sid, col)
-                        other_value = db2compare.get_sheet_sd(sh).get_subject_col_value(sid, col)
-
-                        if curr_value != other_value:
-                            diff_db.get_sheet_sd(sh).set_subj_session_value(sid, col, other_value)
-                            are_equal = False
-
-                if are_equal is False:
-                    sheets2save.append(sh)
+            comparer = DBComparer(self, db2compare, sheets2compare, chunk_size)
+            ext      = os.path.splitext(diff_out_db)[1]
+            if ext in [".csv", ".txt", ".dat", ".parquet"]:
+                return comparer.to_file(diff_out_db)
 
-            diff_db.save(diff_out_db, sheets2save)
+            diff = comparer.to_dataframe()
+            DBComparer.to_excel(diff, diff_out_db)
+            return len(diff)
 
         except Exception as e:
-            raise Exception("Error in BayesDB.compare_db: sheet " + sh + " | " + e.msg)
+            raise Exception("Error in BayesDB.compare_db: " + str(e))
@@ -0,0 +1,245 @@
+"""
+This module provides DBComparer, a streaming comparison of the sheets of two MSHDB/BayesDB databases.
+
+Rows of the two databases are aligned by their key (subj, session), not by position, and each column is compared vectorized,
+a chunk of rows at a time. Differences are produced as a long-format table:
+
+    sheet | subj | session | column | old | new
+
+where old is the value in the first db and new the value in the second one (as strings, missing values are empty, dates formatted
+with the date_format of db1's schema).
+Rows (or columns) present in only one db are compared as if they were empty in the other, thus each of their non-empty values is a difference.
+Two missing values (NaN, None) are considered equal.
+
+Differences can be iterated (iter_diffs), collected (to_dataframe), streamed to a CSV or Parquet file (to_file, Parquet requires pyarrow),
+and rendered as an Excel workbook (to_excel), with one sheet per compared sheet containing the new values of the changed cells.
+
+Example usage:
+
+comparer = DBComparer(clinical_db, imaging_db, sheets=["main", "SA"])
+ndiffs   = comparer.to_file("/data/checks/diff.parquet")
+DBComparer.to_excel("/data/checks/diff.parquet", "/data/checks/diff.xlsx")
+"""
+from __future__ import annotations
+
+import csv
+import os
+from datetime import date, datetime
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+
+from data.SubjectsData import SubjectsData
+
+DIFF_COLUMNS = ["sheet", "subj", "session", "column", "old", "new"]
+
+
+class DBComparer:
+    """
+    Compares the sheets of two databases.
+
+    Args:
+        db1 (MSHDB): the reference database (old values).
+        db2 (MSHDB): the database compared to db1 (new values).
+        sheets (List[str], optional): sheets to compare. Defaults to the sheets of db1's schema present in both databases.
+        chunk_size (int, optional): number of rows compared at once. Defaults to 10000.
+    """
+    def __init__(self, db1, db2, sheets:List[str]=None, chunk_size:int=10000):
+
+        self.db1        = db1
+        self.db2        = db2
+        self.chunk_size = chunk_size
+
+        if sheets is None:
+            sheets = [sh for sh in db1.schema_sheets_names if sh in db1.sheets and sh in db2.sheets]
+        self.sheets     = sheets
+
+    # ======================================================================================
+    #region compare
+    def iter_diffs(self) -> Iterator[pd.DataFrame]:
+        """
+        Yields the differences (DataFrames with DIFF_COLUMNS columns), one chunk of rows of one sheet at a time.
+        """
+        for sh in self.sheets:
+            yield from self.iter_sheet_diffs(sh, self.db1.get_sheet_sd(sh), self.db2.get_sheet_sd(sh), self.chunk_size,
+                                             getattr(self.db1, "date_format", None))
+
+    @staticmethod
+    def iter_sheet_diffs(sheet:str, sd1:SubjectsData, sd2:SubjectsData, chunk_size:int=10000, date_format:str=None) -> Iterator[pd.DataFrame]:
+        """
+        Yields the differences between two versions of a sheet, chunk_size rows at a time.
+        Dates are written with date_format (e.g. "%d-%b-%Y"), in ISO format if None.
+        """
+        keycols = [sd1.first_col_name, sd1.second_col_name]
+        df1     = sd1.df_view
+        df2     = sd2.df_view
+
+        # align rows by key: all keys of sd1 (in its order) followed by those only present in sd2. -1 = row missing
+        index1  = sd1.index
+        index2  = sd2.index
+        keys    = list(index1.keys()) + [k for k in index2 if k not in index1]
+        pos1    = DBComparer.__positions(df1, [index1.get(k) for k in keys])
+        pos2    = DBComparer.__positions(df2, [index2.get(k) for k in keys])
+
+        columns = [c for c in df1.columns if c not in keycols] + [c for c in df2.columns if c not in keycols and c not in df1.columns]
+        values1 = {c: DBComparer.__values(df1[c]) for c in columns if c in df1.columns}
+        values2 = {c: DBComparer.__values(df2[c]) for c in columns if c in df2.columns}
+
+        labels   = np.array([k[0] for k in keys], dtype=object)
+        sessions = np.array([k[1] for k in keys], dtype=object)
+
+        for start in range(0, len(keys), chunk_size):
+            chunk   = slice(start, start + chunk_size)
+            p1      = pos1[chunk]
+            p2      = pos2[chunk]
+            parts   = []
+            for col in columns:
+                old = DBComparer.__take(values1.get(col), p1)
+                new = DBComparer.__take(values2.get(col), p2)
+
+                isna_old = pd.isna(old)
+                isna_new = pd.isna(new)
+                diff     = np.flatnonzero(DBComparer.__not_equal(old, new) & ~(isna_old & isna_new))
+                if len(diff) == 0:
+                    continue
+
+                parts.append(pd.DataFrame({"sheet":     sheet,
+                                           "subj":      labels[chunk][diff],
+                                           "session":   sessions[chunk][diff],
+                                           "column":    str(col),
+                                           "old":       DBComparer.__to_str(old[diff], isna_old[diff], date_format),
+                                           "new":       DBComparer.__to_str(new[diff], isna_new[diff], date_format)}))
+            if len(parts) > 0:
+                yield pd.concat(parts, ignore_index=True)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Returns all the differences in a single DataFrame.
+        """
+        parts = list(self.iter_diffs())
+        if len(parts) == 0:
+            return pd.DataFrame(columns=DIFF_COLUMNS)
+        return pd.concat(parts, ignore_index=True)
+    #endregion
+
+    # ======================================================================================
+    #region output
+    def to_file(self, outfile:str) -> int:
+        """
+        Streams the differences to a CSV (.csv, .txt, .dat) or Parquet (.parquet, requires pyarrow) file,
+        one chunk at a time, and returns the number of differences.
+        """
+        ndiffs = 0
+        if outfile.endswith(".parquet"):
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise Exception("Error in DBComparer.to_file: writing parquet files requires pyarrow, use a csv output file")
+
+            schema = pa.schema([(c, pa.string()) for c in DIFF_COLUMNS])
+            with pq.ParquetWriter(outfile, schema) as writer:
+                for diff in self.iter_diffs():
+                    writer.write_table(pa.Table.from_pandas(self.__as_strings(diff), schema=schema, preserve_index=False))
+                    ndiffs += len(diff)
+
+        elif outfile.endswith(".csv") or outfile.endswith(".txt") or outfile.endswith(".dat"):
+            with open(outfile, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(DIFF_COLUMNS)
+                for diff in self.iter_diffs():
+                    self.__as_strings(diff).to_csv(f, header=False, index=False)
+                    ndiffs += len(diff)
+        else:
+            raise Exception("Error in DBComparer.to_file: unknown output file format (" + outfile + ")")
+
+        return ndiffs
+
+    @staticmethod
+    def read_file(infile:str) -> pd.DataFrame:
+        """
+        Reads a differences file written by to_file.
+        """
+        if infile.endswith(".parquet"):
+            return pd.read_parquet(infile)
+        return pd.read_csv(infile, dtype=str, keep_default_na=False)
+
+    @staticmethod
+    def to_excel(diff:pd.DataFrame|str, outfile:str):
+        """
+        Renders the differences (a DataFrame or a file written by to_file) as an Excel workbook:
+        one sheet per compared sheet with differences, a row per (subj, session) and a column per changed column,
+        containing the new values of the changed cells.
+        """
+        if isinstance(diff, str):
+            if not os.path.exists(diff):
+                raise Exception("Error in DBComparer.to_excel: given differences file (" + diff + ") does not exist")
+            diff = DBComparer.read_file(diff)
+
+        with pd.ExcelWriter(outfile) as writer:
+            if len(diff) == 0:      # a workbook needs at least one sheet
+                pd.DataFrame(columns=DIFF_COLUMNS).to_excel(writer, sheet_name="diff", index=False)
+            for sheet, sdiff in diff.groupby("sheet", sort=False):
+                table = sdiff.drop_duplicates(["subj", "session", "column"]).set_index(["subj", "session", "column"])["new"].unstack("column")
+                table = table[list(sdiff["column"].unique())].reset_index()
+                table.columns.name = None
+                table.to_excel(writer, sheet_name=str(sheet)[:31], index=False)
+    #endregion
+
+    @staticmethod
+    def __positions(df:pd.DataFrame, ids:list) -> np.ndarray:
+        # positional index in df of the given row ids (None = missing row => -1)
+        pos     = np.full(len(ids), -1, dtype=np.int64)
+        present = [i for i, id_ in enumerate(ids) if id_ is not None]
+        if len(present) > 0:
+            pos[present] = df.index.get_indexer([ids[i] for i in present])
+        return pos
+
+    @staticmethod
+    def __values(col:pd.Series) -> np.ndarray:
+        # values of a column: native numpy dtypes are kept (vectorized comparison), others (dates, extension dtypes) become objects
+        # (e.g. Timestamps: a datetime64 array turned into objects would give integer nanoseconds)
+        if isinstance(col.dtype, np.dtype) and col.dtype.kind not in "mM":
+            return col.to_numpy()
+        return col.astype(object).to_numpy()
+
+    @staticmethod
+    def __take(values:np.ndarray|None, pos:np.ndarray) -> np.ndarray:
+        # values at the given positions, NaN for missing rows (-1) or missing column (values None)
+        if values is None:
+            return np.full(len(pos), np.nan, dtype=object)
+
+        missing = pos < 0
+        if not missing.any():
+            return values[pos]
+
+        res = values[np.where(missing, 0, pos)].astype(object) if len(values) > 0 else np.empty(len(pos), dtype=object)
+        res[missing] = np.nan
+        return res
+
+    @staticmethod
+    def __not_equal(old:np.ndarray, new:np.ndarray) -> np.ndarray:
+        # vectorized when both columns have a native dtype, element by element (as python compares them) otherwise
+        if old.dtype != object and new.dtype != object:
+            try:
+                with np.errstate(invalid="ignore"):
+                    return np.asarray(old != new, dtype=bool)
+            except TypeError:
+                pass
+        return np.fromiter((bool(o != n) for o, n in zip(old, new)), dtype=bool, count=len(old))
+
+    @staticmethod
+    def __to_str(values:np.ndarray, isna:np.ndarray, date_format:str=None) -> list:
+        def to_str(v) -> str:
+            if isinstance(v, (datetime, date)) and date_format is not None:
+                return v.strftime(date_format)
+            return str(v)
+        return [None if na else to_str(v) for v, na in zip(values, isna)]
+
+    @staticmethod
+    def __as_strings(diff:pd.DataFrame) -> pd.DataFrame:
+        diff = diff.copy()
+        for c in ["sheet", "subj", "session", "column"]:
+            diff[c] = diff[c].map(lambda v: None if v is None or (isinstance(v, float) and np.isnan(v)) else str(v))
+        return diff
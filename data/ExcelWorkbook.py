@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import io
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import msoffcrypto
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+
+def _read_excel_sheets(src:str|bytes, sh_names:List[str]) -> dict:
+    # worker of ExcelWorkbook.read_sheets: opens its own copy of the (decrypted) workbook and parses only the given sheets
+    with pd.ExcelFile(io.BytesIO(src) if isinstance(src, bytes) else src) as xls:
+        return {sh: pd.read_excel(xls, sh) for sh in sh_names}
+
+
+def _convert_cell(cell):
+    # value of an openpyxl cell as given by pandas.read_excel to its parser: "" if empty, NaN if an error, int if an integer number
+    if cell.value is None:
+        return ""
+    elif cell.data_type == "e":
+        return np.nan
+    elif cell.data_type == "n":
+        val = int(cell.value)
+        return val if val == cell.value else float(cell.value)
+    return cell.value
+
+
+class ExcelWorkbook:
+    """
+    An Excel workbook opened (and decrypted) on first use, whose sheets are read one at a time.
+
+    xlsx files are opened by openpyxl in read-only (streaming) mode, thus reading a sheet does not parse the others,
+    and the first columns of a sheet can be scanned without reading the whole sheet's data.
+
+    Parameters
+    ----------
+    fpath : str
+        The path to the Excel file.
+    password : str
+        The password to decrypt the file with, "" if not encrypted.
+    """
+    def __init__(self, fpath:str, password:str=""):
+        self.fpath      = fpath
+        self.password   = password
+        self._xls       = None
+        self._data      = None                  # decrypted content
+        self._lock      = threading.RLock()     # pandas/openpyxl readers are not thread-safe
+
+    @property
+    def xls(self) -> pd.ExcelFile:
+        with self._lock:
+            if self._xls is None:
+                src = self.fpath
+                if self.password != "":
+                    src         = self.decrypt(self.fpath, self.password)
+                    self._data  = src.getvalue()
+                self._xls = pd.ExcelFile(src)
+            return self._xls
+
+    @property
+    def sheet_names(self) -> List[str]:
+        return self.xls.sheet_names
+
+    def read_sheet(self, sh_name:str) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_excel(self.xls, sh_name)
+
+    def read_sheets(self, sh_names:List[str]=None, num_cpu:int=1) -> dict:
+        """
+        Read several sheets (all by default), returning a sheet name => DataFrame dictionary.
+        With num_cpu > 1, sheets are parsed in parallel by num_cpu processes, each one parsing a subset of the sheets.
+        """
+        if sh_names is None:
+            sh_names = self.sheet_names
+
+        num_cpu = min(num_cpu, len(sh_names))
+        if num_cpu <= 1:
+            return {sh: self.read_sheet(sh) for sh in sh_names}
+
+        if self.password != "" and self._data is None:
+            self._data = self.decrypt(self.fpath, self.password).getvalue()
+        src     = self.fpath if self.password == "" else self._data
+        chunks  = [sh_names[i::num_cpu] for i in range(num_cpu)]
+        sheets  = {}
+        with ProcessPoolExecutor(max_workers=num_cpu) as executor:
+            for res in executor.map(_read_excel_sheets, [src] * num_cpu, chunks):
+                sheets.update(res)
+
+        return {sh: sheets[sh] for sh in sh_names}
+
+    def read_columns(self, sh_name:str, ncols:int) -> pd.DataFrame:
+        """
+        Read only the first ncols columns of a sheet (e.g. subject and session), returning what pandas.read_excel would return
+        for them: cells are converted and types inferred by the same pandas parser, and the rows are those of the whole sheet
+        (a trailing row is empty, thus dropped, only when all its cells are empty, not just its first ncols ones).
+        """
+        with self._lock:
+            if self.xls.engine != "openpyxl":
+                return pd.read_excel(self.xls, sh_name, usecols=list(range(ncols)))
+
+            sheet = self.xls.book[sh_name]
+            if self.xls.book.read_only:
+                sheet.reset_dimensions()
+
+            data    = []
+            nrows   = 0     # without trailing empty rows
+            for row in sheet.iter_rows():
+                values = [_convert_cell(cell) for cell in row]
+                if not all(v == "" for v in values):
+                    nrows = len(data) + 1
+                values = values[:ncols]
+                data.append(values + [""] * (ncols - len(values)))
+
+        data = data[:nrows]
+        if len(data) == 0:
+            return pd.DataFrame()
+
+        return TextParser(data, header=0, skip_blank_lines=False).read()
+
+    def close(self):
+        with self._lock:
+            if self._xls is not None:
+                self._xls.close()
+                self._xls = None
+            self._data = None
+
+    @staticmethod
+    def decrypt(fpath:str, pwd:str) -> io.BytesIO:
+        """
+        Decrypt an Excel file.
+
+        Parameters
+        ----------
+        fpath : str
+            The path to the Excel file.
+        pwd : str
+            The password to decrypt the file with.
+
+        Returns
+        -------
+        io.BytesIO
+            The decrypted file as a BytesIO object.
+
+        """
+        unlocked_file = io.BytesIO()
+
+        with open(fpath, "rb") as file:
+            excel_file = msoffcrypto.OfficeFile(file)
+            excel_file.load_key(password=pwd)
+            excel_file.decrypt(unlocked_file)
+
+        return unlocked_file
@@ -1,4 +1,8 @@
+from typing import Dict, List, Tuple
+
 import gspread
+import numpy as np
+import pandas as pd
 from df2gspread import df2gspread as d2g
 
 from datetime import date, datetime
@@ -14,6 +18,7 @@ class GDriveSheet:
         ifolder_id (str): The ID of the folder within Google Drive that contains the Google Sheet.
         service_account (str): The path to the service account credentials file.
         backupfolder_id (str, optional): The ID of the folder within Google Drive to store backups of the Google Sheet. Defaults to None.
+        client (gspread.client.Client, optional): An already authorized client (or a stand-in exposing the same methods), service_account is then ignored. Defaults to None.
 
     Attributes:
         ss_id (str): The ID of the Google Sheet to interact with.
@@ -22,13 +27,26 @@ class GDriveSheet:
         account (str): The path to the service account credentials file.
         creds (google.oauth2.credentials.Credentials): The OAuth2 credentials object.
         client (gspread.client.Client): The Google Sheets API client.
+        snapshots (dict): {spreadsheet id: {sheet title: cells}} content of the spreadsheets at the last pull/sync, see update_file.
+
+    Incremental sync:
+        pull() reads all the sheets and stores a snapshot of their cells (rendered by to_cells).
+        update_file() then, instead of deleting and re-uploading the whole spreadsheet, compares each sheet with its snapshot
+        and sends only the changed cells, in a single batch request (see sync_file).
     """
 
-    def __init__(self, ss_id: str, ifolder_id: str, service_account: str, backupfolder_id: str = None):
+    def __init__(self, ss_id: str, ifolder_id: str, service_account: str, backupfolder_id: str = None, client=None):
         self.ss_id = ss_id
         self.ifolder_id = ifolder_id
         self.backupfolder_id = backupfolder_id
         self.account = service_account
+        self.snapshots:Dict[str, Dict[str, List[list]]] = {}
+
+        if client is not None:
+            self.creds  = None
+            self.client = client
+            return
+
         scope = [
             "https://spreadsheets.google.com/feeds",
             "https://www.googleapis.com/auth/drive",
@@ -40,14 +58,46 @@ class GDriveSheet:
         )
         self.client = gspread.authorize(self.creds)
 
-    def open_ss(self) -> gspread.Spreadsheet:
+    def open_ss(self, ss_id: str = None) -> gspread.Spreadsheet:
         """Opens the Google Sheet.
 
+        Args:
+            ss_id (str, optional): The ID of the Google Sheet to open. Defaults to the one specified in the class constructor.
+
         Returns:
             gspread.Spreadsheet: The opened Google Sheet.
         """
+        if ss_id is None:
+            ss_id = self.ss_id
+
+        if self.creds is None:
+            return self.client.open_by_key(ss_id)
+
         gc = gspread.service_account(self.account)
-        return gc.open_by_key(self.ss_id)  # , self.ifolder_id)
+        return gc.open_by_key(ss_id)  # , self.ifolder_id)
+
+    def pull(self, ss_id: str = None) -> Dict[str, pd.DataFrame]:
+        """
+        Reads all the sheets of the Google Sheet, storing their snapshot for the following incremental updates.
+
+        Args:
+            ss_id (str, optional): The ID of the Google Sheet to read. Defaults to the one specified in the class constructor.
+
+        Returns:
+            Dict[str, pandas.DataFrame]: {sheet title: data}, in the spreadsheet order.
+        """
+        if ss_id is None:
+            ss_id = self.ss_id
+
+        sheets      = {}
+        snapshot    = {}
+        for wsh in self.open_ss(ss_id).worksheets():
+            df                  = pd.DataFrame(wsh.get_all_records())
+            sheets[wsh.title]   = df
+            snapshot[wsh.title] = self.to_cells(df)
+
+        self.snapshots[ss_id] = snapshot
+        return sheets
 
     def get_spreadsheet_id(self, ssname: str, folder_id: str) -> str:
         """
@@ -77,13 +127,13 @@ class GDriveSheet:
         """
         spreadsheet = self.client.create(name, folder_id=folder_id)
         for sh in sheets:
-            d2g.upload(sheets[sh].df, spreadsheet.id, sh, credentials=self.creds, df_size=True,
+            d2g.upload(sheets[sh].df_view, spreadsheet.id, sh, credentials=self.creds, df_size=True,
                        col_names=True, row_names=False, start_cell="A1", clean=False)
         spreadsheet.del_worksheet(spreadsheet.worksheet("Sheet1"))
 
         return spreadsheet
 
-    def update_file(self, sheets: dict, source: str = None, backuptitle: str = None, backupfolder_id: str = None):
+    def update_file(self, sheets: dict, source: str = None, backuptitle: str = None, backupfolder_id: str = None, sync: bool = None):
         """
         Updates the Google Sheet with the specified sheets.
 
@@ -92,6 +142,8 @@ class GDriveSheet:
             source (str, optional): The ID of the Google Sheet to update. If not specified, the ID of the Google Sheet specified in the class constructor is used.
             backuptitle (str, optional): The title of the backup Google Sheet. If not specified, "backup" is used.
             backupfolder_id (str, optional): The ID of the folder to store the backup Google Sheet in. If not specified, the ID of the backup folder specified in the class constructor is used.
+            sync (bool, optional): send only the cells changed since the last pull (see sync_file) instead of deleting and re-uploading the whole spreadsheet.
+                                   If not specified, it is used when a snapshot of source is available.
         """
         if source is None:
             source = self.ss_id
@@ -107,10 +159,133 @@ class GDriveSheet:
         if backupfolder_id is not None:
             ss_copy = self.client.copy(file_id=source, title=backuptitle, copy_permissions=True, folder_id=backupfolder_id)
 
+        if sync is None:
+            sync = source in self.snapshots
+
+        if sync:
+            self.sync_file(sheets, source)
+            return
+
+        self.snapshots.pop(source, None)
         self.client.del_spreadsheet(source)
 
+        # same layout of create_ss and sync_file (header in row 1, no index column), thus of what pull reads back
         for sh in sheets:
-            d2g.upload(sheets[sh].df, source, sh, credentials=self.creds, df_size=True,
-                       col_names=True, row_names=True, start_cell="A1", clean=False)
+            d2g.upload(sheets[sh].df_view, source, sh, credentials=self.creds, df_size=True,
+                       col_names=True, row_names=False, start_cell="A1", clean=False)
+
+    # ======================================================================================
+    #region incremental sync
+    def sync_file(self, sheets: dict, source: str = None) -> int:
+        """
+        Updates the Google Sheet sending only the cells that differ from the snapshot taken by the last pull (or sync).
+        Sheets missing in the snapshot are completely (re)written, missing worksheets are created, worksheets are resized
+        to the size of the data. All the changed cells of all the sheets are sent in a single batch request, as RAW (typed) values:
+        the sheet is the same one written by a full upload (see update_file).
 
+        Args:
+            sheets (dict): A dictionary of sheets, where the key is the name of the sheet and the value is a SubjectsData.
+            source (str, optional): The ID of the Google Sheet to update. Defaults to the one specified in the class constructor.
 
+        Returns:
+            int: the number of updated cells.
+        """
+        if source is None:
+            source = self.ss_id
+
+        spreadsheet = self.open_ss(source)
+        worksheets  = {wsh.title: wsh for wsh in spreadsheet.worksheets()}
+        snapshot    = self.snapshots.get(source, {})
+
+        data    = []
+        ncells  = 0
+        for sh in sheets:
+            new = self.to_cells(sheets[sh].df_view)
+            old = snapshot.get(sh)
+
+            nrows = len(new)
+            ncols = max([len(row) for row in new] + [1])
+
+            wsh = worksheets.get(sh)
+            if wsh is None:
+                wsh = spreadsheet.add_worksheet(title=sh, rows=nrows, cols=ncols)
+                old = None
+            elif wsh.row_count != nrows or wsh.col_count != ncols:
+                wsh.resize(rows=nrows, cols=ncols)     # removed rows/columns are deleted, added ones are empty
+
+            if old is None:
+                old = []        # unknown content: write everything
+            else:
+                old = [row[:ncols] for row in old[:nrows]]
+
+            for row, col, values in self.cells_diff(old, new):
+                data.append({"range": self.a1_range(sh, row, col, len(values)), "values": [values]})
+                ncells += len(values)
+
+        if len(data) > 0:
+            spreadsheet.values_batch_update(body={"valueInputOption": "RAW", "data": data})
+
+        self.snapshots[source] = {sh: self.to_cells(sheets[sh].df_view) for sh in sheets}
+        return ncells
+
+    @staticmethod
+    def to_cells(df: pd.DataFrame) -> List[list]:
+        """
+        Renders a DataFrame (header and rows, no index) as the values written to the sheet's cells: numbers and booleans keep
+        their type (as written by a full upload), other values are strings. Missing values are empty cells, integral floats are
+        written as integers (as read back by gspread's numericise).
+        """
+        def cell(v):
+            if v is None or (not isinstance(v, str) and pd.api.types.is_scalar(v) and pd.isna(v)):
+                return ""
+            if isinstance(v, (bool, np.bool_)):
+                return bool(v)
+            if isinstance(v, (float, np.floating)):
+                v = float(v)
+                if v.is_integer():
+                    return int(v)
+                return v if np.isfinite(v) else str(v)
+            if isinstance(v, (int, np.integer)):
+                return int(v)
+            return str(v)
+
+        return [[str(c) for c in df.columns]] + [[cell(v) for v in row] for row in df.itertuples(index=False, name=None)]
+
+    @staticmethod
+    def cells_diff(old: List[list], new: List[list], max_gap: int = 3) -> List[Tuple[int, int, list]]:
+        """
+        Compares two cells grids and returns the changed cells as horizontal runs (row, first column, new values), 0-based.
+        Cells present in old but not in new are returned as empty values. Runs separated by up to max_gap unchanged cells are merged.
+        Cells differing only in type (e.g. 1 and True, or 1 and "1") are changed.
+        """
+        runs = []
+        for r in range(max(len(old), len(new))):
+            o = old[r] if r < len(old) else []
+            n = new[r] if r < len(new) else []
+            ncols = max(len(o), len(n))
+            o = o + [""] * (ncols - len(o))
+            n = n + [""] * (ncols - len(n))
+
+            start = None
+            last  = None
+            for c in range(ncols):
+                if o[c] != n[c] or type(o[c]) is not type(n[c]):
+                    if start is None:
+                        start = c
+                    elif c - last - 1 > max_gap:
+                        runs.append((r, start, n[start:last + 1]))
+                        start = c
+                    last = c
+            if start is not None:
+                runs.append((r, start, n[start:last + 1]))
+        return runs
+
+    @staticmethod
+    def a1_range(sheet: str, row: int, col: int, ncols: int) -> str:
+        """
+        Returns the A1 notation ('sheet'!B3:D3) of ncols cells of a row, given 0-based row and col.
+        """
+        first = gspread.utils.rowcol_to_a1(row + 1, col + 1)
+        last  = gspread.utils.rowcol_to_a1(row + 1, col + ncols)
+        return "'" + sheet.replace("'", "''") + "'!" + first + ":" + last
+    #endregion
@@ -8,14 +8,15 @@ from datetime import datetime
 from typing import List
 
 import gspread
-import msoffcrypto
 import pandas
 import pandas as pd
 
+from data.ExcelWorkbook import ExcelWorkbook
 from data.GDriveSheet import GDriveSheet
 from data.SID import SID
 from data.SIDList import SIDList
 from data.Sheets import Sheets
+from data.SheetsCache import SheetsCache
 from data.SubjectsData import SubjectsData
 from myutility.exceptions import DataFileException
 
@@ -41,6 +42,11 @@ class MSHDB:
         The password for decrypting an Excel file.
     sortonload : bool
         If True, the sheets will be sorted by the values in the first column when they are loaded.
+    use_cache : bool
+        If True and data is an Excel file, the loaded sheets are stored in a sidecar cache (see SheetsCache, requires pyarrow) and
+        the following loads of the same (unchanged) file read them from there, lazily. Default False.
+    cache_dir : str
+        The cache folder, by default .<file name>.cache next to the Excel file.
 
     Attributes
     ----------
@@ -115,7 +121,9 @@ class MSHDB:
                  data: str | Sheets | GDriveSheet = None,
                  suppress_nosubj: bool = True,
                  password: str = "",
-                 sortonload: bool = True):
+                 sortonload: bool = True,
+                 use_cache: bool = False,
+                 cache_dir: str = None):
 
         super().__init__()
 
@@ -136,6 +144,8 @@ class MSHDB:
 
         self.suppress_nosubj        = suppress_nosubj
         self.password               = password
+        self.use_cache              = use_cache
+        self.cache_dir              = cache_dir
 
         self.main_name:str          = self.schema_sheets_names[self.main_id]       # e.g. "main"
 
@@ -146,6 +156,7 @@ class MSHDB:
         if data is not None:
             self.load(data, sort=sortonload)
 
+        # sheets not loaded yet (lazy) are formatted when loaded
         self.__format_dates()
         self.__round_columns()
 
@@ -223,44 +234,35 @@ class MSHDB:
             # Check if the data parameter is an Excel file
             if not data.endswith(".xls") and not data.endswith(".xlsx"):
                 raise DataFileException("Error in MXLSDB.load: unknown data file format")
-            # Check if a password is required to decrypt the Excel file
-            if self.password != "":
-                # Decrypt the Excel file
-                data = self.decrypt_excel(data, self.password)
-            # Read the Excel file into a Pandas DataFrame
-            xls = pd.ExcelFile(data)
+            # sheets are read (and the file decrypted) only when first accessed, or read from the sheets cache if present
+            workbook    = ExcelWorkbook(data, self.password)
+            cache       = None
+            if self.use_cache is True:
+                cache = SheetsCache(data, self.schema_file, password=self.password, cache_dir=self.cache_dir, options={"sort": sort, "suppress_nosubj": self.suppress_nosubj})
+
+            xls_sheet_names = cache.sheet_names if cache is not None else None
+            if xls_sheet_names is None:
+                xls_sheet_names = workbook.sheet_names
+                self.__store_cache(cache, "store_sheet_names", xls_sheet_names)
 
             if self.schema_sheets_names is None:
-                self.schema_sheets_names = xls.sheet_names
+                self.schema_sheets_names = xls_sheet_names
 
             for sheet_name in self.schema_sheets_names:
 
-                if sheet_name in xls.sheet_names:
-                    df = pd.read_excel(xls, sheet_name)
-                    # Verify that the first column is valid
-                    df = self.is_valid(df)
-                    # Sort the data by the first column if requested
-                    if sort:
-                        df = self.sort_values(df)
-                    # Create a SubjectsData object from the DataFrame
-                    sd = SubjectsData(df)
-                    # Add the SubjectsData object to the sheets dictionary
+                if sheet_name in xls_sheet_names:
                     # TODO: Check if this condition is necessary
                     # if not self.mustbeconsistent:
                     #     self.check_labels(sd.subjects, sheet)  # raise an exception
-                    self.sheets[sheet_name] = sd
+                    self.sheets.set_lazy(sheet_name, self.__sheet_loader(workbook, cache, sheet_name, sort),
+                                                     self.__sheet_scanner(workbook, cache, sheet_name, sort))
         elif isinstance(data, Sheets):
             self.sheets = data
         elif isinstance(data, GDriveSheet):
             # Try to open the Google Sheet
             try:
-                spreadsheet = data.open_ss()
-                # Iterate through the worksheets in the Google Sheet
-                for wsh in spreadsheet.worksheets():
-                    # Get the data from the worksheet
-                    rows = wsh.get_all_records()
-                    # Create a Pandas DataFrame from the data
-                    df = pd.DataFrame(rows)
+                # Iterate through the worksheets in the Google Sheet (their content is kept for the following incremental saves)
+                for title, df in data.pull().items():
                     # Verify that the first column is valid
                     df = self.is_valid(df)
                     # Sort the data by the first column if requested
@@ -272,7 +274,7 @@ class MSHDB:
                     # TODO: Check if this condition is necessary
                     # if not self.mustbeconsistent:
                     #     self.check_labels(sd.subjects, sheet)  # raise an exception
-                    self.sheets[wsh.title] = sd
+                    self.sheets[title] = sd
             except gspread.exceptions.APIError as ex:
                 print("GOOGLE API ERROR: " + ex.args[0]["message"])
         else:
@@ -280,6 +282,64 @@ class MSHDB:
         # Return the sheets dictionary
         return self.sheets
 
+    def __sheet_loader(self, workbook:ExcelWorkbook, cache:SheetsCache|None, sheet_name:str, sort:bool):
+        return lambda: self.__load_sheet(workbook, cache, sheet_name, sort)
+
+    def __sheet_scanner(self, workbook:ExcelWorkbook, cache:SheetsCache|None, sheet_name:str, sort:bool):
+        return lambda: self.__scan_sheet(workbook, cache, sheet_name, sort)
+
+    def __load_sheet(self, workbook:ExcelWorkbook, cache:SheetsCache|None, sheet_name:str, sort:bool) -> SubjectsData:
+        """
+        Read, validate, sort and format a sheet (or read it from the sheets cache, where it is stored already formatted).
+        """
+        if cache is not None and cache.has_sheet(sheet_name):
+            return cache.load_sheet(sheet_name)
+
+        df = workbook.read_sheet(sheet_name)
+        # Verify that the first column is valid
+        df = self.is_valid(df)
+        # Sort the data by the first column if requested
+        if sort:
+            df = self.sort_values(df)
+        # Create a SubjectsData object from the DataFrame
+        sd = SubjectsData(df)
+        self.__format_sheet_dates(sheet_name, sd)
+        self.__round_sheet_columns(sheet_name, sd)
+
+        self.__store_cache(cache, "store_sheet", sheet_name, sd)
+        return sd
+
+    def __scan_sheet(self, workbook:ExcelWorkbook, cache:SheetsCache|None, sheet_name:str, sort:bool) -> SIDList:
+        """
+        Returns the subjects of a sheet reading only its subject/session columns.
+        """
+        if cache is not None:
+            sids = cache.sheet_subjects(sheet_name)
+            if sids is not None:
+                return sids
+
+        df = workbook.read_columns(sheet_name, len(self.unique_columns))
+        if len(df.columns) < len(self.unique_columns):
+            sids = self.sheets[sheet_name].subjects     # load the sheet, it raises the same error of an eager load
+        else:
+            # same validation and sort of __load_sheet, SubjectsData then coerces the sessions as for the whole sheet
+            df = self.is_valid(df)
+            if sort:
+                df = self.sort_values(df)
+            sids = SubjectsData(df).subjects
+
+        self.__store_cache(cache, "store_sheet_subjects", sheet_name, sids)
+        return sids
+
+    @staticmethod
+    def __store_cache(cache:SheetsCache|None, method:str, *args):
+        if cache is None:
+            return
+        try:
+            getattr(cache, method)(*args)
+        except Exception as e:
+            print("Warning in MSHDB: cannot write the sheets cache (" + str(e) + ")")
+
     def get_sheet_sd(self, name: str, can_create:bool=False) -> SubjectsData:
         """
         Returns the SubjectsData object for a specific sheet.
@@ -391,8 +451,7 @@ class MSHDB:
         if not isvalid:
             if self.suppress_nosubj:
 
-                for i, v in enumerate(self.unique_columns):
-                    df.columns.values[i] = self.unique_columns[i]
+                df.columns = list(self.unique_columns) + list(df.columns[len(self.unique_columns):])
                 print("Warning in MXLSDB.load: first column was not called subj, I renamed it to subj....check if it's ok")
                 return df
             else:
@@ -631,28 +690,15 @@ class MSHDB:
                     currdb.get_sheet_sd(sh).add_sd([reallynew_db.get_sheet_sd(sh)])
 
         if duplicated_db is not None:
-            # update existing subjects
-            for s in duplicated_subjs:
-                original_id     = currdb.main.get_subjid_by_session(s.label, s.session)             # get the original index of the subject to be updated
-                original_sid    = currdb.main.get_sid(s.label, s.session)             # get the original index of the subject to be updated
-                for sh in duplicated_db.sheet_labels:
-                    df:pandas.DataFrame = duplicated_db.get_sheet_sd(sh).df
-                    new_row             = df.loc[(df['subj'] == s.label) & (df['session'] == s.session)]    # extract the subject row from duplicated_db
-                    new_row.index       = [original_id]                                          # update its index to make update working
-                    try:
-                        sh_df = currdb.get_sheet_sd(sh).df
-                        sh_df.update(new_row),    # sh_df.loc[new_row.notna()] = new_row
-
-                        # for col in new_row.columns:
-                        #     value = new_row.iloc[0][col]
-                        #     if pd.notna(value):
-                        #         currdb.get_sheet_sd(sh).set_subj_session_value(original_sid, col, new_row.iloc[0][col])
-                        #         sh_df.at[original_id, col] = value                                                      # YES
-                        #         sh_df.loc[(sh_df['subj'] == s.label) & (sh_df['session'] == s.session), col] = value  # YES
-                        #         sh_df.loc[original_id, col] = value                                               # YES
-                        #         sh_df[(sh_df['subj'] == s.label) & (sh_df['session'] == s.session)][col] = value    # NO: A value is trying to be set on a copy of a slice from a DataFrame.  Try using .loc[row_indexer,col_indexer] = value instead
-                    except Exception as e:
-                        raise DataFileException("Error in MSHDB.add_new_subjects", str(e))
+            # update existing subjects: each sheet is merged at once, matching rows by subject and session.
+            # non-empty new values overwrite the existing ones (as DataFrame.update), new columns are not added
+            for sh in duplicated_db.sheet_labels:
+                sd = currdb.get_sheet_sd(sh)
+                try:
+                    df = duplicated_db.get_sheet_sd(sh).df_view
+                    sd.upsert(df, columns=[c for c in df.columns[2:] if c in sd.header], policy="overwrite", insert=False)
+                except Exception as e:
+                    raise DataFileException("Error in MSHDB.add_new_subjects", str(e))
 
         if update is True:
             self = currdb
@@ -739,13 +785,13 @@ class MSHDB:
                     if sh not in self.sheets.keys():
                         continue
 
-                    self.get_sheet_sd(sh).df.to_excel(writer, sheet_name=sh, startrow=1, header=False, index=False)
+                    self.get_sheet_sd(sh).df_view.to_excel(writer, sheet_name=sh, startrow=1, header=False, index=False)
 
                     # create a table
                     workbook = writer.book
                     worksheet = writer.sheets[sh]
-                    (max_row, max_col) = self.get_sheet_sd(sh).df.shape
-                    column_settings = [{"header": column} for column in self.get_sheet_sd(sh).df.columns]
+                    (max_row, max_col) = self.get_sheet_sd(sh).df_view.shape
+                    column_settings = [{"header": column} for column in self.get_sheet_sd(sh).df_view.columns]
                     worksheet.add_table(0, 0, max_row, max_col - 1, {
                         "columns": column_settings})  # Add the Excel table structure. Pandas will add the data.
                     worksheet.set_column(0, max_col - 1, 12)  # Make the columns wider for clarity.
@@ -773,14 +819,7 @@ class MSHDB:
             The decrypted file as a BytesIO object.
 
         """
-        unlocked_file = io.BytesIO()
-
-        with open(fpath, "rb") as file:
-            excel_file = msoffcrypto.OfficeFile(file)
-            excel_file.load_key(password=pwd)
-            excel_file.decrypt(unlocked_file)
-
-        return unlocked_file
+        return ExcelWorkbook.decrypt(fpath, pwd)
 
     def __format_dates(self) -> None:
         """
@@ -788,11 +827,16 @@ class MSHDB:
 
         """
         for sh in self.dates:
-            if sh in self.sheets.keys():
-                sd: SubjectsData = self.get_sheet_sd(sh)
-                if sd.num == 0:
-                    continue
+            if self.sheets.is_loaded(sh):
+                self.__format_sheet_dates(sh, self.get_sheet_sd(sh))
+
+    def __format_sheet_dates(self, sh:str, sd:SubjectsData) -> None:
+        """
+        Format date columns of the given sheet.
 
+        """
+        if sh in self.dates:
+            if sd.num > 0:
                 for col in self.dates[sh]:
                     date_values = []
                     for subj in sd.subjects:
@@ -820,10 +864,16 @@ class MSHDB:
 
         """
         for sh in self.to_be_rounded:
-            if sh in self.sheets.keys():
-                ds: SubjectsData = self.get_sheet_sd(sh)
-                if ds.num == 0:
-                    continue
+            if self.sheets.is_loaded(sh):
+                self.__round_sheet_columns(sh, self.get_sheet_sd(sh))
+
+    def __round_sheet_columns(self, sh:str, ds:SubjectsData) -> None:
+        """
+        Round numeric columns of the given sheet.
+
+        """
+        if sh in self.to_be_rounded:
+            if ds.num > 0:
                 for col in self.to_be_rounded[sh]:
 
                     if col in ds.df.columns:
@@ -988,10 +1038,10 @@ class MSHDB:
 
     def copy(self) -> 'MSHDB':
         '''
-        return a deep copy of current instance
+        return an independent copy of current instance.
+        sheets are copied-on-write (see SubjectsData.copy): they share the data of self until modified, not loaded sheets stay lazy.
         :return:
         '''
         db = MSHDB(self.schema_file, None)
-        for sh in self.sheets:
-            db.sheets[sh] = SubjectsData(self.get_sheet_sd(sh).df.copy())
+        db.sheets = self.sheets.copy()
         return db
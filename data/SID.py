@@ -36,3 +36,20 @@ class SID:
 
         """
         return subj.label == self.label and subj.session == self.session
+
+    @property
+    def key(self) -> tuple:
+        """
+        The (label, session) pair identifying the subject session, regardless of its id.
+        """
+        return self.label, self.session
+
+    def __eq__(self, other) -> bool:
+        # as is_equal: ids are not compared, since they depend on the data the SID was taken from
+        if not isinstance(other, SID):
+            return NotImplemented
+        return self.is_equal(other)
+
+    def __hash__(self) -> int:
+        return hash((self.label, self.session))
+
@@ -20,6 +20,9 @@ class SIDList(list):
         union_norep: Unions two lists of SID objects, removing duplicates.
         are_equal: Checks if two lists of SID objects are equal.
         contains: Checks if a SID object is present in the current list.
+
+    Membership checks use a {(label, session): SID} index (first occurrence in the list), built on first use
+    and dropped whenever the list is modified in place.
     """
 
     def __init__(self, subjects: List[SID]=None):
@@ -31,8 +34,83 @@ class SIDList(list):
         """
         if subjects is None:
             subjects = []
+        self._index = None
         super().__init__(item for item in subjects)
 
+    # ======================================================================================
+    #region index
+    @property
+    def index(self) -> dict:
+        """
+        Returns the {(label, session): SID} dictionary of the list's elements, the first one in case of repetitions.
+        """
+        if self._index is None:
+            index = {}
+            for s in self:
+                index.setdefault(s.key, s)
+            self._index = index
+        return self._index
+
+    def _invalidate(self):
+        self._index = None
+
+    def __getstate__(self):
+        # copies (also shallow ones) and unpickled lists rebuild their own index
+        state = self.__dict__.copy()
+        state["_index"] = None
+        return state
+
+    def append(self, sid: SID):
+        super().append(sid)
+        if self._index is not None:
+            self._index.setdefault(sid.key, sid)
+
+    def extend(self, sids):
+        super().extend(sids)
+        self._invalidate()
+
+    def insert(self, i, sid: SID):
+        super().insert(i, sid)
+        self._invalidate()
+
+    def remove(self, sid: SID):
+        super().remove(sid)
+        self._invalidate()
+
+    def pop(self, i=-1) -> SID:
+        self._invalidate()
+        return super().pop(i)
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._invalidate()
+
+    def reverse(self):
+        super().reverse()
+        self._invalidate()
+
+    def __setitem__(self, i, value):
+        super().__setitem__(i, value)
+        self._invalidate()
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self._invalidate()
+
+    def __iadd__(self, sids):
+        self.extend(sids)
+        return self
+
+    def __contains__(self, sid) -> bool:
+        if not isinstance(sid, SID):
+            return super().__contains__(sid)
+        return sid.key in self.index
+    #endregion
+
     @property
     def labels(self) -> List[str]:
         """
@@ -64,29 +142,22 @@ class SIDList(list):
         """
         return [s.session for s in self]
 
-    def filter(self, sd, select_conds=None) -> 'SIDList':
+    def filter(self, sd, select_conds=None, logic:str="and") -> 'SIDList':
         """
         Filters the list based on select conditions.
 
         Args:
             sd (SubjectData): The SubjectData object.
             select_conds (List[SelectCondition]): A list of select conditions.
+            logic (str): how conditions are combined, "and" or "or". Defaults to "and".
 
         Returns:
             SIDList: The filtered list.
         """
-        res = []
         if select_conds is None:
             return self
         else:
-            for s in self:
-                add = True
-                for selcond in select_conds:
-                    if not selcond.isValid(sd.get_subject_col_value(s.id, selcond.colname)):
-                        add = False
-                if add:
-                    res.append(s)
-            return SIDList(res)
+            return sd.filter_sids(select_conds, self, logic)
 
     def is_in(self, sids: 'SIDList', context_self:bool=False) -> 'SIDList':
         """
@@ -104,13 +175,10 @@ class SIDList(list):
         if len(self) == 0:
             return SIDList()
 
+        index = self.index
         for sid in sids:
-            doexist = False
-            for ss in self:
-                if sid.is_equal(ss):
-                    doexist = True
-                    break
-            if doexist:
+            ss = index.get(sid.key)
+            if ss is not None:
                 if context_self is True:
                     res.append(ss)
                 else:
@@ -118,6 +186,19 @@ class SIDList(list):
 
         return SIDList(res)
 
+    def not_in(self, sids: 'SIDList') -> 'SIDList':
+        """
+        Returns the elements of sids that are not present in the current list (in the context of sids).
+
+        Args:
+            sids (SIDList): The list of SID objects.
+
+        Returns:
+            SIDList: The list of SID objects of sids that are not present in the current list.
+        """
+        index = self.index
+        return SIDList([sid for sid in sids if sid.key not in index])
+
     def append_novel(self, subj_list: 'SIDList') -> 'SIDList':
         """
         Append self only with novel elements of given list SIDList.
@@ -126,14 +207,10 @@ class SIDList(list):
             subj_list (SIDList): The list of SID objects to be unioned.
         """
 
+        index = self.index
         for s in subj_list:
-            add = True
-            for ss in self:
-                if s.is_equal(ss):
-                    add = False
-                    break
-            if add:
-                self.append(s)
+            if s.key not in index:
+                self.append(s)      # also updates index
 
     def are_equal(self, subj_list: 'SIDList') -> bool:
         """
@@ -149,26 +226,8 @@ class SIDList(list):
         if subj_list is None or not isinstance(subj_list, SIDList):
             raise DataFileException("Error in SIDList.are_equal: given subj_list (" + str(subj_list) +  ") is not a SIDList")
 
-        for s in subj_list:
-            exist = False
-            for ss in self:
-                if s.is_equal(ss):
-                    exist = True
-                    break
-            if not exist:
-                return False
-
-        # at this point, all elements of subj_list exist in self. check the contrary (element of self that does not exist in subj_list)
-        for ss in self:
-            exist = False
-            for s in subj_list:
-                if s.is_equal(ss):
-                    exist = True
-                    break
-            if not exist:
-                return False
-
-        return True
+        # all elems of subj_list exist in self and viceversa
+        return self.index.keys() == subj_list.index.keys()
 
 
     def contains(self, subj: SID) -> bool:
@@ -181,7 +240,4 @@ class SIDList(list):
         Returns:
             bool: True if the SID object is present, False otherwise.
         """
-        for s in self:
-            if s.is_equal(subj):
-                return True
-        return False
+        return subj.key in self.index
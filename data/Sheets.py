@@ -1,10 +1,13 @@
-from typing import List
+import threading
+from typing import Callable, List
 
 import pandas
 
 from data.SubjectsData import SubjectsData
 from data.SIDList import SIDList
 
+_lazy_lock = threading.RLock()    # reentrant: a loader may access other sheets
+
 
 class Sheets(dict):
     """
@@ -33,6 +36,13 @@ class Sheets(dict):
     is_consistent
     copy
     is_equal
+    set_lazy
+    is_loaded
+
+    Sheets can be lazy: set_lazy(sh, loader) registers the sheet name, while its SubjectsData is created by calling loader()
+    on first access. Iteration and membership tests (keys) do not load the sheets, values(), items() and get() do.
+    A lazy sheet may also have a scanner, returning its subjects (SIDList) without loading the whole sheet: all_subjects and
+    is_consistent use it (see sheet_subjects).
     """
 
     def __new__(cls, data:dict=None, sh_names: List[str] = None, main_id: int = 0, init: bool = False):
@@ -97,6 +107,81 @@ class Sheets(dict):
             return SubjectsData()
 
 
+    # ======================================================================================
+    #region lazy sheets
+    @property
+    def _loaders(self) -> dict:
+        # not created in __init__: __setitem__ may be called (e.g. by copy/pickle) before __init__
+        return self.__dict__.setdefault("_lazy_loaders", {})
+
+    @property
+    def _scanners(self) -> dict:
+        return self.__dict__.setdefault("_lazy_scanners", {})
+
+    def set_lazy(self, sh_name:str, loader:Callable[[], SubjectsData], scanner:Callable[[], SIDList]=None):
+        """
+        Register a sheet whose SubjectsData is created by loader() on first access.
+        scanner(), if given, returns the sheet's subjects without loading it.
+        """
+        super().__setitem__(sh_name, None)
+        self._loaders[sh_name] = loader
+        if scanner is not None:
+            self._scanners[sh_name] = scanner
+        else:
+            self._scanners.pop(sh_name, None)
+
+    def sheet_subjects(self, sh_name:str) -> SIDList:
+        """
+        Returns the subjects of the given sheet, scanning (and not loading) it when it is lazy and has a scanner.
+        """
+        if sh_name in self._loaders and sh_name in self._scanners:
+            with _lazy_lock:
+                scanned = self._scanners[sh_name]
+                if callable(scanned):
+                    scanned = self._scanners[sh_name] = scanned()
+            return scanned
+        return self[sh_name].subjects
+
+    def is_loaded(self, sh_name:str) -> bool:
+        return sh_name in self and sh_name not in self._loaders
+
+    def __getitem__(self, sh_name:str) -> SubjectsData:
+        if sh_name in self._loaders:
+            with _lazy_lock:
+                loader = self._loaders.get(sh_name)
+                if loader is not None:
+                    super().__setitem__(sh_name, loader())
+                    del self._loaders[sh_name]
+                    self._scanners.pop(sh_name, None)
+        return super().__getitem__(sh_name)
+
+    def __setitem__(self, sh_name:str, sd:SubjectsData):
+        self._loaders.pop(sh_name, None)
+        self._scanners.pop(sh_name, None)
+        super().__setitem__(sh_name, sd)
+
+    def __delitem__(self, sh_name:str):
+        self._loaders.pop(sh_name, None)
+        self._scanners.pop(sh_name, None)
+        super().__delitem__(sh_name)
+
+    def get(self, sh_name:str, default=None) -> SubjectsData:
+        return self[sh_name] if sh_name in self else default
+
+    def pop(self, sh_name:str, *default) -> SubjectsData:
+        if sh_name in self:
+            sd = self[sh_name]
+            del self[sh_name]
+            return sd
+        return super().pop(sh_name, *default)
+
+    def values(self) -> List[SubjectsData]:
+        return [self[sh] for sh in self]
+
+    def items(self) -> List[tuple]:
+        return [(sh, self[sh]) for sh in self]
+    #endregion
+
     def sheet(self, sh_name:str) -> SubjectsData:
         return self[sh_name]
 
@@ -117,7 +202,7 @@ class Sheets(dict):
         try:
             all_subjs = SIDList()
             for sh in self:
-                subjs = self[sh].subjects
+                subjs = self.sheet_subjects(sh)
                 all_subjs.append_novel(subjs)
 
             return all_subjs
@@ -137,7 +222,7 @@ class Sheets(dict):
         """
         all_subjs:SIDList = self.all_subjects
         for sh in self:
-            if not all_subjs.are_equal(self[sh].subjects):
+            if not all_subjs.are_equal(self.sheet_subjects(sh)):
                 return False
 
         return True
@@ -145,6 +230,7 @@ class Sheets(dict):
     def copy(self) -> 'Sheets':
         """
         Returns a copy of the Sheets object.
+        Each sheet is copied-on-write (see SubjectsData.copy): it shares the data of the original one until either one is modified.
 
         Returns
         -------
@@ -154,7 +240,10 @@ class Sheets(dict):
         """
         sheets = Sheets(sh_names=self.schema_sheets_names, main_id=self.main_id)
         for sh in self:
-            sheets[sh] = self[sh]
+            if sh in self._loaders:     # do not load it, the copy shares the loader (first access by either one loads it) and copies its result
+                sheets.set_lazy(sh, self.__shared_loader(sh), self.__shared_scanner(sh))
+            else:
+                sheets[sh] = self[sh].copy()
 
         return sheets
 
@@ -192,5 +281,13 @@ class Sheets(dict):
             print("Sheets.is_equal show the following differences")
             return False
 
+    def __shared_loader(self, sh:str) -> Callable[[], SubjectsData]:
+        return lambda: self[sh].copy()
+
+    def __shared_scanner(self, sh:str) -> Callable[[], SIDList] | None:
+        if sh not in self._scanners:
+            return None
+        return lambda: self.sheet_subjects(sh)
+
     def remove_sheet(self, sh:str):
         del self[sh]
\ No newline at end of file
@@ -0,0 +1,273 @@
+"""
+This module provides a columnar on-disk cache of the sheets of a MSHDB workbook.
+
+Reading a multi-sheet Excel workbook (and validating, sorting and formatting its sheets) is slow, while the workbook rarely changes
+between two script executions. SheetsCache stores the loaded sheets in a sidecar folder (by default .<workbook name>.cache, next to
+the workbook), one Parquet file per sheet. pyarrow is required: sheets are never stored as pickles, as unpickling files that anybody
+able to write next to the workbook could plant would execute arbitrary code. Sheets that cannot be represented in Arrow (e.g. object
+columns mixing numbers and strings) are not cached and are always read from the workbook.
+
+The cache is keyed by the content of the workbook and of the schema file (and by the loading options), thus any change of either one
+invalidates it. When the workbook is password protected, sheet files are encrypted (Fernet, key derived from the password).
+
+The cache is filled incrementally: each sheet is stored when it is first loaded from the workbook (see MSHDB.load), together with
+the workbook's sheet names and the subjects pre-scan of the sheets, so that the following loads never open the workbook for them.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+from typing import List
+
+import pandas as pd
+
+from data.SID import SID
+from data.SIDList import SIDList
+from data.Sheets import Sheets
+from data.SubjectsData import SubjectsData
+
+CACHE_VERSION       = 3
+KDF_ITERATIONS      = 200000
+
+
+def file_hash(fpath:str, blocksize:int=1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class SheetsCache:
+    """
+    Sidecar cache of the sheets of a workbook.
+
+    Args:
+        workbook (str): path of the Excel workbook.
+        schema_file (str): path of the json schema used to load the workbook.
+        password (str, optional): workbook password. If not empty, cached sheets are encrypted with it. Defaults to "".
+        cache_dir (str, optional): cache folder. Defaults to .<workbook name>.cache in the workbook folder.
+        options (dict, optional): loading options (e.g. sort) affecting the loaded data, part of the cache key. Defaults to None.
+    """
+    def __init__(self, workbook:str, schema_file:str, password:str="", cache_dir:str=None, options:dict=None):
+
+        try:
+            import pyarrow
+        except ImportError:
+            raise Exception("Error in SheetsCache: the sheets cache requires pyarrow, install it or do not use the cache")
+
+        self.workbook       = os.path.abspath(workbook)
+        self.schema_file    = os.path.abspath(schema_file)
+        self.password       = password
+        self.options        = options if options is not None else {}
+
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(self.workbook), "." + os.path.basename(self.workbook) + ".cache")
+        self.cache_dir      = cache_dir
+        self.manifest_file  = os.path.join(cache_dir, "manifest.json")
+
+        self._key           = None
+        self._manifest      = None
+        self._fernets       = {}        # salt => Fernet, key derivation is deliberately slow
+        self._lock          = threading.RLock()
+
+    # ======================================================================================
+    #region key / manifest
+    @property
+    def key(self) -> str:
+        """
+        Returns the hash identifying the current workbook/schema/options.
+        The workbook hash stored in the manifest is reused if its mtime and size did not change.
+        """
+        if self._key is None:
+            st          = os.stat(self.workbook)
+            manifest    = self.read_manifest()
+            if manifest is not None and manifest.get("workbook_stat") == [st.st_mtime_ns, st.st_size]:
+                wb_hash = manifest["workbook_hash"]
+            else:
+                wb_hash = file_hash(self.workbook)
+
+            h = hashlib.sha256()
+            h.update(json.dumps([CACHE_VERSION, wb_hash, file_hash(self.schema_file), self.options, self.password != ""], sort_keys=True).encode())
+            self._key       = h.hexdigest()
+            self._wb_hash   = wb_hash
+            self._wb_stat   = [st.st_mtime_ns, st.st_size]
+        return self._key
+
+    def read_manifest(self) -> dict | None:
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def manifest(self) -> dict:
+        """
+        Returns the manifest of the current workbook/schema, a new (empty) one if the stored manifest is missing or outdated.
+        """
+        with self._lock:
+            if self._manifest is None:
+                manifest = self.read_manifest()
+                if manifest is None or manifest.get("key") != self.key or \
+                        (manifest.get("salt") is not None and not self.__check_password(manifest)):
+                    manifest = None
+
+                if manifest is None:
+                    salt        = base64.b64encode(os.urandom(16)).decode() if self.password != "" else None
+                    manifest    = {"key": self.key, "version": CACHE_VERSION, "workbook": self.workbook, "workbook_hash": self._wb_hash,
+                                   "workbook_stat": self._wb_stat, "salt": salt, "sheet_names": None, "sheets": {}, "subjects": {}}
+                    if salt is not None:
+                        manifest["check"] = self.__fernet(salt).encrypt(self.key.encode()).decode()
+                    manifest["new"] = True
+                self._manifest = manifest
+            return self._manifest
+
+    def __write_manifest(self):
+        manifest = self.manifest
+        if manifest.pop("new", False):
+            # outdated content is removed when the new one starts being written
+            self.invalidate()
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        tmp = self.manifest_file + "." + str(os.getpid()) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_file)
+
+    def is_valid(self, sh_names:List[str]=None) -> bool:
+        """
+        Returns True if the cache contains all the sheets of the current workbook (only those in sh_names, if given).
+        """
+        manifest = self.manifest
+        if manifest.get("new", False) or manifest["sheet_names"] is None:
+            return False
+        return all(self.has_sheet(sh) for sh in manifest["sheet_names"] if sh_names is None or sh in sh_names)
+
+    @property
+    def sheet_names(self) -> List[str] | None:
+        """
+        Returns the names of the sheets of the workbook, None if not cached yet.
+        """
+        return self.manifest["sheet_names"]
+
+    def has_sheet(self, sh_name:str) -> bool:
+        entry = self.manifest["sheets"].get(sh_name)
+        return entry is not None and entry.get("format") == "parquet" and os.path.isfile(os.path.join(self.cache_dir, entry["file"]))
+
+    def invalidate(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+    #endregion
+
+    # ======================================================================================
+    #region load / store
+    def load(self, sh_names:List[str]=None, main_id:int=0) -> Sheets | None:
+        """
+        Returns a Sheets instance whose sheets are loaded from the cache on first access, None if the cache is not complete.
+        """
+        if not self.is_valid(sh_names):
+            return None
+
+        sheets = Sheets(sh_names=sh_names, main_id=main_id)
+        for sh_name in self.manifest["sheet_names"]:
+            if self.has_sheet(sh_name) and (sh_names is None or sh_name in sh_names):
+                sheets.set_lazy(sh_name, self.__loader(sh_name))
+        return sheets
+
+    def load_sheet(self, sh_name:str) -> SubjectsData:
+
+        entry = self.manifest["sheets"][sh_name]
+        if entry.get("format") != "parquet":
+            raise Exception("Error in SheetsCache.load_sheet: sheet " + sh_name + " is not stored as parquet")
+
+        with open(os.path.join(self.cache_dir, entry["file"]), "rb") as f:
+            data = f.read()
+
+        if self.manifest["salt"] is not None:
+            data = self.__fernet(self.manifest["salt"]).decrypt(data)
+
+        return SubjectsData(pd.read_parquet(io.BytesIO(data)))
+
+    def sheet_subjects(self, sh_name:str) -> SIDList | None:
+        """
+        Returns the cached subjects pre-scan of the given sheet, None if not cached.
+        """
+        subjs = self.manifest["subjects"].get(sh_name)
+        if subjs is None:
+            return None
+        return SIDList([SID(lab, sess, id_) for lab, sess, id_ in subjs])
+
+    def store(self, sheets:Sheets):
+        """
+        Write all the given sheets to the cache.
+        """
+        with self._lock:
+            self.manifest["sheet_names"] = list(sheets.keys())
+            for sh_name, sd in sheets.items():
+                self.store_sheet(sh_name, sd)
+
+    def store_sheet_names(self, sh_names:List[str]):
+        with self._lock:
+            self.manifest["sheet_names"] = list(sh_names)
+            self.__write_manifest()
+
+    def store_sheet(self, sh_name:str, sd:SubjectsData):
+        """
+        Write one sheet to the cache. The manifest is written last, thus an interrupted store leaves an incomplete (not a corrupted) cache.
+        Raises an exception if the sheet cannot be represented in Arrow.
+        """
+        with self._lock:
+            manifest = self.manifest
+            if manifest.get("new", False):
+                self.__write_manifest()
+
+            buf = io.BytesIO()
+            try:
+                sd.df_view.to_parquet(buf, engine="pyarrow")
+            except Exception as e:
+                raise Exception("Error in SheetsCache.store_sheet: sheet " + sh_name + " cannot be stored as parquet (" + str(e) + ")")
+
+            data = buf.getvalue()
+            name = hashlib.sha1(sh_name.encode()).hexdigest()[:16] + ".parquet"
+            if manifest["salt"] is not None:
+                data = self.__fernet(manifest["salt"]).encrypt(data)
+                name = name + ".enc"
+
+            with open(os.path.join(self.cache_dir, name), "wb") as f:
+                f.write(data)
+
+            manifest["sheets"][sh_name] = {"file": name, "format": "parquet"}
+            manifest["subjects"][sh_name] = [[s.label, s.session, s.id] for s in sd.subjects]
+            self.__write_manifest()
+
+    def store_sheet_subjects(self, sh_name:str, sids:SIDList):
+        with self._lock:
+            self.manifest["subjects"][sh_name] = [[s.label, s.session, s.id] for s in sids]
+            self.__write_manifest()
+
+    def __loader(self, sh_name:str):
+        return lambda: self.load_sheet(sh_name)
+
+    def __check_password(self, manifest:dict) -> bool:
+        # a cache written with a different password is not valid for this one
+        from cryptography.fernet import InvalidToken
+        try:
+            return self.__fernet(manifest["salt"]).decrypt(manifest["check"].encode()).decode() == manifest["key"]
+        except (InvalidToken, KeyError):
+            return False
+
+    def __fernet(self, salt:str):
+        if salt not in self._fernets:
+            from cryptography.fernet import Fernet
+            from cryptography.hazmat.primitives import hashes
+            from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+            kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=base64.b64decode(salt), iterations=KDF_ITERATIONS)
+            self._fernets[salt] = Fernet(base64.urlsafe_b64encode(kdf.derive(self.password.encode())))
+        return self._fernets[salt]
+    #endregion
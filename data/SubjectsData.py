@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import os
+import threading
+import warnings
 from typing import List, Any, Tuple
 
 import numpy as np
@@ -10,7 +12,7 @@ from pandas import DataFrame
 
 from data.SID import SID
 from data.SIDList import SIDList
-from data.utilities import demean_serie, FilterValues
+from data.utilities import demean_serie, FilterValues, filter_mask
 from myutility.exceptions import DataFileException
 from myutility.list import same_elements, reorder_list, _argsort
 
@@ -47,6 +49,42 @@ from myutility.list import same_elements, reorder_list, _argsort
 # method with (*) can select only specific rows among those given according to columns values
 # method with (@) can specify the desired sessions or all sessions (giving sessions=[])
 
+# (label, session) => row id resolution uses a hash index, lazily built and invalidated whenever df is replaced (df setter)
+# or its key columns are modified by the methods of this class. code modifying in-place the key columns of df must call invalidate_index
+
+# copies of a SubjectsData (SubjectsData.copy, thus MSHDB.copy and Sheets.copy) share the same data frame until either one is modified,
+# then the modified one works on its own (deep) copy. methods reading the data use _df (or df_view), those modifying it in place use df,
+# which clones a shared data frame first: sheets copied and only read (e.g. filtered) are never cloned.
+# pandas copy-on-write mode is not enabled by this module (it is a process-wide option changing the semantics of all pandas code),
+# applications may opt in themselves (pd.set_option("mode.copy_on_write", True)): the internal copies of df (copy_df) are then lazy too.
+_share_lock = threading.Lock()
+
+
+def copy_df(df:pandas.DataFrame) -> pandas.DataFrame:
+    """
+    Returns an independent copy of df: lazy (shared until modified) if the application enabled pandas copy-on-write mode, deep otherwise.
+    """
+    try:
+        cow = pd.get_option("mode.copy_on_write") is True
+    except KeyError:       # pandas < 1.5
+        cow = False
+    return df.copy(deep=not cow)
+
+
+def _can_hold(dtype:np.dtype, values:np.ndarray) -> bool:
+    """
+    Whether values can be stored in an array of the given dtype without changing them (e.g. 31.0 in an int column, not 31.5 or "31").
+    """
+    if values.dtype == dtype or dtype == object:
+        return True
+    try:
+        with warnings.catch_warnings(), np.errstate(all="ignore"):
+            warnings.simplefilter("ignore")
+            converted = values.astype(dtype)
+            return bool((pandas.Series(converted, dtype=object) == pandas.Series(values, dtype=object)).all())
+    except (ValueError, TypeError, OverflowError):
+        return False
+
 
 class SubjectsData:
     """
@@ -56,7 +94,6 @@ class SubjectsData:
 
     first_col_name          = "subj"
     second_col_name         = "session"
-    df: pandas.DataFrame    = None
 
     def __init__(self, data:str|pandas.DataFrame|None=None, validcols:List[str]=None, cols2num:List[str]|dict=None, delimiter:str='\t', check_data:bool=True):
         """
@@ -86,6 +123,12 @@ class SubjectsData:
         Exception
             If the data contains an invalid column name or if the data type conversion is not supported.
         """
+        self._df:pandas.DataFrame   = None
+        self._df_sharers:list       = None     # [number of SubjectsData sharing _df], see copy
+        self._index:dict            = None     # (label, session) => row id
+        self._sessions:dict         = None     # label => [sessions], in df order
+        self._index_key:tuple       = None
+
         self.filepath   = data
         self.df         = pandas.DataFrame()
         if data is not None:
@@ -175,6 +218,7 @@ class SubjectsData:
 
             # sort by first two columns
             self.df.sort_values([self.first_col_name, self.second_col_name], ascending=[True, True], inplace=True)
+            self.invalidate_index()
 
 
 
@@ -185,6 +229,41 @@ class SubjectsData:
 
     # =========================================================================================================
     # region PROPERTIES
+    @property
+    def df(self) -> pandas.DataFrame:
+        """
+        The data frame, to be used to modify it: a data frame shared with copies of this SubjectsData is cloned first.
+        Use df_view to only read it.
+        """
+        return self._writable_df()
+
+    @property
+    def df_view(self) -> pandas.DataFrame:
+        """
+        The data frame, to be used to only read it: it may be shared with copies of this SubjectsData and must not be modified.
+        """
+        return self._df
+
+    def _writable_df(self) -> pandas.DataFrame:
+        # clone-on-write: a data frame shared with copies is cloned before being modified
+        if self._df_sharers is not None:
+            with _share_lock:
+                if self._df_sharers is not None:
+                    if self._df_sharers[0] > 1:
+                        self._df = self._df.copy()
+                    self._df_sharers[0] -= 1
+                    self._df_sharers = None
+        return self._df
+
+    @df.setter
+    def df(self, value:pandas.DataFrame):
+        with _share_lock:
+            if self._df_sharers is not None:
+                self._df_sharers[0] -= 1
+                self._df_sharers = None
+        self._df = value
+        self.invalidate_index()
+
     @property
     def header(self) -> list:
         """
@@ -195,10 +274,10 @@ class SubjectsData:
         list
             The header of the data frame.
         """
-        if self.df is None:
+        if self._df is None:
             return []
         else:
-            return self.df.columns.to_list()
+            return self._df.columns.to_list()
 
     @property
     def num(self) -> int:
@@ -210,7 +289,7 @@ class SubjectsData:
         int
             The number of rows in the data frame.
         """
-        return self.df.shape[0]
+        return self._df.shape[0]
 
     @property
     def isValid(self) -> bool:
@@ -234,7 +313,10 @@ class SubjectsData:
         SIDList
             A list of SID objects.
         """
-        return SIDList([SID(row[self.first_col_name], row[self.second_col_name], index) for index, row in self.df.iterrows()])
+        df = self._df       # read only, a shared data frame is not cloned
+        if df is None or not self.isValid:
+            return SIDList()
+        return SIDList([SID(lab, sess, index) for lab, sess, index in zip(df[self.first_col_name].tolist(), df[self.second_col_name].tolist(), df.index.tolist())])
 
     @property
     def subjects_labels(self) -> List[str]:
@@ -244,11 +326,49 @@ class SubjectsData:
         Returns:
             List[str]: A list of strings representing the labels of the subjects.
         """
-        slab = []
-        for s in self.subjects:
-            if s.label not in slab:
-                slab.append(s.label)
-        return slab
+        return list(self.sessions_index.keys())
+
+    @property
+    def index(self) -> dict:
+        """
+        Returns the (label, session) => row id dictionary, (re)building it if df changed.
+        When a (label, session) pair is duplicated, the first row is indexed.
+        """
+        self.__check_index()
+        return self._index
+
+    @property
+    def sessions_index(self) -> dict:
+        """
+        Returns the label => [sessions] dictionary (sessions in the df order), (re)building it if df changed.
+        """
+        self.__check_index()
+        return self._sessions
+
+    def invalidate_index(self) -> None:
+        """
+        Discard the (label, session) index, to be called after in-place modifications of the first two columns of df.
+        """
+        self._index     = None
+        self._sessions  = None
+        self._index_key = None
+
+    def __check_index(self):
+        # df replaced/resized by external code (without using the setter) is detected comparing the identity and length of df
+        key = (id(self._df), 0 if self._df is None else len(self._df))
+        if self._index is not None and self._index_key == key:
+            return
+
+        index       = {}
+        sessions    = {}
+        if self._df is not None and self.isValid:
+            for lab, sess, id_ in zip(self._df[self.first_col_name].tolist(), self._df[self.second_col_name].tolist(), self._df.index.tolist()):
+                index.setdefault((lab, sess), id_)
+                sessions.setdefault(lab, []).append(sess)
+
+        self._index     = index
+        self._sessions  = sessions
+        self._index_key = key
 
     # endregion
 
@@ -256,7 +376,7 @@ class SubjectsData:
     # region EXIST -> bool
 
     def exist_subject_session(self, subj_lab:str, sess_id:int=1) -> bool:
-        return ((self.df[self.first_col_name] == subj_lab) & (self.df[self.second_col_name] == sess_id)).any()
+        return (subj_lab, sess_id) in self.index
 
     def exist_subjects_session(self, subj_labels:List[str], sess_id:int=1) -> bool:
         for subj in subj_labels:
@@ -317,7 +437,7 @@ class SubjectsData:
     #region (labels, session, [conds]) -> SID/SIDList
     # only methods of SubjectsData that returns a SIDList given a list of subjects' label, sessions and filtering conditions on other columns
     def filter_subjects(self, subj_labels: List[str] = None, sess_ids: List[int] = None,
-                        conditions: List[FilterValues] = None) -> SIDList:
+                        conditions: List[FilterValues] = None, logic:str="and") -> SIDList:
         """
         Filter subjects based on their labels, sessions, and conditions on other columns.
 
@@ -329,6 +449,8 @@ class SubjectsData:
             A list of sessions to include. If None, all sessions will be included.
         conditions: List[FilterValues], optional
             A list of conditions to apply. If None, no conditions will be applied.
+        logic: str, optional
+            How conditions are combined: "and" (all must be satisfied) or "or" (at least one). Defaults to "and".
 
         Returns
         -------
@@ -342,33 +464,22 @@ class SubjectsData:
 
         """
         if subj_labels is None:
-            subj_labels = self.subjects.labels
+            subj_labels = self.subjects_labels
 
         sids:SIDList = SIDList()
 
         for slab in subj_labels:
             if sess_ids is None:
                 # for each subject, I get all its sessions
-                sess_ids = self.get_subject_available_sessions(slab)
+                subj_sess_ids = self.get_subject_available_sessions(slab)
             else:
                 # for each subject, I get only given sessions
-                sess_ids = sess_ids
+                subj_sess_ids = sess_ids
 
-            for sess in sess_ids:
+            for sess in subj_sess_ids:
                 sids.append(self.get_sid(slab, sess))
 
-        if conditions is not None:
-            res = []
-            for sid in sids:
-                add = True
-                for selcond in conditions:
-                    if not selcond.isValid(self.get_subject_col_value(sid, selcond.colname)):
-                        add = False
-                if add:
-                    res.append(sid)
-            return SIDList(res)
-        else:
-            return sids
+        return self.filter_sids(conditions, sids, logic)
 
     def get_sid(self, subj_lab: str, sess_id: int = 1, must_exist:bool=True) -> SID | None:
         """
@@ -383,12 +494,12 @@ class SubjectsData:
         Returns:
             SID: The subject with the given subject label and session, if it exists in the data frame. Otherwise, returns None.
         """
-        if self.exist_subject_session(subj_lab, sess_id):
-            id_ = self.get_subjid_by_session(subj_lab, sess_id)
+        id_ = self.index.get((subj_lab, sess_id))
+        if id_ is not None:
             return SID(subj_lab, sess_id, id_)
         else:
             if must_exist is True:
-                raise DataFileException("Error in SubjectsData.get_sid: given subj (" + subj_lab + "|" + sess_id + ") does not exist")
+                raise DataFileException("Error in SubjectsData.get_sid: given subj (" + str(subj_lab) + "|" + str(sess_id) + ") does not exist")
             else:
                 return None
 
@@ -396,9 +507,10 @@ class SubjectsData:
 
     # ======================================================================================
     #region (SIDS|conditions) -> SIDS
-    def filter_sids(self, conditions: List[FilterValues], sids: SIDList = None) -> SIDList:
+    def filter_sids(self, conditions: List[FilterValues], sids: SIDList = None, logic:str="and") -> SIDList:
         """
         Filter SIDList based on conditions on other columns.
+        Conditions are evaluated once over whole columns (see data.utilities.filter_mask), then sids are kept if their row is valid.
 
         Parameters
         ----------
@@ -406,6 +518,8 @@ class SubjectsData:
             A list of SIDS to filter. If None, all subjects will be included.
         conditions: List[FilterValues], optional
             A list of conditions to apply. If None, no conditions will be applied.
+        logic: str, optional
+            How conditions are combined: "and" (all must be satisfied) or "or" (at least one). Defaults to "and".
 
         Returns
         -------
@@ -421,23 +535,48 @@ class SubjectsData:
         if sids is None:
             sids = self.subjects
 
-        if conditions is not None:
-            res = []
-            for sid in sids:
-                add = True
-                for selcond in conditions:
-                    if not selcond.isValid(self.get_subject_col_value(sid, selcond.colname)):
-                        add = False
-                if add:
-                    res.append(sid)
-            return SIDList(res)
-        else:
+        if conditions is None or len(conditions) == 0:
             return sids
 
+        for selcond in conditions:
+            if selcond.colname not in self.header:
+                raise DataFileException("Error in filter_sids: given column name (" + str(selcond.colname) + ") does not exist in the data frame")
+
+        try:
+            mask = filter_mask(self._df, conditions, logic)
+        except ValueError as e:
+            raise DataFileException(str(e))
+
+        # as get_subject_col_value, the first row of a duplicated id is considered
+        mask        = mask & ~self._df.index.duplicated(keep="first")
+        valid_ids   = set(self._df.index[mask])
+
+        res = []
+        for sid in sids:
+            if sid.id >= self.num:
+                raise DataFileException("Error in filter_sids: given subject id (" + str(sid.id) + ") exceeds the total number of elements")
+            if sid.id in valid_ids:
+                res.append(sid)
+        return SIDList(res)
+
     #endregion
 
     # ======================================================================================
     #region (SIDS|validcols) -> SubjectsData
+    def copy(self) -> 'SubjectsData':
+        """
+        Returns an independent copy of the present SubjectsData, sharing its data frame until either one is modified.
+        """
+        sd          = SubjectsData()
+        sd.filepath = self.filepath
+        with _share_lock:
+            if self._df_sharers is None:
+                self._df_sharers = [1]
+            self._df_sharers[0] += 1
+            sd._df          = self._df
+            sd._df_sharers  = self._df_sharers
+        return sd
+
     def extract_subjset(self, sids:SIDList, validcols:List[str]=None) -> 'SubjectsData':
         '''
         Returns a subset of the present SubjectsData containing only the given subjects
@@ -477,7 +616,9 @@ class SubjectsData:
             The selected data frame.
         """
         if df is None:
-            df = self.df.copy()
+            if sids is None and validcols is None:
+                return copy_df(self._df)
+            df = self._df       # the selection below creates a new data frame
 
         if sids is None and validcols is None:
             return df
@@ -508,11 +649,12 @@ class SubjectsData:
         pandas.DataFrame
             The selected data frame.
         """
-        if df is None:
-            df = self.df.copy()
+        own = df is None
+        if own:
+            df = self._df
 
         if validcols is None:
-            return df
+            return copy_df(df) if own else df
         else:
             vcs = validcols.copy()
             for vc in vcs:
@@ -546,7 +688,7 @@ class SubjectsData:
             The selected data frame.
         """
         if df is None:
-            df = self.df.copy()
+            df = self._df       # iloc below creates a new data frame
 
         if sids is None:
             sids = self.subjects
@@ -599,7 +741,7 @@ class SubjectsData:
             if len(missing_col) > 0:
                 raise ValueError("Error in SubjectsData.get_subject: given validcols list contains columns (" + str(missing_col) + ") not present in the original df...exiting")
 
-        return self.df.loc[sid.id, validcols].to_dict()
+        return self._df.loc[sid.id, validcols].to_dict()
 
     def get_sids_dict(self, sids:SIDList=None, validcols:List[str]=None) -> List[dict]:
         """
@@ -653,7 +795,7 @@ class SubjectsData:
         if colname not in self.header:
             raise DataFileException("Error in get_subject_col_value: given column name (" + colname + ") does not exist in the data frame")
 
-        value = self.df.loc[sid.id, colname]
+        value = self._df.loc[sid.id, colname]
         if isinstance(value, pandas.Series):
             return value.values[0]
         else:
@@ -843,8 +985,9 @@ class SubjectsData:
         Raises:
             DataFileException: If error_if_empty is True and no session is available for given subj_label.
         """
-        if self.exist_subject_session(subj_lab, sess_id):
-            return int(self.df.index[(self.df[self.second_col_name] == sess_id) & (self.df[self.first_col_name] == subj_lab)].values[0])
+        id_ = self.index.get((subj_lab, sess_id))
+        if id_ is not None:
+            return int(id_)
         else:
             if error_if_empty:
                 raise DataFileException("SubjectsData.get_subjid_by_session")
@@ -867,12 +1010,9 @@ class SubjectsData:
             DataFileException: If error_if_empty is True and no session is available for given subj_label.
         """
         if df is None:
-            df = self.df.copy()
-
-        mask    = df[self.first_col_name].isin([subj_lab])
-        df      = df[mask]
-
-        sessions = list(df[self.second_col_name])
+            sessions = list(self.sessions_index.get(subj_lab, []))
+        else:
+            sessions = list(df.loc[df[self.first_col_name] == subj_lab, self.second_col_name])
 
         if len(sessions) > 0:
             return sessions
@@ -913,6 +1053,8 @@ class SubjectsData:
 
         col_id = self.col_id(col_label)
         self.df.iat[sid.id, col_id] = value
+        if col_id < 2:
+            self.invalidate_index()
 
     # add new subjects: can be
     # - List[SubjectsData] e.g. several object containing one subject only
@@ -944,14 +1086,14 @@ class SubjectsData:
         for subj in newsubjs:
             if isinstance(subj, SubjectsData):
 
-                if subj.df.columns[0] != self.first_col_name or subj.df.columns[1] != self.second_col_name:
+                if subj._df.columns[0] != self.first_col_name or subj._df.columns[1] != self.second_col_name:
                     raise Exception("Error in SubjectsData.add, SubjectsData does not contain subj column as 1st one or sessions as second")
 
-                self.df = pd.concat([self.df, subj.df], ignore_index=True)
+                self.df = pd.concat([self._df, subj._df], ignore_index=True)
 
             elif isinstance(subj, dict):
                 df = pandas.DataFrame.from_dict(subj)
-                self.df = pd.concat([self.df, df], ignore_index=True)
+                self.df = pd.concat([self._df, df], ignore_index=True)
 
             else:
                 raise Exception("Error in SubjectsData.add, an element of newsubjs is not a SubjectsData")
@@ -995,6 +1137,119 @@ class SubjectsData:
         else:
             print("Warning in SubjectsData.add_columns_df...trying to add new columns, but new subjects are also present...skipping this operation")
 
+    def upsert(self, subjsdf:pandas.DataFrame, key:Tuple[str, str]=None, columns:List[str]=None, policy:str="overwrite", insert:bool=True) -> Tuple[int, int]:
+        """
+        Merges a DataFrame into the current one: rows whose key already exists are updated, the others are appended.
+        Rows are matched through the key columns in a single indexed operation and each column is updated at once.
+
+        Parameters
+        ----------
+        subjsdf : pandas.DataFrame
+            The DataFrame to merge, it must contain the key columns, its keys must be unique.
+        key : Tuple[str, str], optional
+            The columns identifying a row, by default the first two columns (subject and session).
+        columns : List[str], optional
+            The columns to merge, by default all the non-key columns of subjsdf. Columns not present in the current df are added.
+        policy : str, optional
+            How existing values are updated by the non-empty values of subjsdf (empty values never overwrite existing ones):
+            - "overwrite": always (as DataFrame.update)
+            - "fill_na": only when the existing value is empty
+            - "error": as fill_na, but raise an exception if an existing value differs from the new one
+            by default "overwrite".
+        insert : bool, optional
+            Whether to append the rows whose key does not exist (otherwise they are ignored), by default True.
+
+        Returns
+        -------
+        Tuple[int, int]
+            The number of inserted rows and of updated rows (those in which at least one value changed).
+
+        Raises
+        ------
+        Exception
+            If subjsdf is not a DataFrame, its keys are not unique, a column does not exist, the policy is unknown
+            or (policy "error") an existing value would be changed.
+        """
+        if not isinstance(subjsdf, pandas.DataFrame):
+            raise Exception("Error in SubjectsData.upsert, given subjsdf is not a DataFrame")
+
+        if policy not in ("overwrite", "fill_na", "error"):
+            raise Exception("Error in SubjectsData.upsert, unknown policy (" + str(policy) + ")")
+
+        key = [self.first_col_name, self.second_col_name] if key is None else list(key)
+        for col in key:
+            if col not in subjsdf.columns or col not in self.header:
+                raise Exception("Error in SubjectsData.upsert, key column (" + str(col) + ") does not exist")
+
+        if columns is None:
+            columns = [c for c in subjsdf.columns if c not in key]
+        for col in columns:
+            if col not in subjsdf.columns:
+                raise Exception("Error in SubjectsData.upsert, column (" + str(col) + ") does not exist in given subjsdf")
+
+        src_keys = pd.MultiIndex.from_frame(subjsdf[key])
+        if src_keys.has_duplicates:
+            raise Exception("Error in SubjectsData.upsert, given subjsdf contains duplicated keys: " + str(list(src_keys[src_keys.duplicated()])[:10]))
+
+        # position of each incoming row within df (-1 = new row). duplicated keys of df: the first row is updated
+        df          = copy_df(self._df)
+        dst_keys    = pd.MultiIndex.from_frame(df[key])
+        first       = ~dst_keys.duplicated()
+        pos         = dst_keys[first].get_indexer(src_keys)
+        pos         = np.where(pos >= 0, np.flatnonzero(first)[np.maximum(pos, 0)], -1)
+        existing    = pos >= 0
+
+        added = [col for col in columns if col not in df.columns]
+        for col in added:
+            df[col] = np.nan
+
+        # update existing rows, one column at a time. values are taken from subjsdf with their own dtype (no reindexing,
+        # that would turn int columns into floats) and the column dtype is kept unless it cannot hold the new values
+        updated = np.zeros(len(df), dtype=bool)
+        rows    = pos[existing]
+        for col in columns:
+            newval  = subjsdf[col].to_numpy()[existing]
+            values  = df[col].to_numpy()
+            new     = pandas.Series(newval)
+            cur     = pandas.Series(values[rows])
+            write   = new.notna().to_numpy()
+            if policy != "overwrite":
+                conflict = write & cur.notna().to_numpy()
+                if policy == "error":
+                    conflict = conflict & (cur != new).to_numpy()
+                    if conflict.any():
+                        raise Exception("Error in SubjectsData.upsert, column (" + str(col) + ") would change the existing values of: " +
+                                        str([tuple(r) for r in df.iloc[rows[conflict]][key].to_numpy()][:10]))
+                write = write & ~conflict
+
+            changed = write & (cur != new).to_numpy() & ~(cur.isna() & new.isna()).to_numpy()
+            if changed.any():
+                target  = rows[changed]
+                newval  = newval[changed]
+                if col not in added and _can_hold(values.dtype, newval):
+                    values = values.copy()
+                else:
+                    values = values.astype(object)      # e.g. strings or non-integer floats into an int column, types are then inferred
+                values[target] = newval
+                column  = pandas.Series(values, index=df.index, name=col)
+                df[col] = column.infer_objects() if values.dtype == object else column
+                updated[target] = True
+
+        # append new rows
+        ninserted = 0
+        if insert and not existing.all():
+            newrows     = subjsdf.loc[~existing, key + [c for c in columns if c not in key]]
+            ninserted   = len(newrows)
+            for col in key:         # e.g. sessions read as float
+                try:
+                    newrows = newrows.astype({col: df[col].dtype})
+                except (ValueError, TypeError):
+                    pass
+            df          = pd.concat([df, newrows], ignore_index=True)
+
+        self.df = df
+        return ninserted, int(updated.sum())
+
     def add_column(self, col_label: str, values: list, sids: SIDList = None, position: int = None, df: pandas.DataFrame = None) -> None:
         """
         Adds a new column to the SubjectsData object.
@@ -1070,6 +1325,9 @@ class SubjectsData:
             # ids = self.subj_ids(val)
             self.df.at[s.id, col_label] = values[i]
 
+        if col_label in (self.first_col_name, self.second_col_name):
+            self.invalidate_index()
+
         if df is not None:
             self.save_data(df)
 
@@ -1096,10 +1354,11 @@ class SubjectsData:
         if row is None:
             row = {self.first_col_name: sid.label, self.second_col_name: sid.session}
 
-        if len(self.df) == 0:
+        if len(self._df) == 0:
             self.df = pandas.DataFrame(columns=list(row.keys()))
 
-        self.df.loc[len(self.df)] = row
+        self.df.loc[len(self._df)] = row
+        self.invalidate_index()
 
     # assoc_dict is a dictionary where key is current name and value is the new one
     def rename_subjects(self, assoc_dict) -> None:
@@ -1116,11 +1375,16 @@ class SubjectsData:
         None
 
         """
+        ids = []
         for i, (k_oldlab, v_newlab) in enumerate(assoc_dict.items()):
             sessions = self.get_subject_available_sessions(k_oldlab)
             for sess in sessions:
-                subj_id = self.get_subjid_by_session(k_oldlab, sess)
-                self.df.loc[subj_id, self.first_col_name] = v_newlab
+                ids.append((self.get_subjid_by_session(k_oldlab, sess), v_newlab))
+
+        # ids are all resolved before renaming: a new label may be the old label of another subject
+        for subj_id, v_newlab in ids:
+            self.df.loc[subj_id, self.first_col_name] = v_newlab
+        self.invalidate_index()
 
     # REMOVE SUBJ DATA
     def remove_subjects(self, subjects2remove: SIDList, df: pandas.DataFrame = None, update=False) -> SubjectsData:
@@ -1143,19 +1407,16 @@ class SubjectsData:
 
         """
         if df is None:
-            df = self.df.copy()
-
-        labels = list(df[self.first_col_name])
+            df = self._df
 
-        try:
-            for sid in subjects2remove:
-                # ids = labels.index(subjlab)
-                id = df.index[(df[self.first_col_name] == sid.label) & (df['session'] == sid.session)].tolist()[0]
-                df.drop(id, inplace=True)
-                df.reset_index(drop=True, inplace=True)
-        except Exception:
-            a=1
-        sd = SubjectsData(df)
+        # a single pass over the rows, subjects not present in df are ignored
+        keys    = set((sid.label, sid.session) for sid in subjects2remove)
+        mask    = np.array([(lab, sess) in keys for lab, sess in zip(df[self.first_col_name].tolist(), df[self.second_col_name].tolist())], dtype=bool)
+        if mask.any():
+            df  = df[~mask].reset_index(drop=True)
+        else:
+            df  = copy_df(df).reset_index(drop=True)     # nothing to remove: do not clone the data
+        sd      = SubjectsData(df)
 
         if update:
             self.df = df
@@ -1185,7 +1446,7 @@ class SubjectsData:
             raise Exception("Error in SubjectsData.remove_columns: given cols param is not a list")
 
         if df is None:
-            df = self.df.copy()
+            df = copy_df(self._df)
 
         for col in cols2remove:
             if col in df.columns.to_list():
@@ -1217,7 +1478,7 @@ class SubjectsData:
             DataFileException: If the given column does not exist in the data frame.
         """
         if df is None:
-            df = self.df.copy()
+            df = copy_df(self._df)
 
         if col_str not in df.columns.values[:]:
             raise DataFileException("SubjectsData.is_cell_not_empty: given col (" + str(col_str) + ") does not exist in df")
@@ -1259,7 +1520,7 @@ class SubjectsData:
 
         """
         if df is None:
-            df = self.df.copy()
+            df = copy_df(self._df)
 
         return df.columns.get_loc(col_lab)
 
@@ -1318,7 +1579,7 @@ class SubjectsData:
             if len(outcolnames) != len(incolnames):
                 raise Exception("Error in SubjectsData.save_data: given outcolnames length differs from column number")
             else:
-                df.columns.values[:] = outcolnames
+                df.columns = outcolnames
 
         df = self.select_rows_df(sids, df)
 
@@ -1372,7 +1633,7 @@ class SubjectsData:
 
         """
         if df is None:
-            df = self.df.copy()
+            df = copy_df(self._df)
 
         Q1 = df[colname].quantile(0.25)
         Q3 = df[colname].quantile(0.75)
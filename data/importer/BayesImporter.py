@@ -1,15 +1,14 @@
 import datetime
-import io
 from typing import List
-import json
 
-import msoffcrypto
 import numpy
 import pandas
 import pandas as pd
 import os
 
 from data.BayesDB import BayesDB
+from data.ExcelWorkbook import ExcelWorkbook
+from data.utilities import read_json_file
 from myutility.exceptions import DataFileException
 from data.SubjectsData import SubjectsData
 from data.Sheets import Sheets
@@ -23,6 +22,7 @@ class BayesImporter:
         data (str or dict): The path to the excel file to be parsed or a dictionary of the sheets.
         bayes_schema (str) : path to json containing full bayes schema
         password (str, optional): The password for decrypting the excel file. Defaults to "".
+        num_cpu (int, optional): The number of processes parsing the excel sheets in parallel. Defaults to 1.
 
     Attributes:
         input_sheets_names (list): A list of the names of the input sheets to be parsed automatically through the json schema.
@@ -64,30 +64,31 @@ class BayesImporter:
     def __init__(self,  import_schema_file: str,
                         bayes_schema:str,
                         data: str | dict = None,
-                        password: str = ""):
+                        password: str = "",
+                        num_cpu: int = 1):
         super().__init__()
 
         self.bayes_schema_file  = bayes_schema
         self.import_schema_file = import_schema_file
         self.password           = password
+        self.num_cpu            = num_cpu
         self.filepath           = ""
 
-        with open(import_schema_file) as json_file:
-            self.import_schema = json.load(json_file)
+        # schemas are parsed once per process (e.g. when importing many files) and must not be modified
+        self.import_schema              = read_json_file(import_schema_file)
 
-            self.input_sheets_names     = self.import_schema["in_sheets_names"]
-            self.schema_sheets_names    = self.import_schema["out_sheets_names"]
+        self.input_sheets_names         = self.import_schema["in_sheets_names"]
+        self.schema_sheets_names        = self.import_schema["out_sheets_names"]
 
-            self.main_id                = self.import_schema["main_id"]
-            self.date_format            = self.import_schema["date_format"]
-            self.dates                  = self.import_schema["dates"]
-            self.to_be_rounded          = self.import_schema["to_be_rounded"]
-            self.round_decimals         = self.import_schema["round_decimals"]
+        self.main_id                    = self.import_schema["main_id"]
+        self.date_format                = self.import_schema["date_format"]
+        self.dates                      = self.import_schema["dates"]
+        self.to_be_rounded              = self.import_schema["to_be_rounded"]
+        self.round_decimals             = self.import_schema["round_decimals"]
 
         self.main_name                  = self.schema_sheets_names[self.main_id]
 
-        with open(bayes_schema) as json_file:
-            self.bayes_schema = json.load(json_file)
+        self.bayes_schema               = read_json_file(bayes_schema)
 
         if data is not None:
             self.load(data)
@@ -131,21 +132,14 @@ class BayesImporter:
             # Set the filepath
             self.filepath = data
 
-            # Check if a password is set
-            if self.password != "":
-                # Decrypt the Excel file
-                data = self.__decrypt_excel(data, self.password)
-
-            # Read the Excel file
-            xls = pd.ExcelFile(data)
+            # Read (decrypting it if a password is set) the Excel file, parsing its sheets in parallel
+            wb          = ExcelWorkbook(data, self.password)
+            sh_names    = [sheet_name for sheet_name in wb.sheet_names if sheet_name in self.schema_sheets_names]
 
             self.sheets = Sheets(sh_names=self.schema_sheets_names, main_id=self.main_id)
-
-            # Loop through the sheets
-            for sheet_name in xls.sheet_names:
-
-                if sheet_name in self.schema_sheets_names:
-                    self.sheets[sheet_name] = SubjectsData(pd.read_excel(xls, sheet_name), check_data=False)
+            for sheet_name, df in wb.read_sheets(sh_names, self.num_cpu).items():
+                self.sheets[sheet_name] = SubjectsData(df, check_data=False)
+            wb.close()
 
         elif isinstance(data, dict):
             # Check if the given data is a dictionary of sheets
@@ -170,25 +164,6 @@ class BayesImporter:
         # self.check_tot()
         return BayesDB(self.bayes_schema_file, self.sheets, calc_flags=False)
 
-    def __decrypt_excel(self, fpath: str, pwd: str) -> io.BytesIO:
-        """Decrypts an Excel file using the given password.
-
-        Args:
-            fpath (str): The path to the Excel file.
-            pwd (str): The password for decrypting the file.
-
-        Returns:
-            io.BytesIO: The decrypted Excel file as a BytesIO object.
-        """
-        unlocked_file = io.BytesIO()
-
-        with open(fpath, "rb") as file:
-            excel_file = msoffcrypto.OfficeFile(file)
-            excel_file.load_key(password=pwd)
-            excel_file.decrypt(unlocked_file)
-
-        return unlocked_file
-
     def __round_columns(self):
         """
         Rounds the values of the specified columns to the specified number of decimal places.
@@ -200,12 +175,13 @@ class BayesImporter:
             df: pandas.DataFrame = self.sheets.sheet_df(sh)
             if df.size == 0:
                 continue
+            labels = list(df["LABELS"])
             for col in self.to_be_rounded[sh]:
                 label = list(col.keys())[0]
                 value = list(col.values())[0]
 
-                row_id = list(df["LABELS"]).index(label)
-                self.sheets.sheet_df(sh).iloc[row_id, value] = round(df.iloc[row_id, value], self.round_decimals)
+                row_id = labels.index(label)
+                df.iloc[row_id, value] = round(df.iloc[row_id, value], self.round_decimals)
 
     def __format_dates(self):
         """
@@ -219,19 +195,20 @@ class BayesImporter:
             if df.size == 0:
                 continue
 
+            labels = list(df["LABELS"])
             for col in self.dates[sh]:
                 label = list(col.keys())[0]
                 value = list(col.values())[0]
 
-                id_row  = [i for i, v in enumerate(list(df["LABELS"])) if label in v][0]
+                id_row  = [i for i, v in enumerate(labels) if label in v][0]
                 val     = df.iloc[id_row, value]
 
                 if isinstance(val, datetime.datetime):
                     # series = df["LABELS"]
                     # row_id = series[series.str.contains(label)].index   #list(df["LABELS"]).index(label)
-                    self.sheets.sheet_df(sh).iloc[id_row, value] = df.iloc[id_row, value].strftime(self.date_format)
+                    df.iloc[id_row, value] = val.strftime(self.date_format)
                 else:
-                    self.sheets.sheet_df(sh).iloc[id_row, value] = ""
+                    df.iloc[id_row, value] = ""
                     # formatted_date = df.loc[df['LABELS'] == label]["VALUES"].iat[0].strftime(self.date_format)
 
     def __set_main(self):
@@ -392,46 +369,34 @@ class BayesImporter:
         Raises:
             ValueError: If the given scale name is not valid.
         """
-        df = self.sheets.sheet_df(scale_name)
-        sh = {"subj": self.subj, "session": self.session, "group": self.group}
-
-        try:
-            for item in self.import_schema[scale_name]:
-
-                if item == "CAN_BE_EMPTY":
-                    continue
-
-                r = self.import_schema[scale_name][item][0]
-                c = self.import_schema[scale_name][item][1]
-
-                if r < df.shape[0] and c < df.shape[1]:
-
-                    value = df.iloc[r, c]
-
-                    # check whether is an empty value
-                    if value == self.empty_value:
-                        still_valid = False     # by default is not a valid scale
-                        # check if this empty value is allowed
-                        if "CAN_BE_EMPTY" in self.import_schema[scale_name].keys():
-                            # this scale allow at least one empty value
-                            for i,canempty_elem in enumerate(self.import_schema[scale_name]["CAN_BE_EMPTY"]):
-                                if canempty_elem[0] == r and canempty_elem[1] == c:
-                                    sh[item]    = numpy.nan     # this value can be empty
-                                    still_valid = True          # set the flag to avoid scale deletion
-                                    continue                    # exit the for
-
-                        if still_valid is False:
-                            del self.sheets[scale_name]
-                            print("Scale " + scale_name + " is incomplete, skipping it.....")
-                            return
-                    else:
-                        sh[item] = value
-                else:
-                    msg = "Error in __set_sheet limit exceeded in sheet: " + scale_name + ", df is [" + str(df.shape[0]) + "," + str(df.shape[1]) + "] and requested indices are: " + str(r) + "," + str(c)
-                    raise Exception(msg)
-        except Exception as e:
-            a = 1
-
+        df      = self.sheets.sheet_df(scale_name)
+        sh      = {"subj": self.subj, "session": self.session, "group": self.group}
+        schema  = self.import_schema[scale_name]
+
+        # all the (row, col) cells of the scale are picked at once
+        items   = [item for item in schema if item != "CAN_BE_EMPTY"]
+        cells   = numpy.array([schema[item] for item in items], dtype=int).reshape(-1, 2)
+
+        outside = numpy.flatnonzero((cells[:, 0] >= df.shape[0]) | (cells[:, 1] >= df.shape[1]))
+        if len(outside) > 0:
+            r, c = cells[outside[0]]
+            print("Error in __set_sheet limit exceeded in sheet: " + scale_name + ", df is [" + str(df.shape[0]) + "," + str(df.shape[1]) + "] and requested indices are: " + str(r) + "," + str(c))
+            items = items[:outside[0]]      # keep the values preceding the first invalid cell
+            cells = cells[:outside[0]]
+
+        values  = df.to_numpy(dtype=object)[cells[:, 0], cells[:, 1]]
+
+        # check whether there are empty values and whether they are allowed
+        empty   = numpy.array([isinstance(v, str) and v == self.empty_value for v in values], dtype=bool)
+        if empty.any():
+            can_be_empty = {(r, c) for r, c in schema.get("CAN_BE_EMPTY", [])}
+            if not all((r, c) in can_be_empty for r, c in cells[empty].tolist()):
+                del self.sheets[scale_name]
+                print("Scale " + scale_name + " is incomplete, skipping it.....")
+                return
+            values[empty] = numpy.nan
+
+        sh.update(zip(items, values))
         self.sheets[scale_name] = SubjectsData(pd.DataFrame.from_dict([sh]))
 
     # def check_tot(self):
@@ -1,14 +1,12 @@
 import datetime
-import io
-import json
 
-import msoffcrypto
 import pandas
 import pandas as pd
 import os
 
 from data.BayesDB import BayesDB
-from data.SID import SID
+from data.ExcelWorkbook import ExcelWorkbook
+from data.utilities import read_json_file
 from myutility.exceptions import DataFileException
 from data.SubjectsData import SubjectsData
 from data.Sheets import Sheets
@@ -66,22 +64,21 @@ class LimeAutoImporter:
         self.filepath           = ""
         self.bayes_schema_file  = bayes_schema_file
 
-        with open(import_schema_file) as json_file:
-            self.import_schema = json.load(json_file)
+        # schemas are parsed once per process (e.g. when importing many files) and must not be modified
+        self.import_schema              = read_json_file(import_schema_file)
 
-            self.input_sheets_names     = self.import_schema["in_sheets_names"]
-            self.schema_sheets_names    = self.import_schema["out_sheets_names"]
+        self.input_sheets_names         = self.import_schema["in_sheets_names"]
+        self.schema_sheets_names        = self.import_schema["out_sheets_names"]
 
-            self.main_id                = self.import_schema["main_id"]
-            self.date_format            = self.import_schema["date_format"]
-            self.dates                  = self.import_schema["dates"]
-            self.to_be_rounded          = self.import_schema["to_be_rounded"]
-            self.round_decimals         = self.import_schema["round_decimals"]
+        self.main_id                    = self.import_schema["main_id"]
+        self.date_format                = self.import_schema["date_format"]
+        self.dates                      = self.import_schema["dates"]
+        self.to_be_rounded              = self.import_schema["to_be_rounded"]
+        self.round_decimals             = self.import_schema["round_decimals"]
 
         self.main_name                  = self.schema_sheets_names[self.main_id]
 
-        with open(bayes_schema_file) as json_file:
-            self.bayes_schema = json.load(json_file)
+        self.bayes_schema               = read_json_file(bayes_schema_file)
 
         if data is not None:
             self.load(data)
@@ -125,14 +122,10 @@ class LimeAutoImporter:
             # Set the filepath
             self.filepath = data
 
-            # Check if a password is set
-            if self.password != "":
-                # Decrypt the Excel file
-                data = self.__decrypt_excel(data, self.password)
-
-            # Read the Excel file
-            xls = pd.ExcelFile(data)
-            df  = pd.read_excel(xls)
+            # Read (decrypting it if a password is set) the first sheet of the Excel file
+            wb  = ExcelWorkbook(data, self.password)
+            df  = wb.read_sheet(wb.sheet_names[0])
+            wb.close()
 
         else:
             raise Exception("Error in MXLSDB.load: unknown data format, not a str")
@@ -142,34 +135,17 @@ class LimeAutoImporter:
         for sh in self.output_sheets_names:
             bayesdb.set_sheet_sd(sh, SubjectsData())
 
-        nsubjects = df.shape[0]
+        # each sheet is built at once, a row per subject
+        main = self.__get_main(df)
+        bayesdb.set_sheet_sd("main", SubjectsData(main, check_data=False))
 
-        for n in range(nsubjects):
-            bayesdb = self.__set_subject(bayesdb, df.iloc[n,])
+        for scale_name in self.input_sheets_names:
+            bayesdb.set_sheet_sd(scale_name, SubjectsData(self.__get_scale(df, main, scale_name), check_data=False))
 
         # self.check_tot()
         return bayesdb # BayesDB(self.sheets, calc_flags=False)
 
 
-    def __decrypt_excel(self, fpath: str, pwd: str) -> io.BytesIO:
-        """Decrypts an Excel file using the given password.
-
-        Args:
-            fpath (str): The path to the Excel file.
-            pwd (str): The password for decrypting the file.
-
-        Returns:
-            io.BytesIO: The decrypted Excel file as a BytesIO object.
-        """
-        unlocked_file = io.BytesIO()
-
-        with open(fpath, "rb") as file:
-            excel_file = msoffcrypto.OfficeFile(file)
-            excel_file.load_key(password=pwd)
-            excel_file.decrypt(unlocked_file)
-
-        return unlocked_file
-
     def __round_columns(self):
         """
         Rounds the values of the specified columns to the specified number of decimal places.
@@ -219,65 +195,56 @@ class LimeAutoImporter:
                     self.sheets.sheet_df(sh).iloc[id_row, value] = ""
                     # formatted_date = df.loc[df['LABELS'] == label]["VALUES"].iat[0].strftime(self.date_format)
 
-    def __set_subject(self, bayesdb:BayesDB, subj:pandas.Series)-> BayesDB:
+    def __get_main(self, df:pandas.DataFrame) -> pandas.DataFrame:
         """
-        This function returns the main dataframe of the EteroDB file.
+        This function returns the main sheet of all the subjects of the Lime Survey export.
 
         Returns:
-            pandas.DataFrame: The main dataframe of the EteroDB file.
+            pandas.DataFrame: The main dataframe, a row per subject.
         """
-        # self.main_columns = {   "subj":"", "session":1, "group":"", "centre":"", "birth_date":"",
-        #                         "recruitment_date":"", "age":0, "gender":"", "auto":0, "etero":0}
+        main = pd.DataFrame({"subj":     df["Cognome"] + " " + df["Nome"],
+                             "session":  df["session"],
+                             "group":    df["group"],
+                             "auto":     1})
 
-        self.main_default_cols  = { "mri":0, "oa":0, "nk":0, "t":0, "m":0, "b":0, "prot":0,
-                                    "mat":0, "mri_oa":0, "mri_nk":0, "mri_t":0, "mri_m":0, "mri_b":0, "mri_prot":0}
+        duplicated = main.duplicated(["subj", "session"])
+        if duplicated.any():
+            raise ValueError("Error in LimeAutoImporter.load: subjects (" + str(main.loc[duplicated, "subj"].tolist()) + ") are duplicated")
 
-        main                    = {}
+        return main
 
-        main["subj"]            = subj["Cognome"] + " " + subj["Nome"]
-        main["session"]         = subj["session"]
-        main["group"]           = subj["group"]
-        main["auto"]            = 1
-
-        subj_sd:SID       = SID(main["subj"], main["session"], -1)
+    def __get_scale(self, df:pandas.DataFrame, main:pandas.DataFrame, scale_name:str) -> pandas.DataFrame:
+        """
+        This function returns the sheet of a scale for all the subjects: the scale columns of the export, with answers converted to numbers.
 
-        bayesdb.get_sheet_sd("main", can_create=True).add_row(subj_sd, main)
+        Returns:
+            pandas.DataFrame: The scale dataframe, a row per subject.
+        """
+        items   = list(self.import_schema[scale_name].keys())
+        values  = df.iloc[:, list(self.import_schema[scale_name].values())]
+        values.columns = items
 
         try:
-            for scale_name in self.input_sheets_names:
-                sh = {"subj":main["subj"], "session":main["session"], "group":main["group"]}
-
-                for item in self.import_schema[scale_name]:
-
-                    c       = self.import_schema[scale_name][item]
-                    value   = subj.iloc[c]
-
-                    if isinstance(value, str):
-
-                        if " (" in value:
-                            nvalue = int(value.split(" ")[0])
-                        elif value == "No" or value == "Falso":
-                            nvalue = 0
-                        elif value == "Sì" or value == "Vero":
-                            nvalue = 1
-                        else:
-                            nvalue = value
-                    else:
-                        nvalue = value
-
-                    sh[item] = nvalue
-
-                bayesdb.get_sheet_sd(scale_name, can_create=True).add_row(subj_sd, sh)
-
-            return bayesdb
-
+            scale = pd.concat([main[["subj", "session", "group"]], values.apply(self.__convert_answers)], axis=1)
         except Exception as e:
-            a = 1
-
+            raise Exception("Error in LimeAutoImporter.load: scale " + scale_name + " | " + str(e))
 
+        return scale
 
+    @staticmethod
+    def __convert_answers(col:pandas.Series) -> pandas.Series:
+        # coded answers (e.g. "3 (spesso)") become their code, No/Falso 0 and Sì/Vero 1, other values are left unchanged
+        if col.dtype != object:
+            return col
 
+        strs    = col.where(col.map(lambda v: isinstance(v, str)))
+        coded   = strs.str.contains(" (", regex=False, na=False).to_numpy(dtype=bool)
+        res     = col.to_numpy(copy=True)
+        res[coded] = strs[coded].str.split(" ").str[0].astype(int).to_numpy()
+        res[strs.isin(["No", "Falso"]).to_numpy()]  = 0
+        res[strs.isin(["Sì", "Vero"]).to_numpy()]   = 1
 
+        return pandas.Series(res, index=col.index, name=col.name).infer_objects()
 
     # presently unused
     def __set_sheet(self, scale_name: str):
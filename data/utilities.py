@@ -13,10 +13,15 @@ The functions in this module are designed to be flexible and can be easily custo
 """
 
 import csv
+import json
 import os
+import threading
 from statistics import mean
 from typing import Dict, List, Any
 
+import numpy as np
+import pandas as pd
+
 from myutility.fileutilities import write_text_file
 # read file as:   lab1=val1\nlab2=val2\n....etc
 from myutility.list import listToString
@@ -61,6 +66,45 @@ def read_varlist_file(filepath: str, comment_char: str = "#") -> Dict[str, str]:
     return data
 
 
+# parsed json files, path => ((mtime, size), content). shared by all the instances (e.g. of an importer) of a process
+_json_cache:Dict[str, tuple]    = {}
+_json_lock                      = threading.Lock()
+
+
+def read_json_file(filepath: str) -> Dict[str, Any]:
+    """
+    Read a json file (e.g. a schema), caching its content until the file changes.
+
+    Args:
+        filepath (str): Path to the file.
+
+    Returns:
+        Dict[str, Any]: The parsed content. It is shared among callers and must not be modified.
+
+    Raises:
+        IOError: If the file does not exist.
+
+    """
+    if not os.path.exists(filepath):
+        raise IOError(f"File {filepath} does not exist.")
+
+    filepath    = os.path.abspath(filepath)
+    st          = os.stat(filepath)
+    stamp       = (st.st_mtime_ns, st.st_size)
+
+    with _json_lock:
+        cached = _json_cache.get(filepath)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+    with open(filepath) as f:
+        data = json.load(f)
+
+    with _json_lock:
+        _json_cache[filepath] = (stamp, data)
+    return data
+
+
 # get a data list and return a \n separated string
 def list2spm_text_column(datalist: List[Any]) -> str:
     """
@@ -339,6 +383,62 @@ class FilterValues:
             else:
                 return False
 
+    def mask(self, values:pd.Series) -> np.ndarray:
+        """
+        Vectorized isValid: check all the values of a column at once.
+
+        Parameters
+        ----------
+        values : pandas.Series
+            The column to be checked.
+
+        Returns
+        -------
+        numpy.ndarray
+            A boolean array, True where the value is valid.
+
+        """
+        try:
+            if self.op == "=" or self.op == "==":
+                res = values == self.par1
+            elif self.op == "!=":
+                res = values != self.par1
+            elif self.op == ">":
+                res = values > self.par1
+            elif self.op == ">=":
+                res = values >= self.par1
+            elif self.op == "<":
+                res = values < self.par1
+            elif self.op == "<=":
+                res = values <= self.par1
+            elif self.op == "<>":
+                res = (values > self.par1) & (values < self.par2)
+            elif self.op == "<=>":
+                res = (values >= self.par1) & (values <= self.par2)
+            elif self.op == "exist":
+                res = ~self.__empty_mask(values)
+            elif self.op == "noexist":
+                res = self.__empty_mask(values)
+            else:
+                return np.zeros(len(values), dtype=bool)
+        except TypeError:
+            # values not comparable with the parameters as a whole (e.g. mixed strings and numbers): check them one by one
+            return np.array([bool(self.isValid(v)) for v in values], dtype=bool)
+
+        # missing values of nullable dtypes (pd.NA) are not valid
+        return np.asarray(pd.Series(res).fillna(False), dtype=bool)
+
+    @staticmethod
+    def __empty_mask(values:pd.Series) -> pd.Series:
+        # same definition of empty of isValid: str(value) is "", "na" or "nan" (case insensitive)
+        if values.dtype.kind == "f":
+            return values.isna()
+        elif values.dtype.kind in "iub":
+            return pd.Series(np.zeros(len(values), dtype=bool), index=values.index)
+
+        strvalues = values.astype(str).str.lower()
+        return (strvalues == "") | (strvalues == "na") | (strvalues == "nan")
+
     def areValid(self, values:List[Any]):
         """
         Check if a list of values is valid according to the filter conditions.
@@ -396,3 +496,46 @@ class FilterValues:
             else:
                 valid.append(False)
         return res, valid
+
+
+def filter_mask(df:pd.DataFrame, conditions:List[FilterValues], logic:str="and") -> np.ndarray:
+    """
+    Evaluate a list of conditions over all the rows of a DataFrame in a single vectorized pass.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The data to be checked.
+    conditions : List[FilterValues]
+        The conditions, each one over a column of df.
+    logic : str
+        How conditions are combined: "and" (all must be valid) or "or" (at least one valid).
+
+    Returns
+    -------
+    numpy.ndarray
+        A boolean array with one element per row of df, True where the row satisfies the conditions.
+
+    Raises
+    ------
+    ValueError
+        If logic is not "and"/"or" or a condition refers to a column not present in df.
+
+    """
+    logic = logic.lower()
+    if logic not in ("and", "or"):
+        raise ValueError("Error in filter_mask: logic (" + str(logic) + ") must be either and or or")
+
+    if conditions is None or len(conditions) == 0:
+        return np.ones(len(df), dtype=bool)
+
+    res = np.ones(len(df), dtype=bool) if logic == "and" else np.zeros(len(df), dtype=bool)
+    for cond in conditions:
+        if cond.colname not in df.columns:
+            raise ValueError("Error in filter_mask: given column name (" + str(cond.colname) + ") does not exist in the data frame")
+
+        if logic == "and":
+            res &= cond.mask(df[cond.colname])
+        else:
+            res |= cond.mask(df[cond.colname])
+    return res
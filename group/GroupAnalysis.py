@@ -6,7 +6,8 @@ from math import ceil
 from random import randrange
 from shutil import move
 import subprocess
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
 import numpy
 import pandas
 
@@ -19,6 +20,8 @@ from myutility.exceptions import NotExistingImageException
 from myutility.fileutilities import get_dirname, write_text_file
 from myutility.fileutilities import sed_inplace
 from myutility.images.Image import Image
+from myutility.images.Images import Images
+from myutility.images.voxelstats import MaskSet, STATS
 from myutility.matlab import call_matlab_spmbatch
 from myutility.myfsl.utils.run import rrun
 from myutility.utilities import fillnumber2threedigits
@@ -772,11 +775,13 @@ class GroupAnalysis:
             data_labels = data.columns.to_list()
             data_labels.pop(0)
 
+        tracts_masks = []
         for entry in os.scandir(in_clust_res_dir):
             if not entry.name.startswith('.') and not entry.is_dir():
                 if entry.name.startswith("sk_"):
                     lab         = Image(entry.name[3:]).fpathnoext
                     tracts_labels.append(lab)
+                    tracts_masks.append(entry.path)
                     str_data    = str_data + "\t" + lab
         str_data = str_data + "\n"
 
@@ -784,26 +789,21 @@ class GroupAnalysis:
         [tracts_data.append([]) for _ in range(len(tracts_labels))]
 
 
+        maskset = MaskSet(tracts_masks)     # clusters are stacked once and reused for all subjects
+
         nsubj = len(subj_labels)
         for id,subj_label in enumerate(subj_labels):
             in_img          = os.path.join(subjects_images, subj_label + "-dti_fit" + subj_img_postfix)
-            subj_img        = Image(in_img, must_exist=True, msg="Error in tbss_summarize_clusterized_folder, subj image (" + in_img + "_masked" + ") is missing...exiting")
-            subj_img_masked = Image(subj_img + "_masked")
-            n_tracts        = 0
+            subj_img        = Image(in_img, must_exist=True, msg="Error in tbss_summarize_clusterized_folder, subj image (" + in_img + ") is missing...exiting")
             str_data        = str_data + subj_label
             for id,lab in enumerate(data_labels):
                 str_data = str_data + "\t" + str(data.loc[data['subj'] == subj_label, lab].values[0])
 
-            for entry in os.scandir(in_clust_res_dir):
-                if not entry.name.startswith('.') and not entry.is_dir():
-                    if entry.name.startswith("sk_"):
-                        subj_img.mask_image(entry.path, subj_img_masked)
-                        val = subj_img_masked.get_image_mean()
-                        subj_img_masked.rm()
-
-                        str_data = str_data + "\t" + str(val)
-                        tracts_data[n_tracts].append(val)
-                        n_tracts = n_tracts + 1
+            # mean of the non-zero voxels of the subject image within each cluster, the image is read once for all clusters
+            for n_tracts, stats in enumerate(maskset.stats(subj_img)):
+                val = stats["nzmean"]
+                str_data = str_data + "\t" + str(val)
+                tracts_data[n_tracts].append(val)
             str_data = str_data + "\n"
 
         res_file = os.path.join(out_folder, ofn + ifn + "_" + listToString(data_labels, separator='_') + ".dat")
@@ -911,6 +911,85 @@ class GroupAnalysis:
     #
     #         # ---------------------------------------------------
 
+    # ====================================================================================================
+    # ROI VALUES EXTRACTION
+    # ====================================================================================================
+    def extract_rois_stats(self, masks:Images|List[str], subjects:List[Subject], subj_image:str|Callable[[Subject], str], ncore:int=1, must_exist:bool=True,
+                           rois_labels:List[str]=None) -> pandas.DataFrame:
+        """
+        Extract the statistics of one image per subject within a set of ROIs.
+
+        Masks are stacked once and all the ROI statistics of a subject are computed in a single vectorized pass (see voxelstats.MaskSet),
+        subjects are distributed across a pool of ncore processes.
+
+        Args:
+            masks (Images): The ROI masks, all with the same geometry of the subjects' images.
+            subjects (List[Subject]): The list of subjects instances.
+            subj_image (str | Callable): name of the Subject attribute containing the image to analyze (e.g. "dti_fit_FA"),
+                                         or a function returning the image path of a given Subject.
+            ncore (int, optional): The number of processes. Defaults to 1.
+            must_exist (bool, optional): raise an exception if a subject image is missing, otherwise skip that subject. Defaults to True.
+            rois_labels (List[str], optional): the roi column values, one per mask. Defaults to the masks' names (that may collide
+                                               when masks come from different folders).
+
+        Returns:
+            pandas.DataFrame: long-format table with columns subj, session, roi, mean, nzmean, nvoxels, volume (one row per subject x roi).
+                              use rois_stats_to_wide to obtain a SubjectsData-compatible table.
+        """
+        masks       = Images(masks, must_exist=True, msg="Error in GroupAnalysis.extract_rois_stats: one or more masks do not exist")
+        if rois_labels is None:
+            rois_labels = [mask.name for mask in masks]
+        elif len(rois_labels) != len(masks):
+            raise Exception("Error in GroupAnalysis.extract_rois_stats: rois_labels and masks have different lengths")
+
+        jobs = []
+        for subj in subjects:
+            img = subj_image(subj) if callable(subj_image) else getattr(subj, subj_image)
+            if not Image(img).exist:
+                if must_exist:
+                    raise NotExistingImageException("Error in GroupAnalysis.extract_rois_stats: image of subject " + subj.label + " is missing", img)
+                print("Warning in GroupAnalysis.extract_rois_stats: image (" + str(img) + ") of subject " + subj.label + " is missing...skipping subject")
+                continue
+            jobs.append((subj.label, subj.sessid, str(img)))
+
+        results = []
+        if ncore > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=ncore) as executor:
+                futures = [executor.submit(_extract_subject_rois_stats, label, sess, img, [str(m) for m in masks]) for label, sess, img in jobs]
+                for fut in futures:
+                    results.append(fut.result())
+        else:
+            maskset = MaskSet(masks)
+            for label, sess, img in jobs:
+                results.append(maskset.stats(img))
+
+        rows = []
+        for (label, sess, img), subj_stats in zip(jobs, results):
+            for roi, stats in zip(rois_labels, subj_stats):
+                rows.append({"subj": label, "session": sess, "roi": roi, **stats})
+
+        return pandas.DataFrame(rows, columns=["subj", "session", "roi"] + STATS)
+
+    @staticmethod
+    def rois_stats_to_wide(df:pandas.DataFrame, stats:List[str]=None, prefix:str="") -> pandas.DataFrame:
+        """
+        Convert the output of extract_rois_stats to a subject x (roi_stat) table, that can be added to a SubjectsData with add_columns_df.
+
+        Args:
+            df (pandas.DataFrame): output of extract_rois_stats.
+            stats (List[str], optional): statistics to keep. Defaults to ["mean"].
+            prefix (str, optional): prefix of the new columns names. Defaults to "".
+
+        Returns:
+            pandas.DataFrame: a table with columns subj, session, [prefix]roi_stat...
+        """
+        if stats is None:
+            stats = ["mean"]
+
+        wide            = df.pivot_table(index=["subj", "session"], columns="roi", values=stats, sort=False)
+        wide.columns    = [prefix + roi + "_" + stat for stat, roi in wide.columns]
+        return wide.reset_index()
+
     def extract_values_from_image(self, ):
 
         """
@@ -918,3 +997,14 @@ class GroupAnalysis:
         """
         pass
     # ====================================================================================================
+
+
+# per-process cache of the stacked masks, so that each worker builds the MaskSet only once
+_masksets:dict = {}
+
+
+def _extract_subject_rois_stats(label:str, session:int, img:str, masks:List[str]) -> List[dict]:
+    key = tuple(masks)
+    if key not in _masksets:
+        _masksets[key] = MaskSet(masks)
+    return _masksets[key].stats(img)
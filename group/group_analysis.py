@@ -3,6 +3,7 @@ from typing import List
 
 from Project import Project
 from subject.Subject import Subject
+from group.GroupAnalysis import GroupAnalysis
 from myutility.images.Image import Image
 from myutility.images.Images import Images
 from myutility.myfsl.utils.run import rrun
@@ -73,19 +74,21 @@ def convert_melodic_rois_to_individual(project:Project, templ_name:str, popul_na
 # subjects: list of subjects instances
 # metric:   measures to analyze. values are: FA,MD,AD,RD
 
-def extract_meanvalue_from_tbssresults(project:Project, rois:Images, subjects:List[Subject], metric:str="FA"):
+def extract_meanvalue_from_tbssresults(project:Project, rois:Images, subjects:List[Subject], metric:str="FA", ncore:int=1):
 
     """
-    This function takes
+    This function extracts, for each subject, the mean of the given tbss metric (non-zero voxels) within each roi.
+    subjects' images are those created by tbss in the project's tbss/FA folder.
 
     Args:
         project (Project): The project object.
         rois (List[Image]): The list of normalized Image to investigate (extract mean individual metrics)
         subjects (List[Subject]): The list of subjects instances
         metric (str, optional): The measures to analyze. Defaults to "FA".
+        ncore (int, optional): The number of processes. Defaults to 1.
 
     Returns:
-        List[List[float]]: The mean values of the given metric in each ROI.
+        List[List[float]]: The mean values of the given metric in each ROI (one row per roi, one column per subject).
 
     Raises:
         Exception: If the given metric is not valid.
@@ -106,25 +109,22 @@ def extract_meanvalue_from_tbssresults(project:Project, rois:Images, subjects:Li
     else:
         subj_img_postfix = "_FA_to_target_" + metric
 
+    masks = Images()
     for roi in rois:
-        rrun(f"fslmaths {roi} -thr 0.95 -bin {roi.split_ext()[0]}_mask")
-    out_folder = os.path.join(project.tbss_dir, "results_sp_sts_htc_fmrib58")
+        mask = Image(roi.split_ext()[0] + "_mask")
+        rrun(f"fslmaths {roi} -thr 0.95 -bin {mask}")
+        masks.append(mask)
 
-    results = []
-    for roi in tbssmap:
-        roi_mask_img = os.path.join(roi_root_dir, roi + "_mask")
-        roi_row = []
-
-        for subj in subjects:
-            subj_img = os.path.join(subjects_images, subj.dti_fit_label + subj_img_postfix)
-            subj_img_masked = os.path.join(subjects_images, subj.dti_fit_label + subj_img_postfix + "_masked")
+    subjects_images = os.path.join(project.tbss_dir, "FA")
+    # rois are identified by their full path, as rois of different folders may have the same name
+    df = GroupAnalysis(project).extract_rois_stats(masks, subjects, lambda subj: os.path.join(subjects_images, subj.dti_fit_label + subj_img_postfix), ncore=ncore,
+                                                   rois_labels=[str(mask) for mask in masks])
 
-            rrun(f"fslmaths {subj_img} -mas {roi_mask_img} {subj_img_masked}")
-            val = float(rrun(f"fslstats  {subj_img_masked} -M").strip())
-            imrm([subj_img_masked])
-            roi_row.append(val)
+    results = []
+    for mask in masks:
+        results.append(df.loc[df["roi"] == str(mask), "nzmean"].tolist())
 
-        results.append(roi_row)
+    return results
 
 
 # takes melodic RSN's labels created with fsleyes, parse it and
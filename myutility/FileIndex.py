@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import os
+import threading
+from typing import Dict, List, Tuple
+
+
+class FileIndex:
+    """
+    In-memory index of the content of directories, used to answer the many existence tests of a validation pass
+    (e.g. Image.exist probes up to 12 extensions per image) without a stat call each.
+
+    Each directory is listed once (one os.scandir call), the first time one of its files is tested, and its content is then
+    kept until invalidated. The index is used (by isfile, isdir, exists) only within a with block, by the thread that opened it:
+
+        with FileIndex():
+            for subj in subjects:
+                subj.hasT1 ...
+
+    Files written within the block must be invalidated (invalidate(path)), Image methods writing files (cp, mv, rm) already do it.
+    """
+    _local = threading.local()
+
+    def __init__(self):
+        self._dirs:Dict[str, Tuple[frozenset, frozenset] | None] = {}     # dir => (files, subdirs), None if dir does not exist
+        self._prev:FileIndex | None = None
+
+    def __enter__(self) -> FileIndex:
+        self._prev                  = getattr(FileIndex._local, "index", None)
+        if self._prev is not None:      # nested blocks share the content of the outer one
+            self._dirs              = self._prev._dirs
+        FileIndex._local.index      = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        FileIndex._local.index      = self._prev
+        self._prev                  = None
+
+    @staticmethod
+    def current() -> FileIndex | None:
+        """
+        Returns the index active in the current thread, None if no index is active.
+        """
+        return getattr(FileIndex._local, "index", None)
+
+    def listdir(self, dirpath:str) -> Tuple[frozenset, frozenset] | None:
+        """
+        Returns the names of the files and subdirectories of the given directory, None if it does not exist.
+        """
+        dirpath = os.path.abspath(dirpath)
+        try:
+            return self._dirs[dirpath]
+        except KeyError:
+            pass
+
+        files   = []
+        subdirs = []
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            files.append(entry.name)
+                        elif entry.is_dir():
+                            subdirs.append(entry.name)
+                    except OSError:     # e.g. broken link
+                        pass
+            content = (frozenset(files), frozenset(subdirs))
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            content = None
+
+        self._dirs[dirpath] = content
+        return content
+
+    def invalidate(self, path:str=None):
+        """
+        Discard the content of the directory containing path (and of path itself, if a directory), or of all directories if path is None.
+        """
+        if path is None:
+            self._dirs.clear()
+            return
+
+        path = os.path.abspath(path)
+        self._dirs.pop(path, None)
+        self._dirs.pop(os.path.dirname(path), None)
+
+    def _contains(self, path:str, what:int) -> bool:
+        if path == "":
+            return False
+        path    = os.path.abspath(path)
+        content = self.listdir(os.path.dirname(path))
+        return content is not None and os.path.basename(path) in content[what]
+
+    # ======================================================================================
+    # os.path replacements, answered by the active index if any
+    @staticmethod
+    def isfile(path:str) -> bool:
+        index = FileIndex.current()
+        if index is None:
+            return os.path.isfile(path)
+        return index._contains(path, 0)
+
+    @staticmethod
+    def isdir(path:str) -> bool:
+        index = FileIndex.current()
+        if index is None:
+            return os.path.isdir(path)
+        return index._contains(path, 1)
+
+    @staticmethod
+    def exists(path:str) -> bool:
+        index = FileIndex.current()
+        if index is None:
+            return os.path.exists(path)
+        return index._contains(path, 0) or index._contains(path, 1)
+
+    @staticmethod
+    def subdirs(path:str) -> List[str]:
+        """
+        Returns the (sorted) names of the subdirectories of path, raises FileNotFoundError if path does not exist.
+        """
+        index = FileIndex.current()
+        if index is None:
+            with os.scandir(path) as it:
+                return sorted(entry.name for entry in it if entry.is_dir())
+
+        content = index.listdir(path)
+        if content is None:
+            raise FileNotFoundError(path)
+        return sorted(content[1])
+
+    @staticmethod
+    def invalidate_path(path:str):
+        """
+        Invalidate path in the active index, if any. To be called after writing path.
+        """
+        index = FileIndex.current()
+        if index is not None:
+            index.invalidate(path)
@@ -0,0 +1,307 @@
+"""
+This module provides Inventory, a persistent (SQLite) record of the processing steps completed by each subject/session of a project.
+
+For each (subj, session, step) the inventory stores the completion time, the versions of the tools (FSL, SPM, CAT) that produced it
+and the step's output files with their size and mtime, so that questions like "which subjects have a T1 but no CAT surfaces"
+are answered by a query instead of probing the subjects tree:
+
+    inv = project.inventory
+    inv.scan(project.get_subjects("grp1"))                  # one-time, build it from the existing tree
+    todo = inv.subjects(has=["t1"], missing=["cat_surfaces"])
+
+The inventory is updated by Project.run_subjects_methods(..., inventory=True): each method completed by a subject is recorded as a step
+(e.g. "mpr.cat_segment") whose outputs are the files produced by the commands it ran through rrun, together with the given inventory_steps.
+
+Known steps (STEPS) define their expected outputs, used by scan and by record_subject when outputs are not given.
+verify() reports the recorded outputs that have been deleted or modified after being recorded.
+"""
+from __future__ import annotations
+
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+from myutility.FileIndex import FileIndex
+from myutility.myfsl.utils.buildcache import IMAGE_EXTENSIONS
+from myutility.myfsl.utils.trace import produced_files
+
+# step => function returning the outputs (files or images without extension) of that step for a given Subject
+STEPS:Dict[str, Callable] = {
+    "t1":           lambda s: [s.t1_data],
+    "t2":           lambda s: [s.t2_data],
+    "rs":           lambda s: [s.rs_data],
+    "dti":          lambda s: [s.dti_data],
+    "t1_brain":     lambda s: [s.t1_brain_data],
+    "spm_segment":  lambda s: [s.t1_spm_icv_file, s.t1_dartel_c1],
+    "spm_dartel":   lambda s: [s.t1_dartel_rc1],
+    "cat_segment":  lambda s: [os.path.join(s.t1_cat_dir, "tiv_" + s.label + ".txt"), os.path.join(s.t1_cat_dir, "report", "cat_T1_" + s.label + ".xml")],
+    "cat_surfaces": lambda s: [s.t1_cat_lh_surface, s.t1_cat_resampled_surface],
+    "dti_ec":       lambda s: [s.dti_ec_data],
+    "dti_fit":      lambda s: [s.dti_fit_FA],
+    "bedpostx":     lambda s: [os.path.join(s.dti_bedpostX_dir, s.dti_bedpostx_mean_S0_label)],
+    "xtract":       lambda s: [os.path.join(s.dti_xtract_dir, "tracts", tract, "densityNorm") for tract in s._global.dti_xtract_labels],
+}
+
+
+class Inventory:
+    """
+    Persistent record of the processing steps completed by the subjects of a project.
+
+    Args:
+        db_file (str): SQLite database file, created if not existing.
+    """
+    def __init__(self, db_file:str):
+
+        self.db_file    = db_file
+        self._lock      = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        with self.__connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS steps (subj TEXT, session INTEGER, step TEXT, completed TEXT, versions TEXT, "
+                         "PRIMARY KEY (subj, session, step))")
+            conn.execute("CREATE TABLE IF NOT EXISTS outputs (subj TEXT, session INTEGER, step TEXT, path TEXT, size INTEGER, mtime REAL, "
+                         "PRIMARY KEY (subj, session, step, path))")
+
+    # instances are given to the workers of run_subjects_methods, which may be processes: the lock cannot be pickled
+    def __getstate__(self):
+        return {"db_file": self.db_file}
+
+    def __setstate__(self, state):
+        self.db_file    = state["db_file"]
+        self._lock      = threading.Lock()
+
+    @contextlib.contextmanager
+    def __connect(self):
+        # a connection per operation (as Tracer does), usable by any thread or process. commits on exit
+        with contextlib.closing(sqlite3.connect(self.db_file, timeout=60)) as conn, conn:
+            yield conn
+
+    # ======================================================================================
+    #region update
+    def record(self, subj:str, session:int, step:str, outputs:List[str]=None, versions:dict=None, completed:str=None) -> int:
+        """
+        Records (replacing a previous record) the completion of a step.
+
+        Args:
+            subj (str): subject label.
+            session (int): session id.
+            step (str): step name.
+            outputs (List[str], optional): output files of the step, images can be given without extension. Missing ones are skipped.
+            versions (dict, optional): versions of the tools used by the step, e.g. {"fsl": "6.0.7", "cat": "cat12.8"}.
+            completed (str, optional): completion time (ISO format). Defaults to now.
+
+        Returns:
+            int: the number of recorded outputs.
+        """
+        if completed is None:
+            completed = datetime.datetime.now().isoformat(timespec="seconds")
+
+        rows = []
+        for out in (outputs or []):
+            path = self.resolve(out)
+            if path is None:
+                print("WARNING in Inventory.record: output (" + str(out) + ") of step " + step + " of subj " + subj + " does not exist, skipped")
+                continue
+            st = os.stat(path)
+            rows.append((subj, session, step, path, st.st_size, st.st_mtime))
+
+        with self._lock, self.__connect() as conn:
+            conn.execute("DELETE FROM outputs WHERE subj=? AND session=? AND step=?", (subj, session, step))
+            conn.execute("INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?)", (subj, session, step, completed, json.dumps(versions or {})))
+            conn.executemany("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def record_subject(self, subj, step:str, outputs:List[str]=None, versions:dict=None) -> int:
+        """
+        Records the completion of a step by a Subject. If not given, outputs are those defined by STEPS (if step is a known step)
+        and versions are those of the tools configured in the subject's Global.
+        """
+        if outputs is None:
+            outputs = STEPS[step](subj) if step in STEPS else []
+        if versions is None:
+            versions = Inventory.tool_versions(subj._global)
+        return self.record(subj.label, subj.sessid, step, outputs, versions)
+
+    def remove(self, subj:str, session:int, step:str=None):
+        """
+        Removes the record of the given step (all steps if None) of a subject/session.
+        """
+        cond    = "subj=? AND session=?" + ("" if step is None else " AND step=?")
+        params  = (subj, session) if step is None else (subj, session, step)
+        with self._lock, self.__connect() as conn:
+            conn.execute("DELETE FROM steps WHERE " + cond, params)
+            conn.execute("DELETE FROM outputs WHERE " + cond, params)
+
+    def scan(self, subjects:list, steps:List[str]=None, overwrite:bool=False) -> int:
+        """
+        Builds the inventory from the existing subjects tree: each known step (STEPS) whose outputs all exist is recorded,
+        with the mtime of its newest output as completion time and unknown tool versions.
+        Steps already recorded are kept, unless overwrite is True.
+
+        Returns:
+            int: the number of recorded steps.
+        """
+        if steps is None:
+            steps = list(STEPS.keys())
+
+        nrecorded = 0
+        with FileIndex():
+            for subj in subjects:
+                done = set(self.steps(subj.label, subj.sessid))
+                for step in steps:
+                    if step in done and not overwrite:
+                        continue
+                    paths = [self.resolve(out) for out in STEPS[step](subj)]
+                    if len(paths) == 0 or None in paths:
+                        continue
+                    completed = datetime.datetime.fromtimestamp(max(os.stat(p).st_mtime for p in paths)).isoformat(timespec="seconds")
+                    self.record(subj.label, subj.sessid, step, paths, None, completed)
+                    nrecorded += 1
+        return nrecorded
+    #endregion
+
+    # ======================================================================================
+    #region query
+    def get(self, subj:str, session:int, step:str) -> dict | None:
+        """
+        Returns the record {"completed", "versions", "outputs": {path: (size, mtime)}} of a step, None if not recorded.
+        """
+        with self.__connect() as conn:
+            row = conn.execute("SELECT completed, versions FROM steps WHERE subj=? AND session=? AND step=?", (subj, session, step)).fetchone()
+            if row is None:
+                return None
+            outs = conn.execute("SELECT path, size, mtime FROM outputs WHERE subj=? AND session=? AND step=?", (subj, session, step)).fetchall()
+        return {"completed": row[0], "versions": json.loads(row[1]), "outputs": {p: (size, mtime) for p, size, mtime in outs}}
+
+    def has(self, subj:str, session:int, step:str) -> bool:
+        with self.__connect() as conn:
+            return conn.execute("SELECT 1 FROM steps WHERE subj=? AND session=? AND step=?", (subj, session, step)).fetchone() is not None
+
+    def steps(self, subj:str, session:int) -> List[str]:
+        """
+        Returns the steps recorded for a subject/session.
+        """
+        with self.__connect() as conn:
+            return [r[0] for r in conn.execute("SELECT step FROM steps WHERE subj=? AND session=? ORDER BY completed", (subj, session))]
+
+    def subjects(self, has:List[str]=None, missing:List[str]=None, session:int=None) -> List[Tuple[str, int]]:
+        """
+        Returns the (subj, session) of the inventory that completed all the steps in has and none of those in missing.
+        e.g. subjects(has=["t1"], missing=["cat_surfaces"])
+        Only subjects/sessions having at least one recorded step are considered.
+        """
+        has     = list(has or [])
+        missing = list(missing or [])
+
+        query   = "SELECT subj, session FROM steps"
+        params  = []
+        if session is not None:
+            query += " WHERE session=?"
+            params.append(session)
+        query += " GROUP BY subj, session HAVING 1"
+        if len(has) > 0:
+            query += " AND SUM(step IN (" + ", ".join(["?"] * len(has)) + ")) = ?"
+            params += has + [len(set(has))]
+        if len(missing) > 0:
+            query += " AND SUM(step IN (" + ", ".join(["?"] * len(missing)) + ")) = 0"
+            params += missing
+        query += " ORDER BY subj, session"
+
+        with self.__connect() as conn:
+            return [(r[0], r[1]) for r in conn.execute(query, params)]
+
+    def verify(self, subj:str=None, session:int=None) -> List[Tuple[str, int, str, str]]:
+        """
+        Returns the (subj, session, step, path) of the recorded outputs that are missing or whose size/mtime changed since recorded.
+        """
+        query   = "SELECT subj, session, step, path, size, mtime FROM outputs"
+        params  = []
+        if subj is not None:
+            query += " WHERE subj=?" + ("" if session is None else " AND session=?")
+            params = [subj] if session is None else [subj, session]
+        with self.__connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        stale = []
+        for s, sess, step, path, size, mtime in rows:
+            try:
+                st = os.stat(path)
+                if st.st_size == size and st.st_mtime == mtime:
+                    continue
+            except FileNotFoundError:
+                pass
+            stale.append((s, sess, step, path))
+        return stale
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Returns a DataFrame with a row per subj/session and a column per step, containing the completion time (NaN if not completed).
+        """
+        with self.__connect() as conn:
+            df = pd.read_sql_query("SELECT subj, session, step, completed FROM steps", conn)
+        if len(df) == 0:
+            return pd.DataFrame(columns=["subj", "session"])
+        df = df.pivot(index=["subj", "session"], columns="step", values="completed").reset_index()
+        df.columns.name = None
+        return df
+    #endregion
+
+    # ======================================================================================
+    @staticmethod
+    def resolve(path:str) -> str | None:
+        """
+        Returns the existing file corresponding to path (an image may be given without extension), None if not existing.
+        """
+        path = os.path.abspath(str(path))
+        if FileIndex.isfile(path):
+            return path
+        for ext in IMAGE_EXTENSIONS:
+            if FileIndex.isfile(path + ext):
+                return path + ext
+        return None
+
+    @staticmethod
+    def tool_versions(globaldata) -> dict:
+        """
+        Returns the versions of FSL, SPM and CAT configured in the given Global.
+        """
+        versions = {"spm": os.path.basename(os.path.normpath(globaldata.spm_dir)), "cat": globaldata.cat_version}
+        fslversion = os.path.join(globaldata.fsl_dir or "", "etc", "fslversion")
+        if os.path.isfile(fslversion):
+            with open(fslversion) as f:
+                versions["fsl"] = f.readline().strip().split(":")[0]
+        return versions
+
+
+class OutputsCollector:
+    """
+    Tracer-like object (see myutility.myfsl.utils.trace.Tracer) collecting the files produced by the commands run through rrun,
+    while forwarding each record to the tracer it replaces (if any):
+
+        collector = OutputsCollector(get_context().tracer)
+        with tracing(collector):
+            subj.mpr.cat_segment()
+        inventory.record(subj.label, subj.sessid, "mpr.cat_segment", collector.outputs)
+    """
+    def __init__(self, tracer=None):
+        self.tracer     = tracer
+        self._outputs   = {}        # used as an ordered set
+        self._lock      = threading.Lock()
+
+    @property
+    def outputs(self) -> List[str]:
+        return list(self._outputs)
+
+    def record(self, args, start, wall, usage, exitcode, cwd=None):
+        if exitcode == 0:
+            produced = produced_files(args, start, cwd)
+            with self._lock:
+                self._outputs.update(dict.fromkeys(produced))
+        if self.tracer is not None:
+            self.tracer.record(args, start, wall, usage, exitcode, cwd=cwd)
@@ -0,0 +1,277 @@
+"""
+This module provides a pool of persistent ("warm") Matlab engines, shared by the SPM/CAT batch calls.
+
+Starting a Matlab engine and setting up the SPM/CAT paths takes tens of seconds, which dominates the processing time when
+running short batches (e.g. segmentation, TIV calculation, group stats) on many subjects.
+A MatlabEnginePool starts N engines once, with the given paths already added, and leases them to callers:
+
+    - lease:   context manager returning a health-checked engine, given back to the pool on exit
+    - acquire: returns a leased engine, given back by calling its quit() (or release()) method
+    - submit:  runs a function on the first available engine in a background thread, returning a Future
+
+When a pool is installed as default (see myutility.matlab.matlab_pool), the call_matlab_* functions lease their engine from it
+instead of starting a new Matlab session, thus the existing code (e.g. SubjectMpr.cat_segment) uses the pool unchanged.
+
+Engines are created by an engine_factory(paths2add) callable, which by default starts a new matlab.engine session.
+A stand-in object exposing addpath, eval and quit can be used to test pool-based code without Matlab.
+
+Example usage:
+
+from myutility.MatlabEnginePool import MatlabEnginePool
+from myutility.matlab import matlab_pool
+
+with MatlabEnginePool.from_globaldata(globaldata, nengines=4) as pool, matlab_pool(pool):
+    project.run_subjects_methods("mpr", "cat_segment", [{}], ncore=4)
+"""
+from __future__ import annotations
+
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List
+
+from myutility.myfsl.utils.run import bind_context
+
+
+def start_matlab_engine(paths2add:List[str]=None):
+    """
+    Default engine factory: start a new (not shared) Matlab session and add the given paths.
+    """
+    import matlab.engine
+
+    eng = matlab.engine.start_matlab()
+    for path in (paths2add or []):
+        eng.addpath(path)
+    return eng
+
+
+class PooledEngine:
+    """
+    Proxy of a Matlab engine leased from a MatlabEnginePool.
+
+    All attributes and Matlab functions are forwarded to the wrapped engine, while quit() gives the engine back to the pool
+    instead of closing the Matlab session. In this way a pooled engine can be passed to code written for dedicated sessions.
+    """
+    def __init__(self, pool:MatlabEnginePool, engine):
+        self._pool      = pool
+        self._engine    = engine
+        self._released  = False
+        self._paths     = pool._paths.setdefault(id(engine), set(pool.paths2add))     # shared by all the leases of this engine
+
+    @property
+    def engine(self):
+        if self._released:
+            raise Exception("Error in PooledEngine: the engine was already given back to the pool")
+        return self._engine
+
+    def addpath(self, path, *args, **kwargs):
+        # paths added by previous jobs are kept by the engine, skip the (slow) Matlab call
+        if path in self._paths:
+            return
+        self.engine.addpath(path, *args, **kwargs)
+        self._paths.add(path)
+
+    def release(self, broken:bool=False):
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self, broken)
+
+    def quit(self):
+        self.release()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.engine, name)
+
+    def __del__(self):
+        # engine returned by call_matlab_spmbatch(endengine=False) and then discarded by the caller
+        try:
+            self.release()
+        except Exception:
+            pass
+
+
+class MatlabEnginePool:
+    """
+    A fixed-size pool of persistent Matlab engines.
+
+    Args:
+        nengines (int, optional): number of engines. Defaults to 1.
+        paths2add (List[str], optional): paths added to every engine on creation (e.g. spm, cat and pymri matlab functions). Defaults to None.
+        engine_factory (Callable, optional): engine_factory(paths2add) returns a new engine. Defaults to start_matlab_engine.
+        warm (bool, optional): start all the engines immediately, otherwise they are started on first request. Defaults to True.
+        max_uses (int, optional): recycle an engine after this number of leases (0 = never), to limit Matlab memory growth. Defaults to 0.
+    """
+    def __init__(self, nengines:int=1, paths2add:List[str]=None, engine_factory:Callable=None, warm:bool=True, max_uses:int=0):
+
+        if nengines < 1:
+            raise Exception("Error in MatlabEnginePool: nengines must be greater than 0")
+
+        self.nengines:int           = nengines
+        self.paths2add:List[str]    = [str(p) for p in (paths2add or [])]
+        self.engine_factory         = start_matlab_engine if engine_factory is None else engine_factory
+        self.max_uses:int           = max_uses
+
+        self._idle                  = queue.LifoQueue()     # most recently used engine first: its caches are warmer
+        self._uses                  = {}
+        self._paths                 = {}
+        self._created               = 0
+        self._lock                  = threading.Lock()
+        self._closed                = False
+        self._executor              = None
+
+        if warm:
+            with ThreadPoolExecutor(max_workers=nengines) as executor:
+                engines = list(executor.map(lambda _: self._new_engine(), range(nengines)))
+            for eng in engines:
+                self._idle.put(eng)
+
+    @classmethod
+    def from_globaldata(cls, globaldata, nengines:int=1, **kwargs) -> MatlabEnginePool:
+        """
+        Create a pool whose engines have SPM, CAT and the pymri matlab functions in their path.
+        """
+        return cls(nengines, [globaldata.spm_functions_dir, globaldata.spm_dir, globaldata.cat_dir], **kwargs)
+
+    # ===============================================================================================================================
+    # LEASE
+    # ===============================================================================================================================
+    def acquire(self, timeout:float=None) -> PooledEngine:
+        """
+        Lease a healthy engine, waiting up to timeout seconds (None = forever) when all the engines are busy.
+        Dead engines are replaced transparently.
+        """
+        if self._closed:
+            raise Exception("Error in MatlabEnginePool.acquire: the pool has been closed")
+
+        while True:
+            eng = None
+            try:
+                eng = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    create = self._created < self.nengines
+                    if create:
+                        self._created += 1      # reserve the slot before the (slow) creation
+                if create:
+                    try:
+                        eng = self.engine_factory(self.paths2add)
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                    self._uses[id(eng)] = 0
+                else:
+                    try:
+                        eng = self._idle.get(timeout=timeout)
+                    except queue.Empty:
+                        raise Exception("Error in MatlabEnginePool.acquire: no engine became available within " + str(timeout) + " seconds")
+
+            if self.is_healthy(eng):
+                self._uses[id(eng)] = self._uses.get(id(eng), 0) + 1
+                return PooledEngine(self, eng)
+
+            print("MatlabEnginePool: discarding a dead Matlab engine")
+            self._discard(eng)
+
+    def release(self, pooled:PooledEngine, broken:bool=False):
+        """
+        Give back a leased engine. broken engines (or engines exceeding max_uses) are closed and replaced on next request.
+        """
+        eng = pooled._engine
+        if self._closed or broken or (0 < self.max_uses <= self._uses.get(id(eng), 0)):
+            self._discard(eng)
+        else:
+            self._idle.put(eng)
+
+    @contextmanager
+    def lease(self, timeout:float=None):
+        """
+        Context manager leasing an engine for the duration of the block.
+        """
+        eng = self.acquire(timeout)
+        try:
+            yield eng
+        finally:
+            eng.release()
+
+    @staticmethod
+    def is_healthy(eng) -> bool:
+        try:
+            eng.eval("1;", nargout=0)
+            return True
+        except Exception:
+            return False
+
+    # ===============================================================================================================================
+    # JOBS
+    # ===============================================================================================================================
+    def submit(self, fn:Callable, *args, **kwargs) -> Future:
+        """
+        Run fn(*args, eng=<leased engine>, **kwargs) in a background thread, as soon as an engine is available.
+        Up to nengines jobs run concurrently, each on its own engine.
+        """
+        if self._closed:
+            raise Exception("Error in MatlabEnginePool.submit: the pool has been closed")
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.nengines)
+
+        return self._executor.submit(bind_context(self._run_job), fn, args, kwargs)
+
+    def map(self, fn:Callable, *iterables) -> list:
+        """
+        Concurrent equivalent of [fn(*args, eng=eng) for args in zip(*iterables)], results are returned in the input order.
+        """
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return [f.result() for f in futures]
+
+    def _run_job(self, fn:Callable, args, kwargs):
+        with self.lease() as eng:
+            return fn(*args, eng=eng, **kwargs)
+
+    # ===============================================================================================================================
+    # SHUTDOWN
+    # ===============================================================================================================================
+    def close(self):
+        """
+        Wait for the submitted jobs, then quit all the idle engines. Engines still leased are closed when given back.
+        """
+        if self._closed:
+            return
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self._closed = True
+
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def _new_engine(self):
+        eng = self.engine_factory(self.paths2add)
+        with self._lock:
+            self._created += 1
+            self._uses[id(eng)] = 0
+        return eng
+
+    def _discard(self, eng):
+        with self._lock:
+            self._created -= 1
+            self._uses.pop(id(eng), None)
+            self._paths.pop(id(eng), None)
+        try:
+            eng.quit()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -5,12 +5,15 @@ import ntpath
 import os
 import shutil
 import xml.etree.ElementTree as ET
+from functools import cached_property
 from shutil import move, copyfile
 from typing import Optional, List
 
 # https://stackoverflow.com/questions/30045106/python-how-to-extend-str-and-overload-its-constructor
+from myutility.FileIndex import FileIndex
 from myutility.exceptions import NotExistingImageException
 from myutility.fileutilities import compress, gunzip
+from myutility.images import nifti, voxelstats
 from myutility.myfsl.utils.run import rrun
 from myutility.utilities import fillnumber2fourdigits
 
@@ -46,21 +49,38 @@ class Image(str):
             NotExistingImageException: If the image does not exist and must_exist is True.
 
         """
+        # path components (dir, name, ext, fpathnoext) are computed on first access, is_dir checks the file system when read
         if value != "":
-            parts = self.imgparts()
-
-            self.dir = parts[0]
-            self.name = parts[1]  # name NO EXTENSION !!!!!!
-            self.ext = parts[2]
-            self.fpathnoext = str(os.path.join(self.dir, self.name))
-            self.is_dir = os.path.isdir(self)
-
             if must_exist and not self.exist:
                 raise NotExistingImageException(msg, self)
             return
 
         raise NotExistingImageException(msg, self)
 
+    @cached_property
+    def _parts(self) -> list:
+        return self.imgparts()
+
+    @cached_property
+    def dir(self) -> str:
+        return self._parts[0]
+
+    @cached_property
+    def name(self) -> str:
+        return self._parts[1]  # name NO EXTENSION !!!!!!
+
+    @cached_property
+    def ext(self) -> str:
+        return self._parts[2]
+
+    @cached_property
+    def fpathnoext(self) -> str:
+        return str(os.path.join(self.dir, self.name))
+
+    @property
+    def is_dir(self) -> bool:
+        return FileIndex.isdir(self)
+
     @property
     def exist(self):
         """
@@ -158,6 +178,9 @@ class Image(str):
             int: The number of slices.
 
         """
+        hdr = nifti.read_nifti_header(self)
+        if hdr is not None:
+            return nifti.dim(hdr, 3)
         return int(rrun(f"fslval {self} dim3"))
 
     @property
@@ -169,6 +192,9 @@ class Image(str):
             int: The number of volumes.
 
         """
+        hdr = nifti.read_nifti_header(self)
+        if hdr is not None:
+            return nifti.dim(hdr, 4)
         return int(rrun(f"fslnvols {self}").split('\n')[0])
 
     @property
@@ -178,7 +204,7 @@ class Image(str):
         Returns:
             int: The number of voxels.
         """
-        return int(rrun(f"fslstats {self} -V").strip().split(" ")[0])
+        return voxelstats.image_stats(self)["nvoxels"]
 
     @property
     def TR(self):
@@ -189,6 +215,9 @@ class Image(str):
             float: The repetition time.
 
         """
+        hdr = nifti.read_nifti_header(self)
+        if hdr is not None:
+            return float(hdr["pixdim"][4])
         return float(rrun(f"fslval {self} pixdim4"))
 
     # ===============================================================================================================================
@@ -227,7 +256,7 @@ class Image(str):
             list: A list containing the directory, filename, and extension.
 
         """
-        if os.path.isdir(self):
+        if FileIndex.isdir(self):
             return [self, "", ""]
 
         parts = self.split_ext()
@@ -256,20 +285,20 @@ class Image(str):
         # if self == "":
         #     return False
 
-        if os.path.isfile(self.upath) or os.path.isfile(self.cpath) or os.path.isfile(self.spath) or os.path.isfile(self.fpathnoext + ".mgz"):
+        if FileIndex.isfile(self.upath) or FileIndex.isfile(self.cpath) or FileIndex.isfile(self.spath) or FileIndex.isfile(self.fpathnoext + ".mgz"):
             return True
 
-        if os.path.isfile(self.fpathnoext + ".mnc") or os.path.isfile(self.fpathnoext + ".mnc.gz"):
+        if FileIndex.isfile(self.fpathnoext + ".mnc") or FileIndex.isfile(self.fpathnoext + ".mnc.gz"):
             return True
 
-        if os.path.isfile(self.fpathnoext + ".gii"):
+        if FileIndex.isfile(self.fpathnoext + ".gii"):
             return True
 
-        if not os.path.isfile(self.fpathnoext + ".hdr") and not os.path.isfile(self.fpathnoext + ".hdr.gz"):
+        if not FileIndex.isfile(self.fpathnoext + ".hdr") and not FileIndex.isfile(self.fpathnoext + ".hdr.gz"):
             # return 0 here as no header exists and no single image means no image!
             return False
 
-        if not os.path.isfile(self.fpathnoext + ".img") and not os.path.isfile(self.fpathnoext + ".img.gz"):
+        if not FileIndex.isfile(self.fpathnoext + ".img") and not FileIndex.isfile(self.fpathnoext + ".img.gz"):
             # return 0 here as no img file exists and no single image means no image!
             return False
 
@@ -287,20 +316,20 @@ class Image(str):
         # if self == "":
         #     return False
 
-        if os.path.isfile(self.cpath):
+        if FileIndex.isfile(self.cpath):
             return True
 
-        if os.path.isfile(self.fpathnoext + ".mnc.gz"):
+        if FileIndex.isfile(self.fpathnoext + ".mnc.gz"):
             return True
 
-        if os.path.isfile(self.fpathnoext + ".gii"):
+        if FileIndex.isfile(self.fpathnoext + ".gii"):
             return True
 
-        if not os.path.isfile(self.fpathnoext + ".hdr.gz"):
+        if not FileIndex.isfile(self.fpathnoext + ".hdr.gz"):
             # return 0 here as no header exists and no single image means no image!
             return False
 
-        if not os.path.isfile(self.fpathnoext + ".img.gz"):
+        if not FileIndex.isfile(self.fpathnoext + ".img.gz"):
             # return 0 here as no img file exists and no single image means no image!
             return False
 
@@ -318,20 +347,20 @@ class Image(str):
         # if self == "":
         #     return False
 
-        if os.path.isfile(self.upath):
+        if FileIndex.isfile(self.upath):
             return True
 
-        if os.path.isfile(self.fpathnoext + ".mnc"):
+        if FileIndex.isfile(self.fpathnoext + ".mnc"):
             return True
 
-        if os.path.isfile(self.fpathnoext + ".gii"):
+        if FileIndex.isfile(self.fpathnoext + ".gii"):
             return True
 
-        if not os.path.isfile(self.fpathnoext + ".hdr"):
+        if not FileIndex.isfile(self.fpathnoext + ".hdr"):
             # return 0 here as no header exists and no single image means no image!
             return False
 
-        if not os.path.isfile(self.fpathnoext + ".img"):
+        if not FileIndex.isfile(self.fpathnoext + ".img"):
             # return 0 here as no img file exists and no single image means no image!
             return False
 
@@ -340,7 +369,7 @@ class Image(str):
 
     # return False if surface image does not exist or True if surface image exists
     def gimtest(self):
-        if os.path.isfile(self.fpathnoext + ".gii"):
+        if FileIndex.isfile(self.fpathnoext + ".gii"):
             return True
 
     def cp(self, dest:str, error_src_not_exist:bool=True, logFile=None) -> str:
@@ -367,11 +396,11 @@ class Image(str):
                 print("WARNING in cp. src image (" + self + ") does not exist, skip copy and continue")
 
         ext = ""
-        if os.path.isfile(self.upath):
+        if FileIndex.isfile(self.upath):
             ext = ".nii"
-        elif os.path.isfile(self.cpath):
+        elif FileIndex.isfile(self.cpath):
             ext = ".nii.gz"
-        elif os.path.isfile(self.gpath):
+        elif FileIndex.isfile(self.gpath):
             ext = ".gii"
 
         dest = Image(dest)
@@ -387,6 +416,7 @@ class Image(str):
             dest_ext = ext
 
         copyfile(self.fpathnoext + ext, fileparts_dst[0] + dest_ext)
+        FileIndex.invalidate_path(fileparts_dst[0] + dest_ext)
 
         if logFile is not None:
             print("cp " + self.fpathnoext + ext + " " + fileparts_dst[0] + dest_ext, file=logFile)
@@ -445,11 +475,11 @@ class Image(str):
                 print("WARNING in mv. src image (" + self + ") does not exist, skip rename and continue")
 
         ext = ""
-        if os.path.isfile(self.upath):
+        if FileIndex.isfile(self.upath):
             ext = ".nii"
-        elif os.path.isfile(self.cpath):
+        elif FileIndex.isfile(self.cpath):
             ext = ".nii.gz"
-        elif os.path.isfile(self.fpathnoext + ".gii"):
+        elif FileIndex.isfile(self.fpathnoext + ".gii"):
             ext = ".gii"
 
         if ext == "":
@@ -457,6 +487,8 @@ class Image(str):
 
         dest = Image(dest)
         move(self.fpathnoext + ext, dest.fpathnoext + ext)
+        FileIndex.invalidate_path(self.fpathnoext + ext)
+        FileIndex.invalidate_path(dest.fpathnoext + ext)
 
         if logFile is not None:
             print("mv " + self.fpathnoext + ext + " " + dest.fpathnoext + ext, file=logFile)
@@ -475,21 +507,22 @@ class Image(str):
 
         if self.ext == "":
             # delete all the existing ones
-            if os.path.isfile(self.upath):
+            if FileIndex.isfile(self.upath):
                 os.remove(self.upath)
 
-            if os.path.isfile(self.cpath):
+            if FileIndex.isfile(self.cpath):
                 os.remove(self.cpath)
 
-            if os.path.isfile(self.fpathnoext + ".mgz"):
+            if FileIndex.isfile(self.fpathnoext + ".mgz"):
                 os.remove(self.fpathnoext + ".mgz")
 
-            if os.path.isfile(self.fpathnoext + ".gii"):
+            if FileIndex.isfile(self.fpathnoext + ".gii"):
                 os.remove(self.fpathnoext + ".gii")
 
         else:
             # delete only the version with the given extension
             os.remove(self.fpathnoext + self.ext)
+        FileIndex.invalidate_path(self.fpathnoext)
 
         if logFile is not None:
             print("rm " + self.fpathnoext, file=logFile)
@@ -505,7 +538,7 @@ class Image(str):
             int: The volume of the image.
 
         """
-        return int(rrun(f"fslstats {self} -V").strip().split(" ")[1])
+        return int(voxelstats.image_stats(self)["volume"])
 
     def get_image_mean(self, includezeros:bool=False):
         """
@@ -515,11 +548,11 @@ class Image(str):
             float: The mean of the image.
 
         """
+        stats = voxelstats.image_stats(self)
         if includezeros:
-            str_mean = " -m"
+            return stats["mean"]
         else:
-            str_mean = " -M"
-        return float(rrun(f"fslstats {self} {str_mean}").strip())
+            return stats["nzmean"]
 
     def mask_image(self, mask, out):
         """
@@ -535,12 +568,24 @@ class Image(str):
     def get_mask_mean(self, mask:str, includezeros:bool=False) -> float:
 
         mask = Image(mask, must_exist=True, msg="Given mask in get_mask_mean is not valid")
+        stats = voxelstats.masks_stats(self, [mask])[0]
         if includezeros:
-            str_mean = " -m"
+            return stats["mean"]
         else:
-            str_mean = " -M"
+            return stats["nzmean"]
 
-        return float(rrun(f"fslstats {self} -k {mask} {str_mean}").strip())
+    def get_masks_stats(self, masks:List[str]) -> List[dict]:
+        """
+        Get mean, non-zero mean, number of non-zero voxels and their volume within each of the given masks, reading the image once.
+
+        Args:
+            masks (List[str]): The mask images.
+
+        Returns:
+            List[dict]: one dict {"mean", "nzmean", "nvoxels", "volume"} per mask.
+
+        """
+        return voxelstats.masks_stats(self, [Image(m, must_exist=True, msg="Given mask in get_masks_stats is not valid") for m in masks])
 
     def imsplit(self, templabel=None, subdirmame:str="") -> tuple[str, str]:
         """
@@ -670,9 +715,13 @@ class Image(str):
             dict: A dictionary containing the header fields.
 
         """
-        res = rrun(f"fslhd -x {self}")
-        root = ET.fromstring(res)
-        attribs_dict = root.attrib
+        hdr = nifti.read_nifti_header(self)
+        if hdr is not None:
+            attribs_dict = nifti.to_fslhd_dict(hdr)
+        else:
+            res = rrun(f"fslhd -x {self}")
+            root = ET.fromstring(res)
+            attribs_dict = root.attrib
 
         if list_field is not None:
             fields = dict()
@@ -729,6 +778,8 @@ class Image(str):
             udest = Image(dest).cpath
 
         compress(self.upath, udest, replace)
+        FileIndex.invalidate_path(self.upath)
+        FileIndex.invalidate_path(udest)
 
     # unzip file to a given path, preserving (by default) the original nii.gz
     def unzip(self, dest: Optional['Image'] = None, replace: bool = False) -> None:
@@ -747,6 +798,8 @@ class Image(str):
         else:
             udest = Image(dest).upath
         gunzip(self.cpath, udest, replace)
+        FileIndex.invalidate_path(self.cpath)
+        FileIndex.invalidate_path(udest)
 
     # check whether nii does not exist but nii.gz does => create the nii copy preserving (by default) the nii.gz one
     def check_if_uncompress(self, replace=False):
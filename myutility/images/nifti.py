@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import gzip
+import os
+import struct
+import threading
+
+# ===============================================================================================================================
+# in-process NIfTI-1/NIfTI-2 header reader.
+# parsed headers are cached per file and invalidated when the file's mtime or size change.
+# when a file cannot be parsed (e.g. .mgz, ANALYZE), read_nifti_header returns None and callers fall back to FSL tools
+# ===============================================================================================================================
+USE_NATIVE_HEADER = True    # set to False to force the FSL (fslval/fslhd) backend
+
+NIFTI_EXTENSIONS = [".nii.gz", ".nii", ".hdr", ".hdr.gz"]
+
+_cache      = {}
+_cache_lock = threading.Lock()
+
+# datatype code => (numpy dtype char, bytes per voxel)
+DATATYPES = {2: ("u1", 1), 4: ("i2", 2), 8: ("i4", 4), 16: ("f4", 4), 64: ("f8", 8), 256: ("i1", 1), 512: ("u2", 2), 768: ("u4", 4), 1024: ("i8", 8), 1280: ("u8", 8),
+             32: ("c8", 8), 128: ("u1", 3), 2304: ("u1", 4), 1536: ("f16", 16), 1792: ("c16", 16)}
+
+
+def nifti_file(img:str) -> str | None:
+    """
+    Return the existing file containing the header of the given image (given with or without extension), None if not present.
+    """
+    img = str(img)
+    if os.path.isfile(img):
+        return img
+
+    for ext in NIFTI_EXTENSIONS:
+        if os.path.isfile(img + ext):
+            return img + ext
+
+    return None
+
+
+def read_nifti_header(img:str) -> dict | None:
+    """
+    Parse the header of a NIfTI-1 or NIfTI-2 image (plain or gzipped).
+
+    Args:
+        img (str): image path, with or without extension.
+
+    Returns:
+        dict: header fields with numeric values (dim and pixdim are 8-elements lists, srow_x/y/z 4-elements lists),
+              plus "file" (the parsed file) and "nifti_version". None if the file does not exist or is not a NIfTI image.
+    """
+    if not USE_NATIVE_HEADER:
+        return None
+
+    path = nifti_file(img)
+    if path is None:
+        return None
+
+    st  = os.stat(path)
+    key = os.path.abspath(path)
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+
+    try:
+        if path.endswith(".gz"):
+            with gzip.open(path, "rb") as f:
+                raw = f.read(540)
+        else:
+            with open(path, "rb") as f:
+                raw = f.read(540)
+        hdr = _parse(raw)
+    except (OSError, EOFError, struct.error):
+        hdr = None
+
+    if hdr is not None:
+        hdr["file"] = path
+        with _cache_lock:
+            _cache[key] = (st.st_mtime_ns, st.st_size, hdr)
+
+    return hdr
+
+
+def clear_header_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def _parse(raw:bytes) -> dict | None:
+
+    if len(raw) < 348:
+        return None
+
+    for endian in ["<", ">"]:
+        sizeof_hdr = struct.unpack_from(endian + "i", raw, 0)[0]
+        if sizeof_hdr == 348:
+            return _parse_nifti1(raw, endian)
+        elif sizeof_hdr == 540 and len(raw) >= 540:
+            return _parse_nifti2(raw, endian)
+
+    return None
+
+
+def _parse_nifti1(raw:bytes, e:str) -> dict | None:
+
+    magic = raw[344:348]
+    if magic not in (b"n+1\x00", b"ni1\x00"):
+        return None
+
+    h = dict()
+    h["nifti_version"]  = 1
+    h["dim_info"]       = raw[39]
+    h["dim"]            = list(struct.unpack_from(e + "8h", raw, 40))
+    h["intent_p1"], h["intent_p2"], h["intent_p3"] = struct.unpack_from(e + "3f", raw, 56)
+    h["intent_code"], h["datatype"], h["bitpix"], h["slice_start"] = struct.unpack_from(e + "4h", raw, 68)
+    h["pixdim"]         = list(struct.unpack_from(e + "8f", raw, 76))
+    h["vox_offset"], h["scl_slope"], h["scl_inter"] = struct.unpack_from(e + "3f", raw, 108)
+    h["slice_end"]      = struct.unpack_from(e + "h", raw, 120)[0]
+    h["slice_code"]     = raw[122]
+    h["xyzt_units"]     = raw[123]
+    h["cal_max"], h["cal_min"], h["slice_duration"], h["toffset"] = struct.unpack_from(e + "4f", raw, 124)
+    h["descrip"]        = _cstr(raw[148:228])
+    h["aux_file"]       = _cstr(raw[228:252])
+    h["qform_code"], h["sform_code"] = struct.unpack_from(e + "2h", raw, 252)
+    h["quatern_b"], h["quatern_c"], h["quatern_d"], h["qoffset_x"], h["qoffset_y"], h["qoffset_z"] = struct.unpack_from(e + "6f", raw, 256)
+    h["srow_x"]         = list(struct.unpack_from(e + "4f", raw, 280))
+    h["srow_y"]         = list(struct.unpack_from(e + "4f", raw, 296))
+    h["srow_z"]         = list(struct.unpack_from(e + "4f", raw, 312))
+    h["intent_name"]    = _cstr(raw[328:344])
+    h["vox_offset"]     = int(h["vox_offset"])
+    h["byteorder"]      = e
+    h["single_file"]    = magic == b"n+1\x00"
+    return h
+
+
+def _parse_nifti2(raw:bytes, e:str) -> dict | None:
+
+    magic = raw[4:12]
+    if magic[:3] not in (b"n+2", b"ni2"):
+        return None
+
+    h = dict()
+    h["nifti_version"]  = 2
+    h["datatype"], h["bitpix"] = struct.unpack_from(e + "2h", raw, 12)
+    h["dim"]            = list(struct.unpack_from(e + "8q", raw, 16))
+    h["intent_p1"], h["intent_p2"], h["intent_p3"] = struct.unpack_from(e + "3d", raw, 80)
+    h["pixdim"]         = list(struct.unpack_from(e + "8d", raw, 104))
+    h["vox_offset"]     = struct.unpack_from(e + "q", raw, 168)[0]
+    h["scl_slope"], h["scl_inter"], h["cal_max"], h["cal_min"], h["slice_duration"], h["toffset"] = struct.unpack_from(e + "6d", raw, 176)
+    h["slice_start"], h["slice_end"] = struct.unpack_from(e + "2q", raw, 224)
+    h["descrip"]        = _cstr(raw[240:320])
+    h["aux_file"]       = _cstr(raw[320:344])
+    h["qform_code"], h["sform_code"] = struct.unpack_from(e + "2i", raw, 344)
+    h["quatern_b"], h["quatern_c"], h["quatern_d"], h["qoffset_x"], h["qoffset_y"], h["qoffset_z"] = struct.unpack_from(e + "6d", raw, 352)
+    h["srow_x"]         = list(struct.unpack_from(e + "4d", raw, 400))
+    h["srow_y"]         = list(struct.unpack_from(e + "4d", raw, 432))
+    h["srow_z"]         = list(struct.unpack_from(e + "4d", raw, 464))
+    h["slice_code"], h["xyzt_units"], h["intent_code"] = struct.unpack_from(e + "3i", raw, 496)
+    h["intent_name"]    = _cstr(raw[508:524])
+    h["dim_info"]       = raw[524]
+    h["byteorder"]      = e
+    h["single_file"]    = magic[:3] == b"n+2"
+    return h
+
+
+def _cstr(b:bytes) -> str:
+    return b.split(b"\x00", 1)[0].decode("latin-1")
+
+
+# ===============================================================================================================================
+# derived values, mimic what fslval/fslnvols/fslhd report
+# ===============================================================================================================================
+def ndim(hdr:dict) -> int:
+    return int(hdr["dim"][0])
+
+
+def dim(hdr:dict, n:int) -> int:
+    """
+    Size along dimension n (1-based). As in FSL, unused dimensions are 1.
+    """
+    if n > ndim(hdr):
+        return 1
+    return max(1, int(hdr["dim"][n]))
+
+
+def to_fslhd_dict(hdr:dict) -> dict:
+    """
+    Convert a parsed header to the dictionary of strings returned by parsing the output of "fslhd -x".
+    """
+    nd      = ndim(hdr)
+    qfac    = -1 if hdr["pixdim"][0] < 0 else 1
+    nbyper  = DATATYPES.get(hdr["datatype"], (None, max(1, hdr["bitpix"] // 8)))[1]
+    nvox    = 1
+    for n in range(1, nd + 1):
+        nvox = nvox * dim(hdr, n)
+
+    d = dict()
+    d["image_offset"]   = str(hdr["vox_offset"])
+    d["ndim"]           = str(nd)
+    labels              = ["x", "y", "z", "t", "u", "v", "w"]
+    for n in range(1, max(nd, 3) + 1):
+        d["n" + labels[n - 1]] = str(dim(hdr, n))
+    for n in range(1, max(nd, 3) + 1):
+        d["d" + labels[n - 1]] = _g(hdr["pixdim"][n])
+    d["datatype"]       = str(hdr["datatype"])
+    d["nvox"]           = str(nvox)
+    d["nbyper"]         = str(nbyper)
+    d["scl_slope"]      = _g(hdr["scl_slope"])
+    d["scl_inter"]      = _g(hdr["scl_inter"])
+    d["intent_code"]    = str(hdr["intent_code"])
+    d["intent_p1"]      = _g(hdr["intent_p1"])
+    d["intent_p2"]      = _g(hdr["intent_p2"])
+    d["intent_p3"]      = _g(hdr["intent_p3"])
+    d["intent_name"]    = hdr["intent_name"]
+    d["toffset"]        = _g(hdr["toffset"])
+    d["xyz_units"]      = str(hdr["xyzt_units"] & 0x07)
+    d["time_units"]     = str(hdr["xyzt_units"] & 0x38)
+    d["freq_dim"]       = str(hdr["dim_info"] & 0x03)
+    d["phase_dim"]      = str((hdr["dim_info"] >> 2) & 0x03)
+    d["slice_dim"]      = str((hdr["dim_info"] >> 4) & 0x03)
+    d["descrip"]        = hdr["descrip"]
+    d["aux_file"]       = hdr["aux_file"]
+    d["qform_code"]     = str(hdr["qform_code"])
+    d["qfac"]           = str(qfac)
+    d["quatern_b"]      = _g(hdr["quatern_b"])
+    d["quatern_c"]      = _g(hdr["quatern_c"])
+    d["quatern_d"]      = _g(hdr["quatern_d"])
+    d["qoffset_x"]      = _g(hdr["qoffset_x"])
+    d["qoffset_y"]      = _g(hdr["qoffset_y"])
+    d["qoffset_z"]      = _g(hdr["qoffset_z"])
+    d["sform_code"]     = str(hdr["sform_code"])
+    d["sto_xyz_matrix"] = " ".join([_g(v) for v in hdr["srow_x"] + hdr["srow_y"] + hdr["srow_z"]] + ["0", "0", "0", "1"])
+    d["slice_code"]     = str(hdr["slice_code"])
+    d["slice_start"]    = str(hdr["slice_start"])
+    d["slice_end"]      = str(hdr["slice_end"])
+    d["slice_duration"] = _g(hdr["slice_duration"])
+    return d
+
+
+def _g(v:float) -> str:
+    return "%g" % v
@@ -1,7 +1,14 @@
 import os
 
 from myutility.images.Image import Image
-from myutility.myfsl.utils.run import rrun
+from myutility.myfsl.utils.run import rrun, is_buildcache_active
+
+
+# the check_xxx functions do nothing when their output exists, unless overwrite is True or a build cache is active (it then decides
+# whether the output is up to date). an existing output whose inputs are missing (e.g. removed intermediate files) is kept and
+# no error is raised, as without a build cache
+def _keep_existing(output_exists:bool, overwrite:bool) -> bool:
+    return output_exists and not overwrite
 
 
 # ======================================================================================================================
@@ -57,7 +64,9 @@ def check_flirt(omat, inimg, ref, params="-cost corratio -dof 12 -searchrx -90 9
         None
 
     """
-    if not os.path.exists(omat) or overwrite:
+    if not os.path.exists(omat) or overwrite or is_buildcache_active():
+        if (not Image(inimg).exist or not Image(ref).exist) and _keep_existing(os.path.exists(omat), overwrite):
+            return
         inimg   = Image(inimg, must_exist=True, msg="ERROR in flirt: input image is not valid")
         ref     = Image(ref, must_exist=True, msg="ERROR in flirt: ref image is not valid")
 
@@ -65,7 +74,7 @@ def check_flirt(omat, inimg, ref, params="-cost corratio -dof 12 -searchrx -90 9
         if not os.path.isdir(outdir):
             raise Exception("ERROR in flirt, output dir (" + outdir + ") does not exist")
 
-        rrun(f"flirt -in {inimg} -ref {ref} -omat {omat} {params}", logFile=logFile)
+        rrun(f"flirt -in {inimg} -ref {ref} -omat {omat} {params}", logFile=logFile, inputs=[inimg, ref], outputs=[omat], rebuild=overwrite)
 
 
 def check_invert_mat(omat: str, imat: str, overwrite: bool = False, logFile: str = None) -> None:
@@ -85,15 +94,17 @@ def check_invert_mat(omat: str, imat: str, overwrite: bool = False, logFile: str
         None
 
     """
-    if not os.path.exists(omat) or overwrite:
+    if not os.path.exists(omat) or overwrite or is_buildcache_active():
         if not os.path.exists(imat):
+            if _keep_existing(os.path.exists(omat), overwrite):
+                return
             raise Exception("ERROR in check_invert_mat, input mat (" + imat + ") does not exist")
         else:
             outdir = os.path.dirname(omat)
             if not os.path.isdir(outdir):
                 raise Exception("ERROR in flirt, output dir (" + outdir + ") does not exist")
 
-            rrun(f"convert_xfm -inverse -omat {omat} {imat}", logFile=logFile)
+            rrun(f"convert_xfm -inverse -omat {omat} {imat}", logFile=logFile, inputs=[imat], outputs=[omat], rebuild=overwrite)
 
 
 def check_concat_mat(omat, imat1, imat2, overwrite=False, logFile=None):
@@ -114,15 +125,17 @@ def check_concat_mat(omat, imat1, imat2, overwrite=False, logFile=None):
         None
 
     """
-    if not os.path.exists(omat) or overwrite:
+    if not os.path.exists(omat) or overwrite or is_buildcache_active():
         if not os.path.exists(imat1) or not os.path.exists(imat2):
+            if _keep_existing(os.path.exists(omat), overwrite):
+                return
             raise Exception("ERROR in check_concat_mat, input mat1 (" + imat1 + ") or input mat2 (" + imat2 + ") does not exist")
         else:
             outdir = os.path.dirname(omat)
             if not os.path.isdir(outdir):
                 raise Exception("ERROR in flirt, output dir (" + outdir + ") does not exist")
 
-            rrun(f"convert_xfm -omat {omat} -concat {imat1} {imat2}", logFile=logFile)
+            rrun(f"convert_xfm -omat {omat} -concat {imat1} {imat2}", logFile=logFile, inputs=[imat1, imat2], outputs=[omat], rebuild=overwrite)
 
 
 def check_apply_mat(oimg, iimg, mat, ref, overwrite=False, logFile=None):
@@ -144,11 +157,13 @@ def check_apply_mat(oimg, iimg, mat, ref, overwrite=False, logFile=None):
         None
 
     """
-    if not Image(oimg).exist or overwrite:
+    if not Image(oimg).exist or overwrite or is_buildcache_active():
         if not Image(iimg).exist or not os.path.exists(mat):
+            if _keep_existing(Image(oimg).exist, overwrite):
+                return
             raise Exception("ERROR in chech_apply_mat, input inmage (" + iimg + ") or mat (" + mat + ") or ref img (" + ref + ") does not exist")
         else:
-            rrun(f"flirt -in {iimg} -ref {ref} -applyxfm -init {mat} -out {oimg}", logFile=logFile)
+            rrun(f"flirt -in {iimg} -ref {ref} -applyxfm -init {mat} -out {oimg}", logFile=logFile, inputs=[iimg, ref, mat], outputs=[oimg], rebuild=overwrite)
 
 
 # ======================================================================================================================
@@ -172,11 +187,13 @@ def check_invert_warp(owarp, iwarp, ref, overwrite=False, logFile=None):
         None
 
     """
-    if not Image(owarp).exist or overwrite:
+    if not Image(owarp).exist or overwrite or is_buildcache_active():
         if not Image(iwarp).exist or not Image(ref).exist:
+            if _keep_existing(Image(owarp).exist, overwrite):
+                return
             raise Exception("ERROR in check_invert_warp, input warp (" + iwarp + ") or ref img (" + ref + ") does not exist")
         else:
-            rrun(f"invwarp -r {ref} -w {iwarp} -o {owarp}", logFile=logFile)
+            rrun(f"invwarp -r {ref} -w {iwarp} -o {owarp}", logFile=logFile, inputs=[iwarp, ref], outputs=[owarp], rebuild=overwrite)
 
 
 # initial warp + midmat + final warp
@@ -199,11 +216,13 @@ def check_convert_warp_wmw(owarp, iwarp1, mat, iwarp2, ref, overwrite=False, log
         None
 
     """
-    if not Image(owarp).exist or overwrite:
+    if not Image(owarp).exist or overwrite or is_buildcache_active():
         if not Image(iwarp1).exist or not Image(iwarp2).exist or not os.path.exists(mat) or not Image(ref).exist:
+            if _keep_existing(Image(owarp).exist, overwrite):
+                return
             raise Exception("ERROR in check_convert_warp_wmw, input warp1 (" + iwarp1 + ") or input warp2 (" + iwarp2 + ") or mid mat (" + mat + ") or ref (" + ref + ") does not exist")
         else:
-            rrun(f"convertwarp --ref={ref} --warp1={iwarp1} --midmat={mat} --warp2={iwarp2} --out={owarp}", logFile=logFile)
+            rrun(f"convertwarp --ref={ref} --warp1={iwarp1} --midmat={mat} --warp2={iwarp2} --out={owarp}", logFile=logFile, inputs=[iwarp1, mat, iwarp2, ref], outputs=[owarp], rebuild=overwrite)
 
 
 # initial warp + final warp
@@ -226,11 +245,13 @@ def check_convert_warp_ww(owarp: str, iwarp1: str, iwarp2: str, ref: str, overwr
         None
 
     """
-    if not Image(owarp).exist or overwrite:
+    if not Image(owarp).exist or overwrite or is_buildcache_active():
         if not Image(iwarp1).exist or not Image(iwarp2).exist or not Image(ref).exist:
+            if _keep_existing(Image(owarp).exist, overwrite):
+                return
             raise Exception("ERROR in check_convert_warp_wmw, input warp1 (" + iwarp1 + ") or input warp2 (" + iwarp2 + ") or ref (" + ref + ") does not exist")
         else:
-            rrun(f"convertwarp --ref={ref} --warp1={iwarp1} --warp2={iwarp2} --out={owarp}", logFile=logFile)
+            rrun(f"convertwarp --ref={ref} --warp1={iwarp1} --warp2={iwarp2} --out={owarp}", logFile=logFile, inputs=[iwarp1, iwarp2, ref], outputs=[owarp], rebuild=overwrite)
 
 
 # initial mat + warp
@@ -253,11 +274,13 @@ def check_convert_warp_mw(owarp, premat, iwarp, ref, overwrite=False, logFile=No
         None
 
     """
-    if not Image(owarp).exist or overwrite:
+    if not Image(owarp).exist or overwrite or is_buildcache_active():
         if not Image(iwarp).exist or not os.path.exists(premat) or not Image(ref).exist:
+            if _keep_existing(Image(owarp).exist, overwrite):
+                return
             raise Exception("ERROR in check_convert_warp_mw, input warp (" + iwarp + ") or pre mat (" + premat + ") or ref (" + ref + ") does not exist")
         else:
-            rrun(f"convertwarp --ref={ref} --premat={premat} --warp1={iwarp} --out={owarp}", logFile=logFile)
+            rrun(f"convertwarp --ref={ref} --premat={premat} --warp1={iwarp} --out={owarp}", logFile=logFile, inputs=[premat, iwarp, ref], outputs=[owarp], rebuild=overwrite)
 
 
 def check_apply_warp(oimg, iimg, warp, ref, overwrite=False, logFile=None):
@@ -279,10 +302,12 @@ def check_apply_warp(oimg, iimg, warp, ref, overwrite=False, logFile=None):
         None
 
     """
-    if not Image(oimg).exist or overwrite:
+    if not Image(oimg).exist or overwrite or is_buildcache_active():
         if not Image(iimg).exist or not Image(warp).exist or not Image(ref).exist:
+            if _keep_existing(Image(oimg).exist, overwrite):
+                return
             raise Exception("ERROR in check_apply_warp, input image (" + iimg + ") or warp (" + warp + ") or ref img (" + ref + ") does not exist")
         else:
-            rrun(f"applywarp -i {iimg} -r {ref} -o {oimg} --warp={warp}", logFile=logFile)
+            rrun(f"applywarp -i {iimg} -r {ref} -o {oimg} --warp={warp}", logFile=logFile, inputs=[iimg, ref, warp], outputs=[oimg], rebuild=overwrite)
 
 # ======================================================================================================================
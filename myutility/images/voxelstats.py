@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+
+from myutility.images import nifti
+from myutility.myfsl.utils.run import rrun
+
+# ===============================================================================================================================
+# in-process voxel statistics.
+# images are loaded once (uncompressed .nii files are memory-mapped) and any number of masks is applied in a single pass,
+# replacing the fslmaths -mas / fslstats / rm round-trips. statistics mimic fslstats:
+#   mean    : -m  mean of all voxels (within mask)
+#   nzmean  : -M  mean of non-zero voxels (within mask)
+#   nvoxels : -V  number of non-zero voxels (within mask)
+#   volume  : -V  volume (mm3) of non-zero voxels (within mask)
+# images that cannot be read natively (e.g. .mgz) are processed by fslstats.
+# ===============================================================================================================================
+STATS = ["mean", "nzmean", "nvoxels", "volume"]
+
+MASK_CACHE_SIZE = 64    # number of masks kept in memory, masks are usually shared by all subjects of a group analysis
+
+_mask_cache         = OrderedDict()
+_mask_cache_lock    = threading.Lock()
+
+
+def load_image_data(img:str, mmap:bool=True) -> np.ndarray | None:
+    """
+    Load the voxel data of a NIfTI image, applying scl_slope/scl_inter.
+
+    Args:
+        img (str): image path, with or without extension.
+        mmap (bool, optional): memory-map uncompressed files instead of reading them. Defaults to True.
+
+    Returns:
+        np.ndarray: data with shape (nx, ny, nz[, nt...]), None if the image cannot be read natively.
+    """
+    hdr = nifti.read_nifti_header(img)
+    if hdr is None or hdr["datatype"] not in nifti.DATATYPES or hdr["datatype"] in (128, 2304):    # RGB images are not supported
+        return None
+
+    dtype   = np.dtype(hdr["byteorder"] + nifti.DATATYPES[hdr["datatype"]][0])
+    shape   = tuple(nifti.dim(hdr, n) for n in range(1, nifti.ndim(hdr) + 1))
+    count   = int(np.prod(shape))
+    path    = hdr["file"]
+    offset  = hdr["vox_offset"]
+
+    if not hdr["single_file"]:  # header/image pair
+        offset = 0
+        path   = path[:-len(".hdr.gz")] + ".img.gz" if path.endswith(".hdr.gz") else path[:-len(".hdr")] + ".img"
+        if not os.path.isfile(path):
+            return None
+
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            f.seek(offset)
+            data = np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype, count=count).reshape(shape, order="F")
+    elif mmap:
+        data = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F")
+    else:
+        data = np.fromfile(path, dtype=dtype, count=count, offset=offset).reshape(shape, order="F")
+
+    slope = hdr["scl_slope"]
+    inter = hdr["scl_inter"]
+    if slope != 0 and (slope != 1 or inter != 0):
+        data = data * slope + inter
+
+    return data
+
+
+def load_mask(mask:str) -> np.ndarray | None:
+    """
+    Return the boolean (non-zero) 3D array of a mask image, cached and invalidated by mtime. None if not natively readable.
+    """
+    hdr = nifti.read_nifti_header(mask)
+    if hdr is None:
+        return None
+
+    st  = os.stat(hdr["file"])
+    key = os.path.abspath(hdr["file"])
+    with _mask_cache_lock:
+        cached = _mask_cache.get(key)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            _mask_cache.move_to_end(key)
+            return cached[1]
+
+    data = load_image_data(mask, mmap=False)
+    if data is None:
+        return None
+    if data.ndim > 3:
+        data = data.reshape(data.shape[:3] + (-1,), order="F")[..., 0]
+    mask_arr = np.asarray(data != 0)
+
+    with _mask_cache_lock:
+        _mask_cache[key] = (st.st_mtime_ns, mask_arr)
+        if len(_mask_cache) > MASK_CACHE_SIZE:
+            _mask_cache.popitem(last=False)
+
+    return mask_arr
+
+
+def voxel_volume(img:str) -> float:
+    hdr = nifti.read_nifti_header(img)
+    return abs(hdr["pixdim"][1] * hdr["pixdim"][2] * hdr["pixdim"][3])
+
+
+def _stats(values:np.ndarray, voxvol:float) -> dict:
+    nonzero = values[values != 0]
+    return {"mean":     float(values.mean(dtype=np.float64)) if values.size > 0 else 0.0,
+            "nzmean":   float(nonzero.mean(dtype=np.float64)) if nonzero.size > 0 else 0.0,
+            "nvoxels":  int(nonzero.size),
+            "volume":   float(nonzero.size * voxvol)}
+
+
+def _fsl_stats(img:str, mask:str | None=None) -> dict:
+    mask_str = "" if mask is None else f" -k {mask}"
+    res = rrun(f"fslstats {img}{mask_str} -m -M -V").strip().split()
+    return {"mean": float(res[0]), "nzmean": float(res[1]), "nvoxels": int(res[2]), "volume": float(res[3])}
+
+
+def image_stats(img:str) -> dict:
+    """
+    Compute mean, nzmean, nvoxels and volume of the whole image.
+    """
+    data = load_image_data(img)
+    if data is None:
+        return _fsl_stats(img)
+
+    voxvol = voxel_volume(img)
+    if data.ndim > 3:
+        # flatten over time: statistics are calculated on all the 4D values, volume/nvoxels over the 3D nonzero voxels (as fslstats)
+        res         = _stats(np.asarray(data).ravel(), voxvol)
+        nz          = int(np.count_nonzero(np.asarray(data).reshape(data.shape[:3] + (-1,), order="F"), axis=3).astype(bool).sum())
+        res.update({"nvoxels": nz, "volume": nz * voxvol})
+        return res
+
+    return _stats(np.asarray(data).ravel(), voxvol)
+
+
+def masks_stats(img:str, masks:List[str]) -> List[dict]:
+    """
+    Compute mean, nzmean, nvoxels and volume of the given image within each mask, loading the image only once.
+
+    Args:
+        img (str): the image to calculate statistics on.
+        masks (List[str]): list of mask images (non-zero voxels are inside the mask), with the same geometry of img.
+
+    Returns:
+        List[dict]: one dictionary {"mean", "nzmean", "nvoxels", "volume"} per mask, in the same order of masks.
+    """
+    data = load_image_data(img)
+    if data is None:
+        return [_fsl_stats(img, m) for m in masks]
+
+    voxvol  = voxel_volume(img)
+    res     = []
+    for mask in masks:
+        mask_arr = load_mask(mask)
+        if mask_arr is None:
+            res.append(_fsl_stats(img, mask))
+            continue
+
+        if mask_arr.shape != data.shape[:3]:
+            raise Exception("Error in voxelstats.masks_stats: mask (" + str(mask) + ") and image (" + str(img) + ") have different dimensions")
+
+        values = np.asarray(data[mask_arr])   # (nvox_in_mask[, nt])
+        stats  = _stats(values.ravel(), voxvol)
+        if values.ndim > 1:
+            nz = int(np.count_nonzero(values, axis=1).astype(bool).sum())
+            stats.update({"nvoxels": nz, "volume": nz * voxvol})
+        res.append(stats)
+
+    return res
+
+
+class MaskSet:
+    """
+    A set of (possibly overlapping) masks sharing the same geometry, stacked once into a (nmasks x nvoxels) matrix restricted to
+    the union of the masks, so that the statistics of an image within all the masks are computed by a single matrix product.
+    Masks that cannot be read natively (e.g. .mgz) are not stacked, their statistics are computed by fslstats.
+
+    Args:
+        masks (List[str]): list of mask images.
+    """
+    def __init__(self, masks:List[str]):
+        self.masks:List[str] = [str(m) for m in masks]
+
+        arrays          = []
+        self.stacked    = []        # indices (in masks) of the stacked masks, the others are processed by fslstats
+        self.shape      = None
+        for i, mask in enumerate(self.masks):
+            mask_arr = load_mask(mask)
+            if mask_arr is None:
+                continue
+            if self.shape is None:
+                self.shape = mask_arr.shape
+            elif mask_arr.shape != self.shape:
+                raise Exception("Error in MaskSet: mask (" + mask + ") has different dimensions from (" + self.masks[self.stacked[0]] + ")")
+            arrays.append(mask_arr.reshape(-1, order="F"))
+            self.stacked.append(i)
+
+        self.index      = np.flatnonzero(np.any(arrays, axis=0)) if len(arrays) > 0 else np.array([], dtype=int)
+        self.matrix     = np.stack([a[self.index] for a in arrays]).astype(np.float64) if len(arrays) > 0 else np.zeros((0, 0))
+        self.counts     = self.matrix.sum(axis=1)
+
+    def stats(self, img:str) -> List[dict]:
+        """
+        Compute mean, nzmean, nvoxels and volume of the given image within each mask.
+
+        Returns:
+            List[dict]: one dictionary {"mean", "nzmean", "nvoxels", "volume"} per mask, in the same order of the masks.
+        """
+        data = load_image_data(img)
+        if data is None or data.ndim > 3:
+            return masks_stats(img, self.masks)
+
+        res     = [None] * len(self.masks)
+        stacked = set(self.stacked)
+        for i, mask in enumerate(self.masks):
+            if i not in stacked:
+                res[i] = _fsl_stats(img, mask)
+
+        if len(self.stacked) == 0:
+            return res
+
+        if data.shape != self.shape:
+            raise Exception("Error in MaskSet.stats: image (" + str(img) + ") and masks have different dimensions")
+
+        values  = np.asarray(data.reshape(-1, order="F")[self.index], dtype=np.float64)
+        sums    = self.matrix @ values
+        nz      = self.matrix @ (values != 0)
+        voxvol  = voxel_volume(img)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means   = np.where(self.counts > 0, sums / self.counts, 0.0)
+            nzmeans = np.where(nz > 0, sums / nz, 0.0)
+
+        for row, i in enumerate(self.stacked):
+            res[i] = {"mean": float(means[row]), "nzmean": float(nzmeans[row]), "nvoxels": int(nz[row]), "volume": float(nz[row] * voxvol)}
+        return res
@@ -28,14 +28,67 @@ matlab_interface.call_matlab_spmbatch('my_spm_batch.m', eng=eng)
 eng.quit()
 
 Note that the actual function names and arguments may vary slightly depending on the specific MATLAB version and environment.
+
+When a MatlabEnginePool is installed with matlab_pool (or set_default_pool), the call_matlab_* functions called without eng
+lease a warm engine from the pool instead of starting a new session, and endengine/eng.quit() give it back to the pool:
+
+with MatlabEnginePool.from_globaldata(globaldata, nengines=4) as pool, matlab_interface.matlab_pool(pool):
+    matlab_interface.call_matlab_spmbatch('my_spm_batch.m')
 """
 
 # from matlab.engine import
+import contextlib
 import os
 
 import matlab.engine
 import matlab.engine.engineerror
 
+DEFAULT_POOL = None
+"""If not None, the MatlabEnginePool the call_matlab_* functions lease their engine from when eng is not given."""
+
+
+def set_default_pool(pool):
+    global DEFAULT_POOL
+    DEFAULT_POOL = pool
+
+
+def get_default_pool():
+    return DEFAULT_POOL
+
+
+@contextlib.contextmanager
+def matlab_pool(pool):
+    """
+    Context manager installing the given MatlabEnginePool as default pool. See DEFAULT_POOL.
+    """
+    global DEFAULT_POOL
+
+    oldval = DEFAULT_POOL
+    DEFAULT_POOL = pool
+
+    try:
+        yield pool
+    finally:
+        DEFAULT_POOL = oldval
+
+
+def _get_engine(standard_paths):
+    # lease from the default pool if present, otherwise start (or connect to) a matlab session
+    if DEFAULT_POOL is not None:
+        engine = DEFAULT_POOL.acquire()
+        for path in standard_paths:
+            engine.addpath(path)
+        return engine
+    return start_matlab(standard_paths)
+
+
+def _end_engine(engine, name):
+    engine.quit()
+    if DEFAULT_POOL is not None and hasattr(engine, "release"):
+        print("returning matlab engine of " + name + " to the pool")
+    else:
+        print("quitting matlab session of " + name)
+
 
 # start a new matlab session (if no session are active) or connect to the first one available or return None.
 def start_matlab(paths2add=None, conn2first:bool=True):
@@ -91,7 +144,7 @@ def call_matlab_function(func, standard_paths=None, params:str="", logfile=None,
     if standard_paths is None:
         standard_paths = []
     if eng is None:
-        engine = start_matlab(standard_paths)
+        engine = _get_engine(standard_paths)
         if engine is None:
             return
     else:
@@ -105,9 +158,8 @@ def call_matlab_function(func, standard_paths=None, params:str="", logfile=None,
     res = eval("engine." + batch_file + "(" + params + ")")
 
     if endengine:
-        engine.quit()
+        _end_engine(engine, batch_file)
         engine = None
-        print("quitting matlab session of " + batch_file)
 
     return [engine, res]
 
@@ -133,7 +185,7 @@ def call_matlab_function_noret(func, standard_paths=None, params:str="", logfile
     if standard_paths is None:
         standard_paths = []
     if eng is None:
-        engine = start_matlab(standard_paths)
+        engine = _get_engine(standard_paths)
         if engine is None:
             return
     else:
@@ -152,9 +204,8 @@ def call_matlab_function_noret(func, standard_paths=None, params:str="", logfile
     eval("engine." + batch_file + str_params)
 
     if endengine:
-        engine.quit()
+        _end_engine(engine, batch_file)
         engine = None
-        print("quitting matlab session of " + batch_file)
 
     return engine
 
@@ -184,7 +235,7 @@ def call_matlab_spmbatch(func, standard_paths=None, logfile=None, endengine:bool
 
     try:
         if eng is None:
-            engine = start_matlab(standard_paths)
+            engine = _get_engine(standard_paths)
             if engine is None:
                 return
         else:
@@ -198,9 +249,8 @@ def call_matlab_spmbatch(func, standard_paths=None, logfile=None, endengine:bool
         # eval("engine." + batch_file + "(nargout=0, stderr=err)")
 
         if endengine:
-            engine.quit()
+            _end_engine(engine, batch_file)
             engine = None
-            print("quitting matlab session of " + batch_file)
 
         os.remove(func)
         return engine
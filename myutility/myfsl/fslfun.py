@@ -3,7 +3,7 @@ import subprocess
 import sys
 
 from myutility.images.Image import Image
-from myutility.myfsl.utils.run import rrun
+from myutility.myfsl.utils.run import rrun, is_buildcache_active
 
 
 # ===============================================================================================================================
@@ -22,10 +22,11 @@ def run_move_notexisting_img(img, cmd, logFile=None):
         runsystem(cmd, logFile)
 
 
-# run command whether the given image is not present
+# run command whether the given image is not present.
+# when a build cache is active, it decides whether the existing image is still up to date
 def run_notexisting_img(img, cmd, logFile=None):
-    if not Image(img).exist:
-        rrun(cmd, logFile=logFile)
+    if is_buildcache_active() or not Image(img).exist:
+        rrun(cmd, logFile=logFile, outputs=[img])
 
 
 # ===============================================================================================================================
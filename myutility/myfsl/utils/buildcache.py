@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+#
+# buildcache.py - Incremental rebuild cache for commands run through rrun
+#
+"""This module provides the :class:`BuildCache` class, used by :func:`.rrun`
+to skip commands whose outputs are already up to date.
+
+For each successfully executed command, the cache records:
+
+  - the command line and the working directory
+  - size, mtime and content hash of every input file
+  - the list of the produced output files and the command's stdout
+
+A command is skipped only when the same command line is run again, all the
+recorded inputs still have the same content and all the outputs exist.
+A command with declared outputs but no record (e.g. run before the cache was
+used) is adopted instead of being run when all its outputs exist and none is
+older than its inputs, see :meth:`BuildCache.adopt_existing`.
+Inputs are compared by size and mtime first, the (slower) content hash is
+computed only when one of them changed, so touching a file without modifying
+it does not trigger a rebuild. Content hashes are remembered by (size, mtime)
+stamp: an input shared by many commands is hashed once, and again only when
+its stamp changes. Recorded inputs that no longer exist (e.g. removed
+intermediate files) do not invalidate existing outputs.
+
+Records are written to the cache file at most every :data:`SAVE_INTERVAL`
+seconds, and when the cache is flushed: on exit of the :func:`.buildcache`
+context and at interpreter exit. Records lost by a crash only cause the
+corresponding commands to be run again.
+
+Inputs and outputs can be given explicitly, otherwise they are inferred from
+the command's arguments: arguments (or ``--opt=value`` values) pointing to an
+existing file or image are inputs, the others are candidate outputs that are
+recorded if they exist once the command has completed. Files modified in
+place by the command are considered outputs.
+
+Example usage::
+
+    from myutility.myfsl.utils.buildcache import BuildCache
+    from myutility.myfsl.utils.run import buildcache
+
+    with buildcache(BuildCache("/data/project/.buildcache.json")):
+        subj.wellcome()
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+SAVE_INTERVAL = 10
+"""Maximum number of seconds records stay in memory before being written to
+the cache file."""
+
+IMAGE_EXTENSIONS = [".nii.gz", ".nii", ".mgz", ".gii", ".hdr", ".img", ".hdr.gz", ".img.gz", ".mnc", ".mnc.gz"]
+
+
+def resolve_path(path, cwd=None):
+    """Returns the existing file corresponding to the given path, which may be
+    an image given without extension, or ``None`` if it does not exist.
+    Relative paths are resolved against cwd (default: the current directory).
+    """
+    path = str(path)
+    if cwd is not None:
+        path = os.path.join(cwd, path)
+    if os.path.isfile(path):
+        return os.path.abspath(path)
+
+    for ext in IMAGE_EXTENSIONS:
+        if os.path.isfile(path + ext):
+            return os.path.abspath(path + ext)
+
+    return None
+
+
+def file_hash(path, blocksize=1 << 20):
+    """Returns the sha1 digest of the content of the given file."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _abspath(path, cwd=None):
+    return os.path.abspath(os.path.join(cwd or os.getcwd(), str(path)))
+
+
+def _candidate_paths(args, cwd=None):
+    """Extracts from the command arguments the strings that may represent a
+    file path (plain arguments and values of ``--opt=value`` arguments)."""
+    if cwd is None:
+        cwd = os.getcwd()
+    paths = []
+    for arg in args[1:]:
+        arg = str(arg)
+        if arg.startswith('-'):
+            if '=' not in arg:
+                continue
+            arg = arg.split('=', 1)[1]
+        if os.sep in arg or os.path.exists(os.path.dirname(os.path.join(cwd, arg))):
+            paths.append(arg)
+    return paths
+
+
+class BuildCache:
+    """Persistent record of the commands executed by :func:`.rrun`.
+
+    :arg cache_file: JSON file where records are stored. It is loaded (if
+                     present) on creation and rewritten, when records
+                     changed, at most every :data:`SAVE_INTERVAL` seconds and
+                     by :meth:`flush`.
+    """
+
+    _shared      = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.records    = {}
+        self._hashes    = {}        # path => (size, mtime, hash) of the last hashed content
+        self._lock      = threading.Lock()
+        self._dirty     = False
+        self._saved_at  = time.time()
+
+        if os.path.isfile(cache_file):
+            with open(cache_file) as f:
+                self.records = json.load(f)
+            for rec in self.records.values():
+                for path, desc in rec['inputs'].items():
+                    self._hashes[path] = (desc['size'], desc['mtime'], desc['hash'])
+
+        atexit.register(self.flush)
+
+    @classmethod
+    def shared(cls, cache_file):
+        """Returns the cache of the given file used by the whole process (one
+        instance per file, so that concurrent threads share its lock)."""
+        path = os.path.abspath(cache_file)
+        with cls._shared_lock:
+            cache = cls._shared.get(path)
+            if cache is None:
+                cache = cls._shared[path] = cls(path)
+            return cache
+
+    def has_record(self, args, cwd=None):
+        """Returns ``True`` if the given command has been recorded (whether or
+        not its outputs are still up to date)."""
+        with self._lock:
+            return self.key(args, cwd) in self.records
+
+    @staticmethod
+    def key(args, cwd=None):
+        """Returns the record key of a command: hash of command line and cwd."""
+        return hashlib.sha1(((cwd or os.getcwd()) + '\n' + ' '.join(args)).encode('utf-8')).hexdigest()
+
+    def describe_inputs(self, args, inputs=None, cwd=None):
+        """Returns {path: {size, mtime}} of the existing inputs. Hashes are
+        computed only when the command is recorded, see :meth:`record`."""
+        if inputs is None:
+            inputs = _candidate_paths(args, cwd)
+
+        desc = {}
+        for p in inputs:
+            rp = resolve_path(p, cwd)
+            if rp is not None:
+                st = os.stat(rp)
+                desc[rp] = {'size': st.st_size, 'mtime': st.st_mtime_ns}
+        return desc
+
+    def is_uptodate(self, args, inputs=None, outputs=None, cwd=None):
+        """Returns ``(True, stdout)`` if the command can be skipped,
+        ``(False, None)`` otherwise. cwd is the working directory of the
+        command (default: the current directory)."""
+        with self._lock:
+            rec = self.records.get(self.key(args, cwd))
+
+        if rec is None:
+            return False, None
+
+        if outputs is not None and sorted(_abspath(o, cwd) for o in outputs) != sorted(rec['declared_outputs']):
+            return False, None
+
+        for out in rec['outputs']:
+            if not os.path.isfile(out):
+                return False, None
+
+        # missing inputs are ignored, new ones make the command out of date
+        if inputs is not None:
+            current = {resolve_path(i, cwd) for i in inputs} - {None}
+            if not current <= set(rec['inputs'].keys()):
+                return False, None
+
+        for path, desc in rec['inputs'].items():
+            if not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            if st.st_size != desc['size']:
+                return False, None
+            if st.st_mtime_ns != desc['mtime'] and self._hash(path, st) != desc['hash']:
+                return False, None
+
+        return True, rec['stdout']
+
+    def adopt_existing(self, args, inputs=None, outputs=None, cwd=None):
+        """Records, without running it, a command that has no record, whose
+        declared outputs all exist and are not older than any of its existing
+        inputs (e.g. produced before the cache was used). Returns ``True`` if
+        the command has been adopted, and can thus be skipped."""
+        if outputs is None or len(outputs) == 0 or self.has_record(args, cwd):
+            return False
+
+        outpaths = [resolve_path(o, cwd) for o in outputs]
+        if None in outpaths:
+            return False
+
+        if inputs is None:
+            inputs = [p for p in _candidate_paths(args, cwd) if resolve_path(p, cwd) not in outpaths]
+        before = self.describe_inputs(args, inputs, cwd)
+        if any(p in outpaths for p in before):
+            return False        # modified in place: outputs cannot be told apart from inputs
+
+        oldest = min(os.stat(p).st_mtime_ns for p in outpaths)
+        if any(desc['mtime'] > oldest for desc in before.values()):
+            return False
+
+        self.record(args, before, '', inputs, outputs, cwd)
+        return True
+
+    def _hash(self, path, st):
+        """Returns the content hash of path, computed only if its (size,
+        mtime) stamp changed since it was last hashed."""
+        with self._lock:
+            known = self._hashes.get(path)
+        if known is not None and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+
+        h = file_hash(path)
+        with self._lock:
+            self._hashes[path] = (st.st_size, st.st_mtime_ns, h)
+        return h
+
+    def record(self, args, before, stdout, inputs=None, outputs=None, cwd=None):
+        """Stores the record of a successfully executed command.
+
+        :arg args:    the command's arguments
+        :arg before:  the inputs description returned by
+                      :meth:`describe_inputs` before running the command
+        :arg stdout:  the command's standard output
+        :arg inputs:  explicit inputs, if given to rrun
+        :arg outputs: explicit outputs, if given to rrun
+        :arg cwd:     working directory of the command
+        """
+        after = self.describe_inputs(args, inputs, cwd)
+
+        # inputs modified by the command are outputs
+        rec_inputs = {}
+        modified   = []
+        for path, desc in before.items():
+            if path in after and after[path] == desc:
+                desc['hash'] = self._hash(path, os.stat(path))
+                rec_inputs[path] = desc
+            elif os.path.isfile(path):
+                modified.append(path)
+
+        if outputs is None:
+            candidates  = [p for p in _candidate_paths(args, cwd) if resolve_path(p, cwd) is not None]
+            rec_outputs = [resolve_path(p, cwd) for p in candidates if resolve_path(p, cwd) not in before] + modified
+            declared    = []
+        else:
+            rec_outputs = [resolve_path(o, cwd) for o in outputs]
+            declared    = sorted(_abspath(o, cwd) for o in outputs)
+            if None in rec_outputs:
+                return      # a declared output was not produced, the step cannot be validated next time
+
+        with self._lock:
+            self.records[self.key(args, cwd)] = {'cmd':              ' '.join(args),
+                                                 'cwd':              cwd or os.getcwd(),
+                                                 'inputs':           rec_inputs,
+                                                 'outputs':          sorted(set(rec_outputs)),
+                                                 'declared_outputs': declared,
+                                                 'stdout':           stdout}
+            self._changed()
+
+    def invalidate(self, args=None, cwd=None):
+        """Removes the record of the given command, or all records."""
+        with self._lock:
+            if args is None:
+                self.records = {}
+            else:
+                self.records.pop(self.key(args, cwd), None)
+            self._changed()
+
+    def flush(self):
+        """Writes the records to the cache file, if they changed."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _changed(self):
+        # called with the lock held: records are written in batches
+        self._dirty = True
+        if time.time() - self._saved_at >= SAVE_INTERVAL:
+            self._save()
+
+    def _save(self):
+        folder = os.path.dirname(os.path.abspath(self.cache_file))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.records, f)
+        os.replace(tmp, self.cache_file)
+        self._dirty     = False
+        self._saved_at  = time.time()
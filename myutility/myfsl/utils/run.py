@@ -30,17 +30,27 @@
    runfsl
    wait
    dryrun
+   buildcache
+   tracing
+   arrun
+   rrun_many
+   deferred
 """
 
+import asyncio
 import collections
 import contextlib
+import contextvars
+import functools
 import logging
 import os
 import os.path    as op
 import subprocess as sp
 import sys
 import threading
+import time
 import warnings
+import weakref
 
 import six
 
@@ -50,13 +60,107 @@ import myutility.myfsl.utils.tempdir                  as tempdir
 
 log = logging.getLogger(__name__)
 
-DRY_RUN = False
-"""If ``True``, the :func:`run` function will only log commands, but will not
-execute them.
-"""
+class RunContext(object):
+    """Execution state of :func:`rrun`, stored in a context variable so that
+    concurrent threads and asyncio tasks (e.g. different subjects processed by
+    ``Project.run_subjects_methods``) do not share it. Use
+    :func:`run_context` (or :func:`dryrun`, :func:`buildcache`,
+    :func:`tracing`) to modify it, and :func:`bind_context` to propagate it to
+    a new thread.
+
+    :arg dry_run:     If ``True``, commands are only logged, not executed.
+    :arg fsl_prefix:  Override for the FSL executable location used by
+                      :func:`runfsl`.
+    :arg env:         Environment variables added to (or, when ``None``,
+                      removed from) the environment of the commands.
+    :arg cwd:         Working directory of the commands.
+    :arg stdout:      Stream receiving the output of the commands run with
+                      ``log={'tee': True}``, defaults to ``sys.stdout``.
+    :arg stderr:      Stream receiving the errors of the commands run with
+                      ``log={'tee': True}``, defaults to ``sys.stderr``.
+    :arg logFile:     Default for the ``logFile`` argument of :func:`rrun`.
+    :arg build_cache: A :class:`.BuildCache` used to skip the commands whose
+                      outputs are already up to date.
+    :arg tracer:      A :class:`.Tracer` recording timing and resource usage
+                      of every executed command.
+    :arg deferred:    If not ``None``, a list where :func:`rrun` appends the
+                      commands instead of executing them. See :func:`deferred`.
+    """
+
+    FIELDS = ('dry_run', 'fsl_prefix', 'env', 'cwd', 'stdout', 'stderr', 'logFile', 'build_cache', 'tracer', 'deferred')
+
+    def __init__(self, dry_run=False, fsl_prefix=None, env=None, cwd=None, stdout=None, stderr=None, logFile=None, build_cache=None, tracer=None, deferred=None):
+        self.dry_run     = dry_run
+        self.fsl_prefix  = fsl_prefix
+        self.env         = env
+        self.cwd         = cwd
+        self.stdout      = stdout
+        self.stderr      = stderr
+        self.logFile     = logFile
+        self.build_cache = build_cache
+        self.tracer      = tracer
+        self.deferred    = deferred
+
+    def replace(self, **kwargs):
+        """Returns a copy of this context with the given fields modified."""
+        for k in kwargs:
+            if k not in RunContext.FIELDS:
+                raise ValueError('unknown run context field: {}'.format(k))
+        values = {f: getattr(self, f) for f in RunContext.FIELDS}
+        values.update(kwargs)
+        return RunContext(**values)
+
+    def environment(self):
+        """Returns the environment of the commands, ``None`` to inherit the
+        one of this process."""
+        if not self.env:
+            return None
+        env = dict(os.environ)
+        for k, v in self.env.items():
+            if v is None:
+                env.pop(k, None)
+            else:
+                env[k] = str(v)
+        return env
+
+
+_CONTEXT = contextvars.ContextVar('run_context', default=RunContext())
+
+
+def get_context():
+    """Returns the :class:`RunContext` of the calling thread/task."""
+    return _CONTEXT.get()
+
+
+@contextlib.contextmanager
+def run_context(**kwargs):
+    """Context manager modifying the given fields of the :class:`RunContext`
+    of the calling thread/task. For example, to log all the commands of a
+    subject to its own file::
+
+        with run_context(logFile=log, cwd=subj.dir):
+            ...
+    """
+    token = _CONTEXT.set(_CONTEXT.get().replace(**kwargs))
+    try:
+        yield _CONTEXT.get()
+    finally:
+        _CONTEXT.reset(token)
+
+
+def bind_context(func):
+    """Returns a wrapper of func running it within a copy of the current
+    context (thus also the current :class:`RunContext`). Threads do not
+    inherit the context of the thread creating them, wrap their target with
+    this function. Each returned wrapper must be called by a single thread at
+    a time.
+    """
+    ctx = contextvars.copy_context()
 
-FSL_PREFIX = None
-"""Global override for the FSL executable location used by :func:`runfsl`. """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return ctx.run(func, *args, **kwargs)
+    return wrapper
 
 
 class FSLNotPresent(Exception):
@@ -69,19 +173,79 @@ class FSLNotPresent(Exception):
 @contextlib.contextmanager
 def dryrun(*args):
     """Context manager which causes all calls to :func:`run` to be logged but
-    not executed. See the :data:`DRY_RUN` flag.
+    not executed. See :attr:`RunContext.dry_run`.
 
     The returned standard output will be equal to ``' '.join(args)``.
     """
-    global DRY_RUN
+    with run_context(dry_run=True):
+        yield
 
-    oldval = DRY_RUN
-    DRY_RUN = True
 
+@contextlib.contextmanager
+def buildcache(cache):
+    """Context manager which causes all calls to :func:`rrun` to be recorded
+    in the given :class:`.BuildCache` and skipped when up to date. See
+    :attr:`RunContext.build_cache`. The cache is flushed on exit.
+    """
     try:
-        yield
+        with run_context(build_cache=cache):
+            yield cache
     finally:
-        DRY_RUN = oldval
+        cache.flush()
+
+
+@contextlib.contextmanager
+def tracing(tracer):
+    """Context manager which causes all the commands executed by :func:`rrun`
+    to be recorded in the given :class:`.Tracer`. See
+    :attr:`RunContext.tracer`.
+    """
+    with run_context(tracer=tracer):
+        yield tracer
+
+
+@contextlib.contextmanager
+def deferred():
+    """Context manager collecting the commands issued through :func:`rrun`
+    instead of executing them (:func:`rrun` then returns ``None``, the commands
+    have no output yet). The collected commands, independent of each other, can
+    then be run concurrently with :func:`rrun_many`::
+
+        with deferred() as cmds:
+            for roi in rois:
+                check_apply_warp(...)
+        rrun_many(cmds)
+    """
+    cmds = []
+    with run_context(deferred=cmds):
+        yield cmds
+
+
+def is_buildcache_active():
+    """Returns ``True`` if a :class:`.BuildCache` is currently in use. """
+    return get_context().build_cache is not None
+
+
+_stream_locks      = weakref.WeakKeyDictionary()
+_stream_locks_lock = threading.Lock()
+_default_lock      = threading.Lock()
+
+
+def _stream_lock(stream):
+    """Returns the lock serializing the writes to the given stream."""
+    with _stream_locks_lock:
+        try:
+            return _stream_locks.setdefault(stream, threading.Lock())
+        except TypeError:   # not weak-referenceable streams share one lock
+            return _default_lock
+
+
+def _writeLog(logFile, msg):
+    """Writes a whole line to the given log file, so that lines written by
+    concurrent threads sharing the same file do not interleave."""
+    with _stream_lock(logFile):
+        logFile.write(msg + '\n')
+        logFile.flush()
 
 
 def _prepareArgs(args):
@@ -102,9 +266,6 @@ def _prepareArgs(args):
     return list(args)
 
 
-real_stdout = sys.stdout
-
-
 def _forwardStream(in_, *outs):
     """Creates and starts a daemon thread which forwards the given input stream
     to one or more output streams. Used by the :func:`run` function to redirect
@@ -122,13 +283,16 @@ def _forwardStream(in_, *outs):
     # if not present, assume a string stream
     omodes = [getattr(o, 'mode', 'w') for o in outs]
 
+    locks  = [_stream_lock(o) for o in outs]
+
     def realForward():
         for line in iter(in_.readline, b''):
             for i, o in enumerate(outs):
-                if 'b' in omodes[i]:
-                    o.write(line)
-                else:
-                    o.write(line.decode('utf-8'))
+                with locks[i]:
+                    if 'b' in omodes[i]:
+                        o.write(line)
+                    else:
+                        o.write(line.decode('utf-8'))
 
     t = threading.Thread(target=realForward)
     t.daemon = True
@@ -168,9 +332,11 @@ def rrun(*args, **kwargs):
                    the :func:`.fslsub.submit` function.  May also be a
                    dictionary containing arguments to that function.
 
-    :arg logFile:  Must be passed as a keyword argument. Defaults to None.
+    :arg logFile:  Must be passed as a keyword argument. Defaults to the
+                    logFile of the current :class:`RunContext` (None).
                     otherwise log the cmd and its params to given file descriptor
-                    and is used to write
+                    and is used to write. Lines written by concurrent threads
+                    to the same file are not interleaved.
 
 
     :arg log:      Must be passed as a keyword argument.  An optional ``dict``
@@ -191,6 +357,24 @@ def rrun(*args, **kwargs):
 
     :arg stop_on_error:    Allow to continue in case of error
 
+    :arg cache:    Must be passed as a keyword argument. A
+                   :class:`.BuildCache` overriding the one of the current
+                   :class:`RunContext`, or
+                   ``False`` to disable caching for this call.
+
+    :arg inputs:   Must be passed as a keyword argument. Files/images read by
+                   the command. Inferred from the arguments if not given.
+
+    :arg outputs:  Must be passed as a keyword argument. Files/images written
+                   by the command. Inferred from the arguments if not given.
+
+    :arg rebuild:  Must be passed as a keyword argument. If ``True`` the
+                   command is run (and its record refreshed) even if the
+                   build cache considers it up to date.  Without a record, a
+                   command with declared ``outputs`` that all exist and are
+                   newer than its inputs is recorded instead of being run
+                   (see :meth:`.BuildCache.adopt_existing`).
+
     :returns:      If ``submit`` is provided, the return value of
                    :func:`.fslsub` is returned. Otherwise returns a single
                    value or a tuple, based on the based on the ``stdout``,
@@ -220,8 +404,10 @@ def rrun(*args, **kwargs):
     logStderr = _log.get('stderr', None)
     logCmd = _log.get('cmd', False)
 
+    ctx = get_context()
+
     # added to write cmd string, returns and error to the given file descriptor
-    logFile = kwargs.get('logFile', None)
+    logFile = kwargs.get('logFile', ctx.logFile)
 
     args = _prepareArgs(args)
 
@@ -240,47 +426,295 @@ def rrun(*args, **kwargs):
         raise ValueError('submit must be a mapping containing '
                          'options for fsl.utils.fslsub.submit')
 
-    if DRY_RUN:
+    if ctx.dry_run:
         return _dryrun(
             submit, returnStdout, returnStderr, returnExitcode, *args)
 
+    # the command is not run yet: there is no output to return
+    if ctx.deferred is not None and submit is None:
+        ctx.deferred.append((args, kwargs))
+        return None
+
     # submit - delegate to fslsub
     if submit is not None:
         return fslsub.submit(' '.join(args), **submit)
 
+    cache = kwargs.get('cache', None)
+    if cache is None:
+        cache = ctx.build_cache
+    inputs  = kwargs.get('inputs', None)
+    outputs = kwargs.get('outputs', None)
+
+    if cache:
+        if not kwargs.get('rebuild', False):
+            uptodate, stdout = cache.is_uptodate(args, inputs, outputs, cwd=ctx.cwd)
+            if not uptodate and cache.adopt_existing(args, inputs, outputs, cwd=ctx.cwd):
+                uptodate, stdout = True, ''
+            if uptodate:
+                if logFile is not None:
+                    _writeLog(logFile, '{} skipped, outputs are up to date'.format(" ".join(args)))
+                return _results(returnStdout, returnStderr, returnExitcode, stdout, '', 0)
+        before = cache.describe_inputs(args, inputs, cwd=ctx.cwd)
+
     # Run directly - delegate to _realrun
-    stdout, stderr, exitcode = _realrun(
-        tee, logStdout, logStderr, logCmd, *args)
+    tracer = ctx.tracer
+    if tracer is not None:
+        usage = {}
+        start = time.time()
+        stdout, stderr, exitcode = _realrun(
+            tee, logStdout, logStderr, logCmd, *args, usage=usage, ctx=ctx)
+        tracer.record(args, start, time.time() - start, usage, exitcode, cwd=ctx.cwd)
+    else:
+        stdout, stderr, exitcode = _realrun(
+            tee, logStdout, logStderr, logCmd, *args, ctx=ctx)
 
+    if cache and exitcode == 0 and not len(stderr):
+        cache.record(args, before, stdout, inputs, outputs, cwd=ctx.cwd)
+
+    return _completed(args, stdout, stderr, exitcode, returnStdout, returnStderr, returnExitcode, logFile, stop_on_error)
+
+
+def _completed(args, stdout, stderr, exitcode, returnStdout, returnStderr, returnExitcode, logFile, stop_on_error):
+    """Used by :func:`rrun` and :func:`arrun`. Logs the result of an executed
+    command, raises an error if it failed and builds the return value.
+    """
     if not returnExitcode and (exitcode != 0 or len(stderr)):
 
         _str = '{} returned non-zero exit code or error: {}\nmessage: {}\n full command: {}'.format(args[0], exitcode, stderr, " ".join(args))
         if logFile is not None:
-            print(_str, file=logFile)
+            _writeLog(logFile, _str)
 
         print(_str)
         if stop_on_error:
             raise RuntimeError(_str)
 
+    _str = '{} returned {}'.format(" ".join(args), stdout)
+
+    if logFile is not None:
+        _writeLog(logFile, _str)
+
+    return _results(returnStdout, returnStderr, returnExitcode, stdout, stderr, exitcode)
+
+
+def _results(returnStdout, returnStderr, returnExitcode, stdout, stderr, exitcode):
+    """Returns a single value or a tuple, based on the ``stdout``, ``stderr``
+    and ``exitcode`` arguments of :func:`rrun`."""
     results = []
     if returnStdout:   results.append(stdout)
     if returnStderr:   results.append(stderr)
     if returnExitcode: results.append(exitcode)
 
-    _str = '{} returned {}'.format(" ".join(args), stdout)
-
-    if logFile is not None:
-        print(_str, file=logFile)
-
     if len(results) == 1:
         return results[0]
     else:
         return tuple(results)
 
 
+MAX_CONCURRENCY = os.cpu_count() or 1
+"""Maximum number of commands run at the same time by :func:`arrun` (and thus
+by :func:`rrun_many`) in the whole process, whatever the number of threads and
+event loops issuing them. Commands run by :func:`rrun` are not bounded. Use
+:func:`set_max_concurrency` to change it.
+"""
+
+_cpu_slots  = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def set_max_concurrency(n):
+    """Sets :data:`MAX_CONCURRENCY`. Must be called while no command is
+    running."""
+    global MAX_CONCURRENCY, _cpu_slots
+    MAX_CONCURRENCY = max(1, int(n))
+    _cpu_slots      = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+
+def _loop_semaphore():
+    """Returns the semaphore bounding the :func:`arrun` commands waiting or
+    running in the current event loop, so that at most MAX_CONCURRENCY of them
+    wait for a process-wide slot."""
+    loop    = asyncio.get_running_loop()
+    entry   = _semaphores.get(loop)
+    if entry is None or entry[0] != MAX_CONCURRENCY:
+        entry = _semaphores[loop] = (MAX_CONCURRENCY, asyncio.Semaphore(MAX_CONCURRENCY))
+    return entry[1]
+
+
+async def _acquire_cpu_slot():
+    """Waits, without blocking the running event loop, for a free slot of the
+    process-wide CPU semaphore, returning it. The slot must be released by the
+    caller."""
+    slots = _cpu_slots
+    if slots.acquire(blocking=False):
+        return slots
+
+    # other threads/loops hold the slots: wait in an executor thread
+    fut = asyncio.get_running_loop().run_in_executor(None, slots.acquire)
+    try:
+        await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        # the slot acquired after the cancellation is released at once
+        fut.add_done_callback(lambda f: slots.release() if not f.cancelled() and f.exception() is None else None)
+        raise
+    return slots
+
+
+async def arrun(*args, **kwargs):
+    """Asynchronous variant of :func:`rrun`: the command is run as an asyncio
+    subprocess, waiting for a slot of the process-wide CPU semaphore (see
+    :data:`MAX_CONCURRENCY`), so that many independent commands can be
+    awaited together without a thread per command::
+
+        await asyncio.gather(*[arrun("fslmaths", img, "-bin", out) for img, out in pairs])
+
+    Accepts the ``stdout``, ``stderr``, ``exitcode``, ``logFile``,
+    ``stop_on_error``, ``cache``, ``inputs``, ``outputs`` and ``rebuild``
+    arguments of :func:`rrun`, plus:
+
+    :arg cwd:  Working directory of the command, overriding the one of the
+               current :class:`RunContext`.
+
+    Commands are not forwarded to other streams (``log`` is ignored), cluster
+    submission is not supported. The peak RSS and CPU times of the command are
+    not traced.
+    """
+    ctx = get_context()
+
+    returnStdout   = kwargs.get('stdout', True)
+    returnStderr   = kwargs.get('stderr', kwargs.get('err', False))
+    returnExitcode = kwargs.get('exitcode', kwargs.get('ret', False))
+    stop_on_error  = kwargs.get('stop_on_error', True)
+    logFile        = kwargs.get('logFile', ctx.logFile)
+    cwd            = kwargs.get('cwd', ctx.cwd)
+
+    args = [str(a) for a in _prepareArgs(args)]
+
+    if ctx.dry_run:
+        return _dryrun(None, returnStdout, returnStderr, returnExitcode, *args)
+
+    cache = kwargs.get('cache', None)
+    if cache is None:
+        cache = ctx.build_cache
+    inputs  = kwargs.get('inputs', None)
+    outputs = kwargs.get('outputs', None)
+
+    if cache:
+        if not kwargs.get('rebuild', False):
+            uptodate, stdout = cache.is_uptodate(args, inputs, outputs, cwd=cwd)
+            if not uptodate and cache.adopt_existing(args, inputs, outputs, cwd=cwd):
+                uptodate, stdout = True, ''
+            if uptodate:
+                if logFile is not None:
+                    _writeLog(logFile, '{} skipped, outputs are up to date'.format(" ".join(args)))
+                return _results(returnStdout, returnStderr, returnExitcode, stdout, '', 0)
+        before = cache.describe_inputs(args, inputs, cwd=cwd)
+
+    async with _loop_semaphore():
+        slots = await _acquire_cpu_slot()
+        try:
+            start = time.time()
+            proc  = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                         cwd=cwd, env=ctx.environment())
+            stdout, stderr = await proc.communicate()
+            exitcode = proc.returncode
+        finally:
+            slots.release()
+
+    stdout = stdout.decode('utf-8')
+    stderr = stderr.decode('utf-8')
+
+    if ctx.tracer is not None:
+        ctx.tracer.record(args, start, time.time() - start, {}, exitcode, cwd=cwd)
+
+    if cache and exitcode == 0 and not len(stderr):
+        cache.record(args, before, stdout, inputs, outputs, cwd=cwd)
+
+    return _completed(args, stdout, stderr, exitcode, returnStdout, returnStderr, returnExitcode, logFile, stop_on_error)
+
+
+async def gather_limited(*aws, limit=None, return_exceptions=False):
+    """Like ``asyncio.gather``, but running at most ``limit`` of the given
+    awaitables at the same time (all of them if ``None``). Results are
+    returned in the order of the given awaitables.
+    """
+    if limit is None or limit <= 0:
+        return await asyncio.gather(*aws, return_exceptions=return_exceptions)
+
+    sem = asyncio.Semaphore(limit)
+
+    async def bounded(aw):
+        async with sem:
+            return await aw
+
+    return await asyncio.gather(*[bounded(aw) for aw in aws], return_exceptions=return_exceptions)
+
+
+def rrun_many(cmds, ncore=None, **kwargs):
+    """Runs many independent commands concurrently through :func:`arrun`,
+    waiting for all of them. This is the synchronous entry point for code not
+    running in an event loop (e.g. subject methods run by threads). If called
+    from a running event loop, the commands are run by a new event loop in a
+    worker thread.
+
+    :arg cmds:   list of commands, each one a string, a sequence of arguments
+                 or a ``(args, kwargs)`` tuple as collected by
+                 :func:`deferred`.
+    :arg ncore:  maximum number of commands run at the same time, defaults
+                 to :data:`MAX_CONCURRENCY`.
+    :arg kwargs: :func:`arrun` arguments applied to all the commands (those
+                 given in the tuples take precedence).
+
+    :returns:    The list of the commands' results, in the order of cmds. If
+                 some commands fail (and ``stop_on_error`` is not ``False``),
+                 all the others are completed before raising the first error.
+    """
+    calls = []
+    for cmd in cmds:
+        if isinstance(cmd, tuple) and len(cmd) == 2 and isinstance(cmd[1], dict):
+            calls.append((cmd[0], dict(kwargs, **cmd[1])))
+        else:
+            calls.append((cmd, kwargs))
+
+    async def run_all():
+        return await gather_limited(*[arrun(c, **kw) for c, kw in calls], limit=ncore, return_exceptions=True)
+
+    # the event loop runs in a copy of the context, the deferred list must not capture the commands again
+    with run_context(deferred=None):
+        try:
+            asyncio.get_running_loop()
+            in_loop = True
+        except RuntimeError:
+            in_loop = False
+
+        if in_loop:
+            # asyncio.run cannot be called from a running event loop (e.g. Jupyter): run a new loop in a worker thread
+            results = [None]
+            errors  = []
+
+            def worker():
+                try:
+                    results[0] = asyncio.run(run_all())
+                except BaseException as e:
+                    errors.append(e)
+
+            thread = threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True)
+            thread.start()
+            thread.join()
+            if len(errors):
+                raise errors[0]
+            results = results[0]
+        else:
+            results = asyncio.run(run_all())
+
+    for res in results:
+        if isinstance(res, BaseException):
+            raise res
+    return results
+
+
 def _dryrun(submit, returnStdout, returnStderr, returnExitcode, *args):
-    """Used by the :func:`run` function when the :attr:`DRY_RUN` flag is
-    active.
+    """Used by the :func:`run` function when the :attr:`RunContext.dry_run`
+    flag is active.
     """
 
     if submit:
@@ -300,13 +734,14 @@ def _dryrun(submit, returnStdout, returnStderr, returnExitcode, *args):
         return tuple(results)
 
 
-def _realrun(tee, logStdout, logStderr, logCmd, *args):
+def _realrun(tee, logStdout, logStderr, logCmd, *args, usage=None, ctx=None):
     """Used by :func:`run`. Runs the given command and manages its standard
     output and error streams.
 
     :arg tee:       If ``True``, the command's standard output and error
-                    streams are forwarded to this process' standard output/
-                    error.
+                    streams are forwarded to the stdout/stderr of the
+                    :class:`RunContext` (this process' standard output/error
+                    by default).
 
     :arg logStdout: Optional file-like object to which the command's standard
                     output stream can be forwarded.
@@ -319,12 +754,21 @@ def _realrun(tee, logStdout, logStderr, logCmd, *args):
 
     :arg args:      Command to run
 
+    :arg usage:     Optional ``dict`` filled with the user/sys CPU time (s)
+                    and the peak RSS (kB) of the command.
+
+    :arg ctx:       The :class:`RunContext` providing environment and working
+                    directory of the command, defaults to the current one.
+
     :returns:       A tuple containing:
                       - the command's standard output as a string.
                       - the command's standard error as a string.
                       - the command's exit code.
     """
-    proc = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE)
+    if ctx is None:
+        ctx = get_context()
+
+    proc = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE, cwd=ctx.cwd, env=ctx.environment())
     with tempdir.tempdir(changeto=False) as td:
 
         # We always direct the command's stdout/
@@ -342,8 +786,8 @@ def _realrun(tee, logStdout, logStderr, logCmd, *args):
             # stdout/stderr to this process'
             # stdout/stderr
             if tee:
-                outstreams.append(sys.stdout)
-                errstreams.append(sys.stderr)
+                outstreams.append(sys.stdout if ctx.stdout is None else ctx.stdout)
+                errstreams.append(sys.stderr if ctx.stderr is None else ctx.stderr)
 
             # And we also duplicate to caller-
             # provided streams if they're given.
@@ -355,10 +799,11 @@ def _realrun(tee, logStdout, logStderr, logCmd, *args):
             if logCmd:
                 cmd = ' '.join(args) + '\n'
                 for o in outstreams:
-                    if 'b' in getattr(o, 'mode', 'w'):
-                        o.write(cmd.encode('utf-8'))
-                    else:
-                        o.write(cmd)
+                    with _stream_lock(o):
+                        if 'b' in getattr(o, 'mode', 'w'):
+                            o.write(cmd.encode('utf-8'))
+                        else:
+                            o.write(cmd)
 
             stdoutt = _forwardStream(proc.stdout, *outstreams)
             stderrt = _forwardStream(proc.stderr, *errstreams)
@@ -368,7 +813,17 @@ def _realrun(tee, logStdout, logStderr, logCmd, *args):
             # command has terminated.
             stdoutt.join()
             stderrt.join()
-            proc.communicate()
+            if usage is not None and hasattr(os, 'wait4'):
+                # reap the process ourselves to get its resource usage
+                _, status, rusage = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+                usage.update({'user':      round(rusage.ru_utime, 4),
+                              'sys':       round(rusage.ru_stime, 4),
+                              'maxrss_kb': rusage.ru_maxrss})
+                proc.stdout.close()
+                proc.stderr.close()
+            else:
+                proc.communicate()
 
         # Read in the command's stdout/stderr
         with open(stdoutf, 'rb') as f:
@@ -385,11 +840,12 @@ def _realrun(tee, logStdout, logStderr, logCmd, *args):
 
 def runfsl(*args, **kwargs):
     """Call a FSL command and return its output. This function simply prepends
-    ``$FSLDIR/bin/`` to the command before passing it to :func:`run`.
+    ``$FSLDIR/bin/`` (or :attr:`RunContext.fsl_prefix`) to the command
+    before passing it to :func:`run`.
     """
 
-    # if FSL_PREFIX is not None:
-    #     prefix = FSL_PREFIX
+    # if get_context().fsl_prefix is not None:
+    #     prefix = get_context().fsl_prefix
     # elif fslplatform.fsldevdir is not None:
     #     prefix = op.join(fslplatform.fsldevdir, 'bin')
     # elif fslplatform.fsldir is not None:
@@ -397,7 +853,9 @@ def runfsl(*args, **kwargs):
     # else:
     #     raise FSLNotPresent('$FSLDIR is not set - FSL cannot be found!')
 
-    prefix = op.join(os.getenv('FSLDIR'), "bin")
+    prefix = get_context().fsl_prefix
+    if prefix is None:
+        prefix = op.join(os.getenv('FSLDIR'), "bin")
 
     args = _prepareArgs(args)
     args[0] = op.join(prefix, args[0])
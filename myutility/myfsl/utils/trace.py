@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+#
+# trace.py - Resource accounting of the commands run through rrun
+#
+"""This module provides the :class:`Tracer` class, used by :func:`.rrun` to
+record, for each executed command:
+
+  - start time, wall time, user/sys CPU time and peak RSS of the command
+    (collected with ``os.wait4``, on Linux the peak RSS of short commands is
+    bounded below by the size of the forking python process)
+  - exit code, command line and working directory
+  - the subject, pipeline and step that issued the command (see
+    :func:`trace_context`)
+  - the files produced by the command and their size
+
+Records are appended to a JSONL file or to a SQLite database (selected by the
+extension of the trace file: ``.db``/``.sqlite`` for SQLite, anything else for
+JSONL). :meth:`Tracer.report` summarizes the most expensive commands of each
+pipeline.
+
+Example usage::
+
+    from myutility.myfsl.utils.trace import Tracer
+    from myutility.myfsl.utils.run import tracing
+
+    tracer = Tracer("/data/project/trace.jsonl")
+    with tracing(tracer):
+        project.run_subjects_methods("", "wellcome", [{}], ncore=4)
+    print(tracer.report(top=10))
+"""
+
+import contextlib
+import contextvars
+import datetime
+import functools
+import json
+import os
+import sqlite3
+import threading
+
+from myutility.myfsl.utils.buildcache import _candidate_paths, resolve_path
+
+FIELDS = ['start', 'cmd', 'args', 'cwd', 'subject', 'pipeline', 'step', 'wall', 'user', 'sys', 'maxrss_kb', 'exitcode', 'outputs', 'output_bytes']
+
+_context = contextvars.ContextVar('trace_context', default={})
+
+
+@contextlib.contextmanager
+def trace_context(**tags):
+    """Context manager tagging the commands run within it. Recognised tags are
+    ``subject``, ``pipeline`` and ``step``, nested contexts inherit the tags of
+    the enclosing one.
+    """
+    token = _context.set(dict(_context.get(), **tags))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def traced(func, **tags):
+    """Returns a wrapper of func running it within a copy of the current
+    context (thus also the current :class:`.RunContext`) with the trace tags
+    updated with the given ones. Used to tag the callables executed by threads,
+    which do not inherit the context of the caller.
+    """
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        with trace_context(**tags):
+            return func(*args, **kwargs)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return ctx.run(run, *args, **kwargs)
+    return wrapper
+
+
+def current_context():
+    return _context.get()
+
+
+def produced_files(args, since, cwd=None):
+    """Returns {path: size} of the files given in the command arguments that
+    have been modified after ``since`` (a ``time.time()`` value)."""
+    outputs = {}
+    for p in _candidate_paths(args, cwd):
+        rp = resolve_path(p, cwd)
+        if rp is not None and rp not in outputs:
+            st = os.stat(rp)
+            if st.st_mtime >= since:
+                outputs[rp] = st.st_size
+    return outputs
+
+
+class Tracer:
+    """Persistent trace of the commands executed by :func:`.rrun`.
+
+    :arg trace_file: JSONL file or SQLite database (``.db``, ``.sqlite``) the
+                     records are appended to.
+    """
+
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.use_sqlite = os.path.splitext(trace_file)[1] in ('.db', '.sqlite', '.sqlite3')
+        self._lock      = threading.Lock()
+
+        folder = os.path.dirname(os.path.abspath(trace_file))
+        os.makedirs(folder, exist_ok=True)
+
+        if self.use_sqlite:
+            with contextlib.closing(sqlite3.connect(self.trace_file)) as conn, conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS trace (' + ', '.join(FIELDS) + ')')
+
+    def record(self, args, start, wall, usage, exitcode, cwd=None):
+        """Appends the record of an executed command.
+
+        :arg args:     the command's arguments
+        :arg start:    ``time.time()`` at the command start
+        :arg wall:     elapsed time in seconds
+        :arg usage:    dict with keys user, sys, maxrss_kb (may be empty if
+                       not available on this platform)
+        :arg exitcode: the command's exit code
+        :arg cwd:      working directory of the command (default: the current
+                       directory)
+        """
+        ctx     = current_context()
+        outputs = produced_files(args, start, cwd)
+        rec     = {'start':        datetime.datetime.fromtimestamp(start).isoformat(timespec='milliseconds'),
+                   'cmd':          os.path.basename(str(args[0])),
+                   'args':         ' '.join(args),
+                   'cwd':          cwd or os.getcwd(),
+                   'subject':      ctx.get('subject', None),
+                   'pipeline':     ctx.get('pipeline', None),
+                   'step':         ctx.get('step', None),
+                   'wall':         round(wall, 4),
+                   'user':         usage.get('user', None),
+                   'sys':          usage.get('sys', None),
+                   'maxrss_kb':    usage.get('maxrss_kb', None),
+                   'exitcode':     exitcode,
+                   'outputs':      outputs,
+                   'output_bytes': sum(outputs.values())}
+
+        with self._lock:
+            if self.use_sqlite:
+                with contextlib.closing(sqlite3.connect(self.trace_file, timeout=60)) as conn, conn:
+                    conn.execute('INSERT INTO trace VALUES (' + ', '.join(['?'] * len(FIELDS)) + ')',
+                                 [json.dumps(rec[f]) if f == 'outputs' else rec[f] for f in FIELDS])
+            else:
+                # a single write of a whole line, so that records of concurrent processes do not interleave
+                with open(self.trace_file, 'a') as f:
+                    f.write(json.dumps(rec) + '\n')
+
+    def load(self):
+        """Returns the list of all the stored records."""
+        if not os.path.isfile(self.trace_file):
+            return []
+
+        if self.use_sqlite:
+            with contextlib.closing(sqlite3.connect(self.trace_file)) as conn:
+                rows = conn.execute('SELECT ' + ', '.join(FIELDS) + ' FROM trace').fetchall()
+            records = [dict(zip(FIELDS, row)) for row in rows]
+            for rec in records:
+                rec['outputs'] = json.loads(rec['outputs'])
+            return records
+
+        with open(self.trace_file) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def summary(self, top=10, by='wall'):
+        """Returns, for each pipeline, the ``top`` most expensive commands
+        (aggregated by tool) and invocations, sorted by ``by`` (one of wall,
+        user, sys, maxrss_kb, output_bytes).
+
+        :returns: {pipeline: {'tools': [{cmd, count, wall, user, sys,
+                  maxrss_kb, output_bytes}], 'invocations': [record]}}
+        """
+        pipelines = {}
+        for rec in self.load():
+            pipelines.setdefault(rec['pipeline'] or '', []).append(rec)
+
+        res = {}
+        for pipeline, records in pipelines.items():
+            tools = {}
+            for rec in records:
+                t = tools.setdefault(rec['cmd'], {'cmd': rec['cmd'], 'count': 0, 'wall': 0., 'user': 0., 'sys': 0., 'maxrss_kb': 0, 'output_bytes': 0})
+                t['count']          += 1
+                t['wall']           += rec['wall'] or 0
+                t['user']           += rec['user'] or 0
+                t['sys']            += rec['sys'] or 0
+                t['maxrss_kb']      = max(t['maxrss_kb'], rec['maxrss_kb'] or 0)
+                t['output_bytes']   += rec['output_bytes'] or 0
+
+            res[pipeline] = {'tools':       sorted(tools.values(), key=lambda t: t[by], reverse=True)[:top],
+                             'invocations': sorted(records, key=lambda r: r[by] or 0, reverse=True)[:top]}
+        return res
+
+    def report(self, top=10, by='wall'):
+        """Returns a printable report of :meth:`summary`."""
+        lines = []
+        for pipeline, summ in sorted(self.summary(top, by).items()):
+            lines.append('=' * 100)
+            lines.append('pipeline: ' + (pipeline if pipeline else '<none>'))
+            lines.append('{:<24}{:>8}{:>12}{:>12}{:>12}{:>14}{:>16}'.format('tool', 'count', 'wall(s)', 'user(s)', 'sys(s)', 'maxrss(MB)', 'output(MB)'))
+            for t in summ['tools']:
+                lines.append('{:<24}{:>8}{:>12.1f}{:>12.1f}{:>12.1f}{:>14.1f}{:>16.1f}'.format(
+                    t['cmd'], t['count'], t['wall'], t['user'], t['sys'], t['maxrss_kb'] / 1024, t['output_bytes'] / 1048576))
+            lines.append('-' * 100)
+            lines.append('top {} invocations by {}:'.format(top, by))
+            for r in summ['invocations']:
+                lines.append('{:>10.1f}s  {:<12} {:<16} {}'.format(r['wall'], str(r['subject']), str(r['step']), r['args']))
+        return '\n'.join(lines)
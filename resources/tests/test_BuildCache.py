@@ -0,0 +1,111 @@
+import os
+
+from myutility.myfsl.utils.buildcache import BuildCache
+
+
+def _build(tmp_path, cache, content='in'):
+    inp = tmp_path / 'in.txt'
+    out = tmp_path / 'out.txt'
+    if not inp.exists():
+        inp.write_text(content)
+    args    = ['tool', str(inp), str(out)]
+    before  = cache.describe_inputs(args, [str(inp)], str(tmp_path))
+    out.write_text('out')
+    cache.record(args, before, 'stdout', [str(inp)], [str(out)], str(tmp_path))
+    return args, inp, out
+
+
+# a recorded command is up to date until an input content changes or an output is removed
+def test_uptodate(tmp_path):
+    cache = BuildCache(str(tmp_path / 'cache.json'))
+    args, inp, out = _build(tmp_path, cache)
+
+    assert cache.is_uptodate(args, [str(inp)], [str(out)], str(tmp_path)) == (True, 'stdout')
+    assert cache.has_record(args, str(tmp_path))
+
+    # same content with a new mtime is still up to date
+    st = os.stat(inp)
+    os.utime(inp, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache.is_uptodate(args, [str(inp)], [str(out)], str(tmp_path))[0]
+
+    inp.write_text('changed')
+    assert not cache.is_uptodate(args, [str(inp)], [str(out)], str(tmp_path))[0]
+
+
+# missing recorded inputs are ignored, new inputs make the command out of date
+def test_missing_and_new_inputs(tmp_path):
+    cache = BuildCache(str(tmp_path / 'cache.json'))
+    args, inp, out = _build(tmp_path, cache)
+
+    os.remove(inp)
+    assert cache.is_uptodate(args, [str(inp)], [str(out)], str(tmp_path))[0]
+
+    other = tmp_path / 'other.txt'
+    other.write_text('other')
+    assert not cache.is_uptodate(args, [str(inp), str(other)], [str(out)], str(tmp_path))[0]
+
+    os.remove(out)
+    assert not cache.is_uptodate(args, [str(inp)], [str(out)], str(tmp_path))[0]
+
+
+# records are written by flush and reloaded by a new instance
+def test_flush_and_reload(tmp_path):
+    cache_file  = str(tmp_path / 'cache.json')
+    cache       = BuildCache(cache_file)
+    args, inp, out = _build(tmp_path, cache)
+    cache.flush()
+
+    assert os.path.isfile(cache_file)
+    assert BuildCache(cache_file).is_uptodate(args, [str(inp)], [str(out)], str(tmp_path)) == (True, 'stdout')
+
+    cache.invalidate(args, str(tmp_path))
+    cache.flush()
+    assert not BuildCache(cache_file).has_record(args, str(tmp_path))
+
+
+# shared returns a single instance per cache file
+def test_shared(tmp_path):
+    cache_file = str(tmp_path / 'cache.json')
+    assert BuildCache.shared(cache_file) is BuildCache.shared(cache_file)
+
+
+# outputs built before the cache was used are adopted when newer than their inputs, rebuilt otherwise
+def test_adopt_existing(tmp_path):
+    cache   = BuildCache(str(tmp_path / 'cache.json'))
+    inp     = tmp_path / 'in.txt'
+    out     = tmp_path / 'out.txt'
+    inp.write_text('in')
+    out.write_text('out')
+    os.utime(inp, ns=(0, os.stat(out).st_mtime_ns - 10**9))
+    args    = ['tool', str(inp), str(out)]
+
+    assert not cache.adopt_existing(args, [str(inp)], None, str(tmp_path))
+    assert cache.adopt_existing(args, [str(inp)], [str(out)], str(tmp_path))
+    assert cache.is_uptodate(args, [str(inp)], [str(out)], str(tmp_path)) == (True, '')
+    assert not cache.adopt_existing(args, [str(inp)], [str(out)], str(tmp_path))     # already recorded
+
+    args2 = ['tool2', str(inp), str(out)]
+    os.utime(inp, ns=(0, os.stat(out).st_mtime_ns + 10**9))
+    assert not cache.adopt_existing(args2, None, [str(out)], str(tmp_path))
+
+
+# rrun skips recorded and adopted commands
+def test_rrun_with_cache(tmp_path):
+    from myutility.myfsl.utils.run import buildcache, rrun
+
+    inp = tmp_path / 'in.txt'
+    out = tmp_path / 'out.txt'
+    inp.write_text('in')
+    out.write_text('old')
+    os.utime(inp, ns=(0, os.stat(out).st_mtime_ns - 10**9))
+
+    with buildcache(BuildCache(str(tmp_path / 'cache.json'))):
+        rrun(f'cp {inp} {out}', inputs=[str(inp)], outputs=[str(out)])
+        assert out.read_text() == 'old'
+
+        rrun(f'cp {inp} {out}', inputs=[str(inp)], outputs=[str(out)], rebuild=True)
+        assert out.read_text() == 'in'
+
+        os.remove(out)
+        rrun(f'cp {inp} {out}', inputs=[str(inp)], outputs=[str(out)])
+        assert out.read_text() == 'in'
@@ -0,0 +1,42 @@
+import pandas
+
+from data.DBComparer import DBComparer
+from data.SubjectsData import SubjectsData
+
+
+def _diffs(sd1, sd2, **kwargs):
+    parts = list(DBComparer.iter_sheet_diffs('main', sd1, sd2, **kwargs))
+    return pandas.concat(parts, ignore_index=True) if len(parts) > 0 else pandas.DataFrame()
+
+
+# dates are compared as dates and reported with the given format, also for rows present in one database only
+def test_dates_are_formatted():
+    sd1 = SubjectsData(pandas.DataFrame({'subj': ['S1'], 'session': [1], 'birth_date': pandas.to_datetime(['2020-03-01'])}))
+    sd2 = SubjectsData(pandas.DataFrame({'subj': ['S1', 'S2'], 'session': [1, 1], 'birth_date': pandas.to_datetime(['2020-03-02', '2021-01-05'])}))
+
+    diff = _diffs(sd1, sd2, date_format='%d-%b-%Y')
+
+    assert diff['subj'].tolist() == ['S1', 'S2']
+    assert diff['old'].tolist()[0] == '01-Mar-2020'
+    assert pandas.isna(diff['old'].tolist()[1])
+    assert diff['new'].tolist() == ['02-Mar-2020', '05-Jan-2021']
+
+
+# equal values (and missing values on both sides) are not differences
+def test_only_changed_cells():
+    sd1 = SubjectsData(pandas.DataFrame({'subj': ['S1', 'S2'], 'session': [1, 1], 'age': [20, None], 'group': ['a', 'b']}))
+    sd2 = SubjectsData(pandas.DataFrame({'subj': ['S1', 'S2'], 'session': [1, 1], 'age': [20, None], 'group': ['a', 'c']}))
+
+    diff = _diffs(sd1, sd2)
+
+    assert len(diff) == 1
+    assert diff.loc[0, ['subj', 'column', 'old', 'new']].tolist() == ['S2', 'group', 'b', 'c']
+
+
+# chunking does not change the reported differences
+def test_chunks():
+    sd1 = SubjectsData(pandas.DataFrame({'subj': ['S' + str(i) for i in range(10)], 'session': [1] * 10, 'age': list(range(10))}))
+    sd2 = SubjectsData(pandas.DataFrame({'subj': ['S' + str(i) for i in range(10)], 'session': [1] * 10, 'age': list(range(1, 11))}))
+
+    assert len(list(DBComparer.iter_sheet_diffs('main', sd1, sd2, chunk_size=3))) == 4
+    assert len(_diffs(sd1, sd2, chunk_size=3)) == 10
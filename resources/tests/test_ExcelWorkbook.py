@@ -0,0 +1,41 @@
+import openpyxl
+import pandas
+
+from data.ExcelWorkbook import ExcelWorkbook
+from data.MSHDB import MSHDB
+
+
+def _write_workbook(path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'main'
+    ws.append(['subj', 'session', 'age'])
+    ws.append(['S1', '1', 30])          # session typed as text
+    ws.append(['S2', 1, 40])
+    ws.append([None, None, None])       # blank row in the middle
+    ws.append(['S3', 2, 50])
+    ws.append([None, None, 60])         # trailing row without subject
+    wb.save(path)
+    return str(path)
+
+
+# the first columns read by the subjects pre-scan must match those read by pandas
+def test_read_columns_matches_read_excel(tmp_path):
+    path = _write_workbook(tmp_path / 'db.xlsx')
+
+    scanned = ExcelWorkbook(path).read_columns('main', 2)
+    loaded  = pandas.read_excel(path, 'main').iloc[:, :2]
+
+    pandas.testing.assert_frame_equal(scanned, loaded)
+
+
+# the subjects returned by the pre-scan must be those of the loaded sheet
+def test_scan_matches_load(tmp_path):
+    path = _write_workbook(tmp_path / 'db.xlsx')
+
+    db      = MSHDB('test_mshdb_schema.json', path, suppress_nosubj=False)
+    scanned = db.sheets._scanners['main']()
+    loaded  = db.sheets['main'].subjects
+
+    assert [str(s.key) for s in scanned] == [str(s.key) for s in loaded]
+    assert scanned.labels[:3] == ['S1', 'S2', 'S3']
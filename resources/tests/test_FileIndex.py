@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from myutility.FileIndex import FileIndex
+
+
+# within a block, existence tests are answered by the index as os.path does
+def test_index_answers(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'f.txt').write_text('x')
+
+    with FileIndex() as index:
+        assert FileIndex.current() is index
+        assert FileIndex.isfile(str(tmp_path / 'f.txt'))
+        assert not FileIndex.isfile(str(tmp_path / 'sub'))
+        assert FileIndex.isdir(str(tmp_path / 'sub'))
+        assert FileIndex.exists(str(tmp_path / 'sub'))
+        assert not FileIndex.exists(str(tmp_path / 'missing'))
+        assert not FileIndex.isfile(str(tmp_path / 'nodir' / 'f.txt'))
+        assert FileIndex.subdirs(str(tmp_path)) == ['sub']
+        with pytest.raises(FileNotFoundError):
+            FileIndex.subdirs(str(tmp_path / 'missing'))
+
+    assert FileIndex.current() is None
+
+
+# files written within a block are seen only after being invalidated
+def test_invalidate(tmp_path):
+    path = str(tmp_path / 'new.txt')
+    with FileIndex():
+        assert not FileIndex.isfile(path)
+        with open(path, 'w') as f:
+            f.write('x')
+        assert not FileIndex.isfile(path)
+
+        FileIndex.invalidate_path(path)
+        assert FileIndex.isfile(path)
+
+        os.remove(path)
+        FileIndex.invalidate_path(path)
+        assert not FileIndex.isfile(path)
+
+
+# nested blocks share the content of the outer one and restore it on exit
+def test_nested(tmp_path):
+    with FileIndex() as outer:
+        FileIndex.isfile(str(tmp_path / 'f.txt'))
+        with FileIndex() as inner:
+            assert FileIndex.current() is inner
+            assert inner._dirs is outer._dirs
+        assert FileIndex.current() is outer
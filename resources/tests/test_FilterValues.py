@@ -0,0 +1,34 @@
+import numpy as np
+import pandas
+
+from data.utilities import FilterValues
+
+
+# mask gives the same result of isValid applied to each value
+def test_mask_matches_isvalid():
+    columns = [pandas.Series([1.0, 2.5, np.nan, 4.0, 0.0]),
+               pandas.Series([1, 2, 3, 4, 5]),
+               pandas.Series(['a', '', 'NA', 'nan', 'b'])]
+    filters = [('=', 2, None), ('!=', 2, None), ('>', 2, None), ('>=', 2, None), ('<', 2, None), ('<=', 2, None),
+               ('<>', 1, 4), ('<=>', 1, 4), ('exist', None, None), ('noexist', None, None)]
+
+    for col in columns:
+        for op, par1, par2 in filters:
+            if col.dtype == object and op not in ('=', '!=', 'exist', 'noexist'):
+                continue
+            fv = FilterValues('col', op, par1, par2)
+            expected = np.array([bool(fv.isValid(v)) for v in col])
+            np.testing.assert_array_equal(fv.mask(col), expected, err_msg=op + ' ' + str(col.dtype))
+
+
+# values that cannot be compared as a whole are checked one by one
+def test_mask_mixed_values():
+    col = pandas.Series([1, 'a', 3, None], dtype=object)
+    np.testing.assert_array_equal(FilterValues('col', '=', 3).mask(col), [False, False, True, False])
+
+
+# missing values of nullable dtypes are not valid, unknown operations select nothing
+def test_mask_nullable_and_unknown():
+    col = pandas.Series([1, None, 3], dtype='Int64')
+    np.testing.assert_array_equal(FilterValues('col', '>', 0).mask(col), [True, False, True])
+    np.testing.assert_array_equal(FilterValues('col', '??', 0).mask(col), [False, False, False])
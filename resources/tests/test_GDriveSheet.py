@@ -0,0 +1,31 @@
+import numpy as np
+import pandas
+
+from data.GDriveSheet import GDriveSheet
+
+
+# cells keep numbers and booleans typed, integral floats become integers and missing values empty cells
+def test_to_cells():
+    df = pandas.DataFrame({'subj': ['S1', 'S2'], 'session': [1, 2], 'age': [30.0, 40.5], 'ok': [True, False], 'note': ['x', np.nan]})
+
+    assert GDriveSheet.to_cells(df) == [['subj', 'session', 'age', 'ok', 'note'],
+                                        ['S1', 1, 30, True, 'x'],
+                                        ['S2', 2, 40.5, False, '']]
+
+
+# changed cells are returned as runs, close runs are merged and removed cells are emptied
+def test_cells_diff():
+    old = [['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+           [1, 2, 3],
+           ['x']]
+    new = [['A', 'b', 'c', 'D', 'e', 'f', 'g'],
+           [1, 2, 3, 4]]
+
+    assert GDriveSheet.cells_diff(old, new, max_gap=3) == [(0, 0, ['A', 'b', 'c', 'D']), (1, 3, [4]), (2, 0, [''])]
+    assert GDriveSheet.cells_diff(old, new, max_gap=1) == [(0, 0, ['A']), (0, 3, ['D']), (1, 3, [4]), (2, 0, [''])]
+
+
+# values differing only in type are changed cells
+def test_cells_diff_types():
+    assert GDriveSheet.cells_diff([[1, 1, 1.5]], [['1', True, 1.5]]) == [(0, 0, ['1', True])]
+    assert GDriveSheet.cells_diff([[1, 'a']], [[1, 'a']]) == []
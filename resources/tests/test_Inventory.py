@@ -0,0 +1,82 @@
+import os
+import pickle
+
+from myutility.Inventory import Inventory, OutputsCollector
+
+
+def _inventory(tmp_path):
+    (tmp_path / 't1.nii.gz').write_text('t1')
+    (tmp_path / 'cat.txt').write_text('cat')
+    inv = Inventory(str(tmp_path / 'db' / 'inventory.sqlite'))
+    inv.record('S1', 1, 't1', [str(tmp_path / 't1')], {'fsl': '6.0.7'}, completed='2024-01-01T10:00:00')
+    inv.record('S1', 1, 'cat_segment', [str(tmp_path / 'cat.txt'), str(tmp_path / 'missing.txt')], completed='2024-01-02T10:00:00')
+    inv.record('S2', 1, 't1', [], completed='2024-01-01T11:00:00')
+    inv.record('S2', 2, 't1', [], completed='2024-01-01T12:00:00')
+    return inv
+
+
+# images given without extension are resolved, missing outputs are skipped
+def test_record_and_get(tmp_path):
+    inv = _inventory(tmp_path)
+
+    assert inv.has('S1', 1, 't1')
+    assert not inv.has('S1', 2, 't1')
+    assert inv.steps('S1', 1) == ['t1', 'cat_segment']
+
+    rec = inv.get('S1', 1, 't1')
+    assert rec['versions'] == {'fsl': '6.0.7'}
+    assert list(rec['outputs']) == [str(tmp_path / 't1.nii.gz')]
+    assert list(inv.get('S1', 1, 'cat_segment')['outputs']) == [str(tmp_path / 'cat.txt')]
+
+
+# subjects are selected by the steps they completed and those they did not
+def test_subjects_query(tmp_path):
+    inv = _inventory(tmp_path)
+
+    assert inv.subjects(has=['t1']) == [('S1', 1), ('S2', 1), ('S2', 2)]
+    assert inv.subjects(has=['t1'], missing=['cat_segment']) == [('S2', 1), ('S2', 2)]
+    assert inv.subjects(has=['t1', 'cat_segment']) == [('S1', 1)]
+    assert inv.subjects(has=['t1'], session=2) == [('S2', 2)]
+
+    inv.remove('S2', 2)
+    assert inv.subjects(has=['t1']) == [('S1', 1), ('S2', 1)]
+
+    df = inv.to_dataframe()
+    assert df[['subj', 'session']].values.tolist() == [['S1', 1], ['S2', 1]]
+    assert df.loc[0, 'cat_segment'] == '2024-01-02T10:00:00'
+
+
+# outputs deleted or modified after being recorded are reported
+def test_verify(tmp_path):
+    inv = _inventory(tmp_path)
+    assert inv.verify() == []
+
+    (tmp_path / 'cat.txt').write_text('modified')
+    os.remove(tmp_path / 't1.nii.gz')
+
+    assert sorted(inv.verify()) == [('S1', 1, 'cat_segment', str(tmp_path / 'cat.txt')),
+                                    ('S1', 1, 't1', str(tmp_path / 't1.nii.gz'))]
+    assert inv.verify('S2') == []
+
+
+# instances can be sent to worker processes
+def test_pickle(tmp_path):
+    inv = pickle.loads(pickle.dumps(_inventory(tmp_path)))
+    assert inv.has('S1', 1, 't1')
+
+
+# the collector forwards the records to the replaced tracer and ignores failed commands
+def test_outputs_collector():
+    class Tracer:
+        def __init__(self):
+            self.records = []
+
+        def record(self, args, start, wall, usage, exitcode, cwd=None):
+            self.records.append(args)
+
+    tracer      = Tracer()
+    collector   = OutputsCollector(tracer)
+    collector.record(['false'], 0, 0, None, 1)
+
+    assert collector.outputs == []
+    assert tracer.records == [['false']]
@@ -0,0 +1,74 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('matlab.engine')     # Project and Subject import the matlab engine wrapper
+
+from Project import Project
+from myutility.myfsl.utils.run import get_context, run_context
+from myutility.myfsl.utils.trace import current_context
+from subject.Subject import Subject
+
+
+class WorkSubject(Subject):
+
+    def work(self, delay=0.0, fail=False):
+        time.sleep(delay)
+        if fail:
+            raise Exception("Error in WorkSubject.work: " + self.label + " failed")
+        return {"label": self.label, "end": time.time(), "logFile": get_context().logFile, "tags": dict(current_context())}
+
+
+def make_subjects(tmp_path, labels):
+    glob    = SimpleNamespace(fsl_dir="", fsl_bin="", fsl_data_std_dir="")
+    project = SimpleNamespace(globaldata=glob, subjects_dir=str(tmp_path))
+    return [WorkSubject(label, project) for label in labels]
+
+
+def run_rolling(subjects, kwparams, ncore=2, use_processes=False):
+    return Project.__new__(Project).run_subjects_methods("", "work", kwparams, ncore=ncore, subjects=subjects,
+                                                         rolling=True, use_processes=use_processes)
+
+
+# results are ordered as the subjects, a failing subject does not stop the others and its error is returned
+def test_rolling_results(tmp_path):
+    subjects    = make_subjects(tmp_path, ["s1", "s2", "s3"])
+    res         = run_rolling(subjects, [{"delay": 0.3}, {"fail": True}, {}])
+
+    assert [r["label"] for r in res] == ["s1", "s2", "s3"]
+    assert [r["session"] for r in res] == [1, 1, 1]
+    assert res[0]["error"] is None and res[0]["result"]["label"] == "s1"
+    assert res[1]["result"] is None and "s2 failed" in str(res[1]["error"])
+    assert res[2]["error"] is None and res[2]["result"]["label"] == "s3"
+
+
+# a slow subject does not block the others: the free worker keeps consuming the queue
+def test_rolling_slow_subject(tmp_path):
+    subjects    = make_subjects(tmp_path, ["slow", "a", "b", "c"])
+    res         = run_rolling(subjects, [{"delay": 1.0}, {"delay": 0.1}, {"delay": 0.1}, {"delay": 0.1}], ncore=2)
+
+    end = {r["label"]: r["result"]["end"] for r in res}
+    assert max(end["a"], end["b"], end["c"]) < end["slow"]
+
+
+# thread workers inherit the caller's run context, and their commands are tagged with subject and pipeline
+def test_rolling_context(tmp_path):
+    subjects    = make_subjects(tmp_path, ["s1", "s2"])
+    log         = str(tmp_path / "log.txt")
+    with run_context(logFile=log):
+        res = run_rolling(subjects, [{}])
+
+    for r in res:
+        assert r["result"]["logFile"] == log
+        assert r["result"]["tags"]["subject"] == r["label"]
+        assert r["result"]["tags"]["pipeline"] == "work"
+
+
+# process workers return results and errors as thread workers do
+def test_rolling_processes(tmp_path):
+    subjects    = make_subjects(tmp_path, ["s1", "s2", "s3"])
+    res         = run_rolling(subjects, [{}, {"fail": True}, {}], use_processes=True)
+
+    assert [r["result"]["label"] if r["result"] else None for r in res] == ["s1", None, "s3"]
+    assert res[1]["error"] is not None
@@ -0,0 +1,59 @@
+import copy
+import pickle
+
+from data.SID import SID
+from data.SIDList import SIDList
+
+
+def _sids():
+    return SIDList([SID('S1', 1, 0), SID('S2', 1, 1), SID('S1', 2, 2)])
+
+
+# SIDs are equal (and hash the same) when label and session are equal, whatever their id
+def test_sid_equality():
+    assert SID('S1', 1, 0) == SID('S1', 1, 5)
+    assert SID('S1', 1, 0) != SID('S1', 2, 0)
+    assert len({SID('S1', 1, 0), SID('S1', 1, 5)}) == 1
+
+
+# membership uses the index, which follows in-place changes of the list
+def test_contains_after_changes():
+    sids = _sids()
+    assert SID('S1', 2, 9) in sids
+    assert SID('S3', 1, 9) not in sids
+
+    sids.append(SID('S3', 1, 3))
+    assert SID('S3', 1, 9) in sids
+
+    sids.remove(SID('S1', 2, 2))
+    assert SID('S1', 2, 9) not in sids
+
+    sids[0] = SID('S4', 1, 0)
+    assert SID('S4', 1, 0) in sids
+    assert SID('S1', 1, 0) not in sids
+
+    del sids[0]
+    assert SID('S4', 1, 0) not in sids
+
+
+# copies and unpickled lists build their own index
+def test_copies():
+    sids = _sids()
+    assert SID('S2', 1, 1) in sids
+
+    for other in [copy.copy(sids), copy.deepcopy(sids), pickle.loads(pickle.dumps(sids))]:
+        other.append(SID('S5', 1, 4))
+        assert SID('S5', 1, 4) in other
+    assert SID('S5', 1, 4) not in sids
+
+
+# is_in/not_in return the elements of the given list that are/are not present in the current one
+def test_is_in_not_in():
+    sids  = _sids()
+    other = SIDList([SID('S1', 2, 7), SID('S9', 1, 8)])
+
+    assert [s.key for s in sids.is_in(other)] == [('S1', 2)]
+    assert sids.is_in(other)[0].id == 7
+    assert sids.is_in(other, context_self=True)[0].id == 2
+    assert [s.key for s in sids.not_in(other)] == [('S9', 1)]
+    assert sids.labels == ['S1', 'S2', 'S1']
@@ -0,0 +1,58 @@
+import pandas
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from data.SheetsCache import SheetsCache
+from data.SubjectsData import SubjectsData
+
+
+def _workbook(tmp_path, content=b'workbook'):
+    path = tmp_path / 'db.xlsx'
+    path.write_bytes(content)
+    return str(path)
+
+
+def _sheet():
+    return SubjectsData(pandas.DataFrame({'subj': ['S1', 'S2'], 'session': [1, 1], 'age': [20, 30]}))
+
+
+# stored sheets and subjects are loaded by a new instance
+def test_store_and_load(tmp_path):
+    wb      = _workbook(tmp_path)
+    cache   = SheetsCache(wb, 'test_mshdb_schema.json')
+    assert not cache.is_valid()
+
+    cache.store_sheet_names(['main'])
+    cache.store_sheet('main', _sheet())
+
+    cache = SheetsCache(wb, 'test_mshdb_schema.json')
+    assert cache.is_valid()
+    assert cache.sheet_names == ['main']
+    pandas.testing.assert_frame_equal(cache.load_sheet('main').df, _sheet().df)
+    assert cache.sheet_subjects('main').labels == ['S1', 'S2']
+
+
+# a change of the workbook or of the loading options invalidates the cache
+def test_invalidation(tmp_path):
+    wb      = _workbook(tmp_path)
+    cache   = SheetsCache(wb, 'test_mshdb_schema.json', options={'sort': True})
+    cache.store_sheet_names(['main'])
+    cache.store_sheet('main', _sheet())
+
+    assert not SheetsCache(wb, 'test_mshdb_schema.json', options={'sort': False}).is_valid()
+
+    _workbook(tmp_path, b'changed workbook')
+    assert not SheetsCache(wb, 'test_mshdb_schema.json', options={'sort': True}).is_valid()
+
+
+# sheets of protected workbooks are encrypted and not readable with another password
+def test_password(tmp_path):
+    pytest.importorskip('cryptography')
+    wb      = _workbook(tmp_path)
+    cache   = SheetsCache(wb, 'test_mshdb_schema.json', password='secret')
+    cache.store_sheet_names(['main'])
+    cache.store_sheet('main', _sheet())
+
+    assert SheetsCache(wb, 'test_mshdb_schema.json', password='secret').load_sheet('main').df['age'].tolist() == [20, 30]
+    assert not SheetsCache(wb, 'test_mshdb_schema.json', password='other').is_valid()
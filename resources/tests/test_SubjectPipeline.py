@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+import pytest
+
+from subject.SubjectPipeline import PipelineStep, SubjectPipeline
+
+
+# steps run after their dependencies, independent branches run at the same time
+def test_run_order_and_parallelism():
+    order   = []
+    lock    = threading.Lock()
+    started = threading.Barrier(2, timeout=5)
+
+    def step(name, wait=False):
+        def f():
+            if wait:
+                started.wait()      # both branches must be running together
+            with lock:
+                order.append(name)
+        return f
+
+    pipe = SubjectPipeline('S1')
+    pipe.add_step('c', step('c'), deps=['a', 'b'])
+    pipe.add_step('a', step('a', True))
+    pipe.add_step('b', step('b', True))
+
+    res = pipe.run(ncore=2)
+
+    assert res == {'a': PipelineStep.DONE, 'b': PipelineStep.DONE, 'c': PipelineStep.DONE}
+    assert order[-1] == 'c'
+
+
+# a failing step blocks its descendants without stopping the other branches
+def test_failure_blocks_descendants():
+    def fail():
+        raise Exception('boom')
+
+    pipe = SubjectPipeline('S1')
+    pipe.add_step('a', fail)
+    pipe.add_step('b', lambda: None, deps=['a'])
+    pipe.add_step('c', lambda: None, deps=['b'])
+    pipe.add_step('d', lambda: None)
+    pipe.add_step('e', lambda: None, deps=['d'])
+
+    res = pipe.run(ncore=2)
+
+    assert res == {'a': PipelineStep.FAILED, 'b': PipelineStep.BLOCKED, 'c': PipelineStep.BLOCKED,
+                   'd': PipelineStep.DONE, 'e': PipelineStep.DONE}
+    assert pipe.steps['a'].error == 'boom'
+
+
+# cycles and duplicated steps are rejected
+def test_invalid_graph():
+    pipe = SubjectPipeline('S1')
+    pipe.add_step('a', lambda: None, deps=['b'])
+    pipe.add_step('b', lambda: None, deps=['a'])
+    with pytest.raises(Exception):
+        pipe.run()
+    with pytest.raises(Exception):
+        pipe.add_step('a', lambda: None)
+
+
+# a dependency on an unknown step is an error, not an ordering to be dropped
+def test_unknown_dependency():
+    calls = []
+    pipe  = SubjectPipeline('S1')
+    pipe.add_step('a', lambda: calls.append('a'))
+    pipe.add_step('b', lambda: calls.append('b'), deps=['aa'])
+    with pytest.raises(Exception):
+        pipe.run()
+    assert calls == []
+
+
+# missing steps block their descendants, optional dependencies are followed only when present
+def test_missing_and_optional_dependencies():
+    calls = []
+    pipe  = SubjectPipeline('S1')
+    pipe.add_missing_step('t1', 'no T1 image')
+    pipe.add_step('rs', lambda: calls.append('rs'), deps=['t1'])
+    pipe.add_step('dti', lambda: calls.append('dti'))
+    pipe.add_step('xtract', lambda: calls.append('xtract'), optional_deps=['dti', 'bedpostx'])
+
+    res = pipe.run(ncore=2)
+
+    assert res == {'t1': PipelineStep.MISSING, 'rs': PipelineStep.BLOCKED, 'dti': PipelineStep.DONE, 'xtract': PipelineStep.DONE}
+    assert pipe.steps['t1'].error == 'no T1 image'
+    assert calls == ['dti', 'xtract']
+
+
+# steps whose outputs are newer than their inputs are skipped unless overwrite is given
+def test_uptodate(tmp_path):
+    inp = tmp_path / 'in.txt'
+    out = tmp_path / 'out.txt'
+    inp.write_text('in')
+    out.write_text('out')
+    os.utime(inp, (time.time() - 10, time.time() - 10))
+
+    calls = []
+    pipe  = SubjectPipeline('S1')
+    pipe.add_step('a', lambda: calls.append('a'), inputs=[str(inp)], outputs=[str(out)])
+
+    assert pipe.run() == {'a': PipelineStep.UPTODATE}
+    assert pipe.run(overwrite=True) == {'a': PipelineStep.DONE}
+    assert calls == ['a']
+
+    os.utime(inp, (time.time() + 10, time.time() + 10))
+    assert pipe.run() == {'a': PipelineStep.DONE}
@@ -0,0 +1,55 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('matlab.engine')     # Subject imports the matlab engine wrapper
+
+from subject.Subject import Subject
+
+
+def _subject(tmp_path):
+    glob    = SimpleNamespace(fsl_dir="", fsl_bin="", fsl_data_std_dir="", fsl_std_mni_2mm_brain=str(tmp_path / "std" / "MNI152_T1_2mm_brain"))
+    project = SimpleNamespace(globaldata=glob, subjects_dir=str(tmp_path))
+    return Subject("S1", project)
+
+
+# the view has the paths of the given session, the original subject is not modified
+def test_session_view_paths(tmp_path):
+    subj    = _subject(tmp_path)
+    roi_dir = subj.roi_dir
+    view    = subj.session_view(2)
+
+    assert view.sessid == 2
+    assert view.dir == os.path.join(str(tmp_path), "S1", "s2")
+    assert view.roi_dir == os.path.join(view.dir, "roi")
+
+    assert subj.sessid == 1
+    assert subj.dir == os.path.join(str(tmp_path), "S1", "s1")
+    assert subj.roi_dir == roi_dir
+
+
+# project and global data are shared, templates and formats are independent copies
+def test_session_view_shared(tmp_path):
+    subj    = _subject(tmp_path)
+    std_img = subj.std_img
+    view    = subj.session_view(2)
+
+    assert view.project is subj.project and view._global is subj._global
+    assert view.std_img is std_img
+
+    view.std_img = "custom"
+    view.DCM2NII_IMAGE_FORMATS.append(".mgz")
+    assert subj.std_img is std_img
+    assert ".mgz" not in subj.DCM2NII_IMAGE_FORMATS
+
+
+# get_properties and set_properties(rollback=True) return a session view, the default one is of the current session
+def test_get_properties(tmp_path):
+    subj = _subject(tmp_path)
+
+    for view in (subj.get_properties(2), subj.set_properties(2, True)):
+        assert view is not subj
+        assert (view.sessid, view.dir) == (2, subj.session_view(2).dir)
+    assert subj.sessid == 1
+    assert subj.session_view().dir == subj.dir
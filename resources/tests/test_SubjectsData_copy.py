@@ -0,0 +1,71 @@
+import pandas
+
+from data.MSHDB import MSHDB
+from data.SID import SID
+from data.SubjectsData import SubjectsData
+from data.utilities import FilterValues
+
+
+def _sd():
+    return SubjectsData(pandas.DataFrame({'subj': ['S1', 'S2', 'S3'], 'session': [1, 1, 2], 'age': [20, 30, 40]}))
+
+
+# copies share the data frame, reading it does not clone it
+def test_copy_shares_until_modified():
+    sd1 = _sd()
+    sd2 = sd1.copy()
+    assert sd2.df_view is sd1.df_view
+
+    sids = sd2.filter_subjects(conditions=[FilterValues('age', '>', 25)])
+    assert sids.labels == ['S2', 'S3']
+    assert sd2.filter_sids([FilterValues('age', '<', 35)], sids).labels == ['S2']
+    assert sd2.get_subject_col_value(sids[0], 'age') == 30
+    assert sd2.select_df(sids, ['age'])['age'].tolist() == [30, 40]
+    assert sd2.header == ['subj', 'session', 'age'] and sd2.num == 3
+
+    assert sd2.df_view is sd1.df_view
+
+
+# the modified copy is cloned, the original keeps its data (and is no longer shared)
+def test_write_clones_and_releases():
+    sd1 = _sd()
+    sd2 = sd1.copy()
+    shared = sd1.df_view
+
+    sd2.set_subj_session_value(sd2.get_sid('S1', 1), 'age', 21)
+
+    assert sd2.df_view is not shared
+    assert sd2.df_view['age'].tolist() == [21, 30, 40]
+    assert sd1.df_view['age'].tolist() == [20, 30, 40]
+
+    # the original is the only owner of its data frame: modifying it does not clone it
+    sd1.set_subj_session_value(sd1.get_sid('S2', 1), 'age', 31)
+    assert sd1.df_view is shared
+    assert sd2.df_view['age'].tolist() == [21, 30, 40]
+
+
+# replacing the data frame of a copy detaches it from the others
+def test_setter_detaches():
+    sd1 = _sd()
+    sd2 = sd1.copy()
+    sd3 = sd1.copy()
+
+    sd2.df = pandas.DataFrame({'subj': ['S9'], 'session': [1], 'age': [90]})
+    assert sd3.df_view is sd1.df_view
+
+    sd3.add_row(SID('S4', 1, 3), {'subj': 'S4', 'session': 1, 'age': 50})
+    assert sd3.num == 4 and sd1.num == 3
+    assert sd1.df_view is not sd3.df_view
+
+
+# sheets of a copied database share the data until modified
+def test_mshdb_copy():
+    db = MSHDB(file_schema='test_mshdb_schema.json')
+    db.sheets['main'] = _sd()
+
+    copy = db.copy()
+    assert copy.get_sheet_sd('main').df_view is db.get_sheet_sd('main').df_view
+
+    copy.get_sheet_sd('main').add_column('weight', [60, 70, 80])
+    assert 'weight' in copy.get_sheet_sd('main').header
+    assert 'weight' not in db.get_sheet_sd('main').header
@@ -0,0 +1,42 @@
+import pandas
+import pytest
+
+from data.SID import SID
+from data.SubjectsData import SubjectsData
+from myutility.exceptions import DataFileException
+
+
+def _sd():
+    return SubjectsData(pandas.DataFrame({'subj': ['S1', 'S1', 'S2'], 'session': [1, 2, 1], 'age': [20, 21, 30]}))
+
+
+# lookups by (subject, session) resolve to the row id
+def test_lookups():
+    sd = _sd()
+    assert sd.get_sid('S1', 2).id == 1
+    assert sd.get_subjid_by_session('S2', 1) == 2
+    assert sd.exist_subject_session('S1', 2)
+    assert not sd.exist_subject_session('S2', 2)
+    assert sd.get_subject_available_sessions('S1') == [1, 2]
+
+    assert sd.get_sid('S3', must_exist=False) is None
+    assert sd.get_subjid_by_session('S3', error_if_empty=False) == -1
+    with pytest.raises(DataFileException):
+        sd.get_sid('S3')
+
+
+# the index follows the changes of the data frame
+def test_index_invalidation():
+    sd = _sd()
+    assert not sd.exist_subject_session('S3', 1)
+
+    sd.add_row(SID('S3', 1, 3), {'subj': 'S3', 'session': 1, 'age': 40})
+    assert sd.get_subjid_by_session('S3', 1) == 3
+
+    sd.rename_subjects({'S1': 'S2', 'S2': 'S1'})
+    assert sd.get_subject_available_sessions('S2') == [1, 2]
+    assert sd.get_subjid_by_session('S1', 1) == 2
+
+    sd.df = pandas.DataFrame({'subj': ['S4'], 'session': [3], 'age': [50]})
+    assert sd.get_subject_available_sessions('S4') == [3]
+    assert not sd.exist_subject_session('S1', 1)
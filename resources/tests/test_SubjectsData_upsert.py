@@ -0,0 +1,49 @@
+import pandas
+import pytest
+
+from data.SubjectsData import SubjectsData
+
+
+def _sd():
+    return SubjectsData(pandas.DataFrame({'subj': ['S1', 'S2'], 'session': [1, 1], 'age': [20, 30]}))
+
+
+# updating and inserting integer values must not turn an integer column into a float one
+def test_upsert_keeps_int_dtype():
+    sd = _sd()
+    inserted, updated = sd.upsert(pandas.DataFrame({'subj': ['S2', 'S3'], 'session': [1, 1], 'age': [31, 40]}))
+
+    assert (inserted, updated) == (1, 1)
+    assert sd.df['age'].dtype == 'int64'
+    assert sd.df['age'].tolist() == [20, 31, 40]
+    assert sd.df['subj'].tolist() == ['S1', 'S2', 'S3']
+
+
+# a value the column cannot hold upcasts the column instead of being truncated
+def test_upsert_upcasts_when_needed():
+    sd = _sd()
+    sd.upsert(pandas.DataFrame({'subj': ['S1'], 'session': [1], 'age': [20.5]}))
+
+    assert sd.df['age'].dtype == 'float64'
+    assert sd.df['age'].tolist() == [20.5, 30]
+
+
+# fill_na only writes the empty cells, error raises when an existing value would change
+def test_upsert_policies():
+    sd = SubjectsData(pandas.DataFrame({'subj': ['S1', 'S2'], 'session': [1, 1], 'age': [20, None]}))
+    sd.upsert(pandas.DataFrame({'subj': ['S1', 'S2'], 'session': [1, 1], 'age': [25, 35]}), policy='fill_na')
+    assert sd.df['age'].tolist() == [20, 35]
+
+    with pytest.raises(Exception):
+        sd.upsert(pandas.DataFrame({'subj': ['S1'], 'session': [1], 'age': [26]}), policy='error')
+    assert sd.df['age'].tolist() == [20, 35]
+
+
+# empty values never overwrite existing ones and new rows are skipped when insert is False
+def test_upsert_empty_values_and_no_insert():
+    sd = _sd()
+    inserted, updated = sd.upsert(pandas.DataFrame({'subj': ['S1', 'S4'], 'session': [1, 1], 'age': [None, 50]}), insert=False)
+
+    assert (inserted, updated) == (0, 0)
+    assert sd.df['age'].tolist() == [20, 30]
+    assert sd.df['subj'].tolist() == ['S1', 'S2']
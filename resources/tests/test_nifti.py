@@ -0,0 +1,59 @@
+import gzip
+import struct
+
+import numpy as np
+
+from myutility.images import nifti
+
+
+def _write_nifti(path, data, pixdim=(1.0, 1.0, 1.0), slope=1.0, inter=0.0):
+    # minimal single-file NIfTI-1 float32 image
+    data = np.asarray(data, dtype=np.float32)
+    hdr  = bytearray(352)
+    struct.pack_into('<i', hdr, 0, 348)
+    struct.pack_into('<8h', hdr, 40, *([data.ndim] + list(data.shape) + [1] * (7 - data.ndim)))
+    struct.pack_into('<4h', hdr, 68, 0, 16, 32, 0)
+    struct.pack_into('<8f', hdr, 76, 1.0, *pixdim, 1.0, 1.0, 1.0, 1.0)
+    struct.pack_into('<3f', hdr, 108, 352.0, slope, inter)
+    hdr[344:348] = b'n+1\x00'
+    content = bytes(hdr) + data.tobytes(order='F')
+
+    path = str(path)
+    if path.endswith('.gz'):
+        with gzip.open(path, 'wb') as f:
+            f.write(content)
+    else:
+        with open(path, 'wb') as f:
+            f.write(content)
+    return path
+
+
+def _image():
+    data = np.zeros((4, 3, 2), dtype=np.float32)
+    data[0, 0, 0] = 2
+    data[1, 0, 0] = 4
+    data[3, 2, 1] = 6
+    return data
+
+
+# the header of plain and gzipped images is parsed, also when the image is given without extension
+def test_read_header(tmp_path):
+    _write_nifti(tmp_path / 'img.nii', _image(), pixdim=(2.0, 2.0, 3.0))
+    _write_nifti(tmp_path / 'imgz.nii.gz', _image())
+
+    hdr = nifti.read_nifti_header(str(tmp_path / 'img'))
+    assert hdr['nifti_version'] == 1
+    assert hdr['dim'][:4] == [3, 4, 3, 2]
+    assert hdr['pixdim'][1:4] == [2.0, 2.0, 3.0]
+    assert hdr['datatype'] == 16
+    assert nifti.dim(hdr, 4) == 1
+
+    assert nifti.read_nifti_header(str(tmp_path / 'imgz'))['dim'][:4] == [3, 4, 3, 2]
+    assert nifti.read_nifti_header(str(tmp_path / 'missing')) is None
+
+
+# files that are not NIfTI images are not parsed
+def test_not_nifti(tmp_path):
+    path = tmp_path / 'img.nii'
+    path.write_bytes(b'\x00' * 400)
+    assert nifti.read_nifti_header(str(path)) is None
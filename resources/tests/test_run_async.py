@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from myutility.myfsl.utils import run
+from myutility.myfsl.utils.run import arrun, deferred, rrun, rrun_many, set_max_concurrency
+
+
+@pytest.fixture
+def two_slots():
+    prev = run.MAX_CONCURRENCY
+    set_max_concurrency(2)
+    yield
+    set_max_concurrency(prev)
+
+
+# results are returned in the order of the commands, whatever their completion order
+def test_rrun_many_results():
+    res = rrun_many([['sh', '-c', 'sleep 0.2; echo a'], 'echo b', (['echo', 'c'], {'stdout': True})])
+    assert [r.strip() for r in res] == ['a', 'b', 'c']
+
+
+# a failing command raises after the others completed
+def test_rrun_many_error(tmp_path):
+    out = tmp_path / 'out.txt'
+    with pytest.raises(RuntimeError):
+        rrun_many(['false', ['sh', '-c', 'sleep 0.2; touch ' + str(out)]])
+    assert out.exists()
+
+
+# commands collected by deferred are not run until given to rrun_many
+def test_deferred(tmp_path):
+    out = tmp_path / 'out.txt'
+    with deferred() as cmds:
+        assert rrun('touch ' + str(out)) is None
+    assert not out.exists()
+
+    rrun_many(cmds)
+    assert out.exists()
+
+
+# the bound applies to the commands of all the threads running rrun_many
+def test_bound_across_threads(two_slots):
+    start   = time.time()
+    threads = [threading.Thread(target=rrun_many, args=(['sleep 0.3', 'sleep 0.3'],)) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert time.time() - start >= 0.55
+
+
+# rrun does not wait for the slots used by arrun
+def test_rrun_not_bounded(two_slots):
+    slots = run._cpu_slots
+    for _ in range(2):
+        slots.acquire()
+    try:
+        done = []
+        t = threading.Thread(target=lambda: done.append(rrun('echo x').strip()))
+        t.start()
+        t.join(5)
+        assert done == ['x']
+    finally:
+        for _ in range(2):
+            slots.release()
+
+
+# rrun_many can be called from a running event loop
+def test_rrun_many_in_loop():
+    async def main():
+        return rrun_many(['echo a'])
+    assert [r.strip() for r in asyncio.run(main())] == ['a']
+
+
+# a cancelled arrun waiting for a slot does not keep it
+def test_cancelled_arrun_releases_slot(two_slots):
+    slots = run._cpu_slots
+
+    async def main():
+        for _ in range(2):
+            slots.acquire()             # held by "another thread"
+        task = asyncio.ensure_future(arrun('echo x'))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        for _ in range(2):
+            slots.release()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert slots.acquire(blocking=False) and slots.acquire(blocking=False)
+    slots.release()
+    slots.release()
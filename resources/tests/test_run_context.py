@@ -0,0 +1,112 @@
+import asyncio
+import threading
+
+import pytest
+
+from myutility.myfsl.utils.run import RunContext, bind_context, deferred, dryrun, get_context, rrun, run_context
+from myutility.myfsl.utils.trace import current_context, trace_context, traced
+
+
+def _in_thread(func):
+    res = {}
+
+    def target():
+        res['value'] = func()
+    t = threading.Thread(target=target)
+    t.start()
+    t.join()
+    return res['value']
+
+
+# run_context modifies only the given fields and restores the previous context on exit
+def test_run_context_nesting(tmp_path):
+    with run_context(logFile='a.log', cwd=str(tmp_path)):
+        with run_context(logFile='b.log') as ctx:
+            assert ctx is get_context()
+            assert (ctx.logFile, ctx.cwd) == ('b.log', str(tmp_path))
+        assert get_context().logFile == 'a.log'
+    assert get_context().logFile is None
+
+
+# unknown fields are rejected
+def test_replace_unknown_field():
+    with pytest.raises(ValueError):
+        RunContext().replace(log_file='a.log')
+
+
+# threads do not inherit the caller's context, unless their target is wrapped by bind_context
+def test_bind_context():
+    with run_context(logFile='a.log'):
+        assert _in_thread(lambda: get_context().logFile) is None
+        assert _in_thread(bind_context(lambda: get_context().logFile)) == 'a.log'
+
+
+# traced propagates both the run context and the trace tags, adding the given ones
+def test_traced():
+    def tags():
+        return dict(current_context()), get_context().logFile
+
+    with run_context(logFile='a.log'), trace_context(subject='s1'):
+        assert _in_thread(traced(tags, pipeline='p')) == ({'subject': 's1', 'pipeline': 'p'}, 'a.log')
+    assert current_context() == {}
+
+
+# concurrent threads have their own context: a dry run in one thread does not affect the others
+def test_threads_isolated(tmp_path):
+    out     = tmp_path / 'out.txt'
+    ready   = threading.Barrier(2)
+
+    def dry():
+        with dryrun():
+            ready.wait()
+            ready.wait()
+            return get_context().dry_run
+
+    def real():
+        ready.wait()
+        rrun('touch ' + str(out))
+        ready.wait()
+        return get_context().dry_run
+
+    res = {}
+    threads = [threading.Thread(target=lambda f=f: res.__setitem__(f.__name__, f())) for f in (dry, real)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert res == {'dry': True, 'real': False}
+    assert out.exists()
+
+
+# asyncio tasks copy the context of the task creating them
+def test_tasks_isolated():
+    async def task(log):
+        with run_context(logFile=log):
+            await asyncio.sleep(0.05)
+            return get_context().logFile
+
+    async def main():
+        with run_context(logFile='main.log'):
+            res = await asyncio.gather(task('a.log'), task('b.log'))
+            return res, get_context().logFile
+
+    assert asyncio.run(main()) == (['a.log', 'b.log'], 'main.log')
+
+
+# in a dry run commands are not executed, rrun returns their command line
+def test_dryrun(tmp_path):
+    out = tmp_path / 'out.txt'
+    with dryrun():
+        assert rrun('touch ' + str(out)) == 'touch ' + str(out)
+    assert not out.exists()
+
+
+# deferred collects the commands of its own context only
+def test_deferred_context(tmp_path):
+    out = tmp_path / 'out.txt'
+    with deferred() as cmds:
+        rrun('touch ' + str(out))
+        assert _in_thread(lambda: get_context().deferred) is None
+    assert len(cmds) == 1
+    assert not out.exists()
@@ -0,0 +1,53 @@
+import numpy as np
+
+from myutility.images.voxelstats import MaskSet, image_stats, load_image_data, masks_stats
+from test_nifti import _image, _write_nifti
+
+
+# voxel data are read in Fortran order and scaled by scl_slope/scl_inter
+def test_load_image_data(tmp_path):
+    data = _image()
+    path = _write_nifti(tmp_path / 'img.nii.gz', data, slope=2.0, inter=1.0)
+    np.testing.assert_allclose(np.asarray(load_image_data(path)), data * 2 + 1)
+
+
+# statistics mimic fslstats -m -M -V
+def test_image_stats(tmp_path):
+    path  = _write_nifti(tmp_path / 'img.nii', _image(), pixdim=(2.0, 1.0, 1.0))
+    stats = image_stats(path)
+
+    assert stats['mean'] == 12 / 24
+    assert stats['nzmean'] == 4
+    assert stats['nvoxels'] == 3
+    assert stats['volume'] == 6
+
+
+# statistics within each mask, mimic fslstats -k mask -m -M -V
+def test_masks_stats(tmp_path):
+    img  = _write_nifti(tmp_path / 'img.nii', _image())
+    mask = np.zeros((4, 3, 2))
+    mask[:2, 0, 0] = 1
+
+    res = masks_stats(img, [_write_nifti(tmp_path / 'm.nii', mask)])
+    assert res == [{'mean': 3.0, 'nzmean': 3.0, 'nvoxels': 2, 'volume': 2.0}]
+
+
+# MaskSet computes the same statistics of masks_stats, with overlapping masks
+def test_maskset_matches_masks_stats(tmp_path):
+    img     = _write_nifti(tmp_path / 'img.nii', _image())
+    m1      = np.zeros((4, 3, 2))
+    m1[:2, 0, 0] = 1
+    m2      = np.zeros((4, 3, 2))
+    m2[1:, :, 1] = 1
+    m2[1, 0, 0] = 1
+    masks   = [_write_nifti(tmp_path / 'm1.nii', m1), _write_nifti(tmp_path / 'm2.nii.gz', m2)]
+
+    expected = masks_stats(img, masks)
+    assert expected[0] == {'mean': 3.0, 'nzmean': 3.0, 'nvoxels': 2, 'volume': 2.0}
+
+    res = MaskSet(masks).stats(img)
+    assert len(res) == 2
+    for r, e in zip(res, expected):
+        assert r['nvoxels'] == e['nvoxels']
+        assert r['volume'] == e['volume']
+        np.testing.assert_allclose([r['mean'], r['nzmean']], [e['mean'], e['nzmean']])
@@ -4,24 +4,55 @@ import glob
 import os
 import shutil
 import traceback
-from copy import deepcopy
 from shutil import move, rmtree
 from typing import List, Tuple
 
 from Global import Global
 from group.SPMConstants import SPMConstants
 from group.spm_utilities import FmriProcParams, GrpInImages
+from myutility.FileIndex import FileIndex
 from myutility.images.Image import Image
 from myutility.images.Images import Images
 from myutility.myfsl.utils.run import rrun
 from subject.SubjectDti import SubjectDti
 from subject.SubjectEpi import SubjectEpi
 from subject.SubjectMpr import SubjectMpr
+from subject.SubjectPipeline import SubjectPipeline
 from subject.SubjectTransforms import SubjectTransforms
 from myutility.myfsl.fslfun import runsystem
 from myutility.fileutilities import extractall_zip, sed_inplace
 
 
+class subject_path:
+    """
+    A Subject attribute (a path, an Image, a label...) computed on first access and cached in the instance.
+    Session dependent attributes are discarded when the session changes (set_properties), the others (templates) when templates change.
+    Assigning the attribute overrides the computed value.
+    """
+    __slots__ = ("func", "name", "session")
+
+    def __init__(self, func, session:bool=True):
+        self.func       = func
+        self.session    = session
+        self.name       = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        cache = obj._paths if self.session else obj._templates
+        try:
+            return cache[self.name]
+        except KeyError:
+            value = cache[self.name] = self.func(obj)
+            return value
+
+    def __set__(self, obj, value):
+        (obj._paths if self.session else obj._templates)[self.name] = value
+
+
 class Subject:
     """
     This class contains all the necessary information and methods for a single subject.
@@ -36,6 +67,239 @@ class Subject:
     TYPE_DTI_B0 = 5     # does not have bval/bvec
     TYPE_T2 = 6
 
+    # instances only store these attributes, all the paths below are computed when first accessed (see subject_path)
+    __slots__ = ("label", "sessid", "project", "_global", "fsl_dir", "fsl_bin", "fsl_data_std_dir", "project_subjects_dir",
+                 "DCM2NII_IMAGE_FORMATS", "std_img_label", "dir", "_paths", "_templates")
+
+    # ------------------------------------------------------------------------------------------------------------------------
+    # processing classes
+    # ------------------------------------------------------------------------------------------------------------------------
+    transform   = subject_path(lambda s: SubjectTransforms(s, s._global))
+    mpr         = subject_path(lambda s: SubjectMpr(s, s._global))
+    dti         = subject_path(lambda s: SubjectDti(s, s._global))
+    epi         = subject_path(lambda s: SubjectEpi(s, s._global))
+
+    # ------------------------------------------------------------------------------------------------------------------------
+    # templates (default ones, custom templates are assigned by set_templates)
+    # ------------------------------------------------------------------------------------------------------------------------
+    std_img             = subject_path(lambda s: Image(s._global.fsl_std_mni_2mm_brain), session=False)
+    std_head_img        = subject_path(lambda s: Image(s._global.fsl_std_mni_2mm_head), session=False)
+    std_img_mask_dil    = subject_path(lambda s: Image(s._global.fsl_std_mni_2mm_brain_mask_dil), session=False)
+
+    std4_img            = subject_path(lambda s: Image(s._global.fsl_std_mni_4mm_brain), session=False)
+    std4_head_img       = subject_path(lambda s: Image(s._global.fsl_std_mni_4mm_head), session=False)
+    std4_img_mask_dil   = subject_path(lambda s: Image(s._global.fsl_std_mni_4mm_brain_mask_dil), session=False)
+
+    # ------------------------------------------------------------------------------------------------------------------------
+    # session paths (relative to self.dir)
+    # ------------------------------------------------------------------------------------------------------------------------
+
+    roi_dir        = subject_path(lambda s: os.path.join(s.dir, "roi"))
+    roi_t1_dir     = subject_path(lambda s: os.path.join(s.roi_dir, "reg_t1"))
+    roi_rs_dir     = subject_path(lambda s: os.path.join(s.roi_dir, "reg_rs"))
+    roi_fmri_dir   = subject_path(lambda s: os.path.join(s.roi_dir, "reg_fmri"))
+    roi_dti_dir    = subject_path(lambda s: os.path.join(s.roi_dir, "reg_dti"))
+    roi_t2_dir     = subject_path(lambda s: os.path.join(s.roi_dir, "reg_t2"))
+
+    roi_std_dir    = subject_path(lambda s: os.path.join(s.roi_dir, "reg_" + s.std_img_label))
+    roi_std4_dir   = subject_path(lambda s: os.path.join(s.roi_dir, "reg_" + s.std_img_label + "4"))
+
+    # ------------------------------------------------------------------------------------------------------------------------
+    # T1/MPR
+    # ------------------------------------------------------------------------------------------------------------------------
+    t1_image_label = subject_path(lambda s: s.label + "-t1")
+
+    t1_dir         = subject_path(lambda s: os.path.join(s.dir, "mpr"))
+    t1_anat_dir    = subject_path(lambda s: os.path.join(s.t1_dir, "anat"))
+    fast_dir       = subject_path(lambda s: os.path.join(s.t1_dir, "fast"))
+    first_dir      = subject_path(lambda s: os.path.join(s.t1_dir, "first"))
+    sienax_dir     = subject_path(lambda s: os.path.join(s.t1_dir, "sienax"))
+    t1_fs_dir      = subject_path(lambda s: os.path.join(s.t1_dir, "freesurfer"))
+    t1_fs_mri_dir  = subject_path(lambda s: os.path.join(s.t1_fs_dir, "mri"))
+    t1_spm_dir     = subject_path(lambda s: os.path.join(s.t1_dir, "spm"))
+    t1_cat_dir     = subject_path(lambda s: os.path.join(s.t1_dir, "cat"))
+
+    t1_data                = subject_path(lambda s: Image(os.path.join(s.t1_dir, s.t1_image_label)))
+    t1_brain_data          = subject_path(lambda s: Image(os.path.join(s.t1_dir, s.t1_image_label + "_brain")))
+    t1_brain_data_mask     = subject_path(lambda s: Image(os.path.join(s.t1_dir, s.t1_image_label + "_brain_mask")))
+    t1_fs_brainmask_data   = subject_path(lambda s: Image(os.path.join(s.t1_fs_dir, "mri", "brainmask")))
+    t1_fs_data             = subject_path(lambda s: Image(os.path.join(s.t1_fs_dir, "mri", "T1")))  # T1 coronal [1x1x1] after conform
+    t1_fs_aparc_aseg       = subject_path(lambda s: Image(os.path.join(s.t1_fs_dir, "mri", "aparc+aseg.mgz")))  # output of freesurfer
+
+    first_all_none_origsegs = subject_path(lambda s: Image(os.path.join(s.first_dir, s.t1_image_label + "_all_none_origsegs")))
+    first_all_fast_origsegs = subject_path(lambda s: Image(os.path.join(s.first_dir, s.t1_image_label + "_all_fast_origsegs")))
+
+    t1_segment_gm_path         = subject_path(lambda s: Image(os.path.join(s.roi_t1_dir, "mask_t1_gm")))
+    t1_segment_wm_path         = subject_path(lambda s: Image(os.path.join(s.roi_t1_dir, "mask_t1_wm")))
+    t1_segment_csf_path        = subject_path(lambda s: Image(os.path.join(s.roi_t1_dir, "mask_t1_csf")))
+    t1_segment_wm_bbr_path     = subject_path(lambda s: Image(os.path.join(s.roi_t1_dir, "wmseg4bbr")))
+    t1_segment_wm_ero_path     = subject_path(lambda s: Image(os.path.join(s.roi_t1_dir, "mask_t1_wmseg4Nuisance")))
+    t1_segment_csf_ero_path    = subject_path(lambda s: Image(os.path.join(s.roi_t1_dir, "mask_t1_csfseg4Nuisance")))
+
+    t1_cat_mri_dir             = subject_path(lambda s: os.path.join(s.t1_cat_dir, "mri"))
+    t1_cat_surface_dir         = subject_path(lambda s: os.path.join(s.t1_cat_dir, "surf"))
+    t1_cat_surface_resamplefilt= subject_path(lambda s: s._global.cat_smooth_surf)
+    t1_cat_gyrif_resamplefilt  = subject_path(lambda s: s._global.cat_smooth_gyrif)
+    t1_cat_lh_surface          = subject_path(lambda s: Image(os.path.join(s.t1_cat_surface_dir, "lh.thickness.T1_" + s.label)))
+    t1_cat_resampled_surface   = subject_path(lambda s: Image(os.path.join(s.t1_cat_surface_dir, "s" + str(s.t1_cat_surface_resamplefilt) + ".mesh.thickness.resampled_32k.T1_" + s.label + ".gii")))
+    t1_cat_resampled_surface_longitudinal = subject_path(lambda s: Image(os.path.join(s.t1_cat_surface_dir, "s" + str(s.t1_cat_surface_resamplefilt) + ".mesh.thickness.resampled_32k.rT1_" + s.label + ".gii")))
+    t1_cat_lhcentral_image     = subject_path(lambda s: Image(os.path.join(s.t1_cat_surface_dir, "lh.central.T1_" + s.label + ".gii")))
+
+    t1_cat_resampled_gyrific   = subject_path(lambda s: Image(os.path.join(s.t1_cat_surface_dir, "s" + str(s.t1_cat_gyrif_resamplefilt) + ".mesh.gyrification.resampled_32k.T1_" + s.label + ".gii")))
+    t1_cat_resampled_suldepth  = subject_path(lambda s: Image(os.path.join(s.t1_cat_surface_dir, "s" + str(s.t1_cat_surface_resamplefilt) + ".mesh.depth.resampled_32k.T1_" + s.label + ".gii")))
+
+    t1_dartel_c1               = subject_path(lambda s: Image(os.path.join(s.t1_spm_dir, "c1T1_" + s.label)))
+    t1_dartel_rc1              = subject_path(lambda s: Image(os.path.join(s.t1_spm_dir, "rc1T1_" + s.label)))
+    t1_dartel_rc2              = subject_path(lambda s: Image(os.path.join(s.t1_spm_dir, "rc2T1_" + s.label)))
+
+    t1_spm_icv_file = subject_path(lambda s: os.path.join(s.t1_spm_dir, "icv_" + s.label + ".dat"))
+
+    # ------------------------------------------------------------------------------------------------------------------------
+    # DTI
+    # ------------------------------------------------------------------------------------------------------------------------
+    dti_image_label    = subject_path(lambda s: s.label + "-dti")
+    dti_ec_image_label = subject_path(lambda s: s.dti_image_label + "_ec")
+    dti_fit_label      = subject_path(lambda s: s.dti_image_label + "_fit")
+
+    dti_dir            = subject_path(lambda s: os.path.join(s.dir, "dti"))
+    dti_bedpostX_dir   = subject_path(lambda s: os.path.join(s.dti_dir, "bedpostx"))
+    dti_probtrackx_dir = subject_path(lambda s: os.path.join(s.dti_dir, "probtrackx"))
+    trackvis_dir       = subject_path(lambda s: os.path.join(s.dti_dir, "trackvis"))
+    tv_matrices_dir    = subject_path(lambda s: os.path.join(s.dti_dir, "tv_matrices"))
+    dti_xtract_dir     = subject_path(lambda s: os.path.join(s.dti_dir, "xtract"))
+    dti_blueprint_dir  = subject_path(lambda s: os.path.join(s.dti_dir, "blueprint"))
+
+    dti_bval           = subject_path(lambda s: os.path.join(s.dti_dir, s.label + "-dti.bval"))
+    dti_bvec           = subject_path(lambda s: os.path.join(s.dti_dir, s.label + "-dti.bvec"))
+    dti_rotated_bvec   = subject_path(lambda s: os.path.join(s.dti_dir, s.label + "-dti_rotated.bvec"))
+    dti_eddyrotated_bvec = subject_path(lambda s: os.path.join(s.dti_dir, s.label + "-dti_ec.eddy_rotated_bvecs"))
+
+    dti_data           = subject_path(lambda s: Image(os.path.join(s.dti_dir, s.dti_image_label)))
+    dti_pa_data        = subject_path(lambda s: Image(os.path.join(s.dti_dir, s.dti_image_label + "_PA")))
+    dti_ec_data        = subject_path(lambda s: Image(os.path.join(s.dti_dir, s.dti_ec_image_label)))
+    dti_fit_data       = subject_path(lambda s: Image(os.path.join(s.dti_dir, s.dti_fit_label)))
+
+    dti_dsi_dir        = subject_path(lambda s: os.path.join(s.dir, "dti", "dsi"))
+    dti_dsi_data       = subject_path(lambda s: Image(os.path.join(s.dti_dsi_dir, s.dti_image_label + ".src.gz")))
+
+    dti_nodiff_data            = subject_path(lambda s: Image(os.path.join(s.roi_dti_dir, "nodif")))
+    dti_nodiff_brain_data      = subject_path(lambda s: Image(os.path.join(s.roi_dti_dir, "nodif_brain")))
+    dti_nodiff_brainmask_data  = subject_path(lambda s: Image(os.path.join(s.roi_dti_dir, "nodif_brain_mask")))
+
+    dti_fit_FA                 = subject_path(lambda s: Image(os.path.join(s.dti_dir, s.dti_fit_label + "_FA")))
+    dti_fit_MD                 = subject_path(lambda s: Image(os.path.join(s.dti_dir, s.dti_fit_label + "_MD")))
+    dti_fit_L1                 = subject_path(lambda s: Image(os.path.join(s.dti_dir, s.dti_fit_label + "_L1")))
+    dti_fit_L23                = subject_path(lambda s: Image(os.path.join(s.dti_dir, s.dti_fit_label + "_L23")))
+
+    dti_bedpostx_mean_S0_label = subject_path(lambda s: "mean_S0samples")
+
+    trackvis_transposed_bvecs = subject_path(lambda s: "bvec_vert.txt")
+
+    # ------------------------------------------------------------------------------------------------------------------------
+    # RS
+    # ------------------------------------------------------------------------------------------------------------------------
+    rs_image_label = subject_path(lambda s: s.label + "-rs")
+
+    rs_dir         = subject_path(lambda s: os.path.join(s.dir, "resting"))
+    rs_data        = subject_path(lambda s: Image(os.path.join(s.rs_dir, s.rs_image_label)))
+    rs_data_dist   = subject_path(lambda s: Image(os.path.join(s.rs_dir, s.rs_image_label + "_distorted")))
+    rs_pa_data     = subject_path(lambda s: Image(os.path.join(s.rs_dir, s.rs_image_label + "_PA")))
+    rs_pa_data2    = subject_path(lambda s: Image(os.path.join(s.rs_dir, s.rs_image_label + "_PA2")))
+
+    sbfc_dir           = subject_path(lambda s: os.path.join(s.rs_dir,     "sbfc"))
+    rs_series_dir      = subject_path(lambda s: os.path.join(s.sbfc_dir,   "series"))
+    sbfc_feat_dir      = subject_path(lambda s: os.path.join(s.sbfc_dir,   "feat"))
+
+    rs_melic_dir       = subject_path(lambda s: os.path.join(s.rs_dir, "melic"))
+    rs_default_mel_dir = subject_path(lambda s: os.path.join(s.rs_dir, "postmel.ica"))
+
+    rs_examplefunc         = subject_path(lambda s: Image(os.path.join(s.roi_rs_dir, "example_func")))
+    rs_examplefunc_mask    = subject_path(lambda s: Image(os.path.join(s.roi_rs_dir, "mask_example_func")))
+
+    rs_series_csf          = subject_path(lambda s: os.path.join(s.rs_series_dir, "csf_ts"))
+    rs_series_wm           = subject_path(lambda s: os.path.join(s.rs_series_dir, "wm_ts"))
+
+    rs_final_regstd_dir    = subject_path(lambda s: os.path.join(s.rs_dir, "reg_" + s.std_img_label))
+
+    rs_final_regstd_image      = subject_path(lambda s: Image(os.path.join(s.rs_final_regstd_dir, "filtered_func_data")))  # image after first preprocessing, aroma and nuisance regression.
+    rs_final_regstd_mask       = subject_path(lambda s: Image(os.path.join(s.rs_final_regstd_dir, "mask")))  # image after first preprocessing, aroma and nuisance regression.
+    rs_final_regstd_bgimage    = subject_path(lambda s: Image(os.path.join(s.rs_final_regstd_dir, "bg_image")))  # image after first preprocessing, aroma and nuisance regression.
+
+    rs_post_preprocess_image_label         = subject_path(lambda s: s.rs_image_label + "_preproc")
+    rs_post_aroma_image_label              = subject_path(lambda s: s.rs_image_label + "_preproc_aroma")
+    rs_post_nuisance_image_label           = subject_path(lambda s: s.rs_image_label + "_preproc_aroma_nuisance")
+    rs_post_nuisance_melodic_image_label   = subject_path(lambda s: s.rs_image_label + "_preproc_aroma_nuisance_melodic")
+
+    rs_aroma_dir           = subject_path(lambda s: os.path.join(s.rs_dir, "ica_aroma"))
+    rs_fix_dir             = subject_path(lambda s: os.path.join(s.rs_dir, "fix"))
+    rs_aroma_image         = subject_path(lambda s: Image(os.path.join(s.rs_aroma_dir, "denoised_func_data_nonaggr")))
+    rs_regstd_aroma_dir    = subject_path(lambda s: os.path.join(s.rs_aroma_dir, "reg_standard"))
+    rs_regstd_aroma_image  = subject_path(lambda s: Image(os.path.join(s.rs_regstd_aroma_dir, "filtered_func_data")))
+
+    rs_mask_t1_wmseg4nuis  = subject_path(lambda s: Image(os.path.join(s.roi_dir, "reg_rs", "mask_t1_wmseg4Nuisance_rs")))
+    rs_mask_t1_csfseg4nuis = subject_path(lambda s: Image(os.path.join(s.roi_dir, "reg_rs", "mask_t1_csfseg4Nuisance_rs")))
+
+    # self.rs_post_nuisance_std4_image_label          = self.rs_image_label + "_preproc_aroma_nuisance_std4"
+    # self.rs_post_nuisance_melodic_std4_image_label  = self.rs_image_label + "_preproc_aroma_nuisance_melodic_std4"
+    # self.rs_regstd_dir              = os.path.join(self.rs_dir, "resting.ica", "reg_std")
+    # self.rs_regstd_image            = os.path.join(self.rs_regstd_dir, "filtered_func_data")
+    # self.rs_regstd_denoise_dir      = os.path.join(self.rs_dir, "resting.ica", "reg_std_denoised")
+    # self.rs_regstd_denoise_image    = os.path.join(self.rs_regstd_denoise_dir, "filtered_func_data")
+
+    # self.mc_params_dir  = os.path.join(self.rs_dir, self.rs_image_label + ".ica", "mc")
+    # self.mc_abs_displ   = os.path.join(self.mc_params_dir, "prefiltered_func_data_mcf_abs_mean.rms")
+    # self.mc_rel_displ   = os.path.join(self.mc_params_dir, "prefiltered_func_data_mcf_rel_mean.rms")
+
+    # ------------------------------------------------------------------------------------------------------------------------
+    # fMRI
+    # ------------------------------------------------------------------------------------------------------------------------
+    fmri_image_label = subject_path(lambda s: s.label + "-fmri")
+
+    fmri_dir       = subject_path(lambda s: os.path.join(s.dir, "fmri"))
+    fmri_data      = subject_path(lambda s: Image(os.path.join(s.fmri_dir, s.fmri_image_label)))
+    fmri_pa_data   = subject_path(lambda s: Image(os.path.join(s.fmri_dir, s.fmri_image_label + "_PA")))
+    fmri_pa_data2  = subject_path(lambda s: Image(os.path.join(s.fmri_dir, s.fmri_image_label + "_PA2")))
+
+    fmri_data_mc           = subject_path(lambda s: Image(os.path.join(s.fmri_dir, "ra" + s.fmri_image_label)))   # assumes motion correction after slice timings
+
+    fmri_examplefunc       = subject_path(lambda s: Image(os.path.join(s.roi_fmri_dir, "example_func")))
+    fmri_examplefunc_mask  = subject_path(lambda s: Image(os.path.join(s.roi_fmri_dir, "mask_example_func")))
+
+    fmri_aroma_dir             = subject_path(lambda s: os.path.join(s.fmri_dir, "ica_aroma"))
+    fmri_icafix_dir            = subject_path(lambda s: os.path.join(s.fmri_dir, "ica_fix"))
+    fmri_aroma_image           = subject_path(lambda s: Image(os.path.join(s.fmri_aroma_dir, "denoised_func_data_nonaggr")))
+    fmri_regstd_aroma_dir      = subject_path(lambda s: os.path.join(s.fmri_aroma_dir, "reg_standard"))
+    fmri_regstd_aroma_image    = subject_path(lambda s: Image(os.path.join(s.fmri_regstd_aroma_dir, "filtered_func_data")))
+    fmri_stats_dir             = subject_path(lambda s: os.path.join(s.fmri_dir, "stats"))
+
+    fmri_logs_dir              = subject_path(lambda s: os.path.join(s.project.script_dir, "fmri", "logs"))
+    # ------------------------------------------------------------------------------------------------------------------------
+    # WB
+    # ------------------------------------------------------------------------------------------------------------------------
+    wb_image_label = subject_path(lambda s: s.label + "-wb_epi")
+
+    wb_dir         = subject_path(lambda s: os.path.join(s.dir, "wb"))
+    wb_data        = subject_path(lambda s: Image(os.path.join(s.wb_dir, s.wb_image_label)))
+    wb_brain_data  = subject_path(lambda s: Image(os.path.join(s.wb_dir, s.wb_image_label + "_brain")))
+
+    # ------------------------------------------------------------------------------------------------------------------------
+    # T2
+    # ------------------------------------------------------------------------------------------------------------------------
+    t2_image_label = subject_path(lambda s: s.label + "-t2")
+
+    t2_dir         = subject_path(lambda s: os.path.join(s.dir, "t2"))
+    t2_data        = subject_path(lambda s: Image(os.path.join(s.t2_dir, s.t2_image_label)))
+    t2_brain_data  = subject_path(lambda s: Image(os.path.join(s.t2_dir, s.t2_image_label + "_brain")))
+
+    # ------------------------------------------------------------------------------------------------------------------------
+    # DE
+    # ------------------------------------------------------------------------------------------------------------------------
+    de_image_label = subject_path(lambda s: s.label + "-de")
+    de_dir         = subject_path(lambda s: os.path.join(s.dir, "de"))
+    de_data        = subject_path(lambda s: Image(os.path.join(s.de_dir, s.de_image_label)))
+    de_brain_data  = subject_path(lambda s: Image(os.path.join(s.de_dir, s.de_image_label + "_brain")))
+
+
     def __init__(self, label:str, project:'Project', sessid:int=1, stdimg:str=""):
         """
         Initialize a new Subject object.
@@ -60,17 +324,15 @@ class Subject:
 
         self.DCM2NII_IMAGE_FORMATS = [".nii", ".nii.gz", ".hdr", ".hdr.gz", ".img", ".img.gz"]
 
+        self._paths     = {}
+        self._templates = {}
+
         self.set_templates(stdimg)
         self.set_properties(self.sessid)
 
-        self.transform:SubjectTransforms    = SubjectTransforms(self, self._global)
-        self.mpr:SubjectMpr                 = SubjectMpr(self, self._global)
-        self.dti:SubjectDti                 = SubjectDti(self, self._global)
-        self.epi:SubjectEpi                 = SubjectEpi(self, self._global)
-
     @property
     def exist(self):
-        return os.path.exists(self.dir)
+        return FileIndex.exists(self.dir)
 
     def hasSeq(self, _type:str, images_labels:List[str]=None):
         """
@@ -188,7 +450,7 @@ class Subject:
         Set the properties for a specific session.
         it has two usages:
         1) rollback=False (DEFAULT) : to create filesystem names at startup         => returns : self  (TODO: doubt, alternatively may always return a deepcopy)
-        2) rollback=True            : to get a copy with names of another session   => returns : deepcopy(self)
+        2) rollback=True            : to get a copy with names of another session   => returns : session_view(sess), self is not modified
 
         Args:
             sess (int): The session ID.
@@ -198,221 +460,34 @@ class Subject:
         Returns:
             Subject: A copy of the subject object with the properties set for the specified session.
         """
+        if rollback:
+            return self.session_view(sess)                  # returns a new instance with given sessid
+
         self.dir            = os.path.join(self.project.subjects_dir, self.label, "s" + str(sess))
+        self._paths         = {}        # all the other paths (and processing classes) are recomputed, for the new session, on access
 
-        self.roi_dir        = os.path.join(self.dir, "roi")
-        self.roi_t1_dir     = os.path.join(self.roi_dir, "reg_t1")
-        self.roi_rs_dir     = os.path.join(self.roi_dir, "reg_rs")
-        self.roi_fmri_dir   = os.path.join(self.roi_dir, "reg_fmri")
-        self.roi_dti_dir    = os.path.join(self.roi_dir, "reg_dti")
-        self.roi_t2_dir     = os.path.join(self.roi_dir, "reg_t2")
-
-        self.roi_std_dir    = os.path.join(self.roi_dir, "reg_" + self.std_img_label)
-        self.roi_std4_dir   = os.path.join(self.roi_dir, "reg_" + self.std_img_label + "4")
-
-        # ------------------------------------------------------------------------------------------------------------------------
-        # T1/MPR
-        # ------------------------------------------------------------------------------------------------------------------------
-        self.t1_image_label = self.label + "-t1"
-
-        self.t1_dir         = os.path.join(self.dir, "mpr")
-        self.t1_anat_dir    = os.path.join(self.t1_dir, "anat")
-        self.fast_dir       = os.path.join(self.t1_dir, "fast")
-        self.first_dir      = os.path.join(self.t1_dir, "first")
-        self.sienax_dir     = os.path.join(self.t1_dir, "sienax")
-        self.t1_fs_dir      = os.path.join(self.t1_dir, "freesurfer")
-        self.t1_fs_mri_dir  = os.path.join(self.t1_fs_dir, "mri")
-        self.t1_spm_dir     = os.path.join(self.t1_dir, "spm")
-        self.t1_cat_dir     = os.path.join(self.t1_dir, "cat")
-
-        self.t1_data                = Image(os.path.join(self.t1_dir, self.t1_image_label))
-        self.t1_brain_data          = Image(os.path.join(self.t1_dir, self.t1_image_label + "_brain"))
-        self.t1_brain_data_mask     = Image(os.path.join(self.t1_dir, self.t1_image_label + "_brain_mask"))
-        self.t1_fs_brainmask_data   = Image(os.path.join(self.t1_fs_dir, "mri", "brainmask"))
-        self.t1_fs_data             = Image(os.path.join(self.t1_fs_dir, "mri", "T1"))  # T1 coronal [1x1x1] after conform
-        self.t1_fs_aparc_aseg       = Image(os.path.join(self.t1_fs_dir, "mri", "aparc+aseg.mgz"))  # output of freesurfer
-
-        self.first_all_none_origsegs = Image(os.path.join(self.first_dir, self.t1_image_label + "_all_none_origsegs"))
-        self.first_all_fast_origsegs = Image(os.path.join(self.first_dir, self.t1_image_label + "_all_fast_origsegs"))
-
-        self.t1_segment_gm_path         = Image(os.path.join(self.roi_t1_dir, "mask_t1_gm"))
-        self.t1_segment_wm_path         = Image(os.path.join(self.roi_t1_dir, "mask_t1_wm"))
-        self.t1_segment_csf_path        = Image(os.path.join(self.roi_t1_dir, "mask_t1_csf"))
-        self.t1_segment_wm_bbr_path     = Image(os.path.join(self.roi_t1_dir, "wmseg4bbr"))
-        self.t1_segment_wm_ero_path     = Image(os.path.join(self.roi_t1_dir, "mask_t1_wmseg4Nuisance"))
-        self.t1_segment_csf_ero_path    = Image(os.path.join(self.roi_t1_dir, "mask_t1_csfseg4Nuisance"))
-
-        self.t1_cat_mri_dir             = os.path.join(self.t1_cat_dir, "mri")
-        self.t1_cat_surface_dir         = os.path.join(self.t1_cat_dir, "surf")
-        self.t1_cat_surface_resamplefilt= self._global.cat_smooth_surf
-        self.t1_cat_gyrif_resamplefilt  = self._global.cat_smooth_gyrif
-        self.t1_cat_lh_surface          = Image(os.path.join(self.t1_cat_surface_dir, "lh.thickness.T1_" + self.label))
-        self.t1_cat_resampled_surface   = Image(os.path.join(self.t1_cat_surface_dir, "s" + str(self.t1_cat_surface_resamplefilt) + ".mesh.thickness.resampled_32k.T1_" + self.label + ".gii"))
-        self.t1_cat_resampled_surface_longitudinal = Image(os.path.join(self.t1_cat_surface_dir, "s" + str(self.t1_cat_surface_resamplefilt) + ".mesh.thickness.resampled_32k.rT1_" + self.label + ".gii"))
-        self.t1_cat_lhcentral_image     = Image(os.path.join(self.t1_cat_surface_dir, "lh.central.T1_" + self.label + ".gii"))
-
-        self.t1_cat_resampled_gyrific   = Image(os.path.join(self.t1_cat_surface_dir, "s" + str(self.t1_cat_gyrif_resamplefilt) + ".mesh.gyrification.resampled_32k.T1_" + self.label + ".gii"))
-        self.t1_cat_resampled_suldepth  = Image(os.path.join(self.t1_cat_surface_dir, "s" + str(self.t1_cat_surface_resamplefilt) + ".mesh.depth.resampled_32k.T1_" + self.label + ".gii"))
-
-        self.t1_dartel_c1               = Image(os.path.join(self.t1_spm_dir, "c1T1_" + self.label))
-        self.t1_dartel_rc1              = Image(os.path.join(self.t1_spm_dir, "rc1T1_" + self.label))
-        self.t1_dartel_rc2              = Image(os.path.join(self.t1_spm_dir, "rc2T1_" + self.label))
-
-        self.t1_spm_icv_file = os.path.join(self.t1_spm_dir, "icv_" + self.label + ".dat")
-
-        # ------------------------------------------------------------------------------------------------------------------------
-        # DTI
-        # ------------------------------------------------------------------------------------------------------------------------
-        self.dti_image_label    = self.label + "-dti"
-        self.dti_ec_image_label = self.dti_image_label + "_ec"
-        self.dti_fit_label      = self.dti_image_label + "_fit"
-
-        self.dti_dir            = os.path.join(self.dir, "dti")
-        self.dti_bedpostX_dir   = os.path.join(self.dti_dir, "bedpostx")
-        self.dti_probtrackx_dir = os.path.join(self.dti_dir, "probtrackx")
-        self.trackvis_dir       = os.path.join(self.dti_dir, "trackvis")
-        self.tv_matrices_dir    = os.path.join(self.dti_dir, "tv_matrices")
-        self.dti_xtract_dir     = os.path.join(self.dti_dir, "xtract")
-        self.dti_blueprint_dir  = os.path.join(self.dti_dir, "blueprint")
-
-        self.dti_bval           = os.path.join(self.dti_dir, self.label + "-dti.bval")
-        self.dti_bvec           = os.path.join(self.dti_dir, self.label + "-dti.bvec")
-        self.dti_rotated_bvec   = os.path.join(self.dti_dir, self.label + "-dti_rotated.bvec")
-        self.dti_eddyrotated_bvec = os.path.join(self.dti_dir, self.label + "-dti_ec.eddy_rotated_bvecs")
-
-        self.dti_data           = Image(os.path.join(self.dti_dir, self.dti_image_label))
-        self.dti_pa_data        = Image(os.path.join(self.dti_dir, self.dti_image_label + "_PA"))
-        self.dti_ec_data        = Image(os.path.join(self.dti_dir, self.dti_ec_image_label))
-        self.dti_fit_data       = Image(os.path.join(self.dti_dir, self.dti_fit_label))
-
-        self.dti_dsi_dir        = os.path.join(self.dir, "dti", "dsi")
-        self.dti_dsi_data       = Image(os.path.join(self.dti_dsi_dir, self.dti_image_label + ".src.gz"))
-
-        self.dti_nodiff_data            = Image(os.path.join(self.roi_dti_dir, "nodif"))
-        self.dti_nodiff_brain_data      = Image(os.path.join(self.roi_dti_dir, "nodif_brain"))
-        self.dti_nodiff_brainmask_data  = Image(os.path.join(self.roi_dti_dir, "nodif_brain_mask"))
-
-        self.dti_fit_FA                 = Image(os.path.join(self.dti_dir, self.dti_fit_label + "_FA"))
-        self.dti_fit_MD                 = Image(os.path.join(self.dti_dir, self.dti_fit_label + "_MD"))
-        self.dti_fit_L1                 = Image(os.path.join(self.dti_dir, self.dti_fit_label + "_L1"))
-        self.dti_fit_L23                = Image(os.path.join(self.dti_dir, self.dti_fit_label + "_L23"))
-
-        self.dti_bedpostx_mean_S0_label = "mean_S0samples"
-
-        self.trackvis_transposed_bvecs = "bvec_vert.txt"
-
-        # ------------------------------------------------------------------------------------------------------------------------
-        # RS
-        # ------------------------------------------------------------------------------------------------------------------------
-        self.rs_image_label = self.label + "-rs"
-
-        self.rs_dir         = os.path.join(self.dir, "resting")
-        self.rs_data        = Image(os.path.join(self.rs_dir, self.rs_image_label))
-        self.rs_data_dist   = Image(os.path.join(self.rs_dir, self.rs_image_label + "_distorted"))
-        self.rs_pa_data     = Image(os.path.join(self.rs_dir, self.rs_image_label + "_PA"))
-        self.rs_pa_data2    = Image(os.path.join(self.rs_dir, self.rs_image_label + "_PA2"))
-
-        self.sbfc_dir           = os.path.join(self.rs_dir,     "sbfc")
-        self.rs_series_dir      = os.path.join(self.sbfc_dir,   "series")
-        self.sbfc_feat_dir      = os.path.join(self.sbfc_dir,   "feat")
-
-        self.rs_melic_dir       = os.path.join(self.rs_dir, "melic")
-        self.rs_default_mel_dir = os.path.join(self.rs_dir, "postmel.ica")
-
-        self.rs_examplefunc         = Image(os.path.join(self.roi_rs_dir, "example_func"))
-        self.rs_examplefunc_mask    = Image(os.path.join(self.roi_rs_dir, "mask_example_func"))
-
-        self.rs_series_csf          = os.path.join(self.rs_series_dir, "csf_ts")
-        self.rs_series_wm           = os.path.join(self.rs_series_dir, "wm_ts")
-
-        self.rs_final_regstd_dir    = os.path.join(self.rs_dir, "reg_" + self.std_img_label)
-
-        self.rs_final_regstd_image      = Image(os.path.join(self.rs_final_regstd_dir, "filtered_func_data"))  # image after first preprocessing, aroma and nuisance regression.
-        self.rs_final_regstd_mask       = Image(os.path.join(self.rs_final_regstd_dir, "mask"))  # image after first preprocessing, aroma and nuisance regression.
-        self.rs_final_regstd_bgimage    = Image(os.path.join(self.rs_final_regstd_dir, "bg_image"))  # image after first preprocessing, aroma and nuisance regression.
-
-        self.rs_post_preprocess_image_label         = self.rs_image_label + "_preproc"
-        self.rs_post_aroma_image_label              = self.rs_image_label + "_preproc_aroma"
-        self.rs_post_nuisance_image_label           = self.rs_image_label + "_preproc_aroma_nuisance"
-        self.rs_post_nuisance_melodic_image_label   = self.rs_image_label + "_preproc_aroma_nuisance_melodic"
-
-        self.rs_aroma_dir           = os.path.join(self.rs_dir, "ica_aroma")
-        self.rs_fix_dir             = os.path.join(self.rs_dir, "fix")
-        self.rs_aroma_image         = Image(os.path.join(self.rs_aroma_dir, "denoised_func_data_nonaggr"))
-        self.rs_regstd_aroma_dir    = os.path.join(self.rs_aroma_dir, "reg_standard")
-        self.rs_regstd_aroma_image  = Image(os.path.join(self.rs_regstd_aroma_dir, "filtered_func_data"))
-
-        self.rs_mask_t1_wmseg4nuis  = Image(os.path.join(self.roi_dir, "reg_rs", "mask_t1_wmseg4Nuisance_rs"))
-        self.rs_mask_t1_csfseg4nuis = Image(os.path.join(self.roi_dir, "reg_rs", "mask_t1_csfseg4Nuisance_rs"))
-
-        # self.rs_post_nuisance_std4_image_label          = self.rs_image_label + "_preproc_aroma_nuisance_std4"
-        # self.rs_post_nuisance_melodic_std4_image_label  = self.rs_image_label + "_preproc_aroma_nuisance_melodic_std4"
-        # self.rs_regstd_dir              = os.path.join(self.rs_dir, "resting.ica", "reg_std")
-        # self.rs_regstd_image            = os.path.join(self.rs_regstd_dir, "filtered_func_data")
-        # self.rs_regstd_denoise_dir      = os.path.join(self.rs_dir, "resting.ica", "reg_std_denoised")
-        # self.rs_regstd_denoise_image    = os.path.join(self.rs_regstd_denoise_dir, "filtered_func_data")
-
-        # self.mc_params_dir  = os.path.join(self.rs_dir, self.rs_image_label + ".ica", "mc")
-        # self.mc_abs_displ   = os.path.join(self.mc_params_dir, "prefiltered_func_data_mcf_abs_mean.rms")
-        # self.mc_rel_displ   = os.path.join(self.mc_params_dir, "prefiltered_func_data_mcf_rel_mean.rms")
-
-        # ------------------------------------------------------------------------------------------------------------------------
-        # fMRI
-        # ------------------------------------------------------------------------------------------------------------------------
-        self.fmri_image_label = self.label + "-fmri"
-
-        self.fmri_dir       = os.path.join(self.dir, "fmri")
-        self.fmri_data      = Image(os.path.join(self.fmri_dir, self.fmri_image_label))
-        self.fmri_pa_data   = Image(os.path.join(self.fmri_dir, self.fmri_image_label + "_PA"))
-        self.fmri_pa_data2  = Image(os.path.join(self.fmri_dir, self.fmri_image_label + "_PA2"))
-
-        self.fmri_data_mc           = Image(os.path.join(self.fmri_dir, "ra" + self.fmri_image_label))   # assumes motion correction after slice timings
-
-        self.fmri_examplefunc       = Image(os.path.join(self.roi_fmri_dir, "example_func"))
-        self.fmri_examplefunc_mask  = Image(os.path.join(self.roi_fmri_dir, "mask_example_func"))
-
-        self.fmri_aroma_dir             = os.path.join(self.fmri_dir, "ica_aroma")
-        self.fmri_icafix_dir            = os.path.join(self.fmri_dir, "ica_fix")
-        self.fmri_aroma_image           = Image(os.path.join(self.fmri_aroma_dir, "denoised_func_data_nonaggr"))
-        self.fmri_regstd_aroma_dir      = os.path.join(self.fmri_aroma_dir, "reg_standard")
-        self.fmri_regstd_aroma_image    = Image(os.path.join(self.fmri_regstd_aroma_dir, "filtered_func_data"))
-        self.fmri_stats_dir             = os.path.join(self.fmri_dir, "stats")
-
-        self.fmri_logs_dir              = os.path.join(self.project.script_dir, "fmri", "logs")
-        # ------------------------------------------------------------------------------------------------------------------------
-        # WB
-        # ------------------------------------------------------------------------------------------------------------------------
-        self.wb_image_label = self.label + "-wb_epi"
-
-        self.wb_dir         = os.path.join(self.dir, "wb")
-        self.wb_data        = Image(os.path.join(self.wb_dir, self.wb_image_label))
-        self.wb_brain_data  = Image(os.path.join(self.wb_dir, self.wb_image_label + "_brain"))
-
-        # ------------------------------------------------------------------------------------------------------------------------
-        # T2
-        # ------------------------------------------------------------------------------------------------------------------------
-        self.t2_image_label = self.label + "-t2"
-
-        self.t2_dir         = os.path.join(self.dir, "t2")
-        self.t2_data        = Image(os.path.join(self.t2_dir, self.t2_image_label))
-        self.t2_brain_data  = Image(os.path.join(self.t2_dir, self.t2_image_label + "_brain"))
-
-        # ------------------------------------------------------------------------------------------------------------------------
-        # DE
-        # ------------------------------------------------------------------------------------------------------------------------
-        self.de_image_label = self.label + "-de"
-        self.de_dir         = os.path.join(self.dir, "de")
-        self.de_data        = Image(os.path.join(self.de_dir, self.de_image_label))
-        self.de_brain_data  = Image(os.path.join(self.de_dir, self.de_image_label + "_brain"))
-
-        # ------------------------------------------------------------------------------------------------------------------------
-        if rollback:
-            self_copy = deepcopy(self)                      # get a deep copy of self with given sessid
-            self.set_properties(self.sessid, False) # restore previous self.sessid
-            return self_copy                                # returns deepcopy of instance with given sessid
-        else:
-            self.sessid = sess                              # returns reference of new instance
-            return self
+        self.sessid = sess                                  # returns reference of new instance
+        return self
+
+    def session_view(self, sess:int=None) -> Subject:
+        """
+        Get an independent Subject instance of the given session (by default the current one) of this subject.
+        The view shares project, global data and templates with self (they do not depend on the session) instead of copying them,
+        and its paths are computed on access, thus its cost does not depend on the project size.
+
+        Args:
+            sess (int, optional): The session ID. Defaults to the current session.
+
+        Returns:
+            Subject: A new Subject instance with the properties set for the specified session.
+        """
+        view = Subject.__new__(Subject)
+        for attr in ("label", "project", "_global", "fsl_dir", "fsl_bin", "fsl_data_std_dir", "project_subjects_dir", "std_img_label"):
+            setattr(view, attr, getattr(self, attr))
+
+        view.DCM2NII_IMAGE_FORMATS  = list(self.DCM2NII_IMAGE_FORMATS)
+        view._templates             = dict(self._templates)
+        return view.set_properties(self.sessid if sess is None else sess)
 
     def set_templates(self, stdimg:str=""):
         """
@@ -429,17 +504,12 @@ class Subject:
             If the given custom standard image does not exist.
 
         """
-        if stdimg == "":
+        self._templates = {}
+        self._paths     = {}    # some paths depend on std_img_label
 
+        if stdimg == "":
+            # default templates images are created on access
             self.std_img_label = "std"
-
-            self.std_img            = Image(self._global.fsl_std_mni_2mm_brain)
-            self.std_head_img       = Image(self._global.fsl_std_mni_2mm_head)
-            self.std_img_mask_dil   = Image(self._global.fsl_std_mni_2mm_brain_mask_dil)
-
-            self.std4_img           = Image(self._global.fsl_std_mni_4mm_brain)
-            self.std4_head_img      = Image(self._global.fsl_std_mni_4mm_head)
-            self.std4_img_mask_dil  = Image(self._global.fsl_std_mni_4mm_brain_mask_dil)
         else:
 
             # assumes to receive the full path of standard head. e.g. "/.../.../.../pediatric.nii.gz"
@@ -545,28 +615,29 @@ class Subject:
 
         missing_images = []
 
-        if t1:
-            if not self.t1_data.exist:
-                missing_images.append("t1")
+        with FileIndex():
+            if t1:
+                if not self.t1_data.exist:
+                    missing_images.append("t1")
 
-        if rs:
-            if not self.rs_data.exist:
-                missing_images.append("rs")
+            if rs:
+                if not self.rs_data.exist:
+                    missing_images.append("rs")
 
-        if fmri_labels is not None:
+            if fmri_labels is not None:
 
-            for s in fmri_labels:
-                fmri_img = Image(os.path.join(self.fmri_dir, self.label + s))
-                if not fmri_img.exist:
-                    missing_images.append(fmri_img)
+                for s in fmri_labels:
+                    fmri_img = Image(os.path.join(self.fmri_dir, self.label + s))
+                    if not fmri_img.exist:
+                        missing_images.append(fmri_img)
 
-        if dti:
-            if not self.dti_data.exist:
-                missing_images.append("dti")
+            if dti:
+                if not self.dti_data.exist:
+                    missing_images.append("dti")
 
-        if t2:
-            if not self.t2_data.exist:
-                missing_images.append("t2")
+            if t2:
+                if not self.t2_data.exist:
+                    missing_images.append("t2")
 
         if len(missing_images) > 0:
             missing_images.insert(0, "---------------------------------------------------------------> " + self.label)
@@ -1223,6 +1294,241 @@ class Subject:
             if do_fmri and do_rs:       # because the method check for the presence of both images and raises an error if other stuff is missing
                 print("Error in Subject.welcome: transform_extra could not be completed")
 
+    def get_wellcome_pipeline(self, do_overwrite:bool=False,
+                              # T1
+                              odn:str="anat", imgtype:int=1, smooth:int=10,
+                              biascorr_type:int=SubjectMpr.BIAS_TYPE_STRONG,
+                              do_reorient:bool=True, do_crop:bool=True,
+                              do_bet:bool=True, betfparam:list=None,
+                              do_reg:bool=True, do_nonlinreg:bool=True, do_seg:bool=True,
+                              do_cleanup:int=Global.CLEANUP_LVL_MIN,
+                              use_lesionmask:bool=False, lesionmask:str="lesionmask",
+                              # EPI
+                              do_rs:bool=True, do_aroma:bool=True, do_nuisance:bool=True, hpfsec:int=100,
+                              feat_preproc_odn:str="resting", feat_preproc_model:str="singlesubj_feat_preproc_noreg_melodic", do_featinitreg:bool=False,
+                              do_melodic:bool=True, mel_odn:str="postmel", mel_preproc_model:str="singlesubj_melodic_noreg", do_melinitreg:bool=False,
+                              replace_std_filtfun:bool=True,
+                              do_fmri:bool=True, fmri_params:FmriProcParams=None, fmri_labels:List[str]=None,
+                              # DTI
+                              do_dtifit:bool=True, do_pa_eddy:bool=False, do_eddy_gpu:bool=False, do_bedx:bool=False, do_bedx_gpu:bool=False, bedpost_odn:str="bedpostx",
+                              do_xtract:bool=False, xtract_odn:str="xtract", xtract_refspace:str="native", xtract_gpu:bool=False, xtract_meas:str="vol,prob,length,FA,MD,L1,L23"
+                              ) -> SubjectPipeline:
+        """
+        Build the dependency graph of the wellcome pre-processing.
+
+        Each step declares the images it reads and writes and the steps it depends on. T1 anatomical processing, RS FEAT pre-processing,
+        fMRI SPM pre-processing and DTI eddy/dtifit only depend on the raw data, while all the co-registrations (and everything downstream)
+        depend on the T1 registrations. Parameters have the same meaning of those of wellcome, which remains the entry point for the less common
+        options (susceptibility correction, SPM/CAT/freesurfer segmentations, FIRST, sienax, structural connectivity).
+
+        Returns
+        -------
+        SubjectPipeline
+            the graph, to be executed with SubjectPipeline.run
+        """
+        if betfparam is None:
+            betfparam = [0.5]
+
+        BET_F_VALUE_T2      = "0.5"
+        feat_preproc_model  = os.path.join(self.project.script_dir, "glm", "templates", feat_preproc_model)
+        melodic_model       = os.path.join(self.project.script_dir, "glm", "templates", mel_preproc_model)
+
+        pipe = SubjectPipeline(self.label)
+
+        # steps of the same branch share a log file, opened in append mode only while the step is running
+        def logged(log_file:str, func):
+            def step():
+                with open(log_file, "a") as log:
+                    func(log)
+            return step
+
+        # ==============================================================================================================================================================
+        #  T1 data
+        # ==============================================================================================================================================================
+        if self.hasT1:
+            os.makedirs(self.roi_t1_dir, exist_ok=True)
+            os.makedirs(self.roi_std_dir, exist_ok=True)
+            os.makedirs(self.fast_dir, exist_ok=True)
+
+            def t1_anat():
+                self.mpr.prebet(odn=odn, imgtype=imgtype, smooth=smooth, biascorr_type=biascorr_type,
+                                do_reorient=do_reorient, do_crop=do_crop, do_bet=do_bet, do_overwrite=do_overwrite,
+                                use_lesionmask=use_lesionmask, lesionmask=lesionmask)
+                self.mpr.bet(odn=odn, imgtype=imgtype, do_bet=do_bet, betfparam=betfparam,
+                             do_reg=do_reg, do_nonlinreg=do_nonlinreg, do_overwrite=do_overwrite,
+                             use_lesionmask=use_lesionmask, lesionmask=lesionmask)
+                self.mpr.postbet(odn=odn, imgtype=imgtype, smooth=smooth, betfparam=betfparam,
+                                 do_reg=do_reg, do_nonlinreg=do_nonlinreg, do_seg=do_seg, do_overwrite=do_overwrite,
+                                 use_lesionmask=use_lesionmask, lesionmask=lesionmask)
+                self.mpr.finalize(odn=odn, do_cleanup=do_cleanup)
+
+            # prebet modifies t1_data in place, thus it cannot be used as input to check the outputs
+            pipe.add_step("t1_anat", t1_anat, outputs=[self.t1_brain_data])
+            pipe.add_step("t1_transform", lambda: self.transform.transform_mpr(overwrite=do_overwrite),
+                          inputs=[self.t1_brain_data], outputs=[self.transform.hr2std_warp, self.transform.std2hr_warp], deps=["t1_anat"])
+        else:
+            # all the co-registrations depend on the T1 ones: they are blocked
+            pipe.add_missing_step("t1_anat", "subject " + self.label + " has no T1 image")
+            pipe.add_missing_step("t1_transform", "subject " + self.label + " has no T1 image")
+
+        if self.hasWB:
+            pipe.add_step("wb_bet", lambda: rrun(f"bet {self.wb_data} {self.wb_brain_data} -f {BET_F_VALUE_T2} -g 0 -m"),
+                          inputs=[self.wb_data], outputs=[self.wb_brain_data])
+
+        if self.hasT2:
+            os.makedirs(os.path.join(self.roi_dir, "reg_t2"), exist_ok=True)
+            pipe.add_step("t2_bet", lambda: rrun(f"bet {self.t2_data} {self.t2_brain_data} -f {BET_F_VALUE_T2} -g 0.2 -m"),
+                          inputs=[self.t2_data], outputs=[self.t2_brain_data])
+
+        # ==============================================================================================================================================================
+        # RS data
+        # ==============================================================================================================================================================
+        if self.hasRS and do_rs:
+            os.makedirs(self.roi_rs_dir, exist_ok=True)
+            os.makedirs(os.path.join(self.project.group_analysis_dir, "resting", "dr"), exist_ok=True)
+            os.makedirs(os.path.join(self.project.group_analysis_dir, "resting", "group_templates"), exist_ok=True)
+            os.makedirs(self.rs_final_regstd_dir, exist_ok=True)
+
+            rs_log              = os.path.join(self.rs_dir, "log_rs_processing.txt")
+            preproc_img         = Image(os.path.join(self.rs_dir, self.rs_post_preprocess_image_label))
+            preproc_feat_dir    = os.path.join(self.rs_dir, feat_preproc_odn + ".feat")
+            preproc_aroma_img   = Image(os.path.join(self.rs_dir, self.rs_post_aroma_image_label))
+            postnuisance        = Image(os.path.join(self.rs_dir, self.rs_post_nuisance_image_label))
+            mel_out_dir         = os.path.join(self.rs_dir, mel_odn + ".ica")
+            postmel_img         = Image(os.path.join(self.rs_dir, self.rs_post_nuisance_melodic_image_label))
+
+            def rs_feat(log):
+                if not os.path.isfile(feat_preproc_model + ".fsf"):
+                    raise Exception("Error in Subject.get_wellcome_pipeline: FEAT_PREPROC template file (" + feat_preproc_model + ".fsf) is missing")
+                if os.path.isdir(preproc_feat_dir):
+                    rmtree(preproc_feat_dir, ignore_errors=True)
+                self.epi.fsl_feat("rs", self.rs_image_label, "resting.feat", feat_preproc_model, do_initreg=do_featinitreg, std_image=self.std_img)
+                Image(os.path.join(preproc_feat_dir, "filtered_func_data")).cp(preproc_img, logFile=log)
+
+            def rs_aroma(log):
+                if do_aroma:
+                    if os.path.isdir(self.rs_aroma_dir):
+                        rmtree(self.rs_aroma_dir, ignore_errors=True)
+                    self.epi.aroma_feat("rs", preproc_feat_dir, os.path.join(preproc_feat_dir, "mc", "prefiltered_func_data_mcf.par"), self.transform.rs2hr_mat, self.transform.hr2std_warp)
+                    self.rs_aroma_image.cp(preproc_aroma_img, logFile=log)
+                else:
+                    preproc_img.cp(preproc_aroma_img, logFile=log)
+
+            def rs_nuisance(log):
+                if do_nuisance:
+                    self.epi.remove_nuisance(self.rs_post_aroma_image_label, self.rs_post_nuisance_image_label, hpfsec=hpfsec)
+                else:
+                    preproc_aroma_img.cp(postnuisance, logFile=log)
+
+            def rs_melodic(log):
+                if not os.path.isfile(melodic_model + ".fsf"):
+                    raise Exception("Error in Subject.get_wellcome_pipeline: resting template file (" + melodic_model + ".fsf) is missing")
+                if os.path.isdir(mel_out_dir):
+                    rmtree(mel_out_dir, ignore_errors=True)
+                self.epi.fsl_feat("rs", self.rs_post_nuisance_image_label, mel_odn + ".ica", melodic_model, do_initreg=do_melinitreg, std_image=self.std_img)
+                Image(os.path.join(mel_out_dir, "filtered_func_data")).cp(postmel_img, logFile=log)
+
+            pipe.add_step("rs_feat", logged(rs_log, rs_feat), inputs=[self.rs_data], outputs=[preproc_img])
+            pipe.add_step("rs_transform", logged(rs_log, lambda log: self.transform.transform_rs(overwrite=do_overwrite, logFile=log)),
+                          inputs=[preproc_img, self.t1_brain_data], outputs=[self.transform.rs2std_warp, self.transform.std2rs_warp], deps=["rs_feat", "t1_transform"])
+            pipe.add_step("rs_aroma", logged(rs_log, rs_aroma), inputs=[preproc_img], outputs=[preproc_aroma_img], deps=["rs_transform"])
+            pipe.add_step("rs_nuisance", logged(rs_log, rs_nuisance), inputs=[preproc_aroma_img], outputs=[postnuisance], deps=["rs_aroma"])
+            if do_melodic:
+                pipe.add_step("rs_melodic", logged(rs_log, rs_melodic), inputs=[postnuisance], outputs=[postmel_img], deps=["rs_nuisance"])
+            if replace_std_filtfun:
+                pipe.add_step("rs_regstd", logged(rs_log, lambda log: self.epi.create_regstd(postnuisance, feat_preproc_odn, do_overwrite, logFile=log)),
+                              inputs=[postnuisance], outputs=[self.rs_final_regstd_image, self.rs_final_regstd_mask, self.rs_final_regstd_bgimage], deps=["rs_nuisance"])
+
+        # ==============================================================================================================================================================
+        # FMRI DATA
+        # ==============================================================================================================================================================
+        if self.hasFMRI(fmri_labels) and do_fmri:
+            if fmri_params is None:
+                raise Exception("Error in Subject.get_wellcome_pipeline of subj " + self.label + ": fmri_params is missing")
+
+            if fmri_labels is None:
+                fmri_images = Images([self.fmri_data])
+            else:
+                fmri_images = Images([os.path.join(self.fmri_dir, self.label + ilab) for ilab in fmri_labels])
+
+            fmri_log = os.path.join(self.fmri_dir, "log_fmri_processing.txt")
+
+            # spm_fmri_preprocessing checks by itself which outputs are already present
+            pipe.add_step("fmri_preproc", lambda: self.epi.spm_fmri_preprocessing(fmri_params, fmri_images, "subj_spm_fmri_full_preprocessing", do_overwrite=do_overwrite),
+                          inputs=fmri_images)
+            pipe.add_step("fmri_transform", logged(fmri_log, lambda log: self.transform.transform_fmri(fmri_labels, overwrite=do_overwrite, logFile=log)),
+                          inputs=[self.t1_brain_data], outputs=[self.transform.fmri2std_warp, self.transform.std2fmri_warp], deps=["fmri_preproc", "t1_transform"])
+
+        # ==============================================================================================================================================================
+        # DTI data
+        # ==============================================================================================================================================================
+        if self.hasDTI:
+            os.makedirs(self.roi_dti_dir, exist_ok=True)
+            dti_log = os.path.join(self.dti_dir, "log_dti_processing.txt")
+
+            def dti_eddy(log):
+                if not do_pa_eddy:
+                    self.dti.eddy_correct(do_overwrite, log)
+                elif do_eddy_gpu:
+                    self.dti.eddy(exe_ver=self._global.eddy_gpu_exe_name, logFile=log)
+                else:
+                    self.dti.eddy(exe_ver="eddy_openmp", logFile=log)
+
+            def dti_fit(log):
+                self.dti.fit(log)
+                rrun(f"fslmaths {os.path.join(self.dti_dir, self.dti_fit_label)}_L2 -add {os.path.join(self.dti_dir, self.dti_fit_label + '_L3')} -div 2 {self.dti_fit_L23}", logFile=log)
+                if os.path.isfile(self.dti_rotated_bvec + ".gz"):
+                    runsystem("gunzip " + self.dti_rotated_bvec + ".gz", logFile=log)
+
+            def dti_xtract(log):
+                if not Image(os.path.join(self.dti_dir, bedpost_odn, "mean_S0samples")).exist:
+                    raise Exception("Error in Subject.get_wellcome_pipeline: xtract tractography requested, but bedpostx was not performed")
+                self.dti.xtract(xtract_odn, bedpost_odn, xtract_refspace, xtract_gpu, logFile=log)
+                self.dti.xtract_stats(xtract_odn, xtract_refspace, xtract_meas, logFile=log)
+
+            pipe.add_step("dti_nodiff", logged(dti_log, lambda log: self.dti.get_nodiff(logFile=log)),
+                          inputs=[self.dti_data], outputs=[self.dti_nodiff_data, self.dti_nodiff_brain_data])
+            if do_dtifit:
+                pipe.add_step("dti_eddy", logged(dti_log, dti_eddy), inputs=[self.dti_data], outputs=[self.dti_ec_data], deps=["dti_nodiff"])
+                pipe.add_step("dti_fit", logged(dti_log, dti_fit), inputs=[self.dti_ec_data], outputs=[self.dti_fit_FA, self.dti_fit_L23], deps=["dti_eddy"])
+            pipe.add_step("dti_transform", logged(dti_log, lambda log: self.transform.transform_dti_t2(ignore_t2=True, overwrite=do_overwrite, logFile=log)),
+                          inputs=[self.dti_nodiff_brain_data, self.t1_brain_data], outputs=[self.transform.dti2std_warp], deps=["dti_nodiff", "t1_transform"])
+            if do_bedx:
+                pipe.add_step("dti_bedpostx", logged(dti_log, lambda log: self.dti.bedpostx(bedpost_odn, use_gpu=do_bedx_gpu, logFile=log)),
+                              inputs=[self.dti_ec_data], outputs=[os.path.join(self.dti_dir, bedpost_odn, "mean_S0samples")], optional_deps=["dti_fit"])
+            if do_xtract:
+                # without do_bedx, bedpostx outputs of a previous run are used (dti_xtract checks them)
+                pipe.add_step("dti_xtract", logged(dti_log, dti_xtract), deps=["dti_transform"], optional_deps=["dti_bedpostx"])
+
+        # ==============================================================================================================================================================
+        # EXTRA
+        # ==============================================================================================================================================================
+        if "rs_transform" in pipe.steps and "fmri_transform" in pipe.steps:
+            pipe.add_step("extra_transform", lambda: self.transform.transform_extra(overwrite=do_overwrite), deps=["rs_transform", "fmri_transform"])
+
+        return pipe
+
+    def wellcome_pipeline(self, ncore:int=4, do_overwrite:bool=False, **kwargs) -> dict:
+        """
+        Run the wellcome pre-processing as a dependency graph, executing independent branches at the same time.
+
+        Parameters
+        ----------
+        ncore : int = 4
+            maximum number of steps running at the same time.
+        do_overwrite : bool = False
+            re-run also the steps whose outputs are up to date.
+        kwargs :
+            any parameter accepted by get_wellcome_pipeline.
+
+        Returns
+        -------
+        dict
+            step name => final status (see PipelineStep)
+        """
+        pipe = self.get_wellcome_pipeline(do_overwrite=do_overwrite, **kwargs)
+        return pipe.run(ncore=ncore, overwrite=do_overwrite)
+
     # ==================================================================================================================================================
     # DATA CONVERSIONS
     # ==================================================================================================================================================
@@ -9,6 +9,7 @@ from myutility.fileutilities import write_text_file, read_value_from_file
 from myutility.images.Image import Image
 from myutility.myfsl.utils.run import rrun
 from myutility.images.Images import Images
+from myutility.images.voxelstats import MaskSet
 from myutility.Tract import Tract
 
 class SubjectDti:
@@ -375,13 +376,16 @@ class SubjectDti:
 
         tracts:SubjectTracts = SubjectTracts(self.subject.label)
         for mask in masks:
-            tract = Tract(mask)
-            for m in meas:
-                meas_image = Image(os.path.join(self.subject.dti_dir, self.subject.dti_fit_label + "_" + m))
-                val = float(rrun("fslstats " + meas_image + " -m -k " + mask).strip())
-                tract.set_metric(m, val)
-
-            tracts.append(tract)
+            tracts.append(Tract(mask))
+
+        # masks are stacked once, then each metric image is read once and all the masks are applied in a single pass.
+        # the value is the mean of all the voxels within the mask (fslstats img -k mask -m): the former "fslstats img -m -k mask"
+        # printed the mean before applying the mask, i.e. the mean of the whole image
+        maskset = MaskSet(masks)
+        for m in meas:
+            meas_image = Image(os.path.join(self.subject.dti_dir, self.subject.dti_fit_label + "_" + m))
+            for tract, stats in zip(tracts, maskset.stats(meas_image)):
+                tract.set_metric(m, stats["mean"])
 
         return tracts
 
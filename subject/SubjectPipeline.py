@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, List
+
+from myutility.images.Image import Image
+from myutility.myfsl.utils.trace import traced
+
+
+class PipelineStep:
+    """
+    A single node of a SubjectPipeline.
+
+    A step wraps a zero-argument callable (usually a bound method of SubjectMpr, SubjectEpi, SubjectDti or SubjectTransforms
+    wrapped in a lambda) together with the files it reads and writes and the names of the steps that must be completed before it.
+    A step without func is a missing step: a step of the full graph that cannot be executed (e.g. the T1 steps of a subject without T1),
+    it is never run and blocks all its descendants.
+
+    Args:
+        name (str): unique name of the step within its pipeline.
+        func (Callable): the callable executing the step, None for a missing step.
+        inputs (List[str], optional): Image or file paths read by the step. Defaults to None.
+        outputs (List[str], optional): Image or file paths written by the step. Defaults to None.
+        deps (List[str], optional): names of the steps this one depends on. Defaults to None.
+        optional_deps (List[str], optional): names of the steps this one follows when they belong to the pipeline. Defaults to None.
+        reason (str, optional): why a missing step cannot be executed. Defaults to "".
+    """
+    PENDING     = "pending"
+    RUNNING     = "running"
+    DONE        = "done"
+    UPTODATE    = "uptodate"
+    FAILED      = "failed"
+    BLOCKED     = "blocked"
+    MISSING     = "missing"
+
+    def __init__(self, name:str, func:Callable | None, inputs:List[str]=None, outputs:List[str]=None, deps:List[str]=None,
+                 optional_deps:List[str]=None, reason:str=""):
+        self.name:str                   = name
+        self.func:Callable | None       = func
+        self.inputs:list                = [] if inputs is None else list(inputs)
+        self.outputs:list               = [] if outputs is None else list(outputs)
+        self.deps:List[str]             = [] if deps is None else list(deps)
+        self.optional_deps:List[str]    = [] if optional_deps is None else list(optional_deps)
+        self.reason:str                 = reason
+        self.status:str                 = PipelineStep.PENDING
+        self.error:str                  = ""
+
+    def is_uptodate(self) -> bool:
+        """
+        A step is up to date when it declares at least one output, all of them exist and none is older than its newest input.
+        """
+        if len(self.outputs) == 0:
+            return False
+
+        out_mtimes = [_path_mtime(o) for o in self.outputs]
+        if None in out_mtimes:
+            return False
+
+        in_mtimes = [m for m in [_path_mtime(i) for i in self.inputs] if m is not None]
+        if len(in_mtimes) == 0:
+            return True
+
+        return min(out_mtimes) >= max(in_mtimes)
+
+    def __repr__(self):
+        return f"PipelineStep({self.name}, deps={self.deps}, status={self.status})"
+
+
+class SubjectPipeline:
+    """
+    Declarative, dependency-aware graph of processing steps of a single subject.
+
+    Steps are added with add_step and executed by run, which submits every step as soon as all its dependencies
+    are completed, so that independent branches (e.g. DTI eddy/dtifit and RS FEAT pre-processing) proceed at the same time.
+    Steps whose outputs are already up to date are skipped, a failing (or missing) step blocks all its descendants without stopping the other branches.
+
+    Args:
+        label (str): label used in log messages (usually the subject label).
+    """
+    def __init__(self, label:str=""):
+        self.label:str                      = label
+        self.steps:dict[str, PipelineStep]  = {}
+
+    def add_step(self, name:str, func:Callable, inputs:List[str]=None, outputs:List[str]=None, deps:List[str]=None,
+                 optional_deps:List[str]=None) -> PipelineStep:
+        """
+        Add a new step to the graph.
+
+        Every name in deps must be a step of the pipeline when it is run (steps that cannot be executed are added with add_missing_step),
+        while optional_deps are followed only if present (e.g. a step using the outputs of a previous run when their producer is not requested).
+
+        Returns:
+            PipelineStep: the created step.
+        """
+        if name in self.steps:
+            raise Exception("Error in SubjectPipeline.add_step: step (" + name + ") already exist")
+
+        step = PipelineStep(name, func, inputs, outputs, deps, optional_deps)
+        self.steps[name] = step
+        return step
+
+    def add_missing_step(self, name:str, reason:str) -> PipelineStep:
+        """
+        Add a step that cannot be executed (e.g. because the subject lacks the sequence it processes): it is never run and all the steps
+        depending on it are blocked.
+
+        Returns:
+            PipelineStep: the created step.
+        """
+        if name in self.steps:
+            raise Exception("Error in SubjectPipeline.add_missing_step: step (" + name + ") already exist")
+
+        step = PipelineStep(name, None, reason=reason)
+        self.steps[name] = step
+        return step
+
+    def sorted_steps(self) -> List[PipelineStep]:
+        """
+        Return the steps in topological order, raising an exception if the graph contains a cycle or a step depends on an unknown step.
+        """
+        for step in self.steps.values():
+            unknown = [d for d in step.deps if d not in self.steps]
+            if len(unknown) > 0:
+                raise Exception("Error in SubjectPipeline.sorted_steps: step (" + step.name + ") depends on unknown steps (" + ", ".join(unknown) + ")")
+
+        ordered:List[PipelineStep]  = []
+        visiting                    = set()
+        visited                     = set()
+
+        def visit(name:str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise Exception("Error in SubjectPipeline.sorted_steps: dependency cycle found at step (" + name + ")")
+            visiting.add(name)
+            for dep in self._deps(self.steps[name]):
+                visit(dep)
+            visiting.remove(name)
+            visited.add(name)
+            ordered.append(self.steps[name])
+
+        for stepname in self.steps:
+            visit(stepname)
+
+        return ordered
+
+    def run(self, ncore:int=1, overwrite:bool=False) -> dict:
+        """
+        Execute the graph running up to ncore independent steps at the same time.
+
+        Args:
+            ncore (int, optional): maximum number of concurrently running steps. Defaults to 1.
+            overwrite (bool, optional): run also steps whose outputs are up to date. Defaults to False.
+
+        Returns:
+            dict: step name => final status (one of PipelineStep.DONE/UPTODATE/FAILED/BLOCKED/MISSING).
+        """
+        order = self.sorted_steps()    # also validates the graph
+        for step in order:
+            step.status = PipelineStep.PENDING
+            step.error  = ""
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, ncore)) as executor:
+            while True:
+                for step in order:
+                    if step.status != PipelineStep.PENDING:
+                        continue
+
+                    if step.func is None:
+                        step.status = PipelineStep.MISSING
+                        step.error  = step.reason
+                        continue
+
+                    deps_status = [self.steps[d].status for d in self._deps(step)]
+                    if any(s in (PipelineStep.FAILED, PipelineStep.BLOCKED, PipelineStep.MISSING) for s in deps_status):
+                        step.status = PipelineStep.BLOCKED
+                        print("SubjectPipeline (" + self.label + "): step " + step.name + " blocked by a failed or missing dependency")
+                        continue
+
+                    if not all(s in (PipelineStep.DONE, PipelineStep.UPTODATE) for s in deps_status):
+                        continue
+
+                    if not overwrite and step.is_uptodate():
+                        step.status = PipelineStep.UPTODATE
+                        continue
+
+                    print("SubjectPipeline (" + self.label + "): starting step " + step.name)
+                    step.status = PipelineStep.RUNNING
+                    running[executor.submit(traced(step.func, subject=self.label, step=step.name))] = step
+
+                # steps are scanned in topological order, thus when nothing is running every step has been resolved
+                if len(running) == 0:
+                    break
+
+                finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    step = running.pop(fut)
+                    try:
+                        fut.result()
+                        step.status = PipelineStep.DONE
+                        print("SubjectPipeline (" + self.label + "): completed step " + step.name)
+                    except Exception as e:
+                        step.status = PipelineStep.FAILED
+                        step.error  = str(e)
+                        traceback.print_exc()
+                        print("SubjectPipeline (" + self.label + "): step " + step.name + " failed: " + str(e))
+
+        return {step.name: step.status for step in order}
+
+    def _deps(self, step:PipelineStep) -> List[str]:
+        # deps are validated by sorted_steps, optional ones are followed only if present
+        return step.deps + [d for d in step.optional_deps if d in self.steps]
+
+
+def _path_mtime(path:str) -> float | None:
+    """
+    Return the modification time of a file, a folder or an image given without extension, None if it does not exist.
+    """
+    path = str(path)
+    if os.path.exists(path):
+        return os.path.getmtime(path)
+
+    img = Image(path)
+    for ext in [".nii.gz", ".nii", ".mgz", ".gii", ".hdr", ".hdr.gz"]:
+        if os.path.isfile(img.fpathnoext + ext):
+            return os.path.getmtime(img.fpathnoext + ext)
+
+    return None
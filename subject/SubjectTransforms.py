@@ -1,10 +1,11 @@
 import os
-from typing import Optional
+from typing import Optional, Tuple
 
 from Global import Global
 # from subject.Subject import Subject
 from myutility.images.Image import Image
-from myutility.myfsl.utils.run import rrun
+from myutility.myfsl.utils.buildcache import BuildCache, resolve_path
+from myutility.myfsl.utils.run import rrun, rrun_many, deferred
 from myutility.myfsl.fslfun import runsystem
 # Class contains all the available transformations across different sequences.
 #
@@ -237,6 +238,10 @@ class SubjectTransforms:
             "dtiTOt2": self.transform_nl_dti2t2
         }
 
+        # transforms composed from others (see check_composed_transform) and the build records of those (the inputs each was built from)
+        self.composed_transforms_file   = os.path.join(self.subject.roi_dir, "composed_transforms.json")
+        self._compositions              = None
+
     # def hr2std_nl(self, hrhead=None, stdhead=None, usehead_nl=True, overwrite=False, logFile=None):
     #
     #     if hrhead is None:
@@ -942,7 +947,10 @@ class SubjectTransforms:
             # DTI <-- (non-lin) -- t2 -- (lin) -- HIGHRES -- (non-lin) --> STANDARD
             # -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
             # dti --> std
+            built = overwrite or not self.dti2std_warp.exist
             check_convert_warp_wmw(self.dti2std_warp, self.dti2t2_warp, self.t22hr_mat, self.hr2std_warp, self.subject.std_head_img, overwrite=overwrite, logFile=logFile)
+            if built:
+                self.record_composed_transform(self.dti2std_warp, self.__dti2std_warp_chain(True))
             check_concat_mat(self.dti2std_mat, self.dti2hr_mat, self.hr2std_mat, overwrite=overwrite, logFile=logFile)
 
             # std --> dti
@@ -956,7 +964,10 @@ class SubjectTransforms:
             # -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
             # dti --> std
             # check_convert_warp_mw(self.dti2std_warp, self.dtihead2hr_mat, self.hr2std_warp, self.subject.std_head_img, overwrite=overwrite, logFile=logFile)
+            built = overwrite or not self.dti2std_warp.exist
             check_convert_warp_mw(self.dti2std_warp, self.dti2hr_mat, self.hr2std_warp, self.subject.std_img, overwrite=overwrite, logFile=logFile)
+            if built:
+                self.record_composed_transform(self.dti2std_warp, self.__dti2std_warp_chain(False))
             check_concat_mat(self.dti2std_mat, self.dti2hr_mat, self.hr2std_mat, overwrite=overwrite, logFile=logFile)
 
             # std --> dti
@@ -994,6 +1005,147 @@ class SubjectTransforms:
             check_convert_warp_ww(self.rs2fmri_warp, self.rs2std_warp, self.std2fmri_warp, self.subject.fmri_examplefunc, overwrite=overwrite, logFile=logFile)
             check_invert_warp(self.fmri2rs_warp, self.rs2fmri_warp, self.subject.fmri_examplefunc, overwrite=overwrite, logFile=logFile)
 
+    # ==================================================================================================================================================
+    # COMPOSED TRANSFORMS
+    # ==================================================================================================================================================
+    # the transforms concatenating/inverting others (e.g. dti2std_warp = dti2hr_mat + hr2std_warp, std2dti_warp = inv(dti2std_warp)).
+    # they are created by the transform_XXX methods, but may be missing or older than their inputs (e.g. after transform_mpr was rerun):
+    # check_composed_transform (re)builds them only when needed. each build is recorded in composed_transforms.json by a BuildCache,
+    # as a pseudo command naming the builder, its inputs and reference, which also tells how a transform was built (e.g. the dti2std_warp chain)
+    @property
+    def compositions(self) -> dict:
+        """
+        Returns {output transform: (check_xxx function, [input transforms], ref image or None)} for each composed transform.
+        """
+        if self._compositions is None:
+            comps = {
+                self.rs2std_mat:        (check_concat_mat,      [self.rs2hr_mat, self.hr2std_mat],          None),
+                self.std2rs_mat:        (check_invert_mat,      [self.rs2std_mat],                          None),
+                self.rs2std4_mat:       (check_concat_mat,      [self.rs2hr_mat, self.hr2std4_mat],         None),
+                self.std42rs_mat:       (check_invert_mat,      [self.rs2std4_mat],                         None),
+                self.rs2std_warp:       (check_convert_warp_mw, [self.rs2hr_mat, self.hr2std_warp],         self.subject.std_head_img),
+                self.std2rs_warp:       (check_invert_warp,     [self.rs2std_warp],                         self.subject.rs_examplefunc),
+                self.rs2std4_warp:      (check_convert_warp_mw, [self.rs2hr_mat, self.hr2std4_warp],        self.subject.std4_head_img),
+                self.std42rs_warp:      (check_invert_warp,     [self.rs2std4_warp],                        self.subject.rs_examplefunc),
+
+                self.fmri2std_mat:      (check_concat_mat,      [self.fmri2hr_mat, self.hr2std_mat],        None),
+                self.std2fmri_mat:      (check_invert_mat,      [self.fmri2std_mat],                        None),
+                self.fmri2std4_mat:     (check_concat_mat,      [self.fmri2hr_mat, self.hr2std4_mat],       None),
+                self.std42fmri_mat:     (check_invert_mat,      [self.fmri2std4_mat],                       None),
+                self.fmri2std_warp:     (check_convert_warp_mw, [self.fmri2hr_mat, self.hr2std_warp],       self.subject.std_head_img),
+                self.std2fmri_warp:     (check_invert_warp,     [self.fmri2std_warp],                       self.subject.fmri_examplefunc),
+                self.fmri2std4_warp:    (check_convert_warp_mw, [self.fmri2hr_mat, self.hr2std4_warp],      self.subject.std4_head_img),
+                self.std42fmri_warp:    (check_invert_warp,     [self.fmri2std4_warp],                      self.subject.fmri_examplefunc),
+
+                self.t22std_mat:        (check_concat_mat,      [self.t22hr_mat, self.hr2std_mat],          None),
+                self.std2t2_mat:        (check_invert_mat,      [self.t22std_mat],                          None),
+                self.t22std_warp:       (check_convert_warp_mw, [self.t22hr_mat, self.hr2std_warp],         self.subject.std_head_img),
+                self.std2t2_warp:       (check_invert_warp,     [self.t22std_warp],                         self.subject.t2_data),
+
+                self.dti2std_mat:       (check_concat_mat,      [self.dti2hr_mat, self.hr2std_mat],         None),
+                self.std2dti_mat:       (check_invert_mat,      [self.dti2std_mat],                         None),
+                self.dti2std_warp:      self.__dti2std_warp_built_chain(),
+                self.std2dti_warp:      (check_invert_warp,     [self.dti2std_warp],                        self.subject.dti_nodiff_data),
+
+                self.rs2fmri_mat:       (check_concat_mat,      [self.rs2hr_mat, self.hr2fmri_mat],         None),
+                self.fmri2rs_mat:       (check_invert_mat,      [self.rs2fmri_mat],                         None),
+                self.rs2fmri_warp:      (check_convert_warp_ww, [self.rs2std_warp, self.std2fmri_warp],     self.subject.fmri_examplefunc),
+                self.fmri2rs_warp:      (check_invert_warp,     [self.rs2fmri_warp],                        self.subject.fmri_examplefunc),
+            }
+            self._compositions = {str(k): v for k, v in comps.items()}
+        return self._compositions
+
+    def __dti2std_warp_chain(self, through_t2:bool) -> tuple:
+        # dti2std_warp is built by transform_dti_t2 through t2 (when available and not ignored) or directly through hr
+        if through_t2:
+            return check_convert_warp_wmw, [self.dti2t2_warp, self.t22hr_mat, self.hr2std_warp], self.subject.std_head_img
+        else:
+            return check_convert_warp_mw,  [self.dti2hr_mat, self.hr2std_warp], self.subject.std_img
+
+    def __dti2std_warp_built_chain(self) -> tuple:
+        # the chain dti2std_warp was last built with (transform_dti_t2 may ignore t2), inferred for warps built before being recorded
+        for through_t2 in (True, False):
+            chain = self.__dti2std_warp_chain(through_t2)
+            if self.composed_cache.has_record(*self.__composed_command(self.dti2std_warp, chain)):
+                return chain
+        return self.__dti2std_warp_chain(self.subject.hasT2 and self.dti2t2_warp.exist)
+
+    @property
+    def composed_cache(self) -> BuildCache:
+        return BuildCache.shared(self.composed_transforms_file)
+
+    def __composed_command(self, transform, comp:tuple) -> Tuple[list, str]:
+        # (pseudo command, cwd) identifying the build of transform in composed_cache
+        func, inputs, ref = comp
+        args = ["compose", func.__name__] + [str(i) for i in inputs] + ([] if ref is None else [str(ref)]) + [str(transform)]
+        return args, self.subject.dir
+
+    def record_composed_transform(self, transform, comp:tuple):
+        """
+        Records that transform has been built from the inputs of comp (a compositions value), as they are now.
+        """
+        if not os.path.isdir(self.subject.roi_dir) or resolve_path(transform) is None:
+            return
+        args, cwd   = self.__composed_command(transform, comp)
+        cache       = self.composed_cache
+        cache.record(args, cache.describe_inputs(args, comp[1], cwd=cwd), "", inputs=comp[1], outputs=[transform], cwd=cwd)
+        self._compositions = None
+
+    def check_composed_transform(self, transform:str, logFile=None) -> bool:
+        """
+        (Re)builds the given composed transform (and, recursively, the composed transforms it derives from) when it does not exist
+        or any of its inputs changed since it was built. Does nothing when transform is not a composed one or some input is missing.
+
+        Returns:
+            bool: True if the transform has been (re)built.
+        """
+        comp = self.compositions.get(str(transform))
+        if comp is None:
+            return False
+
+        func, inputs, ref = comp
+        for inp in inputs:
+            self.check_composed_transform(inp, logFile=logFile)
+
+        inpaths = [resolve_path(inp) for inp in inputs]
+        if None in inpaths:
+            return False        # let the caller report the missing input
+
+        args, cwd   = self.__composed_command(transform, comp)
+        cache       = self.composed_cache
+        uptodate, _ = cache.is_uptodate(args, inputs, [transform], cwd=cwd)
+        if uptodate:
+            return False
+
+        if os.path.isdir(self.subject.roi_dir) and cache.adopt_existing(args, inputs, [transform], cwd=cwd):
+            # built before being tracked, but newer than its inputs
+            self._compositions = None
+            return False
+
+        print(f"{self.subject.label}: building composed transform {os.path.basename(str(transform))}")
+        before = cache.describe_inputs(args, inputs, cwd=cwd)
+        func(transform, *(inputs if ref is None else inputs + [ref]), overwrite=True, logFile=logFile)
+
+        if os.path.isdir(self.subject.roi_dir):
+            cache.record(args, before, "", inputs=inputs, outputs=[transform], cwd=cwd)
+        return True
+
+    def get_transform(self, regtype:str, islin:bool=True, logFile=None) -> Tuple[str, str, bool]:
+        """
+        Returns the transform (mat or warp) and the reference image of the given registration type, the former updated when composed.
+
+        Returns:
+            tuple: (transform, ref, is_warp). is_warp is False for linear transforms and for non-linear ones whose warp does not exist
+                   (as some non-linear registration types return their linear version).
+        """
+        if islin:
+            transform, ref = self.linear_registration_type[regtype]()
+        else:
+            transform, ref = self.non_linear_registration_type[regtype]()
+
+        self.check_composed_transform(transform, logFile=logFile)
+        return transform, ref, (not islin and Image(transform).exist)
+
     # ==================================================================================================================================================
     # GENERIC ROI TRANSFORMS
     # ==================================================================================================================================================
@@ -1071,105 +1223,109 @@ class SubjectTransforms:
         return_paths = []
         print("registration_type " + regtype + ", do_linear = " + str(islin))
 
-        for roi in rois:
-
-            roi_name = os.path.basename(roi)
-            print(f"converting {roi_name}")
-            # ----------------------------------------------------------------------------------------------------------
-            # SET INPUT
-            # ----------------------------------------------------------------------------------------------------------
-            if pathtype == "abs":
-                input_roi = roi
-            elif pathtype == "rel":
-                input_roi = os.path.join(self.subject.dir, roi)  # roi contains also the relative path (e.g.  rs/melodic/dr/templ_a/popul_b/results/standard4/roixx
-            else:
-                # is a roi name
-                if from_space == "hr":
-                    input_roi = os.path.join(self.subject.roi_t1_dir, roi_name)
-                elif from_space == "rs":
-                    input_roi = os.path.join(self.subject.roi_rs_dir, roi_name)
-                elif from_space == "fmri":
-                    input_roi = os.path.join(self.subject.roi_fmri_dir, roi_name)
-                elif from_space == "dti":
-                    input_roi = os.path.join(self.subject.roi_dti_dir, roi_name)
-                elif from_space == "t2":
-                    input_roi = os.path.join(self.subject.roi_t2_dir, roi_name)
-                elif from_space == "std":
-                    input_roi = os.path.join(self.subject.roi_std_dir, roi_name)
-                elif from_space == "std4":
-                    input_roi = os.path.join(self.subject.roi_std4_dir, roi_name)
+        # resolved (and, if composed, brought up to date) once for all the rois, before their commands are deferred
+        if regtype not in ("std2std4", "std42std"):
+            transform, ref, is_warp = self.get_transform(regtype, islin)
+
+        # the transformations of the different rois are independent: their commands are collected and then run concurrently
+        with deferred() as cmds:
+            for roi in rois:
+
+                roi_name = os.path.basename(roi)
+                print(f"converting {roi_name}")
+                # ----------------------------------------------------------------------------------------------------------
+                # SET INPUT
+                # ----------------------------------------------------------------------------------------------------------
+                if pathtype == "abs":
+                    input_roi = roi
+                elif pathtype == "rel":
+                    input_roi = os.path.join(self.subject.dir, roi)  # roi contains also the relative path (e.g.  rs/melodic/dr/templ_a/popul_b/results/standard4/roixx
                 else:
-                    raise Exception("SubjectTransforms.transform_roi. input roi format is not valid")
+                    # is a roi name
+                    if from_space == "hr":
+                        input_roi = os.path.join(self.subject.roi_t1_dir, roi_name)
+                    elif from_space == "rs":
+                        input_roi = os.path.join(self.subject.roi_rs_dir, roi_name)
+                    elif from_space == "fmri":
+                        input_roi = os.path.join(self.subject.roi_fmri_dir, roi_name)
+                    elif from_space == "dti":
+                        input_roi = os.path.join(self.subject.roi_dti_dir, roi_name)
+                    elif from_space == "t2":
+                        input_roi = os.path.join(self.subject.roi_t2_dir, roi_name)
+                    elif from_space == "std":
+                        input_roi = os.path.join(self.subject.roi_std_dir, roi_name)
+                    elif from_space == "std4":
+                        input_roi = os.path.join(self.subject.roi_std4_dir, roi_name)
+                    else:
+                        raise Exception("SubjectTransforms.transform_roi. input roi format is not valid")
 
-            input_roi = Image(input_roi, must_exist="SubjectTransforms.transform_roi input roi")
+                input_roi = Image(input_roi, must_exist="SubjectTransforms.transform_roi input roi")
 
-            # ----------------------------------------------------------------------------------------------------------
-            # SET OUTPUT
-            # ----------------------------------------------------------------------------------------------------------
-            if outname != "":
-                name = outname
-            else:
-                name = roi_name
-
-            if outdir == "":
-                if to_space == "hr":
-                    output_roi = os.path.join(self.subject.roi_t1_dir, name + "_" + to_space)
-                elif to_space == "rs":
-                    output_roi = os.path.join(self.subject.roi_rs_dir, name + "_" + to_space)
-                elif to_space == "fmri":
-                    output_roi = os.path.join(self.subject.roi_fmri_dir, name + "_" + to_space)
-                elif to_space == "dti":
-                    output_roi = os.path.join(self.subject.roi_dti_dir, name + "_" + to_space)
-                elif to_space == "t2":
-                    output_roi = os.path.join(self.subject.roi_t2_dir, name + "_" + to_space)
-                elif to_space == "std":
-                    output_roi = os.path.join(self.subject.roi_std_dir, name + "_" + to_space)
-                elif to_space == "std4":
-                    output_roi = os.path.join(self.subject.roi_std4_dir, name + "_" + to_space)
+                # ----------------------------------------------------------------------------------------------------------
+                # SET OUTPUT
+                # ----------------------------------------------------------------------------------------------------------
+                if outname != "":
+                    name = outname
                 else:
-                    raise Exception("SubjectTransforms.transform_roi. output roi format is not valid")
-            else:
-                output_roi = os.path.join(outdir, f"{name}_{to_space}")
+                    name = roi_name
+
+                if outdir == "":
+                    if to_space == "hr":
+                        output_roi = os.path.join(self.subject.roi_t1_dir, name + "_" + to_space)
+                    elif to_space == "rs":
+                        output_roi = os.path.join(self.subject.roi_rs_dir, name + "_" + to_space)
+                    elif to_space == "fmri":
+                        output_roi = os.path.join(self.subject.roi_fmri_dir, name + "_" + to_space)
+                    elif to_space == "dti":
+                        output_roi = os.path.join(self.subject.roi_dti_dir, name + "_" + to_space)
+                    elif to_space == "t2":
+                        output_roi = os.path.join(self.subject.roi_t2_dir, name + "_" + to_space)
+                    elif to_space == "std":
+                        output_roi = os.path.join(self.subject.roi_std_dir, name + "_" + to_space)
+                    elif to_space == "std4":
+                        output_roi = os.path.join(self.subject.roi_std4_dir, name + "_" + to_space)
+                    else:
+                        raise Exception("SubjectTransforms.transform_roi. output roi format is not valid")
+                else:
+                    output_roi = os.path.join(outdir, f"{name}_{to_space}")
 
-            output_roi = Image(output_roi)
+                output_roi = Image(output_roi)
 
-            # ----------------------------------------------------------------------------------------------------------
-            # TRANSFORM !!!!
-            # ----------------------------------------------------------------------------------------------------------
-            if regtype == "std2std4":
-                rrun(f"flirt -in {input_roi} -ref {self.subject.std4_img} -out {output_roi} -applyisoxfm 4")
-            elif regtype == "std42std":
-                rrun(f"flirt -in {input_roi} -ref {self.subject.std_img} -out {output_roi} -applyisoxfm 2")
-            else:
-                if islin:
-                    mat, ref = self.linear_registration_type[regtype]()
-                    check_apply_mat(output_roi, input_roi, mat, ref, overwrite=True)
+                # ----------------------------------------------------------------------------------------------------------
+                # TRANSFORM !!!!
+                # ----------------------------------------------------------------------------------------------------------
+                if regtype == "std2std4":
+                    rrun(f"flirt -in {input_roi} -ref {self.subject.std4_img} -out {output_roi} -applyisoxfm 4")
+                elif regtype == "std42std":
+                    rrun(f"flirt -in {input_roi} -ref {self.subject.std_img} -out {output_roi} -applyisoxfm 2")
                 else:
-                    # is non-linear (actually, when non-linear reg exist, it can be linear)
-                    warp, ref = self.non_linear_registration_type[regtype]()
-                    if not Image(warp).exist:
-                        check_apply_mat(output_roi, input_roi, warp, ref, overwrite=True)
+                    # is non-linear only when the warp exists (actually, when non-linear reg exist, it can be linear)
+                    if is_warp:
+                        check_apply_warp(output_roi, input_roi, transform, ref, overwrite=True)
                     else:
-                        check_apply_warp(output_roi, input_roi, warp, ref, overwrite=True)
-            # ----------------------------------------------------------------------------------------------------------
-            # THRESHOLD
-            # ----------------------------------------------------------------------------------------------------------
-            if thresh > 0:
-                output_roi_name     = os.path.basename(output_roi)
-                output_roi_dir    = os.path.dirname(output_roi)
-
-                rrun(f"fslmaths {output_roi} -thr {thresh} -bin {os.path.join(output_roi_dir, 'mask_' + output_roi_name)}")
-                v1 = rrun(f"fslstats {os.path.join(output_roi_dir, 'mask_' + output_roi_name)} -V")[0]
-
-                if orf != "":
-                    with open(orf, "a") as text_file:
+                        check_apply_mat(output_roi, input_roi, transform, ref, overwrite=True)
+
+                return_paths.append(output_roi)
+
+        rrun_many(cmds)
+
+        # ----------------------------------------------------------------------------------------------------------
+        # THRESHOLD
+        # ----------------------------------------------------------------------------------------------------------
+        if thresh > 0:
+            masks = [os.path.join(os.path.dirname(output_roi), "mask_" + os.path.basename(output_roi)) for output_roi in return_paths]
+            rrun_many([f"fslmaths {output_roi} -thr {thresh} -bin {mask_roi}" for output_roi, mask_roi in zip(return_paths, masks)])
+
+            if orf != "":
+                with open(orf, "a") as text_file:
+                    for roi, mask_roi in zip(rois, masks):
+                        roi_name = os.path.basename(roi)
+                        v1 = Image(mask_roi).nvoxels
                         if v1 == 0:
                             print(f"subj: {self.subject.label}\t\t, roi: {roi_name} ... is empty, thr: {thresh}", file=text_file)  # TODO: print to file
                         else:
                             print(f"subj: {self.subject.label}\t\t, roi: {roi_name} nvoxels = {v1}, thr: {thresh}", file=text_file)  # TODO: print to file
 
-            return_paths.append(output_roi)
-
         return return_paths
 
     # ==================================================================================================================